@@ -0,0 +1,180 @@
+"""
+Process-wide registry of pooled async HTTP clients for calls to other services.
+
+One ``httpx.AsyncClient`` is kept per upstream origin (scheme, host, port), so
+requests reuse keep-alive connections (HTTP/2 when ``h2`` is installed and the
+upstream speaks it) instead of paying TCP/TLS setup per call. Each client has
+its own connection limits, which makes them per-host limits, and a circuit
+breaker: after ``HTTP_CIRCUIT_FAILURES`` consecutive connection failures or
+502/504 gateway errors the circuit opens and requests fail fast with
+``CircuitOpenError`` for ``HTTP_CIRCUIT_RESET_S`` seconds, after which one trial
+request is let through.
+
+Clients are created on first use and closed by the application lifespan via
+``aclose_all()``.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "32"))
+HTTP_MAX_KEEPALIVE_PER_HOST = int(os.environ.get("HTTP_MAX_KEEPALIVE_PER_HOST", "16"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_DEFAULT_TIMEOUT = float(os.environ.get("HTTP_DEFAULT_TIMEOUT", "30"))
+HTTP_CIRCUIT_FAILURES = int(os.environ.get("HTTP_CIRCUIT_FAILURES", "5"))
+HTTP_CIRCUIT_RESET_S = float(os.environ.get("HTTP_CIRCUIT_RESET_S", "15"))
+
+# Upstream responses that mean "the service is not there" rather than "bad request".
+# 503 is left out: the ML service answers it on purpose while its models load, and
+# a service that answers is up, so warmup must not open the circuit.
+_GATEWAY_ERRORS = {502, 504}
+
+try:
+    import h2  # noqa: F401  # enables HTTP/2 in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of sending a request while an upstream's circuit is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker: closed -> open -> half-open -> closed."""
+
+    def __init__(self, name: str, failure_threshold: int = HTTP_CIRCUIT_FAILURES, reset_timeout: float = HTTP_CIRCUIT_RESET_S):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_request(self) -> None:
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            raise CircuitOpenError(f"Circuit open for {self.name} after {self.failures} consecutive failures")
+        if state == "half_open":
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"[HTTP] Circuit for {self.name} closed")
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"[HTTP] Circuit for {self.name} opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+class _CircuitBreakerTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport, breaker: CircuitBreaker):
+        self.inner = inner
+        self.breaker = breaker
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.breaker.before_request()
+        try:
+            response = await self.inner.handle_async_request(request)
+        except (httpx.TransportError, OSError):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancellation or a caller-side error says nothing about the upstream
+            self.breaker._trial_in_flight = False
+            raise
+        if response.status_code in _GATEWAY_ERRORS:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+# origin -> (event loop the client was created on, client)
+_clients: Dict[str, Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def _origin(url: str) -> str:
+    parsed = httpx.URL(url)
+    return f"{parsed.scheme}://{parsed.host}:{parsed.port or (443 if parsed.scheme == 'https' else 80)}"
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    origin = _origin(url)
+    breaker = _breakers.get(origin)
+    if breaker is None:
+        breaker = _breakers[origin] = CircuitBreaker(origin)
+    return breaker
+
+
+def get_client(url: str, transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    """
+    The shared client for the origin of ``url`` (any URL on that service works).
+
+    Do not close it; it lives until ``aclose_all()``. Pass per-request
+    ``timeout=`` where a call needs a different one. ``transport`` replaces the
+    network transport when the client is first created (used by tests).
+    """
+    origin = _origin(url)
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(origin)
+    # Connections are bound to the loop that opened them; a new loop gets a new client
+    if entry is not None and entry[0] is loop and not entry[1].is_closed:
+        return entry[1]
+
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_PER_HOST,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    inner = transport or httpx.AsyncHTTPTransport(http2=HTTP2_AVAILABLE, limits=limits, retries=1)
+    client = httpx.AsyncClient(
+        transport=_CircuitBreakerTransport(inner, get_breaker(origin)),
+        timeout=HTTP_DEFAULT_TIMEOUT,
+    )
+    _clients[origin] = (loop, client)
+    logger.info(f"[HTTP] Created pooled client for {origin} (http2={HTTP2_AVAILABLE}, max_connections={HTTP_MAX_CONNECTIONS_PER_HOST})")
+    return client
+
+
+def upstream_states() -> Dict[str, Dict[str, Any]]:
+    """Circuit state per upstream origin, for status endpoints."""
+    return {origin: breaker.as_dict() for origin, breaker in _breakers.items()}
+
+
+async def aclose_all() -> None:
+    """Close every client created on the running loop (application shutdown)."""
+    loop = asyncio.get_running_loop()
+    for origin, (client_loop, client) in list(_clients.items()):
+        if client_loop is loop:
+            await client.aclose()
+        del _clients[origin]
+    _breakers.clear()
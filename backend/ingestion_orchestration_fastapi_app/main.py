@@ -12,13 +12,14 @@ import asyncio
 
 # Local utilities & deps
 from .dependencies import app_state, get_qdrant_client
+from . import http_clients
 
 # Dynamic batch-size helper (runs in lifespan → sets env vars before heavy work)
 from .utils import autosize
 
 # Routers – imported *after* helper to ensure any module-level constants read the
 # finalised environment variables.
-from .routers import search, images, duplicates, random, collections, umap, curation, ingest
+from .routers import search, images, duplicates, random, collections, umap, curation, ingest, thumbnails
 
 # Configure logging
 logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
@@ -37,6 +38,8 @@ class CapabilitiesResponse(BaseModel):
     is_ready_for_ingestion: bool
     active_collection: Optional[str] = None
     ml_service_url: str
+    # Circuit-breaker state of each upstream the service talks to
+    upstreams: Dict[str, Dict[str, Any]] = {}
 
 class IngestRequest(BaseModel):
     pass  # Placeholder for now
@@ -151,6 +154,10 @@ async def lifespan(app: FastAPI):
                 # to prevent the service from starting in a broken state.
                 # For now, we'll log the error and continue, but endpoints will likely fail.
 
+    # Replay points from ingest jobs that were interrupted before Qdrant acknowledged them
+    from .pipeline import db_upserter
+    ledger_recovery_task = asyncio.create_task(db_upserter.recover_ledgers(app_state.qdrant_client))
+
     # Note: We don't load ML models here anymore - we use the ML service via HTTP
     app_state.ml_service_url = os.getenv("ML_INFERENCE_SERVICE_URL", "http://localhost:8001")
     logger.info("Using ML service at %s for embeddings", app_state.ml_service_url)
@@ -168,11 +175,14 @@ async def lifespan(app: FastAPI):
         # app_state.qdrant_client.close()
         pass
     # Cancel the periodic sync task
+    ledger_recovery_task.cancel()
     periodic_task.cancel()
     try:
         await periodic_task
-    except Exception:
+    except (asyncio.CancelledError, Exception):
         pass
+    # Close the pooled inter-service HTTP connections
+    await http_clients.aclose_all()
     logger.info("Shutdown complete.")
 
 
@@ -236,6 +246,7 @@ app.include_router(random.router)
 app.include_router(collections.router)
 app.include_router(umap.router)
 app.include_router(curation.router)
+app.include_router(thumbnails.router)
 
 # Import and include the ingest router
 app.include_router(ingest.router)
@@ -288,6 +299,7 @@ async def get_capabilities():
         is_ready_for_ingestion=app_state.is_ready_for_ingestion,
         active_collection=app_state.active_collection,
         ml_service_url=app_state.ml_service_url,
+        upstreams=http_clients.upstream_states(),
     )
 
 
@@ -0,0 +1,248 @@
+"""
+Bulk near-duplicate detection over the vectors of a collection.
+
+Vectors are streamed from Qdrant into a memory-mapped float16 matrix of
+L2-normalized rows, so cosine similarity is a plain dot product. The matrix
+is compared with itself tile by tile with a NumPy matmul: every tile of the
+upper triangle is computed once and feeds the running top-k of both its row
+block and its column block, so memory stays bounded by the tile size and the
+``(n, k)`` top-k arrays. Pairs above the threshold are merged into groups
+with union-find.
+
+A 500k x 512 collection is a 512 MB matrix on disk, and its upper triangle is
+~6.4e13 multiply-adds in large BLAS calls instead of 500k HNSW round trips.
+"""
+import logging
+import os
+import tempfile
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+from qdrant_client import QdrantClient
+
+logger = logging.getLogger(__name__)
+
+# Rows per tile: a tile holds DUPLICATES_BLOCK_SIZE^2 float32 scores (64 MB at 4096)
+DUPLICATES_BLOCK_SIZE = int(os.getenv("DUPLICATES_BLOCK_SIZE", "4096"))
+# Where the float16 vector matrix is spilled (the system temp dir by default)
+DUPLICATES_WORK_DIR = os.getenv("DUPLICATES_WORK_DIR") or None
+
+# progress(phase, done, total) with phase "loading" (points) or "comparing" (tiles)
+ProgressFn = Callable[[str, int, int], None]
+CancelledFn = Callable[[], bool]
+
+
+class Cancelled(Exception):
+    """The ``cancelled`` check returned true; the partial result is discarded."""
+
+
+def _check(cancelled: Optional[CancelledFn]) -> None:
+    if cancelled is not None and cancelled():
+        raise Cancelled()
+
+
+def _close(matrix: Optional[np.ndarray]) -> None:
+    """Unmap a memmap (or a view of one) so its file can be removed, even on Windows."""
+    mm = getattr(matrix, "_mmap", None)
+    if mm is not None:
+        mm.close()
+
+
+def load_vectors(
+    qdrant: QdrantClient,
+    collection_name: str,
+    path: str,
+    batch_size: int = 1000,
+    progress: Optional[ProgressFn] = None,
+    cancelled: Optional[CancelledFn] = None,
+) -> Tuple[List[Any], np.ndarray]:
+    """
+    Scroll every vector of ``collection_name`` into a float16 memmap at ``path``.
+
+    Returns the point ids and the ``(n, dim)`` matrix of normalized rows, in
+    the same order. Points added while scrolling beyond the initial count are
+    left out; points without a vector are skipped. The caller unmaps the
+    matrix with :func:`_close` before removing ``path``; if loading fails the
+    memmap is closed here.
+    """
+    total = qdrant.count(collection_name=collection_name, exact=True).count
+    ids: List[Any] = []
+    matrix: Optional[np.memmap] = None
+    offset = None
+    try:
+        while len(ids) < total:
+            _check(cancelled)
+            points, offset = qdrant.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=False,
+                with_vectors=True,
+            )
+            points = [p for p in points if p.vector is not None][:total - len(ids)]
+            if points:
+                vectors = np.asarray([p.vector for p in points], dtype=np.float32)
+                if matrix is None:
+                    matrix = np.memmap(path, dtype=np.float16, mode="w+", shape=(total, vectors.shape[1]))
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                matrix[len(ids):len(ids) + len(points)] = vectors / norms
+                ids.extend(p.id for p in points)
+                if progress is not None:
+                    progress("loading", len(ids), total)
+            if offset is None:
+                break
+    except BaseException:
+        _close(matrix)
+        raise
+
+    if matrix is None:
+        return [], np.zeros((0, 0), dtype=np.float16)
+    matrix.flush()
+    return ids, matrix[:len(ids)]
+
+
+def _merge_top_k(
+    best_scores: np.ndarray,
+    best_ids: np.ndarray,
+    row_start: int,
+    scores: np.ndarray,
+    col_start: int,
+    threshold: float,
+) -> None:
+    """Fold a tile of scores into the running top-k of its rows (only rows with a hit)."""
+    hit_rows = np.flatnonzero((scores >= threshold).any(axis=1))
+    if hit_rows.size == 0:
+        return
+    k = best_scores.shape[1]
+    tile = scores[hit_rows]
+    tile = np.where(tile >= threshold, tile, -np.inf)
+    target = row_start + hit_rows
+    cand_scores = np.concatenate([best_scores[target], tile], axis=1)
+    cand_ids = np.concatenate(
+        [best_ids[target], np.broadcast_to(np.arange(col_start, col_start + tile.shape[1]), tile.shape)],
+        axis=1,
+    )
+    top = np.argpartition(-cand_scores, k - 1, axis=1)[:, :k]
+    best_scores[target] = np.take_along_axis(cand_scores, top, axis=1)
+    best_ids[target] = np.take_along_axis(cand_ids, top, axis=1)
+
+
+def top_k_neighbours(
+    matrix: np.ndarray,
+    threshold: float,
+    k: int,
+    block_size: Optional[int] = None,
+    progress: Optional[ProgressFn] = None,
+    cancelled: Optional[CancelledFn] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Up to ``k`` most similar other rows per row, among those scoring at least ``threshold``.
+
+    Returns ``(scores, indices)`` arrays of shape ``(n, k)``; unused slots hold
+    ``-inf`` scores. A row is never its own neighbour.
+    """
+    n = matrix.shape[0]
+    block_size = block_size or DUPLICATES_BLOCK_SIZE
+    best_scores = np.full((n, k), -np.inf, dtype=np.float32)
+    best_ids = np.full((n, k), -1, dtype=np.int64)
+    starts = list(range(0, n, block_size))
+    total_tiles = len(starts) * (len(starts) + 1) // 2
+    done = 0
+    for i in starts:
+        rows = np.asarray(matrix[i:i + block_size], dtype=np.float32)
+        for j in starts:
+            if j < i:
+                continue
+            _check(cancelled)
+            cols = rows if j == i else np.asarray(matrix[j:j + block_size], dtype=np.float32)
+            scores = rows @ cols.T
+            if j == i:
+                # Diagonal tile: symmetric, so its rows already cover both directions
+                np.fill_diagonal(scores, -np.inf)
+                _merge_top_k(best_scores, best_ids, i, scores, j, threshold)
+            else:
+                _merge_top_k(best_scores, best_ids, i, scores, j, threshold)
+                _merge_top_k(best_scores, best_ids, j, scores.T, i, threshold)
+            done += 1
+            if progress is not None:
+                progress("comparing", done, total_tiles)
+    return best_scores, best_ids
+
+
+class UnionFind:
+    """Disjoint sets over ``0..n-1`` with path halving and union by size."""
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, x: int) -> int:
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a: int, b: int) -> None:
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+def group_rows(best_scores: np.ndarray, best_ids: np.ndarray, threshold: float) -> List[List[int]]:
+    """Connected components (of two rows or more) of the pairs scoring at least ``threshold``."""
+    rows, slots = np.nonzero(best_scores >= threshold)
+    uf = UnionFind(best_scores.shape[0])
+    for row, col in zip(rows.tolist(), best_ids[rows, slots].tolist()):
+        uf.union(row, col)
+    groups: dict = {}
+    for row in sorted(set(rows.tolist()) | set(best_ids[rows, slots].tolist())):
+        groups.setdefault(uf.find(row), []).append(row)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def find_duplicate_groups(
+    qdrant: QdrantClient,
+    collection_name: str,
+    threshold: float,
+    k: int,
+    batch_size: int = 1000,
+    block_size: Optional[int] = None,
+    work_dir: Optional[str] = None,
+    progress: Optional[ProgressFn] = None,
+    cancelled: Optional[CancelledFn] = None,
+) -> List[List[Tuple[Any, float]]]:
+    """
+    Groups of near-duplicate points in ``collection_name``.
+
+    Each group is a list of ``(point_id, score)``: the first point is the
+    earliest scrolled member with score 1.0, the others carry their cosine
+    similarity to it. Raises :class:`Cancelled` when ``cancelled`` returns true.
+    """
+    fd, path = tempfile.mkstemp(prefix=f"dups_{collection_name}_", suffix=".f16", dir=work_dir or DUPLICATES_WORK_DIR)
+    os.close(fd)
+    matrix = None
+    try:
+        ids, matrix = load_vectors(qdrant, collection_name, path, batch_size, progress, cancelled)
+        if not ids:
+            return []
+        best_scores, best_ids = top_k_neighbours(matrix, threshold, k, block_size, progress, cancelled)
+        groups = []
+        for members in group_rows(best_scores, best_ids, threshold):
+            vectors = np.asarray(matrix[members], dtype=np.float32)
+            scores = vectors @ vectors[0]
+            groups.append([(ids[members[0]], 1.0)] + [(ids[m], float(s)) for m, s in zip(members[1:], scores[1:])])
+        logger.info(f"Found {len(groups)} near-duplicate groups among {len(ids)} points of {collection_name}")
+        return groups
+    finally:
+        _close(matrix)
+        matrix = None
+        try:
+            os.unlink(path)
+        except OSError as e:
+            # Never mask the real outcome (e.g. Cancelled) with a cleanup failure
+            logger.warning(f"Could not remove duplicate scan matrix {path}: {e}")
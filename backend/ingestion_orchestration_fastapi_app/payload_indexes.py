@@ -0,0 +1,249 @@
+"""
+Payload indexes for the metadata fields the API filters and sorts on.
+
+``INDEX_SCHEMAS`` declares a typed index for each filterable field the
+pipeline writes. ``ensure_indexes`` creates the missing ones when a
+collection is created or merged, ``inspect_indexes`` compares a collection
+against the declaration and ``rebuild_indexes`` drops and recreates them.
+``normalize_payloads`` backfills the typed EXIF fields of points ingested
+before they existed.
+
+Qdrant only orders scroll results by a field that has an integer, float or
+datetime payload index. ``ensure_order_index`` creates that index the first
+time a field is used in ``order_by``. Declared fields get their fixed schema.
+Other fields get a schema inferred from a stored value. Fields already ensured
+are remembered per collection, so later requests make no extra Qdrant calls.
+"""
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import (
+    DatetimeRange, Filter, IsEmptyCondition, PayloadField, PayloadSchemaType, Range, SetPayload,
+    SetPayloadOperation,
+)
+
+from .pipeline.utils import TYPED_EXIF_FIELDS, normalize_exif
+
+logger = logging.getLogger(__name__)
+
+# Typed index of every payload field the pipeline writes that is filtered or sorted on
+INDEX_SCHEMAS: Dict[str, PayloadSchemaType] = {
+    "tags": PayloadSchemaType.KEYWORD,
+    "file_hash": PayloadSchemaType.KEYWORD,
+    "camera_make": PayloadSchemaType.KEYWORD,
+    "camera_model": PayloadSchemaType.KEYWORD,
+    "lens_model": PayloadSchemaType.KEYWORD,
+    "date_taken": PayloadSchemaType.DATETIME,
+    "width": PayloadSchemaType.INTEGER,
+    "height": PayloadSchemaType.INTEGER,
+    "iso": PayloadSchemaType.INTEGER,
+    "f_number": PayloadSchemaType.FLOAT,
+    "exposure_time": PayloadSchemaType.FLOAT,
+    "focal_length": PayloadSchemaType.FLOAT,
+}
+ORDERABLE_SCHEMAS = {PayloadSchemaType.INTEGER, PayloadSchemaType.FLOAT, PayloadSchemaType.DATETIME}
+# Declared fields that can be sorted on
+ORDER_BY_SCHEMAS: Dict[str, PayloadSchemaType] = {
+    field: schema for field, schema in INDEX_SCHEMAS.items() if schema in ORDERABLE_SCHEMAS
+}
+
+_ensured: Dict[str, Dict[str, PayloadSchemaType]] = {}
+_lock = threading.Lock()
+
+
+class NotSortableError(ValueError):
+    """The field has no values, or values Qdrant cannot order by."""
+
+
+def range_for(field: str, gte: Any, lte: Any):
+    """
+    Range condition for ``field``: a ``DatetimeRange`` for declared datetime
+    fields, whose bounds are RFC 3339 dates that a numeric ``Range`` rejects.
+    """
+    if INDEX_SCHEMAS.get(field) == PayloadSchemaType.DATETIME:
+        return DatetimeRange(gte=gte, lte=lte)
+    return Range(gte=gte, lte=lte)
+
+
+def infer_schema(value: Any) -> Optional[PayloadSchemaType]:
+    """Orderable schema for a payload value, or ``None``."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return PayloadSchemaType.INTEGER
+    if isinstance(value, float):
+        return PayloadSchemaType.FLOAT
+    if isinstance(value, str):
+        try:
+            datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return PayloadSchemaType.DATETIME
+        except ValueError:
+            return None
+    return None
+
+
+def _schema_type(index_info: Any) -> Optional[PayloadSchemaType]:
+    data_type = getattr(index_info, "data_type", None)
+    try:
+        return PayloadSchemaType(getattr(data_type, "value", data_type))
+    except ValueError:
+        return None
+
+
+def ensure_order_index(qdrant: QdrantClient, collection_name: str, field: str) -> PayloadSchemaType:
+    """
+    Make sure ``field`` has an orderable payload index in ``collection_name``.
+
+    Returns the schema type; raises :class:`NotSortableError` when the field
+    cannot be indexed for ordering.
+    """
+    with _lock:
+        known = _ensured.get(collection_name, {}).get(field)
+    if known is not None:
+        return known
+
+    existing = (qdrant.get_collection(collection_name).payload_schema or {}).get(field)
+    if existing is not None:
+        schema = _schema_type(existing)
+        if schema not in ORDERABLE_SCHEMAS:
+            raise NotSortableError(f"'{field}' is indexed as {schema.value if schema else 'unknown'}, which cannot be sorted")
+    else:
+        schema = ORDER_BY_SCHEMAS.get(field)
+        if schema is None:
+            points, _ = qdrant.scroll(
+                collection_name=collection_name,
+                scroll_filter=Filter(must_not=[IsEmptyCondition(is_empty=PayloadField(key=field))]),
+                limit=1,
+                with_payload=[field],
+                with_vectors=False,
+            )
+            value = (points[0].payload or {}).get(field) if points else None
+            schema = infer_schema(value)
+            if schema is None:
+                raise NotSortableError(f"'{field}' has no numeric or date values to sort by")
+        qdrant.create_payload_index(collection_name=collection_name, field_name=field, field_schema=schema, wait=True)
+        logger.info(f"Created {schema.value} payload index on '{field}' in {collection_name} for sorting")
+
+    with _lock:
+        _ensured.setdefault(collection_name, {})[field] = schema
+    return schema
+
+
+def forget(collection_name: str) -> None:
+    """Forget the indexes ensured for a collection that was deleted or recreated."""
+    with _lock:
+        _ensured.pop(collection_name, None)
+
+
+def _remember(collection_name: str, field: str, schema: PayloadSchemaType) -> None:
+    if schema in ORDERABLE_SCHEMAS:
+        with _lock:
+            _ensured.setdefault(collection_name, {})[field] = schema
+
+
+def ensure_indexes(qdrant: QdrantClient, collection_name: str) -> List[str]:
+    """
+    Create the declared indexes ``collection_name`` is missing; returns their fields.
+
+    A field already indexed with another schema is left alone and logged:
+    :func:`rebuild_indexes` replaces it.
+    """
+    existing = qdrant.get_collection(collection_name).payload_schema or {}
+    created = []
+    for field, schema in INDEX_SCHEMAS.items():
+        if field in existing:
+            actual = _schema_type(existing[field])
+            if actual != schema:
+                logger.warning(f"'{field}' in {collection_name} is indexed as {actual.value if actual else 'unknown'}, not {schema.value}")
+            continue
+        qdrant.create_payload_index(collection_name=collection_name, field_name=field, field_schema=schema, wait=True)
+        _remember(collection_name, field, schema)
+        created.append(field)
+    if created:
+        logger.info(f"Created payload indexes on {created} in {collection_name}")
+    return created
+
+
+def inspect_indexes(qdrant: QdrantClient, collection_name: str) -> List[Dict[str, Any]]:
+    """
+    The declared and actual index of each field in ``collection_name``.
+
+    ``status`` is ``ok``, ``missing``, ``mismatch`` (indexed with another
+    schema) or ``undeclared`` (an index outside ``INDEX_SCHEMAS``).
+    """
+    existing = qdrant.get_collection(collection_name).payload_schema or {}
+    report = []
+    for field in list(INDEX_SCHEMAS) + sorted(f for f in existing if f not in INDEX_SCHEMAS):
+        declared = INDEX_SCHEMAS.get(field)
+        info = existing.get(field)
+        actual = _schema_type(info) if info is not None else None
+        if declared is None:
+            status = "undeclared"
+        elif info is None:
+            status = "missing"
+        else:
+            status = "ok" if actual == declared else "mismatch"
+        report.append({
+            "field": field,
+            "declared": declared.value if declared else None,
+            "actual": actual.value if actual else None,
+            "points": getattr(info, "points", None),
+            "status": status,
+        })
+    return report
+
+
+def rebuild_indexes(qdrant: QdrantClient, collection_name: str, fields: Optional[List[str]] = None) -> List[str]:
+    """
+    Drop and recreate the declared indexes of ``fields`` (all declared fields by
+    default). Raises ``ValueError`` for a field that is not declared.
+    """
+    fields = list(INDEX_SCHEMAS) if fields is None else fields
+    unknown = [f for f in fields if f not in INDEX_SCHEMAS]
+    if unknown:
+        raise ValueError(f"No declared index for {unknown}")
+
+    existing = qdrant.get_collection(collection_name).payload_schema or {}
+    forget(collection_name)
+    for field in fields:
+        if field in existing:
+            qdrant.delete_payload_index(collection_name=collection_name, field_name=field, wait=True)
+        qdrant.create_payload_index(collection_name=collection_name, field_name=field, field_schema=INDEX_SCHEMAS[field], wait=True)
+        _remember(collection_name, field, INDEX_SCHEMAS[field])
+    logger.info(f"Rebuilt payload indexes on {fields} in {collection_name}")
+    return fields
+
+
+def normalize_payloads(qdrant: QdrantClient, collection_name: str, batch_size: int = 256) -> int:
+    """
+    Write the typed EXIF fields (``pipeline.utils.normalize_exif``) of points
+    ingested before they existed. Returns the number of points updated.
+    """
+    exif_keys = sorted({key for keys in TYPED_EXIF_FIELDS.values() for key in keys})
+    selector = exif_keys + list(TYPED_EXIF_FIELDS)
+    updated = 0
+    offset = None
+    while True:
+        points, offset = qdrant.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=selector,
+            with_vectors=False,
+        )
+        operations = []
+        for point in points:
+            payload = point.payload or {}
+            typed = {k: v for k, v in normalize_exif(payload).items() if payload.get(k) != v}
+            if typed:
+                operations.append(SetPayloadOperation(set_payload=SetPayload(payload=typed, points=[point.id])))
+        if operations:
+            qdrant.batch_update_points(collection_name=collection_name, update_operations=operations, wait=True)
+            updated += len(operations)
+        if offset is None:
+            break
+    logger.info(f"Normalized EXIF fields of {updated} points in {collection_name}")
+    return updated
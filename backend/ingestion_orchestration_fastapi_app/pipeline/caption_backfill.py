@@ -0,0 +1,191 @@
+import asyncio
+import contextlib
+import base64
+import io
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from fastapi import BackgroundTasks
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Filter, FieldCondition, IsEmptyCondition, MatchValue, PayloadField
+
+from .manager import JobContext, JobStatus, active_jobs
+from .cpu_processor import cache  # Import the shared cache instance
+from . import gpu_worker, db_upserter, image_record
+from .. import thumbnail_store
+
+logger = logging.getLogger(__name__)
+
+# Points captioned per ML request; the ML service splits them into BLIP-sized device batches
+CAPTION_BACKFILL_BATCH_SIZE = int(os.environ.get("CAPTION_BACKFILL_BATCH_SIZE", "128"))
+# Caption requests in flight while the next page is read from Qdrant
+CAPTION_BACKFILL_INFLIGHT = int(os.environ.get("CAPTION_BACKFILL_INFLIGHT", "2"))
+# Shorter side of images re-read from disk for source="original" (BLIP input resolution)
+CAPTION_SOURCE_MIN_SIDE = 384
+
+CAPTION_SOURCES = {"thumbnail", "original"}
+
+# Points with no caption, a null caption or an empty one (captioning was switched off)
+MISSING_CAPTION_FILTER = Filter(should=[
+    IsEmptyCondition(is_empty=PayloadField(key="caption")),
+    FieldCondition(key="caption", match=MatchValue(value="")),
+])
+
+_PAYLOAD_FIELDS = ["filename", "full_path", "thumbnail_base64", "file_hash"]
+
+
+def _load_original(full_path: str) -> Optional[bytes]:
+    """Decode the source file at BLIP resolution and return it as JPEG bytes."""
+    record, error = image_record.load_image_record(full_path, target_min_side=CAPTION_SOURCE_MIN_SIDE)
+    if error or record is None:
+        return None
+    buffer = io.BytesIO()
+    record.image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _caption_item(point: Any, source: str) -> Optional[Dict[str, Any]]:
+    """Build an ML caption request item for one point, or None if it has no usable image."""
+    payload = point.payload or {}
+    image_bytes = None
+    if source == "original" and payload.get("full_path") and os.path.isfile(payload["full_path"]):
+        image_bytes = _load_original(payload["full_path"])
+    if image_bytes is None and payload.get("file_hash"):
+        # Largest stored variant; BLIP sees it at its input resolution anyway
+        stored = thumbnail_store.read(payload["file_hash"], thumbnail_store.THUMBNAIL_SIZES[-1])
+        if stored is not None:
+            image_bytes = stored[1]
+    if image_bytes is None and payload.get("thumbnail_base64"):
+        image_bytes = base64.b64decode(payload["thumbnail_base64"])
+    if image_bytes is None:
+        return None
+    return {
+        # The ML service echoes this back as unique_id; the point id is what we update
+        "file_hash": str(point.id),
+        "filename": payload.get("filename") or str(point.id),
+        "image_bytes": image_bytes,
+        "cache_key_hash": payload.get("file_hash"),
+    }
+
+
+async def _caption_page(ctx: JobContext, collection_name: str, qdrant_client: QdrantClient, items: List[Dict[str, Any]], client) -> None:
+    start = time.perf_counter()
+    results = await gpu_worker.send_batch_to_ml_service(items, caption=True, embed=False, client=client, tenant=ctx.job_id)
+    by_id = {r.get("unique_id"): r for r in results}
+
+    captions: Dict[str, str] = {}
+    for item in items:
+        result = by_id.get(item["file_hash"]) or {}
+        if result.get("error") or not result.get("caption"):
+            ctx.failed_files += 1
+            continue
+        captions[item["file_hash"]] = result["caption"]
+    if not captions:
+        return
+
+    await db_upserter.set_captions(qdrant_client, collection_name, captions, wait=False)
+    for item in items:
+        caption = captions.get(item["file_hash"])
+        if caption is None or not item.get("cache_key_hash"):
+            continue
+        # Keep the dedup cache in step so a later re-ingest does not restore an empty caption
+        key = f"{collection_name}:{item['cache_key_hash']}"
+        cached = cache.get(key)
+        if cached and str(cached.get("id")) == item["file_hash"]:
+            cached["payload"]["caption"] = caption
+            cache.set(key, cached)
+
+    ctx.processed_files += len(captions)
+    ctx.stage("caption").record(items=len(captions), elapsed=time.perf_counter() - start)
+    ctx.add_log(f"Captioned {len(captions)} points.")
+
+
+async def _run_caption_backfill(job_id: str, collection_name: str, qdrant_client: QdrantClient, source: str):
+    """Scroll the collection for uncaptioned points and caption them in large batches."""
+    ctx = active_jobs.get(job_id)
+    if not ctx:
+        logger.error(f"Caption backfill job {job_id} context not found.")
+        return
+
+    ctx.status = JobStatus.RUNNING
+    ctx.add_log(f"Starting caption backfill for collection '{collection_name}' (source={source})")
+    in_flight: set[asyncio.Task] = set()
+    try:
+        counted = await asyncio.to_thread(
+            qdrant_client.count, collection_name=collection_name, count_filter=MISSING_CAPTION_FILTER, exact=True
+        )
+        ctx.total_files = counted.count
+        ctx.scan_complete = True
+        logger.info(f"[{job_id}] {ctx.total_files} points in '{collection_name}' have no caption")
+
+        async with contextlib.nullcontext(gpu_worker.ml_client()) as client:
+            offset = None
+            while True:
+                points, offset = await asyncio.to_thread(
+                    qdrant_client.scroll,
+                    collection_name=collection_name,
+                    scroll_filter=MISSING_CAPTION_FILTER,
+                    limit=ctx.blip_batch_size,
+                    offset=offset,
+                    with_payload=_PAYLOAD_FIELDS,
+                    with_vectors=False,
+                )
+                if points:
+                    items = await asyncio.to_thread(lambda: [_caption_item(p, source) for p in points])
+                    usable = [item for item in items if item is not None]
+                    ctx.failed_files += len(items) - len(usable)
+                    while len(in_flight) >= max(1, CAPTION_BACKFILL_INFLIGHT):
+                        await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    if usable:
+                        task = asyncio.create_task(_caption_page(ctx, collection_name, qdrant_client, usable, client))
+                        in_flight.add(task)
+                        task.add_done_callback(in_flight.discard)
+                if offset is None:
+                    break
+            if in_flight:
+                for result in await asyncio.gather(*in_flight, return_exceptions=True):
+                    if isinstance(result, Exception):
+                        raise result
+
+        ctx.status = JobStatus.COMPLETED
+        ctx.add_log(f"Caption backfill completed: {ctx.processed_files} captioned, {ctx.failed_files} failed.")
+        logger.info(f"[{job_id}] Caption backfill completed: {ctx.processed_files} captioned, {ctx.failed_files} failed")
+    except asyncio.CancelledError:
+        ctx.status = JobStatus.CANCELLED
+        raise
+    except Exception as e:
+        logger.error(f"[{job_id}] Caption backfill failed: {e}", exc_info=True)
+        ctx.status = JobStatus.FAILED
+        ctx.add_log(f"Caption backfill failed: {e}", level="error")
+    finally:
+        for task in in_flight:
+            task.cancel()
+        ctx.end_time = time.time()
+        for name, stats in ctx.stage_stats.items():
+            logger.info(f"[{job_id}] Stage '{name}' throughput: {stats.as_dict()}")
+
+
+async def start_caption_backfill(
+    collection_name: str,
+    background_tasks: BackgroundTasks,
+    qdrant_client: QdrantClient,
+    source: str = "thumbnail",
+) -> str:
+    """
+    Schedule a caption backfill job. It is tracked in ``active_jobs`` like an
+    ingestion job, so progress is available from the ingest status endpoint.
+    """
+    if source not in CAPTION_SOURCES:
+        raise ValueError(f"Unknown caption source '{source}'; expected one of {sorted(CAPTION_SOURCES)}")
+    ctx = JobContext(
+        job_id=str(uuid.uuid4()),
+        blip_batch_size=max(1, CAPTION_BACKFILL_BATCH_SIZE),
+        caption=True,
+    )
+    active_jobs[ctx.job_id] = ctx
+    background_tasks.add_task(_run_caption_backfill, ctx.job_id, collection_name, qdrant_client, source)
+    logger.info(f"Scheduled caption backfill job {ctx.job_id} for collection '{collection_name}' (source={source}, batch_size={ctx.blip_batch_size})")
+    return ctx.job_id
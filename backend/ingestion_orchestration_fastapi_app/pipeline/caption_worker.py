@@ -0,0 +1,142 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from typing import Dict, List
+
+from qdrant_client import QdrantClient
+
+from .manager import JobContext
+from .cpu_processor import cache  # Import the shared cache instance
+from . import gpu_worker, db_upserter, decode_pool, image_record
+
+logger = logging.getLogger(__name__)
+
+# How long a partial caption batch waits for more items before it is sent
+CAPTION_BATCH_LINGER = float(os.environ.get("INGEST_CAPTION_BATCH_LINGER", "1.0"))
+# Longest wait for the DB stage to acknowledge a point before its caption is written anyway
+CAPTION_ACK_TIMEOUT = float(os.environ.get("INGEST_CAPTION_ACK_TIMEOUT", "60"))
+_ACK_POLL_INTERVAL = 0.1
+
+
+async def _wait_for_acks(ctx: JobContext, point_ids: List[str]) -> None:
+    """Block until Qdrant has acknowledged the points, so payload updates never race their upsert."""
+    if ctx.ledger is None:
+        return
+    deadline = time.monotonic() + CAPTION_ACK_TIMEOUT
+    while any(ctx.ledger.is_pending(pid) for pid in point_ids):
+        if time.monotonic() >= deadline:
+            logger.warning(f"[{ctx.job_id}] [Caption] Points still unacknowledged after {CAPTION_ACK_TIMEOUT}s; writing captions anyway")
+            return
+        await asyncio.sleep(_ACK_POLL_INTERVAL)
+
+
+def _with_images(ctx: JobContext, batch: list) -> list:
+    """
+    Decode each queued source file again, at the model input size and in the
+    job's transport encoding, so BLIP sees the same image as inline captioning.
+    Files that no longer decode, or changed since they were embedded, are skipped.
+    """
+    items = []
+    for item in batch:
+        try:
+            record, error = image_record.load_image_record(item["file_path"], ctx.model_input_size)
+        except OSError as e:
+            record, error = None, str(e)
+        if record is None or record.file_hash != item["file_hash"]:
+            logger.warning(f"[{ctx.job_id}] [Caption] Cannot caption {item['filename']}: {error or 'file changed since it was embedded'}")
+            continue
+        items.append({**item, **decode_pool.encode_model_input(record.image, ctx.ml_transport)})
+    return items
+
+
+async def _caption_batch(ctx: JobContext, collection_name: str, qdrant_client: QdrantClient, batch: list, client) -> None:
+    start = time.perf_counter()
+    batch = await asyncio.to_thread(_with_images, ctx, batch)
+    if not batch:
+        return
+    results = await gpu_worker.send_batch_to_ml_service(batch, caption=True, embed=False, client=client, tenant=ctx.job_id)
+    by_hash = {r.get("unique_id"): r for r in results}
+
+    captions: Dict[str, str] = {}
+    cache_keys: Dict[str, str] = {}
+    for item in batch:
+        result = by_hash.get(item["file_hash"]) or {}
+        if result.get("error") or result.get("caption") is None:
+            # The point is already searchable; a missing caption is picked up by a backfill
+            logger.warning(f"[{ctx.job_id}] [Caption] No caption for {item['filename']}: {result.get('error', 'no result')}")
+            continue
+        captions[item["point_id"]] = result["caption"]
+        cache_keys[item["point_id"]] = f"{item['collection_name']}:{item['file_hash']}"
+
+    if not captions:
+        return
+    await _wait_for_acks(ctx, list(captions))
+    try:
+        await db_upserter.set_captions(qdrant_client, collection_name, captions)
+    except Exception as e:
+        logger.error(f"[{ctx.job_id}] [Caption] Failed to write {len(captions)} captions: {e}", exc_info=True)
+        ctx.add_log(f"Failed to write {len(captions)} captions: {e}", level="error")
+        return
+
+    # Keep cached records in step so cache hits carry the caption
+    for point_id, caption in captions.items():
+        cached = cache.get(cache_keys[point_id])
+        if cached and str(cached.get("id")) == str(point_id):
+            cached["payload"]["caption"] = caption
+            cache.set(cache_keys[point_id], cached)
+
+    ctx.stage("caption").record(items=len(captions), elapsed=time.perf_counter() - start)
+    logger.info(f"[{ctx.job_id}] [Caption] Wrote {len(captions)} captions")
+
+
+async def process_captions(ctx: JobContext, collection_name: str, qdrant_client: QdrantClient):
+    """
+    Caption stage for jobs with ``ctx.deferred_captions``.
+
+    Consumes references to embedded points from ``caption_queue`` (already
+    upserted without a caption), decodes their source files again, sends them
+    to BLIP in caption-only batches of ``ctx.blip_batch_size``
+    and writes the captions back with bulk payload updates. Runs independently of
+    the embedding stage, so search availability is bounded by CLIP throughput.
+    """
+    batch_size = max(1, ctx.blip_batch_size or ctx.ml_batch_size)
+    batch: list = []
+
+    async def flush():
+        nonlocal batch
+        items, batch = batch, []
+        try:
+            await _caption_batch(ctx, collection_name, qdrant_client, items, client)
+        except Exception as e:
+            logger.error(f"[{ctx.job_id}] [Caption] Batch of {len(items)} failed: {e}", exc_info=True)
+        finally:
+            for _ in items:
+                ctx.caption_queue.task_done()
+
+    async with contextlib.nullcontext(gpu_worker.ml_client()) as client:
+        try:
+            while True:
+                try:
+                    if batch:
+                        item = await asyncio.wait_for(ctx.caption_queue.get(), timeout=CAPTION_BATCH_LINGER)
+                    else:
+                        item = await ctx.caption_queue.get()
+                except asyncio.TimeoutError:
+                    await flush()
+                    continue
+
+                if item is None:
+                    if batch:
+                        await flush()
+                    ctx.caption_queue.task_done()
+                    break
+
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    await flush()
+        except asyncio.CancelledError:
+            logger.info(f"[{ctx.job_id}] Caption worker cancelled.")
+        except Exception as e:
+            logger.error(f"[{ctx.job_id}] Unhandled error in caption worker: {e}", exc_info=True)
@@ -1,24 +1,37 @@
 import asyncio
+import base64
 import logging
 import diskcache
 from typing import Any
 import os
-import base64
-import io
 
 from qdrant_client.http.models import PointStruct
 
-from .manager import JobContext
-from . import utils
-from . import image_processing
-
 logger = logging.getLogger(__name__)
 
 # The cache is a thread-safe and process-safe key-value store.
 # We can use a single instance across all workers.
-CACHE_DIR = ".diskcache"
+# Defined before the manager import: the manager imports the other stages,
+# which in turn import this cache.
+CACHE_DIR = os.environ.get("INGEST_CACHE_DIR", ".diskcache")
 cache = diskcache.Cache(CACHE_DIR)
 
+from .manager import JobContext
+from . import decode_pool
+from .. import thumbnail_store
+
+
+def _without_legacy_thumbnail(file_hash: str, payload: dict) -> dict:
+    """Move a base64 thumbnail cached by older versions into the thumbnail store and drop it from the payload."""
+    legacy = payload.get("thumbnail_base64")
+    if not legacy:
+        return payload
+    try:
+        thumbnail_store.store_encoded(file_hash, base64.b64decode(legacy))
+    except Exception as e:
+        logger.warning(f"Could not migrate cached thumbnail for {file_hash}: {e}")
+    return {key: value for key, value in payload.items() if key != "thumbnail_base64"}
+
 
 async def process_files(ctx: JobContext, collection_name: str):
     """
@@ -37,65 +50,53 @@ async def process_files(ctx: JobContext, collection_name: str):
 
             try:
                 # --- CPU-bound work ---
-                # Run synchronous file I/O and hashing in a separate thread
-                # to avoid blocking the asyncio event loop.
+                # Hash, cache check, decode, thumbnails and metadata happen in one
+                # call, in the decode process pool when the job has one (falls back
+                # to the default thread executor otherwise).
                 loop = asyncio.get_running_loop()
-                file_hash = await loop.run_in_executor(None, utils.compute_sha256, file_path)
-
-                # --- Cache Check ---
-                cache_key = f"{collection_name}:{file_hash}"
-                cached_data = cache.get(cache_key)
-
-                if cached_data:
+                record = await loop.run_in_executor(
+                    ctx.decode_pool,
+                    decode_pool.prepare_image_record,
+                    file_path,
+                    collection_name,
+                    CACHE_DIR,
+                    ctx.ml_transport,
+                    ctx.model_input_size,
+                    thumbnail_store.THUMBNAIL_STORE_DIR,
+                )
+                file_hash = record["file_hash"]
+
+                if record.get("cached"):
                     # Cache Hit: Send directly to DB
+                    cached_data = record["cached"]
+                    payload = await asyncio.to_thread(_without_legacy_thumbnail, file_hash, cached_data["payload"])
                     point = PointStruct(
                         id=cached_data["id"],
                         vector=cached_data["vector"],
-                        payload=cached_data["payload"],
+                        payload=payload,
                     )
                     await ctx.db_queue.put(point)
                     ctx.cached_files += 1
+                    ctx.stage("decode").record(elapsed=record.get("elapsed", 0.0))
                     ctx.add_log(f"Cache hit for {os.path.basename(file_path)}")
+                elif record.get("error"):
+                    ctx.add_log(f"Failed to decode {os.path.basename(file_path)}: {record['error']}", level="error")
+                    ctx.failed_files += 1
                 else:
-                    # Cache Miss: Decode image, then send to ML queue for processing
-                    loop = asyncio.get_running_loop()
-                    
-                    # 1. Decode the image using our new processing utility
-                    image_pil, error = await loop.run_in_executor(
-                        None, image_processing.decode_and_prep_image, file_path
-                    )
-
-                    if error or image_pil is None:
-                        ctx.add_log(f"Failed to decode {os.path.basename(file_path)}: {error}", level="error")
-                        ctx.failed_files += 1
-                        ctx.raw_queue.task_done()
-                        continue
-
-                    # 2. Serialize PIL image to base64 PNG for the ML service
-                    img_byte_arr = io.BytesIO()
-                    image_pil.save(img_byte_arr, format='PNG')
-                    image_base64 = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
-
-                    # 3. Create a smaller thumbnail from the PIL image for the frontend
-                    thumbnail_pil = image_pil.copy()
-                    thumbnail_pil.thumbnail((200, 200))
-                    thumb_byte_arr = io.BytesIO()
-                    thumbnail_pil.save(thumb_byte_arr, format='JPEG', quality=85)
-                    thumbnail_base64 = base64.b64encode(thumb_byte_arr.getvalue()).decode('utf-8')
-                    
-                    # 4. Extract metadata
-                    metadata = await loop.run_in_executor(None, utils.extract_image_metadata, file_path)
-
-                    await ctx.ml_queue.put({
+                    # Cache Miss: send the decoded record to the ML queue for processing
+                    item = {
                         "unique_id": file_hash,
                         "file_hash": file_hash,
-                        "image_base64": image_base64,
-                        "thumbnail_base64": thumbnail_base64,
                         "filename": os.path.basename(file_path),
-                        "metadata": metadata,
+                        "metadata": record["metadata"],
                         "collection_name": collection_name,
-                    })
+                    }
+                    for key in ("image_base64", "image_bytes"):
+                        if key in record:
+                            item[key] = record[key]
+                    await ctx.ml_queue.put(item)
                     ctx.processed_files += 1
+                    ctx.stage("decode").record(nbytes=record.get("nbytes", 0), elapsed=record.get("elapsed", 0.0))
 
             except Exception as e:
                 logger.error(f"[{ctx.job_id}] Failed to process file {file_path}: {e}", exc_info=True)
@@ -1,22 +1,62 @@
 import asyncio
 import logging
 import os
-from typing import List
-import json
+import time
+from typing import Any, Dict, List
 
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import PointStruct, Filter, FieldCondition
+from qdrant_client.http.exceptions import UnexpectedResponse
+from qdrant_client.http.models import PointStruct, Filter, FieldCondition, SetPayload, SetPayloadOperation
 
-from .manager import JobContext
-from . import utils
+from .manager import JobContext, active_jobs
+from . import utils, ledger, scan_index
+from ..utils import count_cache
 from .cpu_processor import cache  # Import the shared cache instance
 
 logger = logging.getLogger(__name__)
 
 QDRANT_BATCH_SIZE = int(os.environ.get("QDRANT_UPSERT_BATCH_SIZE", "64"))
+# Upsert requests allowed in flight while the next batch is being collected
+QDRANT_MAX_INFLIGHT_UPSERTS = int(os.environ.get("QDRANT_MAX_INFLIGHT_UPSERTS", "2"))
+# Retries of a whole batch when Qdrant is unreachable or returns a 5xx, with a
+# delay starting at QDRANT_UPSERT_BACKOFF seconds and doubling
+QDRANT_UPSERT_RETRIES = int(os.environ.get("QDRANT_UPSERT_RETRIES", "3"))
+QDRANT_UPSERT_BACKOFF = float(os.environ.get("QDRANT_UPSERT_BACKOFF", "1.0"))
 
 MAX_QDRANT_PAYLOAD = 8 * 1024 * 1024  # 8MB safety margin
-MAX_BATCH_SIZE = 10  # Tune as needed
+
+# JSON-encoded float plus separator; used for the running size estimate
+_BYTES_PER_VECTOR_COMPONENT = 12
+_POINT_OVERHEAD_BYTES = 64
+
+
+def _estimate_value_bytes(value: Any) -> int:
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_value_bytes(v) + 1 for v in value) + 2
+    if isinstance(value, dict):
+        return sum(len(str(k)) + 4 + _estimate_value_bytes(v) for k, v in value.items()) + 2
+    return 8
+
+
+def _rejected_points(error: Exception) -> bool:
+    """True when Qdrant rejected the request for its content (bad point, too large), not for being unavailable."""
+    return isinstance(error, UnexpectedResponse) and error.status_code in (400, 413, 422)
+
+
+def estimate_point_bytes(point: PointStruct) -> int:
+    """
+    Cheap upper-bound estimate of a point's serialized size. Walks the payload
+    once instead of JSON-encoding it; thumbnails dominate and are measured exactly.
+    """
+    vector = point.vector if isinstance(point.vector, list) else []
+    return (
+        _POINT_OVERHEAD_BYTES
+        + len(vector) * _BYTES_PER_VECTOR_COMPONENT
+        + _estimate_value_bytes(point.payload or {})
+    )
+
 
 async def upsert_to_db(
     ctx: JobContext,
@@ -24,139 +64,236 @@ async def upsert_to_db(
     qdrant_client: QdrantClient
 ):
     """
-    Consumes points from db_queue, upserts them to Qdrant in small batches as soon as they arrive.
-    Implements split and retry logic for oversized batches, and at the end, checks the cache for any records not yet upserted.
+    Consumes points from db_queue and upserts them to Qdrant in batches of up to
+    ``ctx.qdrant_batch_size`` points / ``MAX_QDRANT_PAYLOAD`` bytes (running estimate).
+
+    With content-addressed point IDs (``ctx.deterministic_ids``) upserts are
+    idempotent, so points are written without any existence check. With random
+    IDs each batch does one bulk existence check. Points are acknowledged in the
+    job ledger once Qdrant has applied them (``wait=True``); at the end only the
+    ledger's unacknowledged points are replayed. All Qdrant calls run in a worker thread so the sync client never
+    blocks the event loop. Up to ``QDRANT_MAX_INFLIGHT_UPSERTS`` batches are
+    written while the next one fills.
     """
-    batch_points = []
+    batch_points: List[PointStruct] = []
     batch_bytes = 0
     upserted_ids = set()
+    in_flight: set[asyncio.Task] = set()
+    max_batch_points = max(1, ctx.qdrant_batch_size)
 
-    def estimate_batch_size(points):
-        return len(json.dumps([p.dict() for p in points]).encode("utf-8"))
-
-    async def check_point_exists(point_id: str) -> bool:
-        """Check if a point with the given ID already exists in Qdrant."""
+    async def filter_existing(points: List[PointStruct]) -> List[PointStruct]:
+        """Drop points already written in this job or already present in Qdrant (one bulk retrieve)."""
+        candidates = [p for p in points if str(p.id) not in upserted_ids]
+        if not candidates:
+            return []
         try:
-            result = qdrant_client.retrieve(
+            existing = await asyncio.to_thread(
+                qdrant_client.retrieve,
                 collection_name=collection_name,
-                ids=[point_id],
+                ids=[p.id for p in candidates],
                 with_vectors=False,
-                with_payload=False
+                with_payload=False,
             )
-            return len(result) > 0
         except Exception as e:
-            # If retrieve fails, assume point doesn't exist
-            logger.debug(f"[{ctx.job_id}] Error checking point existence for {point_id}: {e}")
-            return False
+            # If retrieve fails, assume none of the points exist
+            logger.debug(f"[{ctx.job_id}] Bulk existence check failed for {len(candidates)} points: {e}")
+            return candidates
+        existing_ids = {str(record.id) for record in existing}
+        if existing_ids:
+            logger.info(f"[{ctx.job_id}] {len(existing_ids)} points already exist in database, skipping")
+            upserted_ids.update(existing_ids)
+            if ctx.ledger is not None:
+                ctx.ledger.record_acked(existing_ids)
+        return [p for p in candidates if str(p.id) not in existing_ids]
 
-    async def upsert_batch(points):
+    async def upsert_batch(points: List[PointStruct], payload_size: int, check_existing: bool = not ctx.deterministic_ids):
         if not points:
             return
-        
-        # Filter out points that already exist in the database
-        points_to_upsert = []
-        for point in points:
-            point_id = str(point.id)
-            if point_id in upserted_ids:
-                logger.debug(f"[{ctx.job_id}] Point {point_id} already upserted in this session, skipping")
-                continue
-            
-            if await check_point_exists(point_id):
-                logger.info(f"[{ctx.job_id}] Point {point_id} already exists in database, skipping")
-                upserted_ids.add(point_id)
-                continue
-            
-            points_to_upsert.append(point)
-        
-        if not points_to_upsert:
-            logger.debug(f"[{ctx.job_id}] All points in batch already exist, skipping upsert")
+        if check_existing:
+            points = await filter_existing(points)
+            if not points:
+                logger.debug(f"[{ctx.job_id}] All points in batch already exist, skipping upsert")
+                return
+            payload_size = sum(estimate_point_bytes(p) for p in points)
+
+        if payload_size > MAX_QDRANT_PAYLOAD and len(points) > 1:
+            # Split and retry
+            mid = len(points) // 2
+            await upsert_batch(points[:mid], sum(estimate_point_bytes(p) for p in points[:mid]), check_existing=False)
+            await upsert_batch(points[mid:], sum(estimate_point_bytes(p) for p in points[mid:]), check_existing=False)
             return
-        
-        try:
-            # Estimate payload size
-            payload_size = estimate_batch_size(points_to_upsert)
-            if payload_size > MAX_QDRANT_PAYLOAD and len(points_to_upsert) > 1:
-                # Split and retry
-                mid = len(points_to_upsert) // 2
-                await upsert_batch(points_to_upsert[:mid])
-                await upsert_batch(points_to_upsert[mid:])
+
+        attempt = 0
+        while True:
+            try:
+                upsert_start = time.perf_counter()
+                # wait=False returns once Qdrant has queued the write, before it is applied.
+                # Points acked in the ledger are never replayed and indexed files are never
+                # read again, so wait for those.
+                await asyncio.to_thread(
+                    qdrant_client.upsert,
+                    collection_name=collection_name,
+                    points=points,
+                    wait=ctx.ledger is not None or ctx.scan_index is not None,
+                )
+                break
+            except Exception as e:
+                if _rejected_points(e):
+                    if len(points) > 1:
+                        # Bisect so one bad point does not fail the whole batch
+                        logger.warning(f"[{ctx.job_id}] Qdrant rejected {len(points)} points ({e}); retrying in halves")
+                        mid = len(points) // 2
+                        await upsert_batch(points[:mid], sum(estimate_point_bytes(p) for p in points[:mid]), check_existing=False)
+                        await upsert_batch(points[mid:], sum(estimate_point_bytes(p) for p in points[mid:]), check_existing=False)
+                        return
+                    logger.error(f"[{ctx.job_id}] Qdrant rejected point {points[0].id}: {e}")
+                    ctx.failed_files += 1
+                    ctx.add_log(f"Failed to upsert 1 point: {e}", level="error")
+                    return
+                if attempt < QDRANT_UPSERT_RETRIES:
+                    # Qdrant unreachable or failing: splitting the batch would only multiply the failures
+                    delay = QDRANT_UPSERT_BACKOFF * (2 ** attempt)
+                    attempt += 1
+                    logger.warning(f"[{ctx.job_id}] Upsert of {len(points)} points failed ({e}); retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                logger.error(f"[{ctx.job_id}] Failed to upsert {len(points)} points to Qdrant: {e}", exc_info=True)
+                ctx.failed_files += len(points)
+                ctx.add_log(f"Failed to upsert {len(points)} points: {e}", level="error")
                 return
-            qdrant_client.upsert(
-                collection_name=collection_name,
-                points=points_to_upsert,
-                wait=False
-            )
-            for p in points_to_upsert:
-                upserted_ids.add(str(p.id))
-            ctx.add_log(f"Upserted {len(points_to_upsert)} points to Qdrant.")
-            logger.info(f"[{ctx.job_id}] Upserted {len(points_to_upsert)} points to Qdrant.")
-        except Exception as e:
-            logger.error(f"[{ctx.job_id}] Failed to upsert batch to Qdrant: {e}", exc_info=True)
-            ctx.failed_files += len(points_to_upsert)
-            ctx.add_log(f"Failed to upsert {len(points_to_upsert)} points: {e}", level="error")
-            # Optionally, retry one-by-one if batch fails
-            if len(points_to_upsert) > 1:
-                for p in points_to_upsert:
-                    await upsert_batch([p])
-
-    while True:
-        try:
+
+        ctx.stage("db").record(items=len(points), nbytes=payload_size, elapsed=time.perf_counter() - upsert_start)
+        upserted_ids.update(str(p.id) for p in points)
+        if ctx.ledger is not None:
+            ctx.ledger.record_acked(p.id for p in points)
+        scan_index.record_points(ctx, points)
+        count_cache.image_counts.invalidate(collection_name)
+        ctx.add_log(f"Upserted {len(points)} points to Qdrant.")
+        logger.info(f"[{ctx.job_id}] Upserted {len(points)} points to Qdrant.")
+
+    async def submit(points: List[PointStruct], payload_size: int):
+        while len(in_flight) >= max(1, QDRANT_MAX_INFLIGHT_UPSERTS):
+            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        task = asyncio.create_task(upsert_batch(points, payload_size))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    async def drain():
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    try:
+        while True:
             try:
-                point = await asyncio.wait_for(ctx.db_queue.get(), timeout=1.0)
-            except asyncio.TimeoutError:
-                # No item received, just flush batch and continue (do NOT call task_done)
-                if batch_points:
-                    await upsert_batch(batch_points)
-                    batch_points = []
-                    batch_bytes = 0
-                continue
+                try:
+                    point = await asyncio.wait_for(ctx.db_queue.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    # No item received, just flush batch and continue (do NOT call task_done)
+                    if batch_points:
+                        await submit(batch_points, batch_bytes)
+                        batch_points = []
+                        batch_bytes = 0
+                    continue
 
-            if point is None:
-                # Sentinel received, flush and exit
-                if batch_points:
-                    await upsert_batch(batch_points)
+                if point is None:
+                    # Sentinel received, flush, wait for outstanding upserts and exit
+                    if batch_points:
+                        await submit(batch_points, batch_bytes)
+                        batch_points = []
+                        batch_bytes = 0
+                    await drain()
+                    ctx.db_queue.task_done()  # Only call for actual get()
+                    break
+
+                point_bytes = estimate_point_bytes(point)
+                if batch_points and (batch_bytes + point_bytes > MAX_QDRANT_PAYLOAD or len(batch_points) >= max_batch_points):
+                    await submit(batch_points, batch_bytes)
                     batch_points = []
                     batch_bytes = 0
-                ctx.db_queue.task_done()  # Only call for actual get()
+                batch_points.append(point)
+                batch_bytes += point_bytes
+                ctx.db_queue.task_done()
+            except asyncio.CancelledError:
+                logger.info(f"[{ctx.job_id}] DB Upserter worker cancelled.")
+                for task in in_flight:
+                    task.cancel()
+                return
+            except Exception as e:
+                logger.error(f"[{ctx.job_id}] Unhandled error in DB Upserter worker: {e}", exc_info=True)
                 break
 
-            # Estimate size of this point
-            point_bytes = estimate_batch_size([point])
-            if batch_points and (batch_bytes + point_bytes > MAX_QDRANT_PAYLOAD or len(batch_points) >= MAX_BATCH_SIZE):
-                await upsert_batch(batch_points)
-                batch_points = []
-                batch_bytes = 0
-            batch_points.append(point)
-            batch_bytes += point_bytes
-            ctx.db_queue.task_done()
-        except asyncio.CancelledError:
-            logger.info(f"[{ctx.job_id}] DB Upserter worker cancelled.")
-            break
-        except Exception as e:
-            logger.error(f"[{ctx.job_id}] Unhandled error in DB Upserter worker: {e}", exc_info=True)
-            break
+        # Final flush
+        if batch_points:
+            await upsert_batch(batch_points, batch_bytes)
+        await drain()
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+    # --- Replay the job's ledger: embedded points Qdrant has not acknowledged ---
+    if ctx.ledger is not None and ctx.ledger.pending:
+        pending = ctx.ledger.pending
+        logger.info(f"[{ctx.job_id}] Replaying {len(pending)} unacknowledged points from the job ledger")
+        missed = points_from_cache(pending)
+        for start in range(0, len(missed), max_batch_points):
+            chunk = missed[start:start + max_batch_points]
+            await upsert_batch(chunk, sum(estimate_point_bytes(p) for p in chunk), check_existing=False)
+
 
-    # Final flush
-    if batch_points:
-        await upsert_batch(batch_points)
+async def set_captions(qdrant_client: QdrantClient, collection_name: str, captions: Dict[str, str], wait: bool = True):
+    """Write per-point captions in one bulk request (one set-payload operation per point)."""
+    if not captions:
+        return
+    await asyncio.to_thread(
+        qdrant_client.batch_update_points,
+        collection_name=collection_name,
+        update_operations=[
+            SetPayloadOperation(set_payload=SetPayload(payload={"caption": caption}, points=[point_id]))
+            for point_id, caption in captions.items()
+        ],
+        wait=wait,
+    )
+    # Counts filtered on caption change
+    count_cache.image_counts.invalidate(collection_name)
 
-    # --- Cache scan for missed records ---
-    logger.info(f"[{ctx.job_id}] Scanning cache for missed records to upsert...")
-    prefix = f"{collection_name}:"
-    for key in cache.iterkeys(prefix=prefix):
+
+def points_from_cache(pending: Dict[str, str]) -> List[PointStruct]:
+    """Rebuild points for ledger entries (point_id -> cache key) from the shared cache."""
+    points: List[PointStruct] = []
+    for point_id, key in pending.items():
         try:
             cached = cache.get(key)
-            if not cached:
+            if not cached or str(cached["id"]) != point_id:
                 continue
-            point_id = str(cached["id"])
-            if point_id in upserted_ids:
-                continue  # Already upserted
-            point = PointStruct(
-                id=point_id,
-                vector=cached["vector"],
-                payload=cached["payload"]
-            )
-            await upsert_batch([point])
-            logger.info(f"[{ctx.job_id}] Upserted missed cached record {point_id}")
+            points.append(PointStruct(id=point_id, vector=cached["vector"], payload=cached["payload"]))
+        except Exception as e:
+            logger.error(f"Error reading cached record {key}: {e}", exc_info=True)
+    return points
+
+
+async def recover_ledgers(qdrant_client: QdrantClient, ledger_dir: str = ledger.LEDGER_DIR):
+    """
+    Replay ledgers left behind by jobs that did not finish (e.g. the service was
+    stopped mid-ingest). Only the unacknowledged points of those jobs are touched.
+    """
+    for job_ledger in ledger.iter_ledgers(ledger_dir):
+        if job_ledger.job_id in active_jobs:
+            continue  # Owned by a running job
+        pending = job_ledger.pending
+        points = points_from_cache(pending)
+        logger.info(f"[{job_ledger.job_id}] Recovering {len(points)} unacknowledged points into '{job_ledger.collection_name}'")
+        try:
+            for start in range(0, len(points), QDRANT_BATCH_SIZE):
+                chunk = points[start:start + QDRANT_BATCH_SIZE]
+                await asyncio.to_thread(
+                    qdrant_client.upsert,
+                    collection_name=job_ledger.collection_name,
+                    points=chunk,
+                    wait=True,
+                )
+                job_ledger.record_acked(p.id for p in chunk)
+            # Entries whose cache record is gone cannot be replayed; drop them too
+            job_ledger.record_acked(pending)
         except Exception as e:
-            logger.error(f"[{ctx.job_id}] Error upserting cached record {key}: {e}", exc_info=True)
+            logger.error(f"[{job_ledger.job_id}] Ledger recovery failed: {e}", exc_info=True)
+        job_ledger.close()
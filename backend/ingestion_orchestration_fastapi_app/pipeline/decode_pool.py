@@ -0,0 +1,106 @@
+import base64
+import io
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+import diskcache
+
+from . import image_record
+from .. import thumbnail_store
+
+logger = logging.getLogger(__name__)
+
+# JPEG quality for images shipped as binary multipart parts
+TRANSPORT_JPEG_QUALITY = int(os.environ.get("ML_TRANSPORT_JPEG_QUALITY", "95"))
+
+# Each worker process opens its own handle on the shared on-disk cache.
+# diskcache is process-safe, so cache-hit checks can happen next to the hashing
+# and we never pay for a decode on files that are already embedded.
+_worker_cache: Optional[diskcache.Cache] = None
+
+
+def _get_worker_cache(cache_dir: str) -> diskcache.Cache:
+    global _worker_cache
+    if _worker_cache is None or _worker_cache.directory != os.path.abspath(cache_dir):
+        _worker_cache = diskcache.Cache(cache_dir)
+    return _worker_cache
+
+
+def create_decode_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Create the process pool used by the CPU stage for hashing and decoding."""
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def encode_model_input(image: Any, transport: str = "json") -> Dict[str, Any]:
+    """Serialize a decoded image for the ML service: ``image_bytes`` (JPEG) or ``image_base64`` (PNG)."""
+    img_byte_arr = io.BytesIO()
+    if transport == "multipart":
+        image.save(img_byte_arr, format="JPEG", quality=TRANSPORT_JPEG_QUALITY)
+        return {"image_bytes": img_byte_arr.getvalue()}
+    image.save(img_byte_arr, format="PNG")
+    return {"image_base64": base64.b64encode(img_byte_arr.getvalue()).decode("utf-8")}
+
+
+def prepare_image_record(
+    file_path: str,
+    collection_name: str,
+    cache_dir: str,
+    transport: str = "json",
+    target_min_side: Optional[int] = None,
+    thumbnail_dir: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Hash, decode, thumbnail and extract metadata for one file in a single call.
+
+    This is the unit of work submitted to the decode pool, so it must stay a
+    top-level, picklable function. The returned dict is ready to be placed on
+    the ML queue:
+
+    - ``{"file_hash", "cached"}`` when the collection cache already has the file,
+      with the cached ``{"id", "vector", "payload"}`` entry under ``cached``
+    - ``{"file_hash", "error"}`` when the image could not be decoded
+    - otherwise ``file_hash``, ``metadata``, ``nbytes``
+      (size of the source file, for throughput accounting) and the model input:
+      ``image_base64`` (PNG) for the ``json`` transport, or ``image_bytes``
+      (JPEG) for the ``multipart`` transport
+
+    ``target_min_side`` downsizes the model input on this side of the wire to
+    the resolution the ML service reports, instead of shipping full-size images.
+    Thumbnails are written to the content-addressed store in ``thumbnail_dir``
+    (default ``THUMBNAIL_STORE_DIR``, see ``thumbnail_store``) rather than returned.
+    """
+    start = time.perf_counter()
+    cache = _get_worker_cache(cache_dir)
+
+    # One read of the file feeds the hash, EXIF/XMP parse, decode and thumbnail
+    with image_record.open_file_buffer(file_path) as buffer:
+        file_hash = image_record.hash_buffer(buffer)
+        # Read the entry rather than test membership: it may be evicted before
+        # the parent process could look it up again
+        cached = cache.get(f"{collection_name}:{file_hash}")
+        if cached is not None:
+            return {"file_hash": file_hash, "cached": cached, "elapsed": time.perf_counter() - start}
+        record, error = image_record.decode_buffer(file_path, buffer, file_hash, target_min_side)
+
+    if error or record is None:
+        return {"file_hash": file_hash, "error": error or "Unknown decode error", "elapsed": time.perf_counter() - start}
+
+    model_input = encode_model_input(record.image, transport)
+
+    # Thumbnail variants for the frontend, keyed by content hash. A failed write
+    # only costs the preview, so it must not fail the embedding.
+    try:
+        thumbnail_store.store_image(file_hash, record.image, thumbnail_dir)
+    except Exception as e:
+        logger.warning(f"Could not store thumbnails for {file_path}: {e}")
+
+    return {
+        "file_hash": file_hash,
+        **model_input,
+        "metadata": record.metadata,
+        "nbytes": record.nbytes,
+        "elapsed": time.perf_counter() - start,
+    }
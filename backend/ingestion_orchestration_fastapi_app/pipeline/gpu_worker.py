@@ -1,12 +1,17 @@
 import asyncio
+import contextlib
+import json
 import logging
 import httpx
 import os
+import time
 import uuid
 import base64
+from typing import Awaitable, Callable, Optional
 
 from qdrant_client.http.models import PointStruct
 
+from .. import http_clients
 from .manager import JobContext
 from .cpu_processor import cache # Import the shared cache instance
 from . import utils
@@ -17,35 +22,227 @@ ML_SERVICE_URL = os.environ.get("ML_INFERENCE_SERVICE_URL", "http://localhost:80
 # Remove ML_BATCH_SIZE global, always use ctx.ml_batch_size
 REQUEST_TIMEOUT = int(os.environ.get("ML_REQUEST_TIMEOUT", "300"))
 POLL_INTERVAL = float(os.environ.get("ML_POLL_INTERVAL", "1.0"))
+# Cancelling an abandoned ML job is best effort; do not hold up the caller for long
+ML_CANCEL_TIMEOUT = 5.0
 ML_BATCH_FILL_TIMEOUT = float(os.environ.get("ML_BATCH_FILL_TIMEOUT", "120"))
+# "json" posts base64 PNGs inside one JSON body; "multipart" streams raw JPEG
+# parts to the binary endpoint. USE_MULTIPART_UPLOAD=1 is honoured as a shorthand.
+_USE_MULTIPART_UPLOAD = os.getenv("USE_MULTIPART_UPLOAD", "0") not in {"0", "false", "False"}
+ML_TRANSPORT = os.environ.get("ML_TRANSPORT", "multipart" if _USE_MULTIPART_UPLOAD else "json").lower()
+# Upper bound on batches in flight to the ML service; the actual window is the
+# smaller of this and the queue depth the service advertises in /capabilities.
+ML_MAX_INFLIGHT_BATCHES = int(os.environ.get("ML_MAX_INFLIGHT_BATCHES", "4"))
+# Shortest time a partial batch waits for more items before it is sent to an idle GPU
+ML_BATCH_LINGER = float(os.environ.get("ML_BATCH_LINGER", "0.05"))
+# Queue batches as ML jobs and receive per-item results over SSE as each
+# sub-batch finishes. Paused for ML_JOB_MODE_COOLDOWN seconds when the service
+# cannot queue a job (e.g. a 503 while it restarts), then tried again.
+ML_RESULT_STREAMING = os.environ.get("ML_RESULT_STREAMING", "1") not in {"0", "false", "False"}
+ML_JOB_MODE_COOLDOWN = float(os.environ.get("ML_JOB_MODE_COOLDOWN", "60"))
+# Seconds the ML service may hold a long-poll status request open
+ML_LONG_POLL_WAIT = float(os.environ.get("ML_LONG_POLL_WAIT", "30"))
+# Job submits retried after a 429 (job queue full) before the batch is sent inline,
+# waiting the service's Retry-After or, without one, ML_JOB_SUBMIT_BACKOFF doubling
+ML_JOB_SUBMIT_RETRIES = int(os.environ.get("ML_JOB_SUBMIT_RETRIES", "3"))
+ML_JOB_SUBMIT_BACKOFF = float(os.environ.get("ML_JOB_SUBMIT_BACKOFF", "1"))
+_job_mode_retry_at = 0.0  # monotonic time before which batches are sent inline
 
-async def send_batch_to_ml_service(batch_items: list[dict], caption: bool = True) -> list[dict]:
-    """Submit a batch to the ML service and poll until results are ready."""
-    if not batch_items:
-        logger.info("[ML] Attempted to send empty batch to ML service. Skipping.")
-        return []
+
+def _job_mode_enabled() -> bool:
+    return ML_RESULT_STREAMING and time.monotonic() >= _job_mode_retry_at
+
+
+def _retry_delay(resp: httpx.Response, attempt: int) -> float:
+    """Seconds to wait before retrying a rejected submit: ``Retry-After`` if given in seconds."""
+    try:
+        return max(0.0, float(resp.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return ML_JOB_SUBMIT_BACKOFF * (2 ** attempt)
+
+
+def negotiate_inflight_window(ml_caps: dict) -> int:
+    """
+    Number of ML batches to keep in flight. Services that predate the
+    ``max_queue_depth`` capability get two: one computing, one uploading.
+    """
+    advertised = ml_caps.get("max_queue_depth") or 2
+    return max(1, min(ML_MAX_INFLIGHT_BATCHES, int(advertised)))
+
+
+def ml_client() -> httpx.AsyncClient:
+    """
+    The process-wide pooled client for the ML service (keep-alive, HTTP/2 when
+    ``h2`` is installed, circuit breaker). It outlives jobs; do not close it.
+    """
+    return http_clients.get_client(ML_SERVICE_URL)
+
+
+async def _submit_batch(
+    client: httpx.AsyncClient,
+    batch_items: list[dict],
+    caption: bool,
+    async_job: bool = False,
+    embed: bool = True,
+    tenant: Optional[str] = None,
+) -> httpx.Response:
+    """
+    POST a batch using the transport matching how the CPU stage encoded it.
+    Ingest work is bulk priority; ``tenant`` (the ingest job id) lets the ML
+    service share its queue fairly between concurrent jobs.
+    """
+    params = {"caption": str(caption).lower(), "priority": "bulk"}
+    if async_job:
+        params["async_job"] = "true"
+    if not embed:
+        params["embed"] = "false"
+    if tenant:
+        params["tenant"] = tenant
+    if all("image_bytes" in item for item in batch_items):
+        files = [
+            ("files", (item["filename"], item["image_bytes"], "image/jpeg"))
+            for item in batch_items
+        ]
+        return await client.post(
+            f"{ML_SERVICE_URL}/api/v1/batch_embed_and_caption_multipart",
+            params=params,
+            data={"unique_ids": [item["file_hash"] for item in batch_items]},
+            files=files,
+            timeout=REQUEST_TIMEOUT,
+        )
 
     images_payload = [
         {
             "unique_id": item["file_hash"],
-            "image_base64": item["image_base64"],
+            "image_base64": item.get("image_base64") or base64.b64encode(item["image_bytes"]).decode("utf-8"),
             "filename": item["filename"],
         }
         for item in batch_items
     ]
+    return await client.post(
+        f"{ML_SERVICE_URL}/api/v1/batch_embed_and_caption",
+        params=params,
+        json={"images": images_payload},
+        timeout=REQUEST_TIMEOUT,
+    )
+
+
+ResultsCallback = Callable[[list[dict]], Awaitable[None]]
 
-    async with httpx.AsyncClient() as client:
+
+async def _stream_job_results(client: httpx.AsyncClient, job_id: str, collect: ResultsCallback) -> None:
+    """Consume the job's Server-Sent Events stream until the ``done`` event."""
+    async with client.stream("GET", f"{ML_SERVICE_URL}/api/v1/status/{job_id}/events", timeout=REQUEST_TIMEOUT) as resp:
+        resp.raise_for_status()
+        event = None
+        async for line in resp.aiter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):].strip())
+                if event == "results":
+                    await collect(data)
+                elif event == "done":
+                    if data.get("status") == "failed":
+                        logger.error(f"ML job {job_id} failed: {data.get('error')}")
+                    return
+            elif not line:
+                event = None
+
+
+async def _long_poll_job_results(client: httpx.AsyncClient, job_id: str, collect: ResultsCallback) -> None:
+    """
+    Fallback when the event stream is unavailable: long-poll ``/status/{job_id}?wait=``.
+    Services without long-poll support answer immediately, so those are polled
+    every ``POLL_INTERVAL`` instead.
+    """
+    cursor = 0
+    while True:
         try:
-            submit_resp = await client.post(
-                f"{ML_SERVICE_URL}/api/v1/batch_embed_and_caption",
-                params={"caption": str(caption).lower()},
-                json={"images": images_payload},
-                timeout=REQUEST_TIMEOUT,
+            status_resp = await client.get(
+                f"{ML_SERVICE_URL}/api/v1/status/{job_id}",
+                params={"wait": ML_LONG_POLL_WAIT, "since": cursor},
+                timeout=ML_LONG_POLL_WAIT + REQUEST_TIMEOUT,
             )
+            status_resp.raise_for_status()
+            status_data = status_resp.json()
+        except Exception as poll_error:
+            logger.error(f"Error polling ML job {job_id}: {poll_error}", exc_info=True)
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        results = status_data.get("results") or []
+        if not results and status_data.get("result"):
+            results = status_data["result"].get("results", [])
+        await collect(results)
+        if status_data.get("status") in {"completed", "failed", "cancelled"}:
+            return
+        if "cursor" in status_data:
+            cursor = status_data["cursor"]
+        else:
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+async def _cancel_ml_job(client: httpx.AsyncClient, job_id: str) -> None:
+    """Best effort: stop an ML job nobody is waiting for any more."""
+    try:
+        await client.post(f"{ML_SERVICE_URL}/api/v1/cancel/{job_id}", timeout=ML_CANCEL_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Could not cancel ML job {job_id}: {e}")
+
+
+async def send_batch_to_ml_service(
+    batch_items: list[dict],
+    caption: bool = True,
+    client: Optional[httpx.AsyncClient] = None,
+    on_results: Optional[ResultsCallback] = None,
+    embed: bool = True,
+    tenant: Optional[str] = None,
+) -> list[dict]:
+    """
+    Submit a batch to the ML service and return its results in batch order.
+
+    ``client`` defaults to the shared pooled ML client (see ``ml_client``).
+    When the batch runs as an ML job, ``on_results`` is awaited with each group of
+    per-item results as soon as the service publishes it, before the batch completes.
+    ``embed=False`` with ``caption=True`` asks for captions only. ``tenant``
+    identifies the ingest job for the ML service's fair scheduling. If the wait
+    is cancelled or times out, the ML job is cancelled too.
+    """
+    global _job_mode_retry_at
+    if not batch_items:
+        logger.info("[ML] Attempted to send empty batch to ML service. Skipping.")
+        return []
+
+    images_payload = [{"unique_id": item["file_hash"]} for item in batch_items]
+
+    async with contextlib.nullcontext(client or ml_client()) as client:
+        try:
+            use_jobs = _job_mode_enabled()
+            submit_resp = await _submit_batch(client, batch_items, caption, async_job=use_jobs, embed=embed, tenant=tenant)
+            if use_jobs and submit_resp.status_code >= 500:
+                logger.warning(
+                    f"ML service could not queue a job (HTTP {submit_resp.status_code}); "
+                    f"sending batches inline for {ML_JOB_MODE_COOLDOWN:.0f}s"
+                )
+                _job_mode_retry_at = time.monotonic() + ML_JOB_MODE_COOLDOWN
+                submit_resp = await _submit_batch(client, batch_items, caption, embed=embed, tenant=tenant)
+            elif use_jobs and submit_resp.status_code == 429:
+                # Job queue full: back off and queue again, so the service is not
+                # pushed harder while it is saturated; inline is the last resort
+                for attempt in range(ML_JOB_SUBMIT_RETRIES):
+                    delay = _retry_delay(submit_resp, attempt)
+                    logger.info(f"ML job queue is full; retrying the submit in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    submit_resp = await _submit_batch(client, batch_items, caption, async_job=True, embed=embed, tenant=tenant)
+                    if submit_resp.status_code != 429:
+                        break
+                else:
+                    logger.warning(f"ML job queue still full after {ML_JOB_SUBMIT_RETRIES} retries; sending this batch inline")
+                    submit_resp = await _submit_batch(client, batch_items, caption, embed=embed, tenant=tenant)
             submit_resp.raise_for_status()
             submit_data = submit_resp.json()
 
-            # Legacy behaviour: immediate results
+            # Inline results (also returned by services that ignore async_job)
             if "results" in submit_data:
                 return submit_data.get("results", [])
 
@@ -58,40 +255,32 @@ async def send_batch_to_ml_service(batch_items: list[dict], caption: bool = True
                 ]
 
             results_map: dict[str, dict] = {}
-            start = asyncio.get_event_loop().time()
 
-            while True:
-                try:
-                    status_resp = await client.get(
-                        f"{ML_SERVICE_URL}/status/{job_id}", timeout=REQUEST_TIMEOUT
-                    )
-                    status_resp.raise_for_status()
-                    status_data = status_resp.json()
-                except Exception as poll_error:
-                    logger.error(
-                        f"Error polling ML job {job_id}: {poll_error}", exc_info=True
-                    )
-                    if asyncio.get_event_loop().time() - start > REQUEST_TIMEOUT:
-                        break
-                    await asyncio.sleep(POLL_INTERVAL)
-                    continue
+            async def collect(results: list[dict]) -> None:
+                fresh = [r for r in results if r.get("unique_id") and r["unique_id"] not in results_map]
+                for res in fresh:
+                    results_map[res["unique_id"]] = res
+                if fresh and on_results:
+                    await on_results(fresh)
 
-                for res in status_data.get("results", []):
-                    uid = res.get("unique_id")
-                    if uid:
-                        results_map[uid] = res
-
-                if status_data.get("status") in {"completed", "failed"}:
-                    break
-                if len(results_map) == len(images_payload):
-                    break
-                if asyncio.get_event_loop().time() - start > REQUEST_TIMEOUT:
-                    logger.warning(
-                        f"Timeout waiting for ML job {job_id}, returning partial results"
-                    )
-                    break
-
-                await asyncio.sleep(POLL_INTERVAL)
+            try:
+                await asyncio.wait_for(_stream_job_results(client, job_id, collect), timeout=REQUEST_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Timeout waiting for ML job {job_id}, returning partial results")
+                await _cancel_ml_job(client, job_id)
+            except asyncio.CancelledError:
+                await _cancel_ml_job(client, job_id)
+                raise
+            except Exception as stream_error:
+                logger.warning(f"Event stream for ML job {job_id} unavailable ({stream_error}); long-polling instead")
+                try:
+                    await asyncio.wait_for(_long_poll_job_results(client, job_id, collect), timeout=REQUEST_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Timeout waiting for ML job {job_id}, returning partial results")
+                    await _cancel_ml_job(client, job_id)
+                except asyncio.CancelledError:
+                    await _cancel_ml_job(client, job_id)
+                    raise
 
             # Assemble results in original order with fallbacks for missing items
             final_results: list[dict] = []
@@ -114,160 +303,203 @@ async def send_batch_to_ml_service(batch_items: list[dict], caption: bool = True
             ]
 
 
+class _ArrivalRate:
+    """Exponential moving average of the gap between items arriving on the ML queue."""
+
+    def __init__(self, smoothing: float = 0.2):
+        self.smoothing = smoothing
+        self.gap: Optional[float] = None
+        self._last: Optional[float] = None
+
+    def observe(self, now: float) -> None:
+        if self._last is not None:
+            gap = now - self._last
+            self.gap = gap if self.gap is None else (1 - self.smoothing) * self.gap + self.smoothing * gap
+        self._last = now
+
+
+def _fill_timeout(ctx: JobContext, batch_len: int, batch_age: float, rate: _ArrivalRate, gpu_busy: bool) -> float:
+    """
+    How long to wait for the next item before sending a partial batch.
+
+    An idle GPU only waits for items that are about to arrive; a busy GPU waits
+    for as long as the batch is expected to take to fill. Either way a batch is
+    never held longer than ``ML_BATCH_FILL_TIMEOUT``.
+    """
+    budget = ML_BATCH_FILL_TIMEOUT - batch_age
+    if budget <= 0:
+        return 0.0
+    gap = rate.gap if rate.gap is not None else ML_BATCH_LINGER
+    expected_fill = (ctx.ml_batch_size - batch_len) * gap
+    wait = expected_fill if gpu_busy else min(2 * gap, expected_fill)
+    return min(budget, max(ML_BATCH_LINGER, wait))
+
+
 async def process_ml_batches(ctx: JobContext):
     """
     Consumes items from ml_queue, batches them, sends them to the ML service,
     and places the results in the db_queue. Runs until all CPU workers are done.
-    Implements robust sequential batching: only one batch is ever in flight to the ML service at a time.
+
+    Up to ``ctx.ml_inflight_batches`` batches are in flight at once over one pooled
+    client, so the next batch is assembled (and its images decoded upstream) while
+    the ML service works on the previous one. Queue items are only marked done
+    once their batch's results have been handed to the DB stage, which keeps
+    ``ml_queue.join()`` in the manager meaningful.
     """
-    batch = []
+    window = max(1, ctx.ml_inflight_batches)
+    in_flight: set[asyncio.Task] = set()
+    batch: list = []
+    batch_start = 0.0
     sentinels_received = 0
-    first_batch = True
-    first_batch_start = None
-    logger.info(f"[{ctx.job_id}] [ML] Using ML_BATCH_FILL_TIMEOUT={ML_BATCH_FILL_TIMEOUT}s for batch filling.")
-    while True:
+    rate = _ArrivalRate()
+    loop = asyncio.get_running_loop()
+    logger.info(f"[{ctx.job_id}] [ML] Submitting with window={window}, batch_size={ctx.ml_batch_size}, http2={http_clients.HTTP2_AVAILABLE}")
+
+    async def submit(items: list) -> None:
+        while len(in_flight) >= window:
+            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        task = asyncio.create_task(_flush_ml_batch(ctx, items, client))
+        in_flight.add(task)
+
+        def _on_done(t: asyncio.Task) -> None:
+            in_flight.discard(t)
+            for _ in items:
+                ctx.ml_queue.task_done()
+
+        task.add_done_callback(_on_done)
+
+    # The shared client is not closed here; its pool outlives the job
+    async with contextlib.nullcontext(ml_client()) as client:
         try:
-            if first_batch:
-                if first_batch_start is None:
-                    logger.info(f"[{ctx.job_id}] [ML] Waiting for first item in ML queue...")
-                    item = await ctx.ml_queue.get()
-                    if item is None:
-                        sentinels_received += 1
-                        ctx.ml_queue.task_done()
-                        if sentinels_received == ctx.cpu_worker_count:
-                            if batch:
-                                logger.info(f"[{ctx.job_id}] [ML] Flushing final ML batch of size {len(batch)} (first batch mode)")
-                                await _flush_ml_batch(ctx, batch)
-                            for _ in range(ctx.db_worker_count):
-                                await ctx.db_queue.put(None)
-                            break
-                        else:
-                            continue
-                    batch.append(item)
-                    first_batch_start = asyncio.get_event_loop().time()
-                    ctx.ml_queue.task_done()
-                timeout = ML_BATCH_FILL_TIMEOUT - (asyncio.get_event_loop().time() - first_batch_start)
-                if timeout <= 0:
-                    timeout = 0.01
-                try:
-                    logger.info(f"[{ctx.job_id}] [ML] Waiting up to {timeout:.2f}s for more items to fill first batch (current size: {len(batch)})...")
-                    item = await asyncio.wait_for(ctx.ml_queue.get(), timeout=timeout)
-                except asyncio.TimeoutError:
-                    if batch:
-                        logger.info(f"[{ctx.job_id}] [ML] Flushing first batch early after {ML_BATCH_FILL_TIMEOUT}s: {len(batch)} items")
-                        await _flush_ml_batch(ctx, batch)
+            while sentinels_received < ctx.cpu_worker_count:
+                if batch:
+                    timeout = _fill_timeout(ctx, len(batch), loop.time() - batch_start, rate, bool(in_flight))
+                    try:
+                        item = await asyncio.wait_for(ctx.ml_queue.get(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        logger.info(f"[{ctx.job_id}] [ML] Sending partial batch of {len(batch)} items ({len(in_flight)} in flight)")
+                        await submit(batch)
                         batch = []
-                        first_batch = False
-                        first_batch_start = None
-                    continue
+                        continue
+                else:
+                    item = await ctx.ml_queue.get()
+
                 if item is None:
                     sentinels_received += 1
                     ctx.ml_queue.task_done()
-                    if sentinels_received == ctx.cpu_worker_count:
-                        if batch:
-                            logger.info(f"[{ctx.job_id}] [ML] Flushing final ML batch of size {len(batch)} (first batch mode)")
-                            await _flush_ml_batch(ctx, batch)
-                        for _ in range(ctx.db_worker_count):
-                            await ctx.db_queue.put(None)
-                        break
-                    else:
-                        continue
+                    continue
+
+                now = loop.time()
+                rate.observe(now)
+                if not batch:
+                    batch_start = now
                 batch.append(item)
                 if len(batch) >= ctx.ml_batch_size:
-                    logger.info(f"[{ctx.job_id}] [ML] Sending first full ML batch of size {len(batch)}")
-                    await _flush_ml_batch(ctx, batch)
-                    batch = []
-                    first_batch = False
-                    first_batch_start = None
-                ctx.ml_queue.task_done()
-            else:
-                flush_due_to_idle = False
-                if not batch:
-                    logger.info(f"[{ctx.job_id}] [ML] Waiting for first item of next batch...")
-                    item = await ctx.ml_queue.get()
-                    if item is None:
-                        sentinels_received += 1
-                        ctx.ml_queue.task_done()
-                        if sentinels_received == ctx.cpu_worker_count:
-                            if batch:
-                                logger.info(f"[{ctx.job_id}] [ML] Flushing final ML batch of size {len(batch)}")
-                                await _flush_ml_batch(ctx, batch)
-                            for _ in range(ctx.db_worker_count):
-                                await ctx.db_queue.put(None)
-                            break
-                        else:
-                            continue
-                    batch.append(item)
-                    ctx.ml_queue.task_done()
-                batch_start_time = asyncio.get_event_loop().time()
-                while len(batch) < ctx.ml_batch_size:
-                    timeout = ML_BATCH_FILL_TIMEOUT - (asyncio.get_event_loop().time() - batch_start_time)
-                    if timeout <= 0:
-                        break
-                    try:
-                        logger.info(f"[{ctx.job_id}] [ML] Waiting up to {timeout:.2f}s for more items to fill batch (current size: {len(batch)})...")
-                        item = await asyncio.wait_for(ctx.ml_queue.get(), timeout=timeout)
-                    except asyncio.TimeoutError:
-                        break
-                    if item is None:
-                        sentinels_received += 1
-                        ctx.ml_queue.task_done()
-                        if sentinels_received == ctx.cpu_worker_count:
-                            break
-                        else:
-                            continue
-                    batch.append(item)
-                    ctx.ml_queue.task_done()
-                if batch:
-                    logger.info(f"[{ctx.job_id}] [ML] Flushing ML batch after idle or full: {len(batch)} items")
-                    await _flush_ml_batch(ctx, batch)
+                    await submit(batch)
                     batch = []
+
+            if batch:
+                logger.info(f"[{ctx.job_id}] [ML] Sending final ML batch of size {len(batch)}")
+                await submit(batch)
+                batch = []
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            for _ in range(ctx.db_worker_count):
+                await ctx.db_queue.put(None)
+            if ctx.deferred_captions:
+                await ctx.caption_queue.put(None)
         except asyncio.CancelledError:
             logger.info(f"[{ctx.job_id}] GPU worker cancelled.")
-            break
+            for task in in_flight:
+                task.cancel()
         except Exception as e:
             logger.error(f"[{ctx.job_id}] Unhandled error in GPU worker: {e}", exc_info=True)
-            break
 
-async def _flush_ml_batch(ctx: JobContext, batch: list):
+async def _flush_ml_batch(ctx: JobContext, batch: list, client: Optional[httpx.AsyncClient] = None):
     if not batch:
         logger.info(f"[{ctx.job_id}] [ML] _flush_ml_batch called with empty batch. Skipping.")
         return
     logger.info(f"[{ctx.job_id}] [ML] Flushing ML batch of size {len(batch)}. Example filenames: {[item['metadata'].get('filename', 'unknown') for item in batch[:3]]}{'...' if len(batch) > 3 else ''}")
+    item_map = {i["file_hash"]: i for i in batch}
+    handled: set[str] = set()
+
+    async def handle_results(results: list[dict]) -> None:
+        # Called for streamed partial results and again for the final list; each item is handled once
+        for result in results:
+            await _handle_ml_result(ctx, item_map, handled, result)
+
     start_time = asyncio.get_event_loop().time()
-    ml_results = await send_batch_to_ml_service(batch, caption=ctx.caption)
+    # With deferred captions this is an embedding-only (CLIP) batch; BLIP runs in the caption stage
+    caption = ctx.caption and not ctx.deferred_captions
+    ml_results = await send_batch_to_ml_service(batch, caption=caption, client=client, on_results=handle_results, tenant=ctx.job_id)
     elapsed = asyncio.get_event_loop().time() - start_time
     logger.info(f"[{ctx.job_id}] [ML] ML batch processed in {elapsed:.2f}s. Received {len(ml_results)} results.")
-    item_map = {i["file_hash"]: i for i in batch}
-    for result in ml_results:
-        file_hash = result.get("unique_id")
-        original_item = item_map.get(file_hash)
-        if not original_item:
-            logger.warning(f"[{ctx.job_id}] Received ML result for unknown hash: {file_hash}")
-            continue
-        if result.get("error"):
-            ctx.failed_files += 1
-            ctx.add_log(f"ML service failed for {original_item['metadata']['filename']}: {result['error']}", level="error")
-            logger.error(f"[{ctx.job_id}] [ML] ML service failed for {original_item['metadata']['filename']}: {result['error']}")
-        else:
-            try:
-                payload = original_item["metadata"]
-                payload["caption"] = result.get("caption")
-                payload["thumbnail_base64"] = original_item.get("thumbnail_base64")
+    ctx.stage("ml").record(items=len(batch), elapsed=elapsed)
+    await handle_results(ml_results)
+
+
+def _queue_for_caption(ctx: JobContext, point_id: str, item: dict) -> None:
+    """
+    Hand an embedded point to the caption stage without ever blocking the CLIP path.
+
+    Only a reference is queued; the caption stage decodes the source file again.
+    When BLIP is so far behind that the queue is full, the point is left
+    uncaptioned and counted in ``captions_skipped``.
+    """
+    try:
+        ctx.caption_queue.put_nowait({
+            "point_id": point_id,
+            "file_hash": item["file_hash"],
+            "filename": item["filename"],
+            "file_path": item["metadata"]["full_path"],
+            "collection_name": item["collection_name"],
+        })
+    except asyncio.QueueFull:
+        ctx.captions_skipped += 1
+        if ctx.captions_skipped == 1:
+            ctx.add_log("Caption stage is behind; further images are left without a caption", level="warning")
+
+
+async def _handle_ml_result(ctx: JobContext, item_map: dict, handled: set, result: dict) -> None:
+    """Turn one ML result into a point on the DB queue (and the cache), or record the failure."""
+    file_hash = result.get("unique_id")
+    if file_hash in handled:
+        return
+    handled.add(file_hash)
+    original_item = item_map.get(file_hash)
+    if not original_item:
+        logger.warning(f"[{ctx.job_id}] Received ML result for unknown hash: {file_hash}")
+        return
+    if result.get("error"):
+        ctx.failed_files += 1
+        ctx.add_log(f"ML service failed for {original_item['metadata']['filename']}: {result['error']}", level="error")
+        logger.error(f"[{ctx.job_id}] [ML] ML service failed for {original_item['metadata']['filename']}: {result['error']}")
+    else:
+        try:
+            payload = original_item["metadata"]
+            payload["caption"] = result.get("caption")
+            payload["file_hash"] = file_hash
+            if ctx.deterministic_ids:
+                point_id = utils.point_id_for(original_item["collection_name"], file_hash)
+            else:
                 point_id = str(uuid.uuid4())
-                point = PointStruct(
-                    id=point_id,
-                    vector=result["embedding"],
-                    payload=payload
-                )
-                await ctx.db_queue.put(point)
-                cache_key = f"{original_item['collection_name']}:{file_hash}"
-                cache.set(cache_key, {
-                    "id": point_id,
-                    "vector": result["embedding"],
-                    "payload": payload
-                })
-                logger.info(f"[{ctx.job_id}] [ML] Successfully processed and cached {payload.get('filename', 'unknown')}")
-            except Exception as e:
-                logger.error(f"[{ctx.job_id}] Error processing ML result for {file_hash}: {e}", exc_info=True)
-                ctx.failed_files += 1
+            point = PointStruct(
+                id=point_id,
+                vector=result["embedding"],
+                payload=payload
+            )
+            cache_key = f"{original_item['collection_name']}:{file_hash}"
+            cache.set(cache_key, {
+                "id": point_id,
+                "vector": result["embedding"],
+                "payload": payload
+            })
+            if ctx.ledger is not None:
+                ctx.ledger.record_embedded(point_id, cache_key)
+            await ctx.db_queue.put(point)
+            if ctx.deferred_captions:
+                _queue_for_caption(ctx, point_id, original_item)
+            logger.info(f"[{ctx.job_id}] [ML] Successfully processed and cached {payload.get('filename', 'unknown')}")
+        except Exception as e:
+            logger.error(f"[{ctx.job_id}] Error processing ML result for {file_hash}: {e}", exc_info=True)
+            ctx.failed_files += 1
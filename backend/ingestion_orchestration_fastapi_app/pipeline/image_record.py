@@ -0,0 +1,198 @@
+import hashlib
+import io
+import logging
+import math
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import exifread
+from PIL import Image
+
+from . import utils
+
+try:
+    import rawpy
+except ImportError:
+    rawpy = None
+
+logger = logging.getLogger(__name__)
+
+RAW_EXTENSIONS = {".dng", ".cr2", ".nef", ".arw", ".rw2", ".orf"}
+
+# XMP keyword properties we index as tags
+_XMP_KEYWORD_PROPS = {
+    "{http://purl.org/dc/elements/1.1/}subject",
+    "{http://ns.adobe.com/lightroom/1.0/}hierarchicalSubject",
+}
+_RDF_LI = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}li"
+_XMP_PACKET_RE = re.compile(rb"<x:xmpmeta.*?</x:xmpmeta>", re.DOTALL)
+
+Buffer = Union[mmap.mmap, bytes]
+
+
+@dataclass
+class ImageRecord:
+    """Everything the pipeline needs from one file, produced from a single read."""
+    file_path: str
+    file_hash: str
+    image: Image.Image
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    nbytes: int = 0
+
+
+@contextmanager
+def open_file_buffer(file_path: str) -> Iterator[Buffer]:
+    """
+    Map a file into memory read-only so every consumer shares one read.
+    Falls back to a plain read for empty files or filesystems without mmap support.
+    """
+    with open(file_path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            yield f.read()
+            return
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+
+def hash_buffer(buffer: Buffer) -> str:
+    """SHA256 of a file buffer; same digest as ``utils.compute_sha256`` on the path."""
+    return hashlib.sha256(buffer).hexdigest()
+
+
+def _as_file(buffer: Buffer):
+    """Return a seekable file-like view over the buffer positioned at 0."""
+    if isinstance(buffer, mmap.mmap):
+        buffer.seek(0)
+        return buffer
+    return io.BytesIO(buffer)
+
+
+def _xmp_keywords(buffer: Buffer) -> List[str]:
+    """Extract dc:subject / lr:hierarchicalSubject keywords from an embedded XMP packet."""
+    match = _XMP_PACKET_RE.search(buffer)
+    if not match:
+        return []
+    try:
+        root = ET.fromstring(match.group(0))
+    except ET.ParseError:
+        return []
+    keywords = []
+    for elem in root.iter():
+        if elem.tag in _XMP_KEYWORD_PROPS:
+            keywords.extend(li.text.strip() for li in elem.iter(_RDF_LI) if li.text and li.text.strip())
+    return keywords
+
+
+def _downscale(image: Image.Image, min_side: int) -> Image.Image:
+    """Resize so the shorter side equals ``min_side``; never upscales."""
+    width, height = image.size
+    short = min(width, height)
+    if short <= min_side:
+        return image
+    scale = min_side / short
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return image.resize(new_size, Image.BICUBIC, reducing_gap=3.0)
+
+
+def _decode(
+    file_path: str,
+    buffer: Buffer,
+    metadata: Dict[str, Any],
+    target_min_side: Optional[int] = None,
+) -> Image.Image:
+    """
+    Decode the buffer once, recording the *original* dimensions/format/mode into
+    ``metadata``. With ``target_min_side`` the image is reduced so its shorter
+    side is at least that many pixels: JPEGs use PIL draft mode (DCT scaling)
+    and RAW files use rawpy's half-size demosaic when that is still large enough.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if rawpy and extension in RAW_EXTENSIONS:
+        try:
+            with rawpy.imread(_as_file(buffer)) as raw:
+                sizes = raw.sizes
+                width, height = sizes.width, sizes.height
+                if sizes.flip in (5, 6):
+                    width, height = height, width
+                half_size = bool(target_min_side) and min(width, height) // 2 >= target_min_side
+                rgb = raw.postprocess(use_camera_wb=True, half_size=half_size)
+            if not half_size:
+                height, width = rgb.shape[:2]
+            metadata.update({"width": width, "height": height, "format": "RAW", "mode": "RGB"})
+            image = Image.fromarray(rgb).convert("RGB")
+            return _downscale(image, target_min_side) if target_min_side else image
+        except Exception as raw_e:
+            logger.error(f"Rawpy failed for {os.path.basename(file_path)}: {raw_e}", exc_info=True)
+            # Fallback to PIL just in case it's a non-standard raw file that PIL can handle
+
+    img = Image.open(_as_file(buffer))
+    metadata.update({"width": img.width, "height": img.height, "format": img.format, "mode": img.mode})
+    if target_min_side and img.format == "JPEG":
+        scale = target_min_side / min(img.width, img.height)
+        if scale < 1:
+            img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    image = img.convert("RGB")
+    return _downscale(image, target_min_side) if target_min_side else image
+
+
+def decode_buffer(
+    file_path: str,
+    buffer: Buffer,
+    file_hash: str,
+    target_min_side: Optional[int] = None,
+) -> Tuple[Optional[ImageRecord], Optional[str]]:
+    """
+    Build an :class:`ImageRecord` from an already-read file buffer.
+
+    EXIF is parsed once and feeds the ``exif_*`` metadata, the typed fields
+    derived from it (``utils.normalize_exif``) and the XPKeywords tags;
+    dimensions come from the decoded image, so RAW files are demosaiced
+    exactly once. ``target_min_side`` enables the reduced decode
+    described in :func:`_decode`; metadata still reports the original size.
+    """
+    metadata: Dict[str, Any] = {
+        "filename": os.path.basename(file_path),
+        "full_path": os.path.abspath(file_path),
+    }
+
+    try:
+        image = _decode(file_path, buffer, metadata, target_min_side)
+    except Exception as e:
+        logger.error(f"Failed to decode image {os.path.basename(file_path)}: {e}", exc_info=True)
+        return None, f"Failed to decode image: {e}"
+
+    tags = set(_xmp_keywords(buffer))
+    try:
+        exif_tags = exifread.process_file(_as_file(buffer), details=False)
+        tags.update(utils.xp_keywords_from_exif(exif_tags))
+        utils.add_exif_metadata(metadata, exif_tags)
+        metadata.update(utils.normalize_exif(metadata))
+    except Exception as e:
+        logger.debug(f"Could not extract EXIF data for {file_path}: {e}")
+    metadata["tags"] = sorted(tags)
+
+    return ImageRecord(
+        file_path=file_path,
+        file_hash=file_hash,
+        image=image,
+        metadata=metadata,
+        nbytes=len(buffer),
+    ), None
+
+
+def load_image_record(
+    file_path: str,
+    target_min_side: Optional[int] = None,
+) -> Tuple[Optional[ImageRecord], Optional[str]]:
+    """Read ``file_path`` once and return its hashed, decoded :class:`ImageRecord`."""
+    with open_file_buffer(file_path) as buffer:
+        return decode_buffer(file_path, buffer, hash_buffer(buffer), target_min_side)
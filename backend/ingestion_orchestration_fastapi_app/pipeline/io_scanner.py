@@ -1,9 +1,13 @@
 import asyncio
+import fnmatch
 import os
 import logging
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
 
 from .manager import JobContext
+from .scan_index import ScanIndex
 
 logger = logging.getLogger(__name__)
 
@@ -12,32 +16,130 @@ SUPPORTED_EXTENSIONS = {
     ".dng", ".cr2", ".nef", ".arw", ".rw2", ".orf"
 }
 
+# Directories listed concurrently; scandir is I/O bound, so this can exceed the core count
+SCAN_THREADS = int(os.environ.get("INGEST_SCAN_THREADS", "8"))
+
+
+@dataclass
+class _DirResult:
+    """What one ``os.scandir`` pass over a single directory produced."""
+    files: List[Tuple[str, int, int]] = field(default_factory=list)  # (path, size, mtime_ns)
+    subdirs: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    unchanged_bytes: int = 0
+    error: Optional[str] = None
+
+
+def _matches(rel_path: str, name: str, patterns: Sequence[str]) -> bool:
+    """Match a glob against the path relative to the scan root or the bare name."""
+    return any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def _scan_one_dir(
+    dir_path: str,
+    root: str,
+    include: Sequence[str],
+    exclude: Sequence[str],
+    index: Optional[ScanIndex],
+) -> _DirResult:
+    """
+    List one directory (runs in a scanner thread). Sizes and mtimes come from
+    the ``DirEntry`` stat results, so no file is opened; files whose signature
+    matches the scan index are only counted.
+    """
+    result = _DirResult()
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                rel_path = os.path.relpath(entry.path, root).replace(os.sep, "/")
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not (exclude and _matches(rel_path, entry.name, exclude)):
+                            result.subdirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    if os.path.splitext(entry.name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                        continue
+                    if include and not _matches(rel_path, entry.name, include):
+                        continue
+                    if exclude and _matches(rel_path, entry.name, exclude):
+                        continue
+                    stat = entry.stat()
+                except OSError as e:
+                    logger.debug(f"Skipping unreadable entry {entry.path}: {e}")
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if index is not None and index.is_unchanged(entry.path, signature):
+                    result.unchanged += 1
+                    result.unchanged_bytes += stat.st_size
+                    continue
+                result.files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+    except OSError as e:
+        result.error = f"Cannot list {dir_path}: {e}"
+    return result
+
+
 async def scan_directory(ctx: JobContext, directory_path: str):
     """
-    Scans a directory for image files and puts their paths into the raw_queue.
+    Scans a directory tree for image files and puts their paths into the raw_queue.
+
+    Subtrees are listed concurrently on ``SCAN_THREADS`` threads with
+    ``os.scandir``; paths are queued as each directory completes, so hashing
+    starts right away and ``ctx.total_files`` / ``ctx.total_bytes`` grow while
+    the scan is running (``ctx.scan_complete`` marks the final count).
+    ``ctx.include_globs`` / ``ctx.exclude_globs`` filter on the path relative to
+    the root or the file name; excluded directories are not descended into.
+    With ``ctx.scan_index`` set, files whose size and mtime match the last
+    successful ingest are skipped and counted in ``ctx.unchanged_files``.
     This coroutine finishes when the entire directory has been scanned.
     """
     logger.info(f"[{ctx.job_id}] Starting directory scan: {directory_path}")
-    
+
+    root = os.path.abspath(directory_path)
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=max(1, SCAN_THREADS), thread_name_prefix=f"scan-{ctx.job_id[:8]}")
+    pending = set()
+
+    def submit(dir_path: str):
+        pending.add(loop.run_in_executor(
+            executor, _scan_one_dir, dir_path, root, ctx.include_globs, ctx.exclude_globs, ctx.scan_index
+        ))
+
     try:
-        file_count = 0
-        for root, _, files in os.walk(directory_path):
-            for filename in files:
-                if os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
-                    file_path = os.path.join(root, filename)
+        submit(root)
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                result = future.result()
+                for subdir in result.subdirs:
+                    submit(subdir)
+                if result.error:
+                    logger.warning(f"[{ctx.job_id}] {result.error}")
+                    ctx.add_log(result.error, level="warning")
+                ctx.unchanged_files += result.unchanged
+                ctx.unchanged_bytes += result.unchanged_bytes
+                for file_path, size, mtime_ns in result.files:
+                    ctx.total_files += 1
+                    ctx.total_bytes += size
+                    if ctx.scan_index is not None:
+                        ctx.file_signatures[file_path] = (size, mtime_ns)
                     await ctx.raw_queue.put(file_path)
-                    file_count += 1
-            # Give other tasks a chance to run during a large directory scan
-            await asyncio.sleep(0)
-
-        ctx.total_files = file_count
-        # Send sentinel (None) for each CPU worker to signal end-of-stream
-        for _ in range(ctx.cpu_worker_count):
-            await ctx.raw_queue.put(None)
-        # This log is now in the manager after this task completes.
-        
     except Exception as e:
         logger.error(f"[{ctx.job_id}] Error during directory scan: {e}", exc_info=True)
         ctx.add_log(f"Error during directory scan: {e}", level="error")
-    
-    logger.info(f"[{ctx.job_id}] IO Scanner finished.")
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    ctx.scan_complete = True
+    # Send sentinel (None) for each CPU worker to signal end-of-stream
+    for _ in range(ctx.cpu_worker_count):
+        await ctx.raw_queue.put(None)
+
+    if ctx.unchanged_files:
+        ctx.add_log(f"Skipped {ctx.unchanged_files} unchanged files.")
+    logger.info(f"[{ctx.job_id}] IO Scanner finished: {ctx.total_files} files queued "
+                f"({ctx.total_bytes / (1024 * 1024):.1f} MB), {ctx.unchanged_files} unchanged.")
@@ -0,0 +1,104 @@
+import glob
+import json
+import logging
+import os
+from typing import Dict, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+LEDGER_DIR = os.environ.get("INGEST_LEDGER_DIR", ".ingest_ledger")
+
+
+class JobLedger:
+    """
+    Per-job write-ahead ledger of points that were embedded (and cached) but not
+    yet acknowledged by Qdrant.
+
+    It is an append-only JSON-lines file: a header with the job id and collection,
+    then ``embedded`` records written by the GPU stage and ``acked`` records written
+    by the DB stage. Recovery only has to replay what is still pending here, so its
+    cost is proportional to the job, not to the size of the shared cache.
+    """
+
+    def __init__(self, path: str, job_id: str, collection_name: str):
+        self.path = path
+        self.job_id = job_id
+        self.collection_name = collection_name
+        # point_id -> cache key holding the vector and payload
+        self._pending: Dict[str, str] = {}
+        self._file = None
+
+    @classmethod
+    def create(cls, job_id: str, collection_name: str, ledger_dir: str = LEDGER_DIR) -> "JobLedger":
+        os.makedirs(ledger_dir, exist_ok=True)
+        ledger = cls(os.path.join(ledger_dir, f"{job_id}.jsonl"), job_id, collection_name)
+        ledger._file = open(ledger.path, "a", encoding="utf-8", buffering=1)
+        ledger._append({"job_id": job_id, "collection": collection_name})
+        return ledger
+
+    @classmethod
+    def load(cls, path: str) -> Optional["JobLedger"]:
+        """Rebuild a ledger's pending set from its file (e.g. after a crash)."""
+        ledger = None
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Torn final line from an interrupted write
+                    if ledger is None:
+                        ledger = cls(path, record.get("job_id", ""), record.get("collection", ""))
+                    elif "embedded" in record:
+                        ledger._pending[record["embedded"]] = record["key"]
+                    elif "acked" in record:
+                        for point_id in record["acked"]:
+                            ledger._pending.pop(point_id, None)
+        except OSError as e:
+            logger.warning(f"Could not read ingest ledger {path}: {e}")
+            return None
+        return ledger
+
+    def _append(self, record: dict) -> None:
+        if self._file is not None:
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def record_embedded(self, point_id: str, cache_key: str) -> None:
+        self._pending[point_id] = cache_key
+        self._append({"embedded": point_id, "key": cache_key})
+
+    def record_acked(self, point_ids: Iterable[str]) -> None:
+        acked = [pid for pid in map(str, point_ids) if pid in self._pending]
+        if not acked:
+            return
+        for point_id in acked:
+            del self._pending[point_id]
+        self._append({"acked": acked})
+
+    def is_pending(self, point_id: str) -> bool:
+        return str(point_id) in self._pending
+
+    @property
+    def pending(self) -> Dict[str, str]:
+        return dict(self._pending)
+
+    def close(self) -> None:
+        """Close the file; it is deleted once nothing is pending, otherwise kept for recovery."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not self._pending:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        else:
+            logger.warning(f"[{self.job_id}] Keeping ledger {self.path} with {len(self._pending)} unacknowledged points")
+
+
+def iter_ledgers(ledger_dir: str = LEDGER_DIR) -> Iterator[JobLedger]:
+    """Yield every ledger left on disk."""
+    for path in sorted(glob.glob(os.path.join(ledger_dir, "*.jsonl"))):
+        ledger = JobLedger.load(path)
+        if ledger is not None:
+            yield ledger
@@ -5,14 +5,18 @@ from datetime import datetime
 from enum import Enum
 from typing import Dict, List, Any, Coroutine, Optional
 from dataclasses import dataclass, field
+from concurrent.futures import Executor
 import logging
 import os
-import httpx
 
 from fastapi import BackgroundTasks
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import HnswConfigDiff
 
+from .. import http_clients
+from .ledger import JobLedger
+from .scan_index import ScanIndex
+
 # Logger setup
 logger = logging.getLogger(__name__)
 
@@ -24,6 +28,35 @@ class JobStatus(str, Enum):
     FAILED = "failed"
     CANCELLED = "cancelled"
 
+@dataclass
+class StageStats:
+    """Throughput counter for a single pipeline stage."""
+    items: int = 0
+    bytes: int = 0
+    busy_seconds: float = 0.0
+    first_ts: Optional[float] = None
+    last_ts: Optional[float] = None
+
+    def record(self, items: int = 1, nbytes: int = 0, elapsed: float = 0.0):
+        now = time.time()
+        if self.first_ts is None:
+            self.first_ts = now - elapsed
+        self.last_ts = now
+        self.items += items
+        self.bytes += nbytes
+        self.busy_seconds += elapsed
+
+    def as_dict(self) -> Dict[str, Any]:
+        wall = (self.last_ts - self.first_ts) if self.first_ts is not None and self.last_ts is not None else 0.0
+        return {
+            "items": self.items,
+            "bytes": self.bytes,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "wall_seconds": round(wall, 3),
+            "items_per_sec": round(self.items / wall, 2) if wall > 0 else 0.0,
+            "mb_per_sec": round(self.bytes / wall / (1024 * 1024), 2) if wall > 0 else 0.0,
+        }
+
 @dataclass
 class JobContext:
     job_id: str
@@ -37,29 +70,62 @@ class JobContext:
     cpu_worker_count: int = 2
     ml_worker_count: int = 1
     db_worker_count: int = 1
+    # Processes in the decode pool; 0 keeps decoding on the default thread executor
+    decode_worker_count: int = 0
     # --- New: Model-specific batch sizes ---
     clip_batch_size: Optional[int] = None
     blip_batch_size: Optional[int] = None
     caption: bool = True
+    # Embed first and caption in a separate stage whose results are applied as payload updates
+    deferred_captions: bool = False
+    # How images travel to the ML service: "json" (base64 PNG) or "multipart" (raw JPEG parts)
+    ml_transport: str = "json"
+    # Shorter-side pixel size images are reduced to before shipping; None sends full resolution
+    model_input_size: Optional[int] = None
+    # ML batches kept in flight at once, negotiated from the service's advertised queue depth
+    ml_inflight_batches: int = 1
+    # Derive point IDs from collection + file hash (idempotent upserts) instead of random UUIDs
+    deterministic_ids: bool = True
+    # Glob filters applied by the scanner to paths relative to the ingest root (or bare names)
+    include_globs: List[str] = field(default_factory=list)
+    exclude_globs: List[str] = field(default_factory=list)
+    # Skip files whose (path, size, mtime) matches the collection's scan index
+    skip_unchanged: bool = True
     
     # --- Queues for pipeline stages ---
     raw_queue: asyncio.Queue = field(init=False)
     ml_queue: asyncio.Queue = field(init=False)
     db_queue: asyncio.Queue = field(init=False)
+    caption_queue: asyncio.Queue = field(init=False)
     
     # --- Progress tracking ---
     total_files: int = 0
+    # Size of the queued files; like total_files it grows while the scan runs
+    total_bytes: int = 0
+    scan_complete: bool = False
+    unchanged_files: int = 0
+    unchanged_bytes: int = 0
     processed_files: int = 0
     cached_files: int = 0
     failed_files: int = 0
+    # Embedded points not queued for captioning because the caption stage was full
+    captions_skipped: int = 0
     
     logs: List[Dict[str, Any]] = field(default_factory=list)
     tasks: List[asyncio.Task] = field(default_factory=list)
+    stage_stats: Dict[str, StageStats] = field(default_factory=dict)
+    decode_pool: Optional[Executor] = None
+    # Write-ahead record of embedded points not yet acknowledged by Qdrant
+    ledger: Optional[JobLedger] = None
+    scan_index: Optional[ScanIndex] = None
+    # path -> (size, mtime_ns) for queued files, moved into the scan index once upserted
+    file_signatures: Dict[str, tuple] = field(default_factory=dict)
     
     def __post_init__(self):
         self.raw_queue = asyncio.Queue(maxsize=self.ml_batch_size * 2)
         self.ml_queue = asyncio.Queue(maxsize=self.ml_batch_size * 2)
         self.db_queue = asyncio.Queue(maxsize=self.qdrant_batch_size * 2)
+        self.caption_queue = asyncio.Queue(maxsize=max(1, self.blip_batch_size or self.ml_batch_size) * 4)
     
     @property
     def progress(self) -> float:
@@ -72,11 +138,18 @@ class JobContext:
     def add_log(self, message: str, level: str = "info"):
         self.logs.append({"timestamp": datetime.utcnow().isoformat(), "level": level, "message": message})
 
+    def stage(self, name: str) -> StageStats:
+        """Return the throughput counter for a pipeline stage, creating it on first use."""
+        stats = self.stage_stats.get(name)
+        if stats is None:
+            stats = self.stage_stats[name] = StageStats()
+        return stats
+
 # In-memory store for active jobs.
 active_jobs: Dict[str, JobContext] = {}
 
 # Local pipeline stages
-from . import io_scanner, cpu_processor, gpu_worker, db_upserter
+from . import io_scanner, cpu_processor, gpu_worker, db_upserter, decode_pool, caption_worker
 
 async def _run_pipeline(
     job_id: str,
@@ -97,7 +170,8 @@ async def _run_pipeline(
     # Log queue and worker configuration
     logger.info(f"[Pipeline {job_id}] Config: ml_batch_size={ctx.ml_batch_size}, qdrant_batch_size={ctx.qdrant_batch_size}, "
                 f"raw_queue.maxsize={ctx.raw_queue.maxsize}, ml_queue.maxsize={ctx.ml_queue.maxsize}, db_queue.maxsize={ctx.db_queue.maxsize}, "
-                f"cpu_worker_count={ctx.cpu_worker_count}, ml_worker_count={ctx.ml_worker_count}, db_worker_count={ctx.db_worker_count}")
+                f"cpu_worker_count={ctx.cpu_worker_count}, ml_worker_count={ctx.ml_worker_count}, db_worker_count={ctx.db_worker_count}, "
+                f"decode_worker_count={ctx.decode_worker_count}")
 
     try:
         try:
@@ -109,6 +183,14 @@ async def _run_pipeline(
         except Exception as e:
             logger.warning(f"[Pipeline {job_id}] Failed to disable indexing: {e}")
 
+        ctx.ledger = JobLedger.create(job_id, collection_name)
+        if ctx.skip_unchanged:
+            ctx.scan_index = ScanIndex.open(collection_name)
+
+        if ctx.decode_worker_count > 0:
+            ctx.decode_pool = decode_pool.create_decode_pool(ctx.decode_worker_count)
+            logger.info(f"[Pipeline {job_id}] Started decode pool with {ctx.decode_worker_count} processes")
+
         # --- Define and start all workers ---
         logger.info(f"[Pipeline {job_id}] Starting IO scanner...")
         scanner_task = asyncio.create_task(io_scanner.scan_directory(ctx, directory_path))
@@ -128,12 +210,15 @@ async def _run_pipeline(
             for _ in range(ctx.db_worker_count)
         ]
         all_workers = cpu_workers + gpu_workers + db_upserters
+        if ctx.deferred_captions:
+            logger.info(f"[Pipeline {job_id}] Starting caption worker (batch size {ctx.blip_batch_size})...")
+            all_workers.append(caption_worker.process_captions(ctx, collection_name, qdrant_client))
         ctx.tasks = [asyncio.create_task(worker) for worker in all_workers]
 
         # --- Orchestrate the pipeline flow ---
         await scanner_task # 1. Wait for the directory scan to complete
-        ctx.add_log(f"Scan finished. Found {ctx.total_files} files.")
-        logger.info(f"[Pipeline {job_id}] IO scan complete. Found {ctx.total_files} files.")
+        ctx.add_log(f"Scan finished. Found {ctx.total_files} files ({ctx.unchanged_files} unchanged skipped).")
+        logger.info(f"[Pipeline {job_id}] IO scan complete. Found {ctx.total_files} files, {ctx.unchanged_files} unchanged.")
 
         await ctx.raw_queue.join() # 2. Wait for all files to be processed by CPU workers
         ctx.add_log("CPU processing stage complete.")
@@ -147,6 +232,11 @@ async def _run_pipeline(
         ctx.add_log("Database upsert stage complete.")
         logger.info(f"[Pipeline {job_id}] Database upsert stage complete.")
 
+        if ctx.deferred_captions:
+            await ctx.caption_queue.join() # 5. Wait for captions to be written back as payload updates
+            ctx.add_log("Caption stage complete.")
+            logger.info(f"[Pipeline {job_id}] Caption stage complete.")
+
         try:
             qdrant_client.update_collection(
                 collection_name=collection_name,
@@ -171,40 +261,34 @@ async def _run_pipeline(
             if not task.done():
                 task.cancel()
         await asyncio.gather(*ctx.tasks, return_exceptions=True)
+        if ctx.decode_pool is not None:
+            ctx.decode_pool.shutdown(wait=False, cancel_futures=True)
+            ctx.decode_pool = None
+        if ctx.ledger is not None:
+            ctx.ledger.close()
+        if ctx.scan_index is not None:
+            ctx.scan_index.close()
+            ctx.scan_index = None
+        ctx.file_signatures.clear()
         ctx.end_time = time.time()
+        for name, stats in ctx.stage_stats.items():
+            logger.info(f"[Pipeline {job_id}] Stage '{name}' throughput: {stats.as_dict()}")
         logger.info(f"[Pipeline {job_id}] Pipeline finished with status: {ctx.status.value}")
 
 
-# Add a function to get ML service capabilities
-def get_ml_service_capabilities(ml_service_url: str) -> dict:
-    try:
-        resp = httpx.get(f"{ml_service_url}/api/v1/capabilities", timeout=10)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        logger.warning(f"Could not fetch ML service capabilities: {e}")
-        return {}
-
-def get_ingestion_service_capabilities(ingestion_service_url: str) -> dict:
-    try:
-        resp = httpx.get(f"{ingestion_service_url}/api/v1/capabilities", timeout=10)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        logger.warning(f"Could not fetch ingestion service capabilities: {e}")
-        return {}
-
-# --- ML Capabilities Cache and Robust Fetch Logic ---
+# --- ML Capabilities Cache and Non-blocking Refresh ---
 _ml_capabilities_cache = None
 _ml_capabilities_last_fetch = 0
+_ml_capabilities_refresh: Optional[asyncio.Task] = None
 ML_CAPABILITIES_TTL = 60  # seconds
 
-def fetch_ml_service_capabilities(ml_service_url: str, retries: int = 3) -> dict:
+async def fetch_ml_service_capabilities(ml_service_url: str, retries: int = 3) -> dict:
     """Fetch ML service capabilities with retries and cache the result."""
     global _ml_capabilities_cache, _ml_capabilities_last_fetch
+    client = http_clients.get_client(ml_service_url)
     for attempt in range(retries):
         try:
-            resp = httpx.get(f"{ml_service_url}/api/v1/capabilities", timeout=10)
+            resp = await client.get(f"{ml_service_url}/api/v1/capabilities", timeout=10)
             resp.raise_for_status()
             caps = resp.json()
             _ml_capabilities_cache = caps
@@ -212,7 +296,8 @@ def fetch_ml_service_capabilities(ml_service_url: str, retries: int = 3) -> dict
             return caps
         except Exception as e:
             logger.warning(f"Attempt {attempt+1}: Could not fetch ML service capabilities: {e}")
-            time.sleep(2 ** attempt)  # Exponential backoff
+            if attempt < retries - 1 and not isinstance(e, http_clients.CircuitOpenError):
+                await asyncio.sleep(2 ** attempt)  # Exponential backoff, off the event loop
     # Fallback to cache if available
     if _ml_capabilities_cache:
         logger.info("Using cached ML capabilities")
@@ -221,11 +306,23 @@ def fetch_ml_service_capabilities(ml_service_url: str, retries: int = 3) -> dict
     logger.warning("No ML capabilities available, defaulting to safe values")
     return {"safe_batch_size": 1}
 
-def get_latest_ml_capabilities(ml_service_url: str) -> dict:
-    """Return cached ML capabilities if recent, else fetch new."""
-    if _ml_capabilities_cache and (time.time() - _ml_capabilities_last_fetch < ML_CAPABILITIES_TTL):
+def refresh_ml_capabilities_in_background(ml_service_url: str) -> None:
+    """Start one background refresh unless one is already running."""
+    global _ml_capabilities_refresh
+    if _ml_capabilities_refresh is None or _ml_capabilities_refresh.done():
+        _ml_capabilities_refresh = asyncio.create_task(fetch_ml_service_capabilities(ml_service_url))
+
+async def get_latest_ml_capabilities(ml_service_url: str) -> dict:
+    """
+    Return cached ML capabilities without waiting on the network. A stale cache
+    is returned as-is and refreshed in the background; only the very first call
+    (no cache yet) waits for a single fetch attempt.
+    """
+    if _ml_capabilities_cache:
+        if time.time() - _ml_capabilities_last_fetch >= ML_CAPABILITIES_TTL:
+            refresh_ml_capabilities_in_background(ml_service_url)
         return _ml_capabilities_cache
-    return fetch_ml_service_capabilities(ml_service_url)
+    return await fetch_ml_service_capabilities(ml_service_url, retries=1)
 
 async def start_pipeline(
     directory_path: str,
@@ -233,10 +330,13 @@ async def start_pipeline(
     background_tasks: BackgroundTasks,
     qdrant_client: QdrantClient,
     caption: bool = True,
+    include_globs: Optional[List[str]] = None,
+    exclude_globs: Optional[List[str]] = None,
+    skip_unchanged: bool = True,
 ) -> str:
     # Dynamically determine ML batch size and queue size from ML service capabilities
     ML_SERVICE_URL = os.environ.get("ML_INFERENCE_SERVICE_URL", "http://localhost:8001")
-    ml_caps = get_latest_ml_capabilities(ML_SERVICE_URL)
+    ml_caps = await get_latest_ml_capabilities(ML_SERVICE_URL)
     logger.info(f"[Batch Size Negotiation] ML service capabilities: {ml_caps}")
     safe_clip_batch_size = ml_caps.get("safe_clip_batch")  # <-- fixed key
     safe_blip_batch_size = ml_caps.get("safe_blip_batch")  # <-- fixed key
@@ -246,23 +346,42 @@ async def start_pipeline(
     clip_batch_size = int(safe_clip_batch_size) if safe_clip_batch_size else (int(safe_ml_batch_size) if safe_ml_batch_size else 32)
     blip_batch_size = int(safe_blip_batch_size) if safe_blip_batch_size else (int(safe_ml_batch_size) if safe_ml_batch_size else 32)
 
-    # Use BLIP batch size for ML operations (since we're doing captioning)
-    ml_batch_size = blip_batch_size
+    # Resize on the CPU workers to the largest resolution either model consumes,
+    # but only when the ML service advertises it (older services do not).
+    model_input_size = None
+    if os.environ.get("INGEST_RESIZE_TO_MODEL", "1") not in {"0", "false", "False"}:
+        input_sizes = [int(ml_caps[k]) for k in ("clip_input_size", "blip_input_size") if ml_caps.get(k)]
+        if input_sizes:
+            model_input_size = max(input_sizes)
+    logger.info(f"[Batch Size Selection] Client-side resize target (shorter side): {model_input_size or 'disabled'}")
+
+    # "inline" (default) embeds and captions each batch together. "deferred": the ML stage
+    # only embeds, sized for CLIP, and captions are generated by a separate stage with the
+    # BLIP batch size and written back as payload updates, so images become searchable at
+    # CLIP speed.
+    deferred_captions = caption and os.environ.get("INGEST_CAPTION_MODE", "inline").lower() == "deferred"
+    ml_batch_size = clip_batch_size if deferred_captions else blip_batch_size
     ml_queue_maxsize = ml_batch_size * 2
 
     # Log the batch size selection for debugging
     logger.info(f"[Batch Size Selection] ML capabilities: {ml_caps}")
     logger.info(f"[Batch Size Selection] CLIP batch size: {clip_batch_size}, BLIP batch size: {blip_batch_size}")
-    logger.info(f"[Batch Size Selection] Using ML batch size: {ml_batch_size} (BLIP-based)")
+    logger.info(f"[Batch Size Selection] Using ML batch size: {ml_batch_size} ({'CLIP' if deferred_captions else 'BLIP'}-based)")
 
     # Set Qdrant batch size and queue size from environment or fallback
     qdrant_batch_size = int(os.environ.get("QDRANT_UPSERT_BATCH_SIZE", 64))
     db_queue_maxsize = qdrant_batch_size * 2
 
-    # Compute worker counts based on batch sizes
-    cpu_worker_count = max(2, ml_batch_size // 32)
+    # Decode pool: one process per core (minus one for the event loop) unless overridden
+    decode_worker_count = int(os.environ.get("INGEST_DECODE_PROCESSES", max(1, (os.cpu_count() or 2) - 1)))
+
+    # Compute worker counts based on batch sizes; keep enough CPU consumers to saturate the pool
+    cpu_worker_count = max(2, ml_batch_size // 32, decode_worker_count)
     ml_worker_count = 1
     db_worker_count = 1
+    ml_inflight_batches = gpu_worker.negotiate_inflight_window(ml_caps)
+    # "content" (default) keys points on collection + SHA256; "random" keeps the legacy uuid4 IDs
+    deterministic_ids = os.environ.get("INGEST_POINT_ID_MODE", "content").lower() != "random"
 
     # Update environment variables for consistency
     os.environ["ML_INFERENCE_BATCH_SIZE"] = str(ml_batch_size)
@@ -275,14 +394,26 @@ async def start_pipeline(
         cpu_worker_count=cpu_worker_count,
         ml_worker_count=ml_worker_count,
         db_worker_count=db_worker_count,
+        decode_worker_count=decode_worker_count,
         clip_batch_size=clip_batch_size,
         blip_batch_size=blip_batch_size,
         caption=caption,
+        deferred_captions=deferred_captions,
+        ml_transport=gpu_worker.ML_TRANSPORT,
+        model_input_size=model_input_size,
+        ml_inflight_batches=ml_inflight_batches,
+        deterministic_ids=deterministic_ids,
+        include_globs=list(include_globs or []),
+        exclude_globs=list(exclude_globs or []),
+        skip_unchanged=skip_unchanged and os.environ.get("INGEST_SKIP_UNCHANGED", "0") not in {"0", "false", "False"},
     )
     # Override queue maxsize for ML and DB queues
     ctx.raw_queue = asyncio.Queue(maxsize=ml_queue_maxsize)
     ctx.ml_queue = asyncio.Queue(maxsize=ml_queue_maxsize)
     ctx.db_queue = asyncio.Queue(maxsize=db_queue_maxsize)
+    # Points waiting for BLIP. Entries are small references (the caption stage decodes
+    # the source file again), so embedding can run far ahead of captioning
+    ctx.caption_queue = asyncio.Queue(maxsize=max(blip_batch_size, int(os.environ.get("INGEST_CAPTION_QUEUE_SIZE", "10000"))))
 
     active_jobs[ctx.job_id] = ctx
 
@@ -294,7 +425,7 @@ async def start_pipeline(
         qdrant_client
     )
 
-    logger.info(f"Scheduled pipeline job {ctx.job_id} for collection '{collection_name}' (ml_batch_size={ml_batch_size}, ml_queue_maxsize={ml_queue_maxsize}, qdrant_batch_size={qdrant_batch_size}, db_queue_maxsize={db_queue_maxsize}, clip_batch_size={clip_batch_size}, blip_batch_size={blip_batch_size}, cpu_worker_count={cpu_worker_count}, ml_worker_count={ml_worker_count}, db_worker_count={db_worker_count})")
+    logger.info(f"Scheduled pipeline job {ctx.job_id} for collection '{collection_name}' (ml_batch_size={ml_batch_size}, ml_queue_maxsize={ml_queue_maxsize}, qdrant_batch_size={qdrant_batch_size}, db_queue_maxsize={db_queue_maxsize}, clip_batch_size={clip_batch_size}, blip_batch_size={blip_batch_size}, cpu_worker_count={cpu_worker_count}, decode_worker_count={decode_worker_count}, ml_worker_count={ml_worker_count}, ml_inflight_batches={ml_inflight_batches}, db_worker_count={db_worker_count}, ml_transport={ctx.ml_transport}, deterministic_ids={deterministic_ids}, skip_unchanged={ctx.skip_unchanged})")
     return ctx.job_id
 
 def get_job_status(job_id: str) -> Optional[JobContext]:
@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+from typing import Iterable, Optional, Tuple
+
+import diskcache
+
+logger = logging.getLogger(__name__)
+
+SCAN_INDEX_DIR = os.environ.get("INGEST_SCAN_INDEX_DIR", ".scan_index")
+
+# (size in bytes, mtime in nanoseconds) as reported by the directory scan
+FileSignature = Tuple[int, int]
+
+
+def _index_path(collection_name: str, index_dir: str) -> str:
+    # Collection names are user supplied; keep them readable but filesystem safe
+    safe = re.sub(r"[^\w.-]", "_", collection_name)[:64]
+    digest = hashlib.sha1(collection_name.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(index_dir, f"{safe}-{digest}")
+
+
+class ScanIndex:
+    """
+    Per-collection index of ``path -> (size, mtime_ns)`` for files whose points
+    Qdrant has acknowledged. The scanner consults it with the stat result it
+    already has from ``os.scandir``, so unchanged files are skipped before they
+    are ever read or hashed.
+    """
+
+    def __init__(self, cache: diskcache.Cache, collection_name: str):
+        self._cache = cache
+        self.collection_name = collection_name
+
+    @classmethod
+    def open(cls, collection_name: str, index_dir: str = SCAN_INDEX_DIR) -> "ScanIndex":
+        return cls(diskcache.Cache(_index_path(collection_name, index_dir)), collection_name)
+
+    def is_unchanged(self, path: str, signature: FileSignature) -> bool:
+        stored = self._cache.get(path)
+        return stored is not None and tuple(stored) == signature
+
+    def record(self, entries: Iterable[Tuple[str, FileSignature]]) -> None:
+        with self._cache.transact():
+            for path, signature in entries:
+                self._cache.set(path, signature)
+
+    def forget(self, paths: Iterable[str]) -> None:
+        with self._cache.transact():
+            for path in paths:
+                self._cache.delete(path)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def close(self) -> None:
+        self._cache.close()
+
+
+def drop_index(collection_name: str, index_dir: str = SCAN_INDEX_DIR) -> None:
+    """Forget every indexed file of a collection (e.g. when the collection is deleted)."""
+    path = _index_path(collection_name, index_dir)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        logger.info(f"Dropped scan index for collection '{collection_name}'")
+
+
+def forget_paths(paths: Iterable[str], collection_name: Optional[str] = None, index_dir: str = SCAN_INDEX_DIR) -> None:
+    """
+    Remove files from a collection's scan index, or from every collection's
+    when ``collection_name`` is None, so the next scan reads them again. Called
+    when their points are deleted or the files are moved away.
+    """
+    paths = [p for p in paths if p]
+    if not paths or not os.path.isdir(index_dir):
+        return
+    if collection_name is not None:
+        index_paths = [_index_path(collection_name, index_dir)]
+    else:
+        index_paths = [os.path.join(index_dir, name) for name in os.listdir(index_dir)]
+    for path in index_paths:
+        if not os.path.isdir(path):
+            continue
+        index = ScanIndex(diskcache.Cache(path), collection_name or "")
+        try:
+            index.forget(paths)
+        except Exception as e:
+            logger.warning(f"Could not update scan index {path}: {e}")
+        finally:
+            index.close()
+
+
+def record_points(ctx, points: Iterable) -> None:
+    """
+    Mark the source files of points Qdrant just applied as indexed, using the
+    signatures the scanner captured for this job. Only call this after an
+    upsert with ``wait=True``.
+    """
+    index: Optional[ScanIndex] = ctx.scan_index
+    if index is None:
+        return
+    entries = []
+    for point in points:
+        path = (point.payload or {}).get("full_path")
+        signature = ctx.file_signatures.pop(path, None) if path else None
+        if signature is not None:
+            entries.append((path, signature))
+    if entries:
+        try:
+            index.record(entries)
+        except Exception as e:
+            logger.warning(f"[{ctx.job_id}] Could not update scan index: {e}")
@@ -4,8 +4,10 @@ import base64
 import io
 import logging
 import asyncio
+import uuid
 from asyncio import Queue
-from typing import List as TypingList, Dict, Any, TypeVar
+from datetime import datetime
+from typing import List as TypingList, Dict, Any, Optional, TypeVar
 
 import exifread
 from PIL import Image
@@ -36,6 +38,111 @@ def compute_sha256(file_path: str) -> str:
             sha256_hash.update(byte_block)
     return sha256_hash.hexdigest()
 
+# Fixed namespace so the same (collection, file hash) always maps to the same point ID
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "pixel-detective/image-point")
+
+def point_id_for(collection_name: str, file_hash: str) -> str:
+    """Content-addressed Qdrant point ID: UUIDv5 over the collection name and file SHA256."""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{collection_name}:{file_hash}"))
+
+def xp_keywords_from_exif(exif_tags: Dict[str, Any]) -> TypingList[str]:
+    """Return the Windows ``XPKeywords`` entries from an exifread tag dict."""
+    if 'Image XPKeywords' not in exif_tags:
+        return []
+    # This tag is often used by Windows and is UCS2 encoded.
+    try:
+        keyword_bytes = exif_tags['Image XPKeywords'].values
+        # Decode from bytes (often UCS-2) into a string, ignoring errors.
+        if not isinstance(keyword_bytes, (bytes, bytearray)):
+            keyword_bytes = bytes(keyword_bytes)
+        keywords = keyword_bytes.decode('utf-16-le', errors='ignore').rstrip('\x00')
+        return [k.strip() for k in keywords.split(';') if k.strip()]
+    except Exception:
+        return []  # Ignore decoding errors
+
+def add_exif_metadata(metadata: Dict[str, Any], exif_tags: Dict[str, Any]) -> None:
+    """Copy exifread tags into ``metadata`` as JSON-safe ``exif_*`` string entries."""
+    for tag, value in exif_tags.items():
+        if tag not in ('JPEGThumbnail', 'TIFFThumbnail'): # Exclude thumbnails
+            # Sanitize value for JSON serialization
+            try:
+                str_val = str(value.values)
+                # clean up string representation of byte arrays
+                if str_val.startswith("b'") or str_val.startswith('b"'):
+                    str_val = str_val[2:-1]
+                metadata[f"exif_{tag.replace(' ', '_')}"] = str_val
+            except:
+                pass # Ignore unserializable tags
+
+# Typed payload fields and the exif_* keys they are parsed from: the pipeline
+# stores "exif_<IFD>_<Tag>" keys, the legacy ingest path "exif_<Tag>"
+TYPED_EXIF_FIELDS = {
+    "camera_make": ("exif_Image_Make", "exif_Make"),
+    "camera_model": ("exif_Image_Model", "exif_Model"),
+    "lens_model": ("exif_EXIF_LensModel", "exif_LensModel"),
+    "date_taken": ("exif_EXIF_DateTimeOriginal", "exif_DateTimeOriginal", "exif_EXIF_DateTimeDigitized", "exif_Image_DateTime"),
+    "iso": ("exif_EXIF_ISOSpeedRatings", "exif_ISO"),
+    "f_number": ("exif_EXIF_FNumber", "exif_FNumber"),
+    "exposure_time": ("exif_EXIF_ExposureTime", "exif_ExposureTime"),
+    "focal_length": ("exif_EXIF_FocalLength", "exif_FocalLength"),
+}
+
+def _first_exif_value(value: Any) -> Optional[str]:
+    """First element of a stringified exifread value (``"[14/5]"`` -> ``"14/5"``)."""
+    text = str(value).strip().strip("\x00").strip()
+    if text.startswith("[") and text.endswith("]"):
+        text = text[1:-1].split(",")[0].strip()
+    text = text.strip("'\"").strip()
+    return text or None
+
+def _exif_number(value: Any) -> Optional[float]:
+    text = _first_exif_value(value)
+    if text is None:
+        return None
+    try:
+        if "/" in text:
+            num, den = text.split("/", 1)
+            return float(num) / float(den) if float(den) else None
+        return float(text)
+    except ValueError:
+        return None
+
+def _exif_datetime(value: Any) -> Optional[str]:
+    """EXIF ``YYYY:MM:DD HH:MM:SS`` as ISO 8601, or ``None`` for blank/zero dates."""
+    text = _first_exif_value(value)
+    if not text:
+        return None
+    for fmt in ("%Y:%m:%d %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y:%m:%d"):
+        try:
+            return datetime.strptime(text[:19], fmt).isoformat()
+        except ValueError:
+            continue
+    return None
+
+def normalize_exif(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Typed fields parsed from the ``exif_*`` strings in ``metadata``: keyword
+    strings for camera and lens, an ISO 8601 ``date_taken``, an integer ``iso``
+    and floats for the exposure settings. Fields that cannot be parsed are left out.
+    """
+    typed: Dict[str, Any] = {}
+    for field, keys in TYPED_EXIF_FIELDS.items():
+        raw = next((metadata[key] for key in keys if metadata.get(key) not in (None, "")), None)
+        if raw is None:
+            continue
+        if field == "date_taken":
+            value = _exif_datetime(raw)
+        elif field == "iso":
+            number = _exif_number(raw)
+            value = int(number) if number is not None else None
+        elif field in ("f_number", "exposure_time", "focal_length"):
+            value = _exif_number(raw)
+        else:
+            value = _first_exif_value(raw)
+        if value is not None:
+            typed[field] = value
+    return typed
+
 def _extract_keyword_tags(path: str) -> TypingList[str]:
     """
     Extracts IPTC/XMP keyword tags from an image file.
@@ -63,16 +170,7 @@ def _extract_keyword_tags(path: str) -> TypingList[str]:
     # Also check EXIF tags which can sometimes hold keywords.
     try:
         with open(path, 'rb') as f:
-            exif_tags = exifread.process_file(f, details=False)
-            if 'Image XPKeywords' in exif_tags:
-                # This tag is often used by Windows and is UCS2 encoded.
-                try:
-                    keyword_bytes = exif_tags['Image XPKeywords'].values
-                    # Decode from bytes (often UCS-2) into a string, ignoring errors.
-                    keywords = keyword_bytes.decode('utf-16-le', errors='ignore').rstrip('\x00')
-                    tags.update([k.strip() for k in keywords.split(';') if k.strip()])
-                except Exception:
-                    pass  # Ignore decoding errors
+            tags.update(xp_keywords_from_exif(exifread.process_file(f, details=False)))
     except Exception:
         pass
 
@@ -125,18 +223,8 @@ def extract_image_metadata(file_path: str) -> Dict[str, Any]:
     # Extract EXIF data using exifread, which is more robust than Pillow's EXIF handling
     try:
         with open(file_path, 'rb') as f:
-            tags = exifread.process_file(f, details=False)
-            for tag, value in tags.items():
-                if tag not in ('JPEGThumbnail', 'TIFFThumbnail'): # Exclude thumbnails
-                    # Sanitize value for JSON serialization
-                    try:
-                        str_val = str(value.values)
-                        # clean up string representation of byte arrays
-                        if str_val.startswith("b'") or str_val.startswith('b"'):
-                            str_val = str_val[2:-1]
-                        metadata[f"exif_{tag.replace(' ', '_')}"] = str_val
-                    except:
-                        pass # Ignore unserializable tags
+            add_exif_metadata(metadata, exifread.process_file(f, details=False))
+        metadata.update(normalize_exif(metadata))
     except Exception as e:
         logger.debug(f"Could not extract EXIF data for {file_path}: {e}")
 
@@ -1,11 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field
 from qdrant_client import QdrantClient, models as qdr
 from qdrant_client.http.models import Distance, VectorParams, HnswConfigDiff
 import logging
 
+from .. import payload_indexes, thumbnail_store
 from ..dependencies import get_qdrant_client, app_state
+from ..pipeline import scan_index
+from ..utils import count_cache
+from .thumbnails import thumbnail_url
 
 logger = logging.getLogger(__name__)
 
@@ -66,17 +70,19 @@ async def get_collection_info(collection_name: str, qdrant: QdrantClient = Depen
             search_result = qdrant.scroll(
                 collection_name=collection_name,
                 limit=5,
-                with_payload=True,
+                with_payload=["filename", "timestamp", "caption", "file_hash"],
                 with_vectors=False
             )
             
             for point in search_result[0]:  # search_result is (points, next_page_offset)
+                payload = point.payload or {}
                 sample_points.append({
                     "id": point.id,
-                    "filename": point.payload.get("filename", "unknown"),
-                    "timestamp": point.payload.get("timestamp", ""),
-                    "has_thumbnail": bool(point.payload.get("thumbnail_url")),
-                    "has_caption": bool(point.payload.get("caption"))
+                    "filename": payload.get("filename", "unknown"),
+                    "timestamp": payload.get("timestamp", ""),
+                    "has_thumbnail": thumbnail_store.exists(payload.get("file_hash") or ""),
+                    "thumbnail_url": thumbnail_url(point.id, payload.get("file_hash")),
+                    "has_caption": bool(payload.get("caption"))
                 })
         except Exception as e:
             logger.warning(f"Could not fetch sample points for {collection_name}: {e}")
@@ -115,6 +121,7 @@ async def create_collection(req: CreateCollectionRequest, qdrant: QdrantClient =
         vectors_config=VectorParams(size=req.vector_size, distance=dist_enum, on_disk=True),
         hnsw_config=HnswConfigDiff(on_disk=True)
     )
+    payload_indexes.ensure_indexes(qdrant, req.collection_name)
     return {"status": "success", "collection": req.collection_name}
 
 @router.post("/from_selection", response_model=Dict[str, Any], status_code=201)
@@ -147,6 +154,7 @@ async def create_collection_from_selection(
         vectors_config=VectorParams(size=vec_params.size, distance=vec_params.distance, on_disk=True),
         hnsw_config=HnswConfigDiff(on_disk=True)
     )
+    payload_indexes.ensure_indexes(qdrant, req.new_collection_name)
 
     # 4) Retrieve the selected points (vectors + payload) in batches to avoid URL length limits
     BATCH = 256
@@ -183,6 +191,7 @@ async def create_collection_from_selection(
         # Upsert into new collection
         qdrant.upsert(collection_name=req.new_collection_name, points=formatted_points)
         total_copied += len(formatted_points)
+        count_cache.image_counts.invalidate(req.new_collection_name)
 
     logger.info(
         "Created collection '%s' with %d points copied from '%s'",
@@ -222,6 +231,10 @@ async def delete_collection(collection_name: str, qdrant: QdrantClient = Depends
         result = qdrant.delete_collection(collection_name=collection_name)
         if result:
             logger.info(f"Collection '{collection_name}' deleted successfully.")
+            # Files indexed for this collection must be ingested again if it is recreated
+            scan_index.drop_index(collection_name)
+            count_cache.image_counts.invalidate(collection_name)
+            payload_indexes.forget(collection_name)
             # If the deleted collection was the active one, clear it
             if app_state.active_collection == collection_name:
                 app_state.active_collection = None
@@ -236,6 +249,48 @@ async def delete_collection(collection_name: str, qdrant: QdrantClient = Depends
         # A more specific check could be to inspect the error message, but this is a reasonable fallback
         raise HTTPException(status_code=500, detail=f"An error occurred while trying to delete collection '{collection_name}'. It might not exist or there was a connection issue.")
 
+class RebuildIndexesRequest(BaseModel):
+    fields: Optional[List[str]] = Field(default=None, description="Declared fields to rebuild (all by default)")
+    normalize: bool = Field(default=False, description="Also backfill typed EXIF fields of existing points in the background")
+
+@router.get("/{collection_name}/indexes", response_model=Dict[str, Any])
+async def get_collection_indexes(collection_name: str, qdrant: QdrantClient = Depends(get_qdrant_client)):
+    """Compare the collection's payload indexes with the declared ones."""
+    try:
+        indexes = payload_indexes.inspect_indexes(qdrant, collection_name)
+    except Exception as e:
+        logger.error(f"Failed to read payload indexes of {collection_name}: {e}")
+        raise HTTPException(status_code=404, detail=f"Collection '{collection_name}' not found")
+    return {"collection": collection_name, "indexes": indexes}
+
+@router.post("/{collection_name}/indexes/rebuild", response_model=Dict[str, Any])
+async def rebuild_collection_indexes(
+    collection_name: str,
+    req: RebuildIndexesRequest,
+    background_tasks: BackgroundTasks,
+    qdrant: QdrantClient = Depends(get_qdrant_client),
+):
+    """Drop and recreate declared payload indexes, optionally backfilling typed EXIF fields."""
+    try:
+        rebuilt = payload_indexes.rebuild_indexes(qdrant, collection_name, req.fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to rebuild payload indexes of {collection_name}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild payload indexes: {e}")
+
+    if req.normalize:
+        background_tasks.add_task(_normalize_payloads_task, collection_name, qdrant)
+    return {"status": "success", "collection": collection_name, "rebuilt": rebuilt, "normalize_scheduled": req.normalize}
+
+def _normalize_payloads_task(collection_name: str, qdrant_client: QdrantClient):
+    try:
+        payload_indexes.normalize_payloads(qdrant_client, collection_name)
+        # Filtered counts may now match points they did not before
+        count_cache.image_counts.invalidate(collection_name)
+    except Exception as e:
+        logger.error(f"Normalizing payloads of {collection_name} failed: {e}", exc_info=True)
+
 # --- New: Merge Collections Endpoint ----------------------------------------------------
 # Allows building/refreshing a master collection from N source collections without
 # touching the originals.  Based on docs/sprints/sprint-11/QDRANT_COLLECTION_MERGE_GUIDE.md.
@@ -291,6 +346,7 @@ def _merge_collections_task(dest: str, sources: List[str], qdrant_client: Qdrant
         if dest in existing:
             logger.info("[Merge] Clearing existing destination '%s'", dest)
             qdrant_client.delete_collection(collection_name=dest, wait=True)
+            scan_index.drop_index(dest)
 
         # Reuse vector config from first source (assumed homogeneous)
         src_info = qdrant_client.get_collection(sources[0])
@@ -300,6 +356,8 @@ def _merge_collections_task(dest: str, sources: List[str], qdrant_client: Qdrant
             vectors_config=vec_params,
             optimizers_config=qdr.OptimizersConfigDiff(memmap_threshold=20000),
         )
+        payload_indexes.forget(dest)
+        payload_indexes.ensure_indexes(qdrant_client, dest)
 
         total_copied = 0
         for src in sources:
@@ -319,6 +377,7 @@ def _merge_collections_task(dest: str, sources: List[str], qdrant_client: Qdrant
                 total_copied += len(points)
             logger.info("[Merge] Finished %s (copied %d points)", src, total_copied)
 
+        count_cache.image_counts.invalidate(dest)
         logger.info("[Merge] Merge complete → %s (total %d points)", dest, total_copied)
     except Exception as e:
         logger.error("[Merge] Failed to merge collections: %s", e, exc_info=True) 
\ No newline at end of file
@@ -8,6 +8,8 @@ import shutil
 import logging
 
 from ..dependencies import get_qdrant_client, get_active_collection
+from ..pipeline import scan_index
+from ..utils import count_cache
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +30,7 @@ async def archive_selection(
     # Snapshot for safety
     snapshot = qdrant.create_snapshot(collection_name=collection_name)
     archived = []
+    paths = []
     for pid in req.point_ids:
         try:
             pts = qdrant.retrieve(
@@ -40,6 +43,7 @@ async def archive_selection(
                 continue
             payload = pts[0].payload or {}
             path = payload.get("full_path")
+            paths.append(path)
             if path and os.path.exists(path):
                 dest_dir = os.path.join(os.path.dirname(path), "_VibeArchive")
                 os.makedirs(dest_dir, exist_ok=True)
@@ -52,4 +56,7 @@ async def archive_selection(
             collection_name=collection_name,
             points_selector=PointIdsList(points=req.point_ids),
         )
+        count_cache.image_counts.invalidate(collection_name)
+        # Without their points these files must be read again if they come back
+        scan_index.forget_paths(paths, collection_name)
     return {"archived": archived, "snapshot": snapshot.name if snapshot else None}
@@ -1,14 +1,17 @@
 from fastapi import APIRouter, HTTPException, Depends, Body, BackgroundTasks
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, FieldCondition, PointStruct
 from typing import List, Dict, Any
 import logging
+import threading
 import uuid
 import os
 import shutil
 from pydantic import BaseModel
 
+from .. import near_duplicates
 from ..dependencies import get_qdrant_client, get_active_collection
+from ..pipeline import scan_index
+from ..utils.payload_fields import COMPACT_FIELDS
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -20,14 +23,17 @@ router = APIRouter(prefix="/api/v1/duplicates", tags=["duplicates"])
 tasks = {}
 # Track curation status per collection so the frontend can display progress
 collection_curation_status: Dict[str, str] = {}
+# Set by the cancel endpoint, polled by the running task between batches and tiles
+_cancel_events: Dict[str, threading.Event] = {}
 
-# Default scroll batch when scanning the collection for duplicates.
+# Scroll batch when loading the collection's vectors for duplicate detection.
 SCROLL_LIMIT = int(os.getenv("SCROLL_LIMIT", "1000"))  # Override at runtime via env var
 
 
 class FindSimilarTask(BaseModel):
     task_id: str
     status: str = "pending"
+    phase: str = "pending"
     progress: float = 0.0
     total_points: int = 0
     processed_points: int = 0
@@ -47,97 +53,78 @@ def find_similar_images_task(
 ):
     """
     Background task to find visually similar images in a collection.
-    Iterates through all points and finds those with a cosine similarity above the threshold.
+
+    Runs :func:`near_duplicates.find_duplicate_groups` over the whole
+    collection: vectors are loaded once into a float16 memmap and compared in
+    tiles, instead of one Qdrant search per point. Loading counts for the
+    first 10% of ``progress`` and comparing for the next 85%.
     """
-    tasks[task_id].status = "running"
+    task = tasks[task_id]
+    cancel_event = _cancel_events.setdefault(task_id, threading.Event())
+    task.status = "running"
     collection_curation_status[collection_name] = "running"
     logger.info(f"Task {task_id}: Starting near-duplicate analysis for collection '{collection_name}'.")
 
+    def on_progress(phase: str, done: int, total: int):
+        task.phase = phase
+        if phase == "loading":
+            task.total_points = total
+            task.processed_points = done
+            task.progress = 10.0 * done / total
+        else:
+            task.progress = 10.0 + 85.0 * done / total
+            if done % 100 == 0:
+                logger.info(f"Task {task_id}: Progress {task.progress:.2f}% ({done}/{total} tiles)")
+
     try:
-        # Get total number of points for progress calculation
-        collection_info = qdrant_client.get_collection(collection_name=collection_name)
-        total_points = collection_info.points_count
-        tasks[task_id].total_points = total_points
-
-        processed_ids = set()
-        duplicate_groups = []
-
-        # Use scroll to iterate over all points in the collection.
-        scroll_response = qdrant_client.scroll(
-            collection_name=collection_name,
-            with_vectors=True,
-            limit=SCROLL_LIMIT,
+        groups = near_duplicates.find_duplicate_groups(
+            qdrant_client,
+            collection_name,
+            threshold,
+            limit_per_image,
+            batch_size=SCROLL_LIMIT,
+            progress=on_progress,
+            cancelled=cancel_event.is_set,
         )
 
-        points_batch = scroll_response[0]
-        next_page_offset = scroll_response[1]
-
-        while points_batch:
-            for i, point in enumerate(points_batch):
-                if point.id in processed_ids:
-                    continue
-
-                # Update progress
-                tasks[task_id].processed_points += 1
-                tasks[task_id].progress = (
-                    tasks[task_id].processed_points / total_points
-                ) * 100
-                if tasks[task_id].processed_points % 100 == 0:
-                    logger.info(
-                        f"Task {task_id}: Progress {tasks[task_id].progress:.2f}% ({tasks[task_id].processed_points}/{total_points})"
-                    )
-
-                search_results = qdrant_client.search(
-                    collection_name=collection_name,
-                    query_vector=point.vector,
-                    query_filter=Filter(
-                        must_not=[FieldCondition(key="id", match={"value": point.id})]
-                    ),
-                    score_threshold=threshold,
-                    limit=limit_per_image,
-                )
-
-                if search_results:
-                    # Found a group of similar images
-                    current_group_ids = {point.id}
-                    current_group_points = [
-                        {"id": point.id, "payload": point.payload, "score": 1.0}
-                    ]
-
-                    for sr in search_results:
-                        current_group_ids.add(sr.id)
-                        current_group_points.append(
-                            {"id": sr.id, "payload": sr.payload, "score": sr.score}
-                        )
-
-                    duplicate_groups.append(
-                        {"group_id": str(uuid.uuid4()), "points": current_group_points}
-                    )
-                    processed_ids.update(current_group_ids)
-
-            if next_page_offset is None:
-                break
-
-            # Fetch the next batch
-            scroll_response = qdrant_client.scroll(
+        task.phase = "grouping"
+        payloads: Dict[Any, Dict[str, Any]] = {}
+        member_ids = [point_id for group in groups for point_id, _ in group]
+        for i in range(0, len(member_ids), SCROLL_LIMIT):
+            for record in qdrant_client.retrieve(
                 collection_name=collection_name,
-                with_vectors=True,
-                limit=SCROLL_LIMIT,
-                offset=next_page_offset,
-            )
-            points_batch = scroll_response[0]
-            next_page_offset = scroll_response[1]
-
-        tasks[task_id].results = duplicate_groups
-        tasks[task_id].status = "completed"
+                ids=member_ids[i:i + SCROLL_LIMIT],
+                with_payload=COMPACT_FIELDS,
+                with_vectors=False,
+            ):
+                payloads[record.id] = record.payload or {}
+
+        task.results = [
+            {
+                "group_id": str(uuid.uuid4()),
+                "points": [
+                    {"id": point_id, "payload": payloads.get(point_id, {}), "score": score}
+                    for point_id, score in group
+                ],
+            }
+            for group in groups
+        ]
+        task.progress = 100.0
+        task.status = "completed"
 
         collection_curation_status[collection_name] = "completed"
-        logger.info(f"Task {task_id}: Analysis complete. Found {len(duplicate_groups)} duplicate groups.")
+        logger.info(f"Task {task_id}: Analysis complete. Found {len(groups)} duplicate groups.")
 
+    except near_duplicates.Cancelled:
+        logger.info(f"Task {task_id}: Cancelled.")
+        task.status = "cancelled"
+        collection_curation_status[collection_name] = "cancelled"
     except Exception as e:
         logger.error(f"Task {task_id}: Failed with error: {e}", exc_info=True)
-        tasks[task_id].status = "failed"
+        task.status = "failed"
         collection_curation_status[collection_name] = "failed"
+    finally:
+        _cancel_events.pop(task_id, None)
 
 
 @router.post("/find-similar", status_code=202, response_model=FindSimilarTask)
@@ -158,6 +145,7 @@ async def find_similar(
     task_id = str(uuid.uuid4())
     task = FindSimilarTask(task_id=task_id)
     tasks[task_id] = task
+    _cancel_events[task_id] = threading.Event()
 
     collection_curation_status[collection_name] = "running"
 
@@ -184,6 +172,21 @@ async def get_similar_report(task_id: str):
     return task
 
 
+@router.post("/cancel/{task_id}", response_model=FindSimilarTask)
+async def cancel_find_similar(task_id: str):
+    """
+    Asks a running `find-similar` task to stop; it becomes `cancelled` at its next check.
+    """
+    task = tasks.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    event = _cancel_events.get(task_id)
+    if event is None or task.status not in ("pending", "running"):
+        raise HTTPException(status_code=409, detail=f"Task is {task.status}")
+    event.set()
+    return task
+
+
 @router.get("/curation-status")
 async def get_curation_statuses():
     """Return the current curation status for all collections."""
@@ -205,5 +208,7 @@ async def archive_exact_duplicates(
                 archived.append(path)
         except Exception as e:
             logger.error(f"Failed to archive {path}: {e}")
+    # A file moved back later is read again instead of being skipped as unchanged
+    scan_index.forget_paths(archived)
     return {"archived": archived}
 
@@ -1,15 +1,19 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends, Request
 from fastapi.responses import Response
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, FieldCondition, Range, ScrollRequest, OrderBy
+from qdrant_client.http.models import Filter, FieldCondition, HasIdCondition, OrderBy
 from typing import List, Dict, Any, Optional, Union
 import logging
 import json
 import base64
-import os
+import hashlib
 import os
 
+from .. import payload_indexes, thumbnail_store
 from ..dependencies import get_qdrant_client, get_active_collection
+from ..utils import count_cache
+from .search import FIELDS_DESCRIPTION, get_projection
+from .thumbnails import thumbnail_response, thumbnail_url
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -17,25 +21,122 @@ logging.basicConfig(level=logging.INFO)
 
 router = APIRouter(prefix="/api/v1/images", tags=["images"])
 
+ID_THUMBNAIL_CACHE_CONTROL = "public, max-age=3600"
+
 # Removed get_qdrant_client_local_temp
 
 # TODO: Define Pydantic models for response
 
-@router.get("", summary="List images with pagination, filtering, and sorting")
-@router.get("/", summary="List images with pagination, filtering, and sorting")
+def _encode_cursor(state: Dict[str, Any]) -> str:
+    raw = json.dumps(state, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if not isinstance(state, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return state
+
+
+def _listing_key(filter_key: str, sort_by: Optional[str], direction: str) -> str:
+    """Ties a cursor to the filter and sort it was issued for."""
+    return hashlib.sha1(f"{filter_key}|{sort_by or ''}|{direction}".encode("utf-8")).hexdigest()[:16]
+
+
+def _cursor_after(
+    points: List[Any],
+    next_page_offset: Any,
+    sort_by: Optional[str],
+    listing: str,
+    position: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Position right after ``points``, which were read from ``position``.
+    Unsorted scrolls resume from Qdrant's ``next_page_offset``; ordered
+    scrolls have none, so they resume from the last sort value, skipping the
+    ids already returned with that value. When a run of equal values spans
+    several pages, those ids accumulate across the cursors of the run.
+    """
+    if not sort_by:
+        return {"k": listing, "o": next_page_offset} if next_page_offset is not None else None
+    if not points:
+        return None
+    last_value = (points[-1].payload or {}).get(sort_by)
+    seen = [str(p.id) for p in points if (p.payload or {}).get(sort_by) == last_value]
+    if position and position.get("v") == last_value:
+        seen = list(position.get("x") or []) + seen
+    return {"k": listing, "v": last_value, "x": seen}
+
+
+def _scroll_page(
+    qdrant: QdrantClient,
+    collection_name: str,
+    qdrant_filter: Optional[Filter],
+    order_by: Optional[OrderBy],
+    position: Optional[Dict[str, Any]],
+    limit: int,
+    with_payload: Any,
+):
+    """One scroll from ``position``; returns ``(points, next_page_offset, has_more)``."""
+    if order_by is None:
+        points, next_page_offset = qdrant.scroll(
+            collection_name=collection_name,
+            scroll_filter=qdrant_filter,
+            limit=limit,
+            offset=(position or {}).get("o"),
+            with_payload=with_payload,
+            with_vectors=False,
+        )
+        return points, next_page_offset, next_page_offset is not None
+
+    scroll_filter = qdrant_filter
+    if position:
+        order_by = OrderBy(key=order_by.key, direction=order_by.direction, start_from=position["v"])
+        if position.get("x"):
+            scroll_filter = Filter(
+                must=[qdrant_filter] if qdrant_filter else None,
+                must_not=[HasIdCondition(has_id=position["x"])],
+            )
+    # One extra point tells whether another page exists
+    points, _ = qdrant.scroll(
+        collection_name=collection_name,
+        scroll_filter=scroll_filter,
+        limit=limit + 1,
+        with_payload=with_payload,
+        with_vectors=False,
+        order_by=order_by,
+    )
+    return points[:limit], None, len(points) > limit
+
+
+@router.get("", summary="List images with cursor pagination, filtering, and sorting")
+@router.get("/", summary="List images with cursor pagination, filtering, and sorting")
 async def list_images(
-    page: int = Query(1, ge=1, description="Page number for pagination."),
+    page: int = Query(1, ge=1, description="Page number; deep pages cost O(offset), prefer `cursor`."),
     per_page: int = Query(10, ge=1, le=100, description="Number of results to return per page."),
+    cursor: Optional[str] = Query(None, description="`next_cursor` of the previous page; takes precedence over `page`."),
     filters: Optional[str] = Query(None, description="JSON string for filters (e.g., '{\"tag\": \"animal\", \"date_range\": {\"gte\": \"2023-01-01\", \"lte\": \"2023-12-31\"}}')."),
-    sort_by: Optional[str] = Query(None, description="Field to sort by (e.g., 'created_at', 'name')."),
+    sort_by: Optional[str] = Query(None, description="Numeric or date payload field to sort by (e.g., 'width'); a payload index is created on first use."),
     sort_order: Optional[str] = Query("desc", description="Sort order: 'asc' or 'desc'."),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    exact_count: bool = Query(False, description="Run an exact count instead of the cached approximate one."),
     qdrant: QdrantClient = Depends(get_qdrant_client),
     collection_name: str = Depends(get_active_collection)
 ):
     """
-    List images with pagination, filtering, and sorting options.
+    List images with keyset pagination, filtering, and sorting options.
+
+    Each page returns a ``next_cursor``; pass it back to get the next page
+    without Qdrant re-reading the earlier ones. ``total`` is an approximate
+    count cached per collection and filter (dropped whenever the collection
+    is written to) unless ``exact_count`` is set.
+    Payloads are projected to ``fields`` (the compact grid profile by default).
     """
-    offset = (page - 1) * per_page
+    projection = get_projection(fields)
 
     try:
         qdrant_filter = None
@@ -45,7 +146,7 @@ async def list_images(
                 must_conditions = []
                 for key, value in filter_dict.items():
                     if isinstance(value, dict) and "gte" in value and "lte" in value:
-                        must_conditions.append(FieldCondition(key=key, range=Range(gte=value["gte"], lte=value["lte"])))
+                        must_conditions.append(FieldCondition(key=key, range=payload_indexes.range_for(key, value["gte"], value["lte"])))
                     elif isinstance(value, list):
                         should_conditions = [FieldCondition(key=key, match={"value": v}) for v in value]
                         if should_conditions:
@@ -60,48 +161,76 @@ async def list_images(
                 logger.error(f"Error processing filters: {e}", exc_info=True)
                 raise HTTPException(status_code=400, detail=f"Error processing filters: {str(e)}")
 
+        # Use string direction as 'asc' or 'desc'
+        direction = sort_order.lower() if sort_order and sort_order.lower() in ("asc", "desc") else "desc"
         qdrant_order_by = None
         if sort_by:
-            # Use string direction as 'asc' or 'desc'
-            direction = sort_order.lower() if sort_order and sort_order.lower() in ("asc", "desc") else "desc"
+            try:
+                payload_indexes.ensure_order_index(qdrant, collection_name, sort_by)
+            except payload_indexes.NotSortableError as e:
+                raise HTTPException(status_code=400, detail=str(e))
             qdrant_order_by = OrderBy(key=sort_by, direction=direction)
-        
-        # Using scroll API for pagination
-        # Note: Qdrant's scroll API uses `offset` as a point ID to start from if `page_offset` is not None.
-        # For simple limit/offset pagination, it's often easier to use search with a null vector if not sorting by score,
-        # or use scroll with careful offset management. Here, we'll use the basic limit/offset approach with scroll.
-        # If sorting by a field other than score, `search` might be more direct with a `match_all: {}` query filter.
-        
-        scroll_request = ScrollRequest(
-            collection_name=collection_name,
-            scroll_filter=qdrant_filter,
-            limit=per_page,
-            offset=offset, # This offset for scroll is a numeric offset of points
-            with_payload=True,
-            with_vectors=False,
-            order_by=qdrant_order_by
-        )
-        
-        scroll_result = qdrant.scroll(**scroll_request.dict(exclude_none=True))
+
+        count_key = count_cache.filter_key(qdrant_filter)
+        listing = _listing_key(count_key, sort_by, direction)
+
+        position = None
+        if cursor:
+            position = _decode_cursor(cursor)
+            if position.get("k") != listing:
+                raise HTTPException(status_code=400, detail="Cursor was issued for different filters or sorting.")
+        elif page > 1:
+            # Legacy page numbers: skip the earlier pages reading ids (and the sort key) only
+            skipped, next_page_offset, has_more = _scroll_page(
+                qdrant, collection_name, qdrant_filter, qdrant_order_by, None,
+                (page - 1) * per_page, [sort_by] if sort_by else False,
+            )
+            position = _cursor_after(skipped, next_page_offset, sort_by, listing) if has_more else None
+
+        with_payload = projection.selector
+        strip_sort_key = bool(sort_by) and isinstance(with_payload, list) and sort_by not in with_payload
+        if strip_sort_key:
+            # The next cursor needs the sort value of the last point
+            with_payload = with_payload + [sort_by]
+        if (cursor or page > 1) and position is None:
+            # Past the last page
+            points, next_page_offset, has_more = [], None, False
+        else:
+            points, next_page_offset, has_more = _scroll_page(
+                qdrant, collection_name, qdrant_filter, qdrant_order_by, position, per_page, with_payload,
+            )
 
         results = []
-        for hit in scroll_result[0]: # scroll_result is a tuple (points, next_page_offset)
+        for hit in points:
+            payload = hit.payload or {}
+            selected = projection.select(payload)
+            if strip_sort_key:
+                selected = {k: v for k, v in selected.items() if k != sort_by}
             results.append({
                 "id": hit.id,
-                "payload": hit.payload
+                "payload": selected,
+                "thumbnail_url": thumbnail_url(hit.id, payload.get("file_hash")),
                 # No score in scroll results unless it was part of payload or used for sorting
             })
-        
-        # Get total count matching the filter for accurate pagination meta
-        count_result = qdrant.count(collection_name=collection_name, scroll_filter=qdrant_filter, exact=True)
-        total_hits = count_result.count
+
+        next_position = _cursor_after(points, next_page_offset, sort_by, listing, position) if has_more else None
+
+        if exact_count:
+            total_hits = qdrant.count(collection_name=collection_name, count_filter=qdrant_filter, exact=True).count
+        else:
+            total_hits = count_cache.image_counts.get_or_compute(
+                collection_name, count_key,
+                lambda: qdrant.count(collection_name=collection_name, count_filter=qdrant_filter, exact=False).count,
+            )
 
         return {
             "total": total_hits,
+            "total_is_exact": exact_count,
             "page": page,
             "per_page": per_page,
             "results": results,
-            "next_page_offset": scroll_result[1] # Can be used for more efficient subsequent scrolls
+            "next_cursor": _encode_cursor(next_position) if next_position else None,
+            "next_page_offset": next_page_offset, # Raw Qdrant offset of unsorted listings
         }
 
     except HTTPException:
@@ -113,32 +242,37 @@ async def list_images(
 @router.get("/{image_id}/thumbnail", summary="Get image thumbnail")
 async def get_image_thumbnail(
     image_id: str,
+    request: Request,
+    size: Optional[int] = Query(None, ge=1, description="Longest side in pixels; the nearest stored variant is served."),
     qdrant: QdrantClient = Depends(get_qdrant_client),
     collection_name: str = Depends(get_active_collection)
 ):
     """
     Get a thumbnail for a specific image by ID.
-    Returns the base64 thumbnail stored in Qdrant payload.
+    Served from the thumbnail store by the point's file_hash, falling back to
+    the base64 thumbnail of points ingested before the store existed.
     """
     try:
-        # Retrieve the point from Qdrant
+        # Only the hash and a possible legacy thumbnail are needed
         points = qdrant.retrieve(
             collection_name=collection_name,
             ids=[image_id],
-            with_payload=True,
+            with_payload=["file_hash", "thumbnail_base64"],
             with_vectors=False
         )
         
         if not points:
             raise HTTPException(status_code=404, detail=f"Image with ID {image_id} not found")
         
-        point = points[0]
-        payload = point.payload
+        payload = points[0].payload or {}
         
-        if not payload:
-            raise HTTPException(status_code=404, detail=f"No payload data found for image {image_id}")
+        # The id -> image mapping can change (re-ingest), so id URLs are only cached briefly
+        file_hash = payload.get("file_hash")
+        if file_hash and thumbnail_store.is_valid_hash(file_hash):
+            response = await thumbnail_response(request, file_hash, size, cache_control=ID_THUMBNAIL_CACHE_CONTROL)
+            if response is not None:
+                return response
         
-        # Get the base64 thumbnail from payload
         thumbnail_base64 = payload.get("thumbnail_base64")
         if not thumbnail_base64:
             raise HTTPException(status_code=404, detail=f"No thumbnail available for image {image_id}")
@@ -149,7 +283,7 @@ async def get_image_thumbnail(
             return Response(
                 content=thumbnail_bytes,
                 media_type="image/jpeg",
-                headers={"Cache-Control": "public, max-age=3600"}  # Cache for 1 hour
+                headers={"Cache-Control": ID_THUMBNAIL_CACHE_CONTROL}
             )
         except Exception as e:
             logger.error(f"Error decoding thumbnail for image {image_id}: {e}")
@@ -288,7 +422,8 @@ async def get_image_info(
             "height": payload.get("height"),
             "format": payload.get("format"),
             "mode": payload.get("mode"),
-            "has_thumbnail": bool(payload.get("thumbnail_base64"))
+            "has_thumbnail": bool(payload.get("thumbnail_base64")) or thumbnail_store.exists(payload.get("file_hash") or ""),
+            "thumbnail_url": f"/api/v1/images/{image_id}/thumbnail",
         }
         
         # Include tags if present
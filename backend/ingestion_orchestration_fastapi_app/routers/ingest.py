@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, File, UploadFile, Query
 from pydantic import BaseModel, Field
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import logging
 import os
 import uuid
@@ -21,8 +21,12 @@ import exifread
 import glob
 from datetime import datetime
 
+from .. import http_clients, thumbnail_store
+from ..utils import count_cache
 from ..dependencies import get_qdrant_client, get_active_collection, app_state
 from ..pipeline import manager as pipeline_manager
+from ..pipeline import caption_backfill
+from ..pipeline.utils import normalize_exif
 
 logger = logging.getLogger(__name__)
 
@@ -62,11 +66,12 @@ def update_batch_sizes(ml_batch_size: int = None, qdrant_batch_size: int = None)
         QDRANT_BATCH_SIZE = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", QDRANT_BATCH_SIZE))
     logger.info(f"[Batch Config] Updated ML_BATCH_SIZE={ML_BATCH_SIZE}, QDRANT_BATCH_SIZE={QDRANT_BATCH_SIZE}")
 
-# NEW ➡️  Feature flag to enable multipart uploads (pre-decoded PNG streaming)
+# NEW ➡️  Feature flag to enable multipart uploads (binary JPEG parts instead of
+# base64 PNG in JSON). Read by pipeline.gpu_worker as a shorthand for ML_TRANSPORT=multipart.
 USE_MULTIPART_UPLOAD = os.getenv("USE_MULTIPART_UPLOAD", "0") not in {"0", "false", "False"}
 
 # Initialize disk cache for deduplication
-cache = diskcache.Cache('.diskcache')
+cache = diskcache.Cache(os.environ.get("INGEST_CACHE_DIR", ".diskcache"))
 
 # Supported image file extensions
 SUPPORTED_EXTENSIONS = [
@@ -94,12 +99,18 @@ except Exception:  # pragma: no cover – includes ExempiLoadError
 
 class IngestRequest(BaseModel):
     directory_path: str = Field(..., description="Absolute path to the directory containing images")
+    include: Optional[List[str]] = Field(None, description="Glob patterns (relative path or file name) a file must match to be ingested")
+    exclude: Optional[List[str]] = Field(None, description="Glob patterns for files and directories to skip")
+    rescan_unchanged: bool = Field(False, description="Re-read files even if their size and mtime match the last ingest")
 
 class JobResponse(BaseModel):
     job_id: str
     status: str
     message: str
 
+class CaptionBackfillRequest(BaseModel):
+    source: str = Field("thumbnail", description="Image sent to the captioning model: the stored 'thumbnail' or the 'original' file, downsized")
+
 @router.post("/", response_model=JobResponse)
 async def start_ingestion(
     request: IngestRequest,
@@ -123,6 +134,9 @@ async def start_ingestion(
         background_tasks=background_tasks,
         qdrant_client=qdrant_client,
         caption=caption,
+        include_globs=request.include,
+        exclude_globs=request.exclude,
+        skip_unchanged=not request.rescan_unchanged,
     )
     return JobResponse(job_id=job_id, status="started", message="Ingestion job started successfully.")
 
@@ -147,6 +161,9 @@ async def start_ingestion_from_path(
         background_tasks=background_tasks,
         qdrant_client=qdrant_client,
         caption=caption,
+        include_globs=request.include,
+        exclude_globs=request.exclude,
+        skip_unchanged=not request.rescan_unchanged,
     )
     return JobResponse(job_id=job_id, status="started", message="Ingestion scan started successfully.")
 
@@ -192,6 +209,8 @@ async def upload_and_ingest_files(
         background_tasks=background_tasks,
         qdrant_client=qdrant_client,
         caption=caption,
+        # Upload directories are unique per request, indexing them would only grow the index
+        skip_unchanged=False,
     )
     
     # The cleanup will be handled by the background task associated with the request that started the pipeline
@@ -204,6 +223,29 @@ async def upload_and_ingest_files(
         message=f"Started ingestion for {len(files)} uploaded files."
     )
 
+@router.post("/captions/backfill", response_model=JobResponse)
+async def start_caption_backfill(
+    background_tasks: BackgroundTasks,
+    request: CaptionBackfillRequest = CaptionBackfillRequest(),
+    qdrant_client: QdrantClient = Depends(get_qdrant_client),
+    collection_name: str = Depends(get_active_collection),
+):
+    """
+    Starts a background job that captions every point of the active collection
+    without a caption (e.g. ingested with ``caption=false``). Progress is
+    reported by ``GET /status/{job_id}`` like an ingestion job.
+    """
+    try:
+        job_id = await caption_backfill.start_caption_backfill(
+            collection_name=collection_name,
+            background_tasks=background_tasks,
+            qdrant_client=qdrant_client,
+            source=request.source,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JobResponse(job_id=job_id, status="started", message="Caption backfill started.")
+
 @router.get("/status/{job_id}")
 async def get_job_status(job_id: str):
     """
@@ -218,9 +260,14 @@ async def get_job_status(job_id: str):
         "status": job_ctx.status.value,
         "progress": job_ctx.progress,
         "total_files": job_ctx.total_files,
+        "total_bytes": job_ctx.total_bytes,
+        "scan_complete": job_ctx.scan_complete,
+        "unchanged_files": job_ctx.unchanged_files,
         "processed_files": job_ctx.processed_files,
         "cached_files": job_ctx.cached_files,
         "failed_files": job_ctx.failed_files,
+        "captions_skipped": job_ctx.captions_skipped,
+        "stage_stats": {name: stats.as_dict() for name, stats in job_ctx.stage_stats.items()},
         "start_time": datetime.fromtimestamp(job_ctx.start_time).isoformat() if job_ctx.start_time else None,
         "end_time": datetime.fromtimestamp(job_ctx.end_time).isoformat() if job_ctx.end_time else None,
         "logs": job_ctx.logs[-100:],  # Return last 100 log entries
@@ -395,6 +442,8 @@ def extract_image_metadata(file_path: str) -> Dict[str, Any]:
                 except Exception as ex:
                     logger.debug(f"EXIF extraction for RAW file {file_path} failed: {ex}")
 
+                metadata.update(normalize_exif(metadata))
+
                 # Tags
                 kw = _extract_keyword_tags(file_path)
                 if kw:
@@ -433,6 +482,8 @@ def extract_image_metadata(file_path: str) -> Dict[str, Any]:
             except Exception as ex:
                 logger.debug(f"EXIF extraction with exifread failed for {file_path}: {ex}")
 
+            metadata.update(normalize_exif(metadata))
+
             # Tags
             kw = _extract_keyword_tags(file_path)
             if kw:
@@ -442,8 +493,8 @@ def extract_image_metadata(file_path: str) -> Dict[str, Any]:
         logger.warning(f"Could not extract metadata from {file_path}: {e}")
         return {"width": 0, "height": 0, "format": "unknown", "mode": "unknown"}
 
-def create_thumbnail_base64(image_path: str, size: tuple = (200, 200)) -> str:
-    """Create a thumbnail and return as base64 string."""
+def store_thumbnail(image_path: str, file_hash: str) -> bool:
+    """Write the thumbnail variants of an image to the thumbnail store; ``False`` on failure."""
     try:
         img: Image.Image
         # Use rawpy for RAW image formats
@@ -456,23 +507,11 @@ def create_thumbnail_base64(image_path: str, size: tuple = (200, 200)) -> str:
             # Use Pillow for standard image formats
             img = Image.open(image_path)
 
-        # Convert to RGB if necessary (e.g., for PNG with transparency, palette-based images)
-        if img.mode in ('RGBA', 'LA', 'P'):
-            img = img.convert('RGB')
-        
-        # Create thumbnail in-place
-        img.thumbnail(size, Image.Resampling.LANCZOS)
-        
-        # Save to an in-memory bytes buffer
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='JPEG', quality=85) # Save as JPEG for web efficiency
-        thumbnail_bytes = img_byte_arr.getvalue()
-        
-        # Return base64 encoded string
-        return base64.b64encode(thumbnail_bytes).decode('utf-8')
+        thumbnail_store.store_image(file_hash, img)
+        return True
     except Exception as e:
         logger.warning(f"Could not create thumbnail for {image_path}: {e}")
-        return ""
+        return False
 
 async def send_batch_to_ml_service(batch_items: list[dict]) -> list[dict]:
     """Send batch to ML service for embedding and captioning with robust error handling."""
@@ -494,19 +533,16 @@ async def send_batch_to_ml_service(batch_items: list[dict]) -> list[dict]:
     logger.info(f"Sending batch of {len(batch_items)} images to ML service with {timeout_seconds:.1f}s timeout")
     
     try:
-        # Use more robust HTTP configuration
-        async with httpx.AsyncClient(
+        # Shared pooled client; only the timeout is specific to this request
+        response = await http_clients.get_client(ML_SERVICE_URL).post(
+            f"{ML_SERVICE_URL}/api/v1/batch_embed_and_caption",
+            json=batch_data,
             timeout=httpx.Timeout(timeout_seconds, read=timeout_seconds, write=60.0),
-            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5)
-        ) as client:
-            response = await client.post(
-                f"{ML_SERVICE_URL}/api/v1/batch_embed_and_caption",
-                json=batch_data
-            )
-            response.raise_for_status()
-            results = response.json()["results"]
-            logger.info(f"Successfully received ML results for {len(results)} images")
-            return results
+        )
+        response.raise_for_status()
+        results = response.json()["results"]
+        logger.info(f"Successfully received ML results for {len(results)} images")
+        return results
             
     except httpx.TimeoutException as e:
         error_msg = f"ML service timeout after {timeout_seconds:.1f}s for batch of {len(batch_items)} images"
@@ -580,27 +616,26 @@ async def process_directory(job_id: str, directory_path: str, collection_name: s
         }
     }
 
+    ml_client = http_clients.get_client(ML_SERVICE_URL)
     try:
         # Warm up ML service
         logger.info(f"Job {job_id}: Warming up ML service...")
         try:
-            async with httpx.AsyncClient(timeout=60.0) as warmup_client:
-                warmup_response = await warmup_client.post(f"{ML_SERVICE_URL}/api/v1/warmup")
-                warmup_response.raise_for_status()
-                warmup_result = warmup_response.json()
-                logger.info(f"Job {job_id}: ML warmup result: {warmup_result}")
+            warmup_response = await ml_client.post(f"{ML_SERVICE_URL}/api/v1/warmup", timeout=60.0)
+            warmup_response.raise_for_status()
+            warmup_result = warmup_response.json()
+            logger.info(f"Job {job_id}: ML warmup result: {warmup_result}")
         except Exception as warmup_error:
             logger.warning(f"Job {job_id}: ML warmup failed: {warmup_error}")
 
         # Get ML service capabilities
         effective_batch_size = 32  # Conservative default
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                _resp = await client.get(f"{ML_SERVICE_URL}/api/v1/capabilities")
-                _resp.raise_for_status()
-                service_safe_batch = int(_resp.json().get("safe_clip_batch", 32))
-                effective_batch_size = max(1, min(service_safe_batch, ML_BATCH_SIZE, 64))
-                logger.info(f"Job {job_id}: Using ML batch size {effective_batch_size} (service reports {service_safe_batch})")
+            _resp = await ml_client.get(f"{ML_SERVICE_URL}/api/v1/capabilities", timeout=10.0)
+            _resp.raise_for_status()
+            service_safe_batch = int(_resp.json().get("safe_clip_batch", 32))
+            effective_batch_size = max(1, min(service_safe_batch, ML_BATCH_SIZE, 64))
+            logger.info(f"Job {job_id}: Using ML batch size {effective_batch_size} (service reports {service_safe_batch})")
         except Exception as e:
             logger.warning(f"Job {job_id}: Failed to get ML capabilities: {e}")
 
@@ -730,7 +765,7 @@ async def process_directory(job_id: str, directory_path: str, collection_name: s
                         if cached_result:
                             # Cache hit - create point directly
                             metadata = await asyncio.to_thread(extract_image_metadata, file_path)
-                            thumbnail_base64 = await asyncio.to_thread(create_thumbnail_base64, file_path)
+                            await asyncio.to_thread(store_thumbnail, file_path, file_hash)
                             
                             point = PointStruct(
                                 id=str(uuid.uuid4()),
@@ -740,7 +775,6 @@ async def process_directory(job_id: str, directory_path: str, collection_name: s
                                     "full_path": file_path,
                                     "file_hash": file_hash,
                                     "caption": cached_result.get("caption", ""),
-                                    "thumbnail_base64": thumbnail_base64,
                                     **metadata
                                 }
                             )
@@ -824,7 +858,7 @@ async def process_directory(job_id: str, directory_path: str, collection_name: s
                             )
                             # Extract metadata and create point
                             metadata = await asyncio.to_thread(extract_image_metadata, src_item["full_path"])
-                            thumbnail_base64 = await asyncio.to_thread(create_thumbnail_base64, src_item["full_path"])
+                            await asyncio.to_thread(store_thumbnail, src_item["full_path"], src_item["file_hash"])
                             point = PointStruct(
                                 id=str(uuid.uuid4()),
                                 vector=ml_result["embedding"],
@@ -833,7 +867,6 @@ async def process_directory(job_id: str, directory_path: str, collection_name: s
                                     "full_path": src_item["full_path"],
                                     "file_hash": src_item["file_hash"],
                                     "caption": ml_result.get("caption", ""),
-                                    "thumbnail_base64": thumbnail_base64,
                                     **metadata,
                                 }
                             )
@@ -933,6 +966,7 @@ async def process_directory(job_id: str, directory_path: str, collection_name: s
                     
                     logger.info(f"Job {job_id}: Upserted final batch of {len(batch_points)} points")
                 
+                count_cache.image_counts.invalidate(collection_name)
                 job_status[job_id]["stage_status"]["db_upserter"] = "completed"
                 logger.info(f"Job {job_id}: Database Upserter completed")
                 
@@ -974,10 +1008,9 @@ async def process_directory(job_id: str, directory_path: str, collection_name: s
 
         # Cool down ML service
         try:
-            async with httpx.AsyncClient(timeout=30.0) as cooldown_client:
-                cooldown_response = await cooldown_client.post(f"{ML_SERVICE_URL}/api/v1/cooldown")
-                cooldown_response.raise_for_status()
-                logger.info(f"Job {job_id}: ML service cooled down")
+            cooldown_response = await ml_client.post(f"{ML_SERVICE_URL}/api/v1/cooldown", timeout=30.0)
+            cooldown_response.raise_for_status()
+            logger.info(f"Job {job_id}: ML service cooled down")
         except Exception as cooldown_error:
             logger.warning(f"Job {job_id}: ML cooldown failed: {cooldown_error}")
 
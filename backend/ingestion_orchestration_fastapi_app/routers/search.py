@@ -3,13 +3,16 @@ from qdrant_client import QdrantClient, models
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional, Union
 import logging
-import httpx
 import os
 import base64
 import json
 
 # Import the new dependency getters, NOT the main app or old dependencies
+from .. import http_clients, payload_indexes
 from ..dependencies import get_qdrant_client, get_active_collection
+from ..utils import text_cache
+from ..utils.payload_fields import FieldProjection, parse_fields
+from .thumbnails import thumbnail_url
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +29,14 @@ ML_SERVICE_URL = (
     or os.getenv("ML_INFERENCE_SERVICE_URL", "http://localhost:8001")
 )
 
+# Repeated queries skip the ML round trip. Entries are keyed by the CLIP model
+# the ML service last reported, and the cache is cleared when that model changes
+# (SEARCH_TEXT_CACHE_SIZE / SEARCH_TEXT_CACHE_TTL_S).
+query_embedding_cache = text_cache.TextEmbeddingCache.from_env("SEARCH_TEXT_CACHE", max_size=1024, ttl_s=600)
+_query_model_name: Optional[str] = None
+
+FIELDS_DESCRIPTION = "Payload keys to return: 'compact' (default), 'full', 'filename,caption,...' or '-exif_MakerNote,...'"
+
 # --- Pydantic Models for API validation and documentation ---
 
 class SearchRequest(BaseModel):
@@ -33,6 +44,7 @@ class SearchRequest(BaseModel):
     limit: int = Field(default=10, ge=1, le=100)
     offset: int = Field(default=0, ge=0)
     filters: Optional[Dict[str, Any]] = Field(default=None, description="Optional metadata filters for hybrid search")
+    fields: Optional[Union[str, List[str]]] = Field(default=None, description=FIELDS_DESCRIPTION)
 
 class SearchResultItem(BaseModel):
     id: Union[str, int]
@@ -46,6 +58,24 @@ class SearchResponse(BaseModel):
     results: List[SearchResultItem]
 
 
+def get_projection(fields: Union[None, str, List[str]]) -> FieldProjection:
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid fields: {e}")
+
+
+def to_result_item(hit: Any, projection: FieldProjection) -> SearchResultItem:
+    payload = hit.payload or {}
+    return SearchResultItem(
+        id=hit.id,
+        score=hit.score,
+        payload=projection.select(payload),
+        filename=payload.get("filename"),
+        thumbnail_url=thumbnail_url(hit.id, payload.get("file_hash")),
+    )
+
+
 # --- Helper function for building Qdrant filters ---
 def build_qdrant_filter(filters: Optional[Dict[str, Any]]) -> Optional[models.Filter]:
     """Convert simple filter dict to Qdrant Filter object."""
@@ -58,7 +88,7 @@ def build_qdrant_filter(filters: Optional[Dict[str, Any]]) -> Optional[models.Fi
             # Range filter
             must_conditions.append(models.FieldCondition(
                 key=key, 
-                range=models.Range(gte=value["gte"], lte=value["lte"])
+                range=payload_indexes.range_for(key, value["gte"], value["lte"])
             ))
         elif isinstance(value, list):
             # Multiple values - use SHOULD for any match
@@ -78,6 +108,31 @@ def build_qdrant_filter(filters: Optional[Dict[str, Any]]) -> Optional[models.Fi
     return models.Filter(must=must_conditions) if must_conditions else None
 
 
+async def embed_query_text(query: str) -> List[float]:
+    """CLIP embedding of a search query, served from the query cache when possible."""
+    global _query_model_name
+    model_name = _query_model_name or ""
+    cached = query_embedding_cache.get(model_name, query)
+    if cached is not None:
+        return cached
+
+    client = http_clients.get_client(ML_SERVICE_URL)
+    response = await client.post(
+        f"{ML_SERVICE_URL}/api/v1/embed_text",
+        json={"text": query, "description": f"Search query: {query}"}
+    )
+    response.raise_for_status()
+    data = response.json()
+
+    reported = data.get("model_name") or ""
+    if reported != model_name:
+        # The ML service switched models: earlier vectors live in another space
+        query_embedding_cache.clear()
+        _query_model_name = reported
+    query_embedding_cache.put(reported, query, data["embedding"])
+    return data["embedding"]
+
+
 # --- API Endpoints ---
 
 @router.post("", response_model=SearchResponse, summary="Search images by text query")
@@ -92,18 +147,16 @@ async def search_images_by_text(
     1. Encodes the text query into a vector using the ML service.
     2. Searches for the most similar vectors in the specified Qdrant collection.
     3. Optionally applies metadata filters for hybrid search.
+
+    Only the payload keys selected by ``fields`` are read from Qdrant; thumbnails
+    are returned as ``thumbnail_url``.
     """
+    projection = get_projection(search_request.fields)
     logger.info(f"Searching in collection '{collection_name}' for: '{search_request.query}' with filters: {search_request.filters}")
 
-    # 1. Encode the text query into a vector using the ML service
+    # 1. Encode the text query into a vector using the ML service (or the query cache)
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{ML_SERVICE_URL}/api/v1/embed_text",
-                json={"text": search_request.query, "description": f"Search query: {search_request.query}"}
-            )
-            response.raise_for_status()
-            query_vector = response.json()["embedding"]
+        query_vector = await embed_query_text(search_request.query)
     except Exception as e:
         logger.error(f"Failed to encode query '{search_request.query}': {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to encode query: {e}")
@@ -118,7 +171,7 @@ async def search_images_by_text(
             query_vector=query_vector,
             limit=search_request.limit,
             offset=search_request.offset,
-            with_payload=True,  # Ensure we get metadata back
+            with_payload=projection.selector,
             query_filter=query_filter  # Add hybrid search support
         )
     except Exception as e:
@@ -128,16 +181,7 @@ async def search_images_by_text(
         raise HTTPException(status_code=404, detail=f"Search failed. Collection '{collection_name}' may not exist or Qdrant is down.")
 
     # 4. Format the results into our response model
-    results = [
-        SearchResultItem(
-            id=hit.id,
-            score=hit.score,
-            payload=hit.payload,
-            filename=hit.payload.get("filename") if hit.payload else None,
-            thumbnail_url=f"/api/v1/images/{hit.id}/thumbnail" # Example URL
-        )
-        for hit in hits
-    ]
+    results = [to_result_item(hit, projection) for hit in hits]
     
     logger.info(f"Found {len(results)} results for query.")
     return SearchResponse(results=results)
@@ -148,6 +192,7 @@ async def search_images_by_image(
     limit: int = Query(10, ge=1, le=100),
     offset: int = Query(0, ge=0),
     filters: Optional[str] = Query(None, description="JSON string for metadata filters"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     qdrant_client: QdrantClient = Depends(get_qdrant_client),
     collection_name: str = Depends(get_active_collection)
 ):
@@ -160,6 +205,8 @@ async def search_images_by_image(
     3. Perform a vector search in the active Qdrant collection with that
        embedding and optional metadata filters.
     """
+    projection = get_projection(fields)
+
     # 1. Read file into memory
     image_bytes = await file.read()
     if not image_bytes:
@@ -178,19 +225,18 @@ async def search_images_by_image(
     # 3. Get embedding from ML service
     try:
         image_b64 = base64.b64encode(image_bytes).decode()
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"{ML_SERVICE_URL}/api/v1/embed",
-                json={
-                    "image_base64": image_b64,
-                    "filename": file.filename or "uploaded_image"
-                },
-                timeout=120.0
-            )
-            resp.raise_for_status()
-            embedding = resp.json().get("embedding")
-            if embedding is None:
-                raise ValueError("ML service did not return an embedding")
+        resp = await http_clients.get_client(ML_SERVICE_URL).post(
+            f"{ML_SERVICE_URL}/api/v1/embed",
+            json={
+                "image_base64": image_b64,
+                "filename": file.filename or "uploaded_image"
+            },
+            timeout=120.0
+        )
+        resp.raise_for_status()
+        embedding = resp.json().get("embedding")
+        if embedding is None:
+            raise ValueError("ML service did not return an embedding")
     except Exception as e:
         logger.error(f"Failed to obtain embedding from ML service: {e}")
         raise HTTPException(status_code=502, detail="Failed to generate embedding for uploaded image")
@@ -202,22 +248,13 @@ async def search_images_by_image(
             query_vector=embedding,
             limit=limit,
             offset=offset,
-            with_payload=True,
+            with_payload=projection.selector,
             query_filter=query_filter  # Add hybrid search support
         )
     except Exception as e:
         logger.error(f"Vector search failed: {e}")
         raise HTTPException(status_code=500, detail="Vector search failed")
 
-    results = [
-        SearchResultItem(
-            id=hit.id,
-            score=hit.score,
-            payload=hit.payload,
-            filename=hit.payload.get("filename") if hit.payload else None,
-            thumbnail_url=f"/api/v1/images/{hit.id}/thumbnail"
-        )
-        for hit in hits
-    ]
+    results = [to_result_item(hit, projection) for hit in hits]
 
     return SearchResponse(results=results)
@@ -0,0 +1,162 @@
+from fastapi import APIRouter, HTTPException, Query, Depends, Request
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Filter, IsEmptyCondition, PayloadField
+from typing import Dict, Any, List, Optional
+import asyncio
+import base64
+import logging
+import os
+
+from .. import thumbnail_store
+from ..dependencies import get_qdrant_client, get_active_collection
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/v1/thumbnails", tags=["thumbnails"])
+
+# Content-addressed variants never change, so browsers and proxies may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+THUMBNAIL_BATCH_MAX = int(os.environ.get("THUMBNAIL_BATCH_MAX", "500"))
+MIGRATION_SCROLL_LIMIT = 256
+
+
+def thumbnail_url(point_id: Any, file_hash: Optional[str] = None, size: Optional[int] = None) -> str:
+    """URL of a point's thumbnail: the immutable content-hash URL when the hash is known, else the id URL."""
+    if file_hash and thumbnail_store.is_valid_hash(file_hash):
+        url = f"/api/v1/thumbnails/{file_hash}"
+        return f"{url}?size={size}" if size else url
+    return f"/api/v1/images/{point_id}/thumbnail"
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates or "*" in candidates
+
+
+async def thumbnail_response(
+    request: Request,
+    file_hash: str,
+    size: Optional[int] = None,
+    cache_control: str = IMMUTABLE_CACHE_CONTROL,
+) -> Optional[Response]:
+    """JPEG response for a stored thumbnail (``304`` when the client's ETag matches); ``None`` if not stored."""
+    stored = await asyncio.to_thread(thumbnail_store.read, file_hash, size)
+    if stored is None:
+        return None
+    variant_size, data = stored
+    etag = thumbnail_store.etag(file_hash, variant_size)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+
+@router.get("/{file_hash}", summary="Get a thumbnail by content hash")
+async def get_thumbnail(
+    file_hash: str,
+    request: Request,
+    size: Optional[int] = Query(None, ge=1, description="Longest side in pixels; the nearest stored variant is served."),
+):
+    """
+    Serve a thumbnail from the content-addressed store.
+
+    The URL is keyed by the image's ``file_hash``, so the response is
+    immutable and carries a strong ETag; conditional requests get ``304``.
+    """
+    if not thumbnail_store.is_valid_hash(file_hash):
+        raise HTTPException(status_code=404, detail=f"No thumbnail for {file_hash}")
+    response = await thumbnail_response(request, file_hash, size)
+    if response is None:
+        raise HTTPException(status_code=404, detail=f"No thumbnail for {file_hash}")
+    return response
+
+
+class ThumbnailBatchRequest(BaseModel):
+    hashes: List[str] = Field(..., description="Content hashes (payload file_hash) of the images")
+    size: Optional[int] = Field(None, ge=1, description="Longest side in pixels")
+
+
+@router.post("/batch", summary="Get many thumbnails in one request")
+async def get_thumbnails_batch(request: ThumbnailBatchRequest) -> Dict[str, Any]:
+    """
+    Return base64 JPEG thumbnails for a list of content hashes, for views such
+    as the UMAP explorer that draw hundreds of previews at once.
+    """
+    if len(request.hashes) > THUMBNAIL_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {THUMBNAIL_BATCH_MAX} thumbnails per request (got {len(request.hashes)})",
+        )
+    size = thumbnail_store.nearest_size(request.size)
+    found = await asyncio.to_thread(thumbnail_store.read_many_base64, request.hashes, size)
+    return {
+        "size": size,
+        "thumbnails": found,
+        "missing": [file_hash for file_hash in request.hashes if file_hash not in found],
+    }
+
+
+def _migrate_points(points) -> Dict[str, List]:
+    """Store the legacy payload thumbnails of ``points``; returns the migrated ids and the ones that failed."""
+    migrated, failed = [], []
+    for point in points:
+        payload = point.payload or {}
+        file_hash = payload.get("file_hash")
+        try:
+            thumbnail_store.store_encoded(file_hash, base64.b64decode(payload["thumbnail_base64"]))
+            migrated.append(point.id)
+        except Exception as e:
+            logger.warning(f"Could not migrate thumbnail of point {point.id}: {e}")
+            failed.append(point.id)
+    return {"migrated": migrated, "failed": failed}
+
+
+@router.post("/migrate", summary="Move payload thumbnails of the active collection into the thumbnail store")
+async def migrate_payload_thumbnails(
+    qdrant: QdrantClient = Depends(get_qdrant_client),
+    collection_name: str = Depends(get_active_collection),
+) -> Dict[str, Any]:
+    """
+    One-off migration for collections ingested before the thumbnail store:
+    every point that still carries ``thumbnail_base64`` has it written to the
+    store under its ``file_hash`` and the key removed from its payload.
+    Points whose thumbnail cannot be stored keep it, so the call is safe to repeat.
+    """
+    has_legacy_thumbnail = Filter(
+        must_not=[IsEmptyCondition(is_empty=PayloadField(key="thumbnail_base64"))]
+    )
+    migrated = failed = 0
+    offset = None
+    try:
+        while True:
+            points, offset = qdrant.scroll(
+                collection_name=collection_name,
+                scroll_filter=has_legacy_thumbnail,
+                limit=MIGRATION_SCROLL_LIMIT,
+                offset=offset,
+                with_payload=["file_hash", "thumbnail_base64"],
+                with_vectors=False,
+            )
+            if points:
+                result = await asyncio.to_thread(_migrate_points, points)
+                if result["migrated"]:
+                    qdrant.delete_payload(
+                        collection_name=collection_name,
+                        keys=["thumbnail_base64"],
+                        points=result["migrated"],
+                    )
+                migrated += len(result["migrated"])
+                failed += len(result["failed"])
+            if offset is None:
+                break
+    except Exception as e:
+        logger.error(f"Thumbnail migration of {collection_name} failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Thumbnail migration failed: {str(e)}")
+
+    logger.info(f"Migrated {migrated} payload thumbnails of {collection_name} to the thumbnail store ({failed} failed)")
+    return {"collection": collection_name, "migrated": migrated, "failed": failed}
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, Query, HTTPException
 from typing import List, Dict, Any, Optional
 from ..dependencies import get_qdrant_client, get_active_collection
+from .. import thumbnail_store
+from .thumbnails import thumbnail_url
 from qdrant_client import QdrantClient
 import os
 from qdrant_client.http.models import PointStruct, Filter, FieldCondition, MatchValue
@@ -30,6 +32,21 @@ from sklearn.metrics import silhouette_score
 
 router = APIRouter(prefix="/umap", tags=["umap"])
 
+# Only what the scatter plot draws; thumbnails are fetched separately by URL
+PROJECTION_PAYLOAD_FIELDS = ["filename", "caption", "file_hash", "thumbnail_base64"]
+PROJECTION_THUMBNAIL_SIZE = thumbnail_store.nearest_size(128)
+
+def _thumbnail_fields(point_id, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """``file_hash`` and ``thumbnail_url`` for the point, plus the inline base64 of legacy points not migrated to the store."""
+    file_hash = payload.get("file_hash")
+    fields: Dict[str, Any] = {
+        "file_hash": file_hash,
+        "thumbnail_url": thumbnail_url(point_id, file_hash, PROJECTION_THUMBNAIL_SIZE),
+    }
+    if payload.get("thumbnail_base64"):
+        fields["thumbnail_base64"] = payload["thumbnail_base64"]
+    return fields
+
 def log_performance_metrics(operation: str, duration: float, data_shape: tuple, cuda_enabled: bool):
     """Log performance metrics for monitoring acceleration benefits."""
     logger.info(f"Performance: {operation} - {duration:.2f}s - Shape: {data_shape} - CUDA: {cuda_enabled}")
@@ -62,7 +79,7 @@ async def umap_projection(
 
     The endpoint randomly samples up to *sample_size* points from the active collection,
     runs UMAP (n_components=2, metric='cosine') on their vectors, and returns a list of
-    objects: `{id, x, y, thumbnail_base64}`.  This allows the frontend to render an
+    objects: `{id, x, y, thumbnail_url}`.  This allows the frontend to render an
     interactive 2-D layout.
     """
     try:
@@ -81,7 +98,7 @@ async def umap_projection(
             batch, next_cursor = qdrant.scroll(
                 collection_name=collection_name,
                 with_vectors=True,
-                with_payload=True,
+                with_payload=PROJECTION_PAYLOAD_FIELDS,
                 limit=fetch_limit,
                 offset=next_cursor,
             )
@@ -109,7 +126,7 @@ async def umap_projection(
                 "id": ids[idx],
                 "x": float(embedding_2d[idx, 0]),
                 "y": float(embedding_2d[idx, 1]),
-                "thumbnail_base64": payload.get("thumbnail_base64"),
+                **_thumbnail_fields(ids[idx], payload),
                 "filename": payload.get("filename"),
                 "caption": payload.get("caption")
             })
@@ -146,7 +163,7 @@ async def umap_projection_with_clustering(
         search_result = qdrant.scroll(
             collection_name=collection_name,
             with_vectors=True,
-            with_payload=True,
+            with_payload=PROJECTION_PAYLOAD_FIELDS,
             limit=sample_size,
         )
         points, _ = search_result
@@ -185,7 +202,7 @@ async def umap_projection_with_clustering(
                 "y": float(embedding_2d[idx, 1]),
                 "cluster_id": payload["cluster_id"],
                 "is_outlier": payload["is_outlier"],
-                "thumbnail_base64": payload.get("thumbnail_base64"),
+                **_thumbnail_fields(ids[idx], payload),
                 "filename": payload.get("filename"),
                 "caption": payload.get("caption")
             })
@@ -0,0 +1,141 @@
+"""
+Content-addressed on-disk thumbnail store.
+
+Thumbnails are JPEG files keyed by the image's content hash (the ``file_hash``
+every point's payload already carries), sharded by hash prefix:
+``THUMBNAIL_STORE_DIR/<size>/<ab>/<cd>/<hash>.jpg``. Every image gets one
+variant per ``THUMBNAIL_SIZES`` entry (longest side in pixels), written by the
+decode workers at ingest, so Qdrant payloads no longer carry base64 JPEGs.
+
+Because the key is the content hash, a stored variant never changes: the HTTP
+layer (``routers/thumbnails.py``) serves it with a strong ETag and an
+immutable ``Cache-Control``. Writes go through a temporary file and
+``os.replace``, so concurrent decode processes can store the same image safely.
+"""
+import base64
+import io
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_STORE_DIR = os.environ.get("THUMBNAIL_STORE_DIR", ".thumbnails")
+# Longest side of each stored variant
+THUMBNAIL_SIZES: Tuple[int, ...] = tuple(sorted({
+    int(size) for size in os.environ.get("THUMBNAIL_SIZES", "128,256,512").split(",") if size.strip()
+}))
+# Variant served when a request does not ask for a size
+DEFAULT_THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_DEFAULT_SIZE", "256"))
+THUMBNAIL_JPEG_QUALITY = int(os.environ.get("THUMBNAIL_JPEG_QUALITY", "85"))
+
+# sha256 hex digests (and other hex content hashes); anything else could escape the store directory
+_HASH_PATTERN = re.compile(r"^[0-9a-f]{16,128}$")
+
+
+def is_valid_hash(file_hash: str) -> bool:
+    return bool(file_hash) and bool(_HASH_PATTERN.match(file_hash))
+
+
+def nearest_size(size: Optional[int] = None, sizes: Sequence[int] = THUMBNAIL_SIZES) -> int:
+    """Smallest stored variant at least ``size`` pixels (the largest if none is)."""
+    if not size:
+        size = DEFAULT_THUMBNAIL_SIZE
+    for candidate in sizes:
+        if candidate >= size:
+            return candidate
+    return sizes[-1]
+
+
+def path_for(file_hash: str, size: int, root: Optional[str] = None) -> Path:
+    if not is_valid_hash(file_hash):
+        raise ValueError(f"Not a content hash: {file_hash!r}")
+    return Path(root or THUMBNAIL_STORE_DIR) / str(size) / file_hash[:2] / file_hash[2:4] / f"{file_hash}.jpg"
+
+
+def etag(file_hash: str, size: int) -> str:
+    return f'"{file_hash}-{size}"'
+
+
+def exists(file_hash: str, size: Optional[int] = None, root: Optional[str] = None) -> bool:
+    return is_valid_hash(file_hash) and path_for(file_hash, nearest_size(size), root).is_file()
+
+
+def render_variants(
+    image: Image.Image,
+    sizes: Sequence[int] = THUMBNAIL_SIZES,
+    quality: int = THUMBNAIL_JPEG_QUALITY,
+) -> Dict[int, bytes]:
+    """JPEG bytes of ``image`` fitted into each size (never upscaled); largest is resized first and reused."""
+    variants: Dict[int, bytes] = {}
+    source = image if image.mode == "RGB" else image.convert("RGB")
+    for size in sorted(sizes, reverse=True):
+        source = source.copy()
+        source.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        source.save(buffer, format="JPEG", quality=quality)
+        variants[size] = buffer.getvalue()
+    return variants
+
+
+def _write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp_path, path)
+
+
+def store_image(
+    file_hash: str,
+    image: Image.Image,
+    root: Optional[str] = None,
+    sizes: Sequence[int] = THUMBNAIL_SIZES,
+) -> bool:
+    """Store every variant of ``image`` that is not stored yet; ``False`` when all already were."""
+    missing = [size for size in sizes if not path_for(file_hash, size, root).is_file()]
+    if not missing:
+        return False
+    for size, data in render_variants(image, missing).items():
+        _write(path_for(file_hash, size, root), data)
+    return True
+
+
+def store_encoded(file_hash: str, data: bytes, root: Optional[str] = None) -> bool:
+    """Store variants from an encoded image, e.g. a legacy payload thumbnail (sizes above it stay at its size)."""
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        return store_image(file_hash, image, root)
+
+
+def read(file_hash: str, size: Optional[int] = None, root: Optional[str] = None) -> Optional[Tuple[int, bytes]]:
+    """``(variant size, JPEG bytes)`` closest to ``size``, falling back to other stored variants; ``None`` if none."""
+    if not is_valid_hash(file_hash):
+        return None
+    wanted = nearest_size(size)
+    # The requested variant, then larger ones (downscaled by the browser), then smaller ones
+    order = [wanted] + [s for s in THUMBNAIL_SIZES if s > wanted] + [s for s in reversed(THUMBNAIL_SIZES) if s < wanted]
+    for candidate in order:
+        try:
+            return candidate, path_for(file_hash, candidate, root).read_bytes()
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def read_many_base64(
+    file_hashes: Iterable[str],
+    size: Optional[int] = None,
+    root: Optional[str] = None,
+) -> Dict[str, str]:
+    """Base64 JPEGs of the stored hashes among ``file_hashes``; missing ones are left out."""
+    found: Dict[str, str] = {}
+    for file_hash in file_hashes:
+        stored = read(file_hash, size, root)
+        if stored is not None:
+            found[file_hash] = base64.b64encode(stored[1]).decode("ascii")
+    return found
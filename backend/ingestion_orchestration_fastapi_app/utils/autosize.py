@@ -1,7 +1,8 @@
 import os
 import logging
 import psutil
-import httpx
+
+from .. import http_clients
 
 CAPABILITIES_FETCHED = False
 
@@ -12,19 +13,18 @@ async def autosize_batches(ml_url: str) -> None:
     safe_clip = None
     safe_batch = None
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            r = await client.get(f"{ml_url}/api/v1/capabilities")
-            r.raise_for_status()
-            caps = r.json()
-            safe_blip = caps.get("SAFE_BLIP_BATCH_SIZE") or caps.get("safe_blip_batch")
-            safe_clip = caps.get("SAFE_CLIP_BATCH_SIZE") or caps.get("safe_clip_batch")
-            safe_batch = caps.get("safe_batch_size") or caps.get("safe_batch")
-            if safe_blip is not None:
-                safe_blip = int(safe_blip)
-            if safe_clip is not None:
-                safe_clip = int(safe_clip)
-            if safe_batch is not None:
-                safe_batch = int(safe_batch)
+        r = await http_clients.get_client(ml_url).get(f"{ml_url}/api/v1/capabilities", timeout=10)
+        r.raise_for_status()
+        caps = r.json()
+        safe_blip = caps.get("SAFE_BLIP_BATCH_SIZE") or caps.get("safe_blip_batch")
+        safe_clip = caps.get("SAFE_CLIP_BATCH_SIZE") or caps.get("safe_clip_batch")
+        safe_batch = caps.get("safe_batch_size") or caps.get("safe_batch")
+        if safe_blip is not None:
+            safe_blip = int(safe_blip)
+        if safe_clip is not None:
+            safe_clip = int(safe_clip)
+        if safe_batch is not None:
+            safe_batch = int(safe_batch)
     except Exception as e:
         log.warning(f"Could not fetch ML capabilities, defaulting to 1: {e}")
 
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Approximate point counts for list pagination, and how long one stays valid
+IMAGE_COUNT_CACHE_SIZE = int(os.environ.get("IMAGE_COUNT_CACHE_SIZE", "256"))
+IMAGE_COUNT_CACHE_TTL_S = float(os.environ.get("IMAGE_COUNT_CACHE_TTL_S", "300"))
+
+
+def filter_key(qdrant_filter: Any) -> str:
+    """Stable key for a Qdrant filter (``""`` for no filter)."""
+    if qdrant_filter is None:
+        return ""
+    data = qdrant_filter.model_dump(exclude_none=True) if hasattr(qdrant_filter, "model_dump") else qdrant_filter
+    encoded = json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class CountCache:
+    """
+    LRU cache with a TTL for point counts, keyed by ``(collection, filter key)``.
+
+    Writers (ingest upserts, deletes, merges) call :meth:`invalidate`, which also
+    bumps the collection's generation: a count computed before an invalidation
+    is discarded by :meth:`get_or_compute` instead of being cached. Invalidation
+    can come from background threads, hence the lock.
+    """
+
+    def __init__(self, max_size: int = IMAGE_COUNT_CACHE_SIZE, ttl_s: float = IMAGE_COUNT_CACHE_TTL_S):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, int]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0  # bumped by a global invalidation
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, collection: str, key: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get((collection, key))
+            if entry is None or (self.ttl_s > 0 and entry[0] < time.monotonic()):
+                if entry is not None:
+                    del self._entries[(collection, key)]
+                self.misses += 1
+                return None
+            self._entries.move_to_end((collection, key))
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, collection: str) -> Tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._generations.get(collection, 0)
+
+    def put(self, collection: str, key: str, count: int, generation: Optional[Tuple[int, int]] = None) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(collection, 0)):
+                return
+            expires = time.monotonic() + self.ttl_s
+            self._entries[(collection, key)] = (expires, count)
+            self._entries.move_to_end((collection, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, collection: str, key: str, compute: Callable[[], int]) -> int:
+        cached = self.get(collection, key)
+        if cached is not None:
+            return cached
+        generation = self.generation(collection)
+        count = compute()
+        self.put(collection, key, count, generation)
+        return count
+
+    def invalidate(self, collection: Optional[str] = None) -> None:
+        """Drop the counts of ``collection`` (of every collection when ``None``)."""
+        with self._lock:
+            if collection is None:
+                self._entries.clear()
+                self._epoch += 1
+                return
+            self._generations[collection] = self._generations.get(collection, 0) + 1
+            for entry_key in [k for k in self._entries if k[0] == collection]:
+                del self._entries[entry_key]
+
+
+# Shared by the images router and the ingest pipeline, which invalidates it
+image_counts = CountCache()
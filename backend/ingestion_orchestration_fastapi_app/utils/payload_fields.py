@@ -0,0 +1,88 @@
+"""
+Payload field projection for the search and list APIs.
+
+Clients pick the payload keys they need with ``fields``, which maps onto
+Qdrant's ``with_payload`` selectors, so unused keys (dozens of ``exif_*``
+strings per point) are neither read from Qdrant nor serialized:
+
+- a profile name: ``compact`` (default, what the results grid renders) or
+  ``full`` (every key except legacy inline thumbnails);
+- ``filename,caption,width`` to include only those keys (dotted paths work);
+- ``-exif_MakerNote,-full_path`` to return everything except those keys.
+"""
+from typing import AbstractSet, Iterable, List, Optional, Sequence, Union
+
+from qdrant_client import models
+
+COMPACT_FIELDS = ["filename", "caption", "file_hash", "width", "height", "tags"]
+# Thumbnails are served by URL; collections not yet migrated still carry them inline
+ALWAYS_EXCLUDED = ["thumbnail_base64"]
+DEFAULT_PROFILE = "compact"
+PROFILES = {"compact", "full"}
+
+PayloadSelector = Union[bool, List[str], models.PayloadSelectorExclude]
+
+
+class FieldProjection:
+    """A parsed ``fields`` value: the Qdrant selector plus the keys fetched only for internal use."""
+
+    def __init__(
+        self,
+        selector: PayloadSelector,
+        keep: Optional[AbstractSet[str]] = None,
+        drop: AbstractSet[str] = frozenset(),
+    ):
+        self.selector = selector
+        self.keep = keep
+        self.drop = drop
+
+    def select(self, payload: Optional[dict]) -> dict:
+        """The payload as the client asked for it, without keys such as ``file_hash`` fetched for thumbnail URLs."""
+        payload = payload or {}
+        if self.keep is None and not self.drop:
+            return payload
+        return {
+            key: value for key, value in payload.items()
+            if (self.keep is None or key in self.keep) and key not in self.drop
+        }
+
+
+def _split(fields: Union[str, Iterable[str]]) -> List[str]:
+    parts = fields.split(",") if isinstance(fields, str) else fields
+    return [part.strip() for part in parts if part and part.strip()]
+
+
+def parse_fields(fields: Union[None, str, Iterable[str]] = None, internal: Sequence[str] = ("file_hash",)) -> FieldProjection:
+    """
+    Build the projection for a ``fields`` value. ``internal`` keys are always
+    fetched and removed again unless the client asked for them.
+    Raises ``ValueError`` on a malformed value.
+    """
+    names = _split(fields) if fields is not None else []
+    if not names:
+        names = [DEFAULT_PROFILE]
+
+    if len(names) == 1 and names[0] in PROFILES:
+        if names[0] == "full":
+            return FieldProjection(models.PayloadSelectorExclude(exclude=list(ALWAYS_EXCLUDED)))
+        return FieldProjection(list(COMPACT_FIELDS))
+
+    excluded = [name[1:] for name in names if name.startswith("-")]
+    if excluded:
+        if len(excluded) != len(names):
+            raise ValueError("fields must either all be included or all be excluded ('-name')")
+        if not all(excluded):
+            raise ValueError("Empty field name in fields")
+        selector = models.PayloadSelectorExclude(
+            exclude=[name for name in excluded if name not in internal] + ALWAYS_EXCLUDED
+        )
+        return FieldProjection(selector, drop=frozenset(name for name in excluded if name in internal))
+
+    profiles = [name for name in names if name in PROFILES]
+    if profiles:
+        raise ValueError(f"Profiles cannot be combined with field names: {', '.join(profiles)}")
+    selector = list(dict.fromkeys(names + list(internal)))
+    if len(selector) == len(names):
+        return FieldProjection(selector)
+    # Include paths come back nested under their top-level key
+    return FieldProjection(selector, keep=frozenset(name.split(".")[0] for name in names))
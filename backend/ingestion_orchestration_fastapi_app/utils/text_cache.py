@@ -0,0 +1,78 @@
+"""
+LRU cache with a TTL for CLIP text embeddings, keyed by model name and normalized text.
+
+The ingestion and ML services are built and deployed separately and share no
+package, so this module is vendored byte for byte into both:
+``backend/ml_inference_fastapi_app/services/text_cache.py`` is the source and
+``backend/ingestion_orchestration_fastapi_app/utils/text_cache.py`` the copy
+(``tests/test_search_cache.py`` fails when they drift). Service specific
+settings stay with the caller, which passes its env prefix to ``from_env``.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+def normalize_text(text: str) -> str:
+    """Cache key form of a query: CLIP's tokenizer lowercases and ignores extra whitespace."""
+    return " ".join(text.split()).lower()
+
+
+class TextEmbeddingCache:
+    """
+    LRU cache with a TTL for text embeddings, keyed by ``(model_name, normalized text)``.
+
+    Used from the event loop only, so it needs no locking. A TTL of 0 disables
+    expiry; a size of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_s: float = 600):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, prefix: str, max_size: int, ttl_s: float) -> "TextEmbeddingCache":
+        """Cache sized by ``<prefix>_SIZE`` and ``<prefix>_TTL_S``, falling back to the given defaults."""
+        return cls(
+            max_size=int(os.environ.get(f"{prefix}_SIZE", str(max_size))),
+            ttl_s=float(os.environ.get(f"{prefix}_TTL_S", str(ttl_s))),
+        )
+
+    def get(self, model_name: str, text: str) -> Optional[Any]:
+        key = (model_name, normalize_text(text))
+        entry = self._entries.get(key)
+        if entry is None or (self.ttl_s > 0 and entry[0] < time.monotonic()):
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, model_name: str, text: str, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        key = (model_name, normalize_text(text))
+        self._entries[key] = (time.monotonic() + self.ttl_s, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
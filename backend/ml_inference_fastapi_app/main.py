@@ -7,8 +7,7 @@ from fastapi.middleware.cors import CORSMiddleware
 import torch
 
 # Import the new service and router modules
-from .services import clip_service, blip_service
-from .services import redis_scheduler as scheduler
+from .services import clip_service, blip_service, batcher, replicas, scheduler
 from .routers import inference
 
 # Configure logging
@@ -32,13 +31,18 @@ async def lifespan(app: FastAPI):
         await blip_service.load_blip_model()
         blip_service.recalculate_safe_batch_size()
 
-    # Start Redis job scheduler
+    # What is left once both models are loaded is the batches' memory budget
+    replicas.pool.measure_memory()
+
+    # Start the job scheduler (ML_SCHEDULER_BACKEND)
     await scheduler.start_scheduler()
     
     logger.info("Startup complete. Models are loaded and ready.")
     yield
     # --- Shutdown ---
     logger.info("ML Inference Service shutting down...")
+    await batcher.stop_all()
+    replicas.pool.shutdown()
     async with clip_service.gpu_lock:
         await clip_service.cooldown_clip_model()
         await blip_service.cooldown_blip_model()
@@ -1,20 +1,72 @@
 import asyncio
+import json
 import logging
 import base64
 import io
-from typing import List, Dict, Any, Optional, Tuple
+import os
+from contextlib import contextmanager
+from typing import List, Dict, Any, Literal, Optional, Tuple, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Body, Query
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, File, Form, UploadFile
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from PIL import Image
 import torch
 
-from ..services import clip_service, blip_service
-from ..services import redis_scheduler as scheduler
+from ..services import clip_service, blip_service, batcher, replicas, scheduler, text_cache
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Batches a client may keep in flight per replica; advertised (times the number
+# of replicas) via /capabilities so the ingestion service can size its submission window.
+MAX_QUEUE_DEPTH = int(os.environ.get("ML_MAX_QUEUE_DEPTH", "2"))
+_inflight_batches = 0
+# Memory admission estimate for one text in a CLIP text batch
+TEXT_ITEM_MEMORY_BYTES = 2**20
+
+
+def _batch_limit(safe_size: int) -> int:
+    # SAFE_* sizes come from the batch-size calibration on every device, CPU included
+    return max(1, int(safe_size))
+
+
+def _rows(features: Any, count: int) -> List[Any]:
+    return [features[i] for i in range(count)]
+
+
+# Per-model request queues. Concurrent requests (search text, ingest batches from
+# several jobs) are fused into device batches of up to the safe batch size -
+# interactive requests first, ingest jobs (tenants) served in turn - and each
+# batch runs on the least-loaded model replica with memory for it.
+clip_image_batcher = batcher.MicroBatcher(
+    "clip_image",
+    lambda images, replica: _rows(clip_service.encode_image_batch(images, replica), len(images)),
+    lambda: _batch_limit(clip_service.SAFE_CLIP_BATCH_SIZE),
+    pool=replicas.pool,
+    bytes_per_item=clip_service.item_memory_bytes,
+)
+clip_text_batcher = batcher.MicroBatcher(
+    "clip_text",
+    lambda texts, replica: _rows(clip_service.encode_text_batch(texts, replica), len(texts)),
+    lambda: _batch_limit(clip_service.SAFE_CLIP_BATCH_SIZE),
+    lane=batcher.INTERACTIVE_LANE,
+    pool=replicas.pool,
+    bytes_per_item=TEXT_ITEM_MEMORY_BYTES,
+)
+blip_batcher = batcher.MicroBatcher(
+    "blip",
+    lambda images, replica: blip_service.generate_captions(images, replica=replica),
+    lambda: _batch_limit(blip_service.SAFE_BLIP_BATCH_SIZE),
+    pool=replicas.pool,
+    bytes_per_item=blip_service.item_memory_bytes,
+)
+
+# Query text -> embedding, keyed by CLIP model name (ML_TEXT_CACHE_SIZE / ML_TEXT_CACHE_TTL_S)
+text_embedding_cache = text_cache.TextEmbeddingCache.from_env("ML_TEXT_CACHE", max_size=4096, ttl_s=3600)
+# Largest number of texts accepted by /embed_text_batch
+TEXT_BATCH_MAX = int(os.environ.get("ML_TEXT_BATCH_MAX", "1024"))
+
 # --- Pydantic Models ---
 
 class BatchImageRequestItem(BaseModel):
@@ -44,6 +96,10 @@ class JobStatusResponse(BaseModel):
     status: str
     result: Optional[BatchEmbedAndCaptionResponse] = None
     error: Optional[str] = None
+    # Per-item results published so far, starting at the requested ``since`` offset
+    results: List[BatchResultItem] = []
+    # Total number of per-item results published; pass back as ``since`` on the next call
+    cursor: int = 0
 
 class JobResponse(BaseModel):
     job_id: str
@@ -56,6 +112,22 @@ class CapabilitiesResponse(BaseModel):
     blip_model_loaded: bool
     device_type: str
     cuda_available: bool
+    clip_input_size: int
+    blip_input_size: int
+    max_queue_depth: int
+    queue_depth: int
+    # Per-model micro-batcher metrics: queue depth, batch counts, mean batch fill and wait
+    batchers: Dict[str, Dict[str, Any]] = {}
+    # Backend serving each model: "torch" or "onnx-<quantization>" (ML_INFERENCE_BACKEND)
+    inference_backend: Dict[str, str] = {}
+    # Batch-size calibration per model: chosen size, stop reason and the throughput curve
+    batch_profiles: Dict[str, Optional[Dict[str, Any]]] = {}
+    # Query embedding cache: size, hits, misses and hit rate
+    text_cache: Dict[str, Any] = {}
+    # Model replicas (ML_DEVICES / ML_CPU_REPLICAS): device, threads, items in flight, busy time, memory budget
+    replicas: List[Dict[str, Any]] = []
+    # Async job scheduler: backend, queued and running jobs
+    scheduler: Dict[str, Any] = {}
 
 class TextEmbedRequest(BaseModel):
     text: str
@@ -64,80 +136,359 @@ class TextEmbedRequest(BaseModel):
 class TextEmbedResponse(BaseModel):
     embedding: List[float]
     embedding_shape: List[int]
+    # Embedding model; clients caching embeddings key them by this
+    model_name: Optional[str] = None
 
-# --- Endpoints ---
+class TextEmbedBatchRequest(BaseModel):
+    texts: List[str]
 
-from fastapi import Query
+class TextEmbedBatchResponse(BaseModel):
+    embeddings: List[List[float]]
+    embedding_shape: List[int]
+    model_name: Optional[str] = None
 
+# --- Helpers ---
 
-@router.post("/batch_embed_and_caption", response_model=BatchEmbedAndCaptionResponse)
-async def batch_embed_and_caption_endpoint(
-    request: BatchEmbedAndCaptionRequest = Body(...),
-    caption: bool = Query(True, description="Generate captions in addition to embeddings"),
-):
-    logger.info(f"[ML Service] Received batch_embed_and_caption request with {len(request.images)} images. Example filenames: {[item.filename for item in request.images[:3]]}{'...' if len(request.images) > 3 else ''}")
-    batch_start_time = asyncio.get_event_loop().time()
-    if not clip_service.get_clip_model_status() or not blip_service.get_blip_model_status():
-        logger.error("[ML Service] Models are not ready. Rejecting batch.")
-        raise HTTPException(status_code=503, detail="Models are not ready. Please use /warmup first.")
+def _vector(row: Any) -> List[float]:
+    if hasattr(row, "detach"):
+        row = row.detach().float().cpu().numpy()
+    return [float(x) for x in row]
 
+
+async def _embed_texts(texts: List[str], cache: bool = True, priority: str = batcher.INTERACTIVE_LANE) -> List[List[float]]:
+    """
+    CLIP text embeddings for ``texts``, in order. Cached queries are answered
+    from the LRU cache; each distinct uncached text is embedded once, together
+    with other concurrent text requests.
+    """
+    model_name = clip_service.CLIP_MODEL_NAME_CONFIG
+    embeddings: List[Optional[List[float]]] = [text_embedding_cache.get(model_name, text) for text in texts]
+    missing: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        if embeddings[i] is None:
+            missing.setdefault(text_cache.normalize_text(text), []).append(i)
+    if missing:
+        keys = list(missing)
+        rows = await clip_text_batcher.submit_many([texts[missing[key][0]] for key in keys], priority)
+        for key, row in zip(keys, rows):
+            vector = _vector(row)
+            if cache:
+                text_embedding_cache.put(model_name, key, vector)
+            for i in missing[key]:
+                embeddings[i] = vector
+    return embeddings
+
+
+def _decode_image_bytes(
+    encoded: List[Tuple[str, str, bytes]],
+) -> Tuple[Dict[str, Image.Image], Dict[str, str]]:
+    """
+    Decode ``(unique_id, filename, data)`` triples into RGB images. Runs in a
+    worker thread so PIL decoding never blocks the event loop.
+    """
     valid_images: Dict[str, Image.Image] = {}
     failed_decodes: Dict[str, str] = {}
-    for item in request.images:
+    for uid, filename, data in encoded:
         try:
-            image_data = base64.b64decode(item.image_base64)
-            image = Image.open(io.BytesIO(image_data)).convert("RGB")
-            valid_images[item.unique_id] = image
+            valid_images[uid] = Image.open(io.BytesIO(data)).convert("RGB")
+        except Exception as e:
+            logger.error(f"[ML Service] Failed to decode image for {uid} ({filename}): {e}", exc_info=True)
+            failed_decodes[uid] = f"Failed to decode image: {e}"
+    return valid_images, failed_decodes
+
+
+def _decode_base64(
+    items: List[BatchImageRequestItem],
+) -> Tuple[List[Tuple[str, str, bytes]], Dict[str, str]]:
+    """``(unique_id, filename, data)`` triples from the JSON endpoint's base64 strings."""
+    encoded: List[Tuple[str, str, bytes]] = []
+    failed_decodes: Dict[str, str] = {}
+    for item in items:
+        try:
+            encoded.append((item.unique_id, item.filename, base64.b64decode(item.image_base64)))
         except Exception as e:
             logger.error(f"[ML Service] Failed to decode base64 for {item.unique_id} ({item.filename}): {e}", exc_info=True)
             failed_decodes[item.unique_id] = f"Failed to decode image: {e}"
+    return encoded, failed_decodes
 
+
+async def _run_embed_and_caption(
+    valid_images: Dict[str, Image.Image],
+    filenames: Dict[str, str],
+    failed_decodes: Dict[str, str],
+    order: List[str],
+    caption: bool,
+    embed: bool = True,
+    priority: str = batcher.BULK_LANE,
+    tenant: str = batcher.DEFAULT_TENANT,
+) -> BatchEmbedAndCaptionResponse:
+    """
+    Run CLIP and/or BLIP on decoded images through their micro-batchers and
+    assemble results in ``order``. The two models are independent stages with
+    their own queues and batch sizes; a caption-only call never touches CLIP.
+    """
     results: Dict[str, BatchResultItem] = {
-        uid: BatchResultItem(unique_id=uid, filename="", error=err)
+        uid: BatchResultItem(unique_id=uid, filename=filenames.get(uid, ""), error=err)
         for uid, err in failed_decodes.items()
     }
 
     if valid_images:
         image_list = list(valid_images.values())
-        embeddings = clip_service.encode_image_batch(image_list)
-        captions = []
-        if caption:
-            captions = blip_service.generate_captions(image_list)
-        else:
-            captions = ["" for _ in image_list]
+        embeddings, captions = await asyncio.gather(
+            clip_image_batcher.submit_many(image_list, priority, tenant) if embed else asyncio.sleep(0, result=[None] * len(image_list)),
+            blip_batcher.submit_many(image_list, priority, tenant) if caption else asyncio.sleep(0, result=[""] * len(image_list)),
+        )
 
         for i, uid in enumerate(valid_images.keys()):
-            original_item = next((item for item in request.images if item.unique_id == uid), None)
             results[uid] = BatchResultItem(
                 unique_id=uid,
-                filename=original_item.filename if original_item else "",
-                embedding=embeddings[i].tolist(),
-                embedding_shape=list(embeddings[i].shape),
+                filename=filenames.get(uid, ""),
+                embedding=embeddings[i].tolist() if embeddings[i] is not None else None,
+                embedding_shape=list(embeddings[i].shape) if embeddings[i] is not None else None,
                 caption=captions[i]
             )
 
-    # Add filenames for decode errors
-    for item in request.images:
-        if item.unique_id in results and not results[item.unique_id].filename:
-            results[item.unique_id].filename = item.filename
+    return BatchEmbedAndCaptionResponse(results=[results[uid] for uid in order])
+
+
+@contextmanager
+def _track_inflight():
+    """Count batch requests currently being received or processed."""
+    global _inflight_batches
+    _inflight_batches += 1
+    try:
+        yield
+    finally:
+        _inflight_batches -= 1
+
+
+EMBED_AND_CAPTION_JOB = "embed_and_caption"
+# Retry-After, in seconds, sent with 429 when the job queue is full
+JOB_QUEUE_RETRY_AFTER_S = int(os.environ.get("ML_JOB_QUEUE_RETRY_AFTER_S", "2"))
+
+
+async def _embed_and_caption_job(job: scheduler.JobSpec) -> Dict[str, Any]:
+    """
+    Scheduler job for ``async_job`` batches. The payload holds the encoded
+    images, which are decoded here rather than at submission so queued jobs
+    stay plain data. Splits the batch into chunks of the device batch size, all
+    queued on the micro-batchers at once, and publishes each chunk's results as
+    soon as it finishes, so clients streaming ``/status/{job_id}/events`` do not
+    wait for the whole batch.
+    """
+    payload = job.payload
+    filenames: Dict[str, str] = payload["filenames"]
+    order: List[str] = payload["order"]
+    caption, embed = payload["caption"], payload["embed"]
+    valid_images, failed = await asyncio.to_thread(_decode_image_bytes, [tuple(image) for image in payload["images"]])
+    failed_decodes = {**payload["failed"], **failed}
+
+    results: Dict[str, BatchResultItem] = {}
+    if failed_decodes:
+        failed = await _run_embed_and_caption({}, filenames, failed_decodes, list(failed_decodes), caption, embed)
+        results.update((r.unique_id, r) for r in failed.results)
+        await scheduler.add_partial_results([r.model_dump() for r in failed.results])
+
+    sizes = []
+    if embed:
+        sizes.append(clip_image_batcher.max_batch_size)
+    if caption:
+        sizes.append(blip_batcher.max_batch_size)
+    sub_batch_size = min(sizes)
+    uids = list(valid_images)
+    chunks = [uids[start:start + sub_batch_size] for start in range(0, len(uids), sub_batch_size)]
+    pending = [
+        asyncio.ensure_future(_run_embed_and_caption(
+            {uid: valid_images[uid] for uid in chunk}, filenames, {}, chunk, caption, embed, job.priority, job.tenant,
+        ))
+        for chunk in chunks
+    ]
+    try:
+        for next_done in asyncio.as_completed(pending):
+            response = await next_done
+            results.update((r.unique_id, r) for r in response.results)
+            await scheduler.add_partial_results([r.model_dump() for r in response.results])
+    finally:
+        # Also runs on cancellation: queued images leave the batchers with the job
+        for task in pending:
+            task.cancel()
+
+    return BatchEmbedAndCaptionResponse(results=[results[uid] for uid in order]).model_dump()
+
+
+scheduler.register_handler(EMBED_AND_CAPTION_JOB, _embed_and_caption_job)
+
+
+async def _dispatch_batch(
+    encoded: List[Tuple[str, str, bytes]],
+    filenames: Dict[str, str],
+    failed_decodes: Dict[str, str],
+    order: List[str],
+    caption: bool,
+    async_job: bool,
+    embed: bool = True,
+    priority: str = batcher.BULK_LANE,
+    tenant: str = batcher.DEFAULT_TENANT,
+) -> Union[BatchEmbedAndCaptionResponse, JobResponse]:
+    """Run the batch inline, or queue it as a job whose results stream as they are ready."""
+    if not async_job:
+        valid_images, failed = await asyncio.to_thread(_decode_image_bytes, encoded)
+        failed_decodes = {**failed_decodes, **failed}
+        return await _run_embed_and_caption(valid_images, filenames, failed_decodes, order, caption, embed, priority, tenant)
+    payload = {
+        "images": [list(image) for image in encoded],
+        "filenames": filenames,
+        "failed": failed_decodes,
+        "order": order,
+        "caption": caption,
+        "embed": embed,
+    }
+    try:
+        job_id = await scheduler.enqueue_job(EMBED_AND_CAPTION_JOB, payload, priority=priority, tenant=tenant)
+    except scheduler.SchedulerFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Job queue is full: {e}",
+            headers={"Retry-After": str(JOB_QUEUE_RETRY_AFTER_S)},
+        )
+    return JobResponse(job_id=job_id, status="queued")
+
+
+def _job_status_response(job_id: str, status: Dict[str, Any], since: int) -> JobStatusResponse:
+    partial = status.get("results") or []
+    result = status.get("result")
+    return JobStatusResponse(
+        job_id=job_id,
+        status=status["status"],
+        result=BatchEmbedAndCaptionResponse(**result) if result else None,
+        error=status.get("error"),
+        results=[BatchResultItem(**r) for r in partial[since:]],
+        cursor=len(partial),
+    )
+
+
+def _ensure_models_ready(embed: bool = True, caption: bool = True) -> None:
+    if not embed and not caption:
+        raise HTTPException(status_code=422, detail="Nothing to do: both embed and caption are false.")
+    if (embed and not clip_service.get_clip_model_status()) or (caption and not blip_service.get_blip_model_status()):
+        logger.error("[ML Service] Models are not ready. Rejecting batch.")
+        raise HTTPException(status_code=503, detail="Models are not ready. Please use /warmup first.")
+
+
+# --- Endpoints ---
+
+ASYNC_JOB_DESCRIPTION = "Queue the batch and return a job id; per-item results stream from /status/{job_id}/events"
+EMBED_DESCRIPTION = "Compute CLIP embeddings; set to false with caption=true for a caption-only (BLIP) batch"
+PRIORITY_DESCRIPTION = "Scheduling priority: interactive requests run before bulk (ingest) work"
+TENANT_DESCRIPTION = "Fair-share key, e.g. the ingest job id; queued work of different tenants is served in turn"
+Priority = Literal["interactive", "bulk"]
 
-    final_results = [results[item.unique_id] for item in request.images]
-    return BatchEmbedAndCaptionResponse(results=final_results)
+
+@router.post("/batch_embed_and_caption", response_model=Union[BatchEmbedAndCaptionResponse, JobResponse])
+async def batch_embed_and_caption_endpoint(
+    request: BatchEmbedAndCaptionRequest = Body(...),
+    caption: bool = Query(True, description="Generate captions in addition to embeddings"),
+    async_job: bool = Query(False, description=ASYNC_JOB_DESCRIPTION),
+    embed: bool = Query(True, description=EMBED_DESCRIPTION),
+    priority: Priority = Query(batcher.BULK_LANE, description=PRIORITY_DESCRIPTION),
+    tenant: str = Query(batcher.DEFAULT_TENANT, description=TENANT_DESCRIPTION),
+):
+    logger.info(f"[ML Service] Received batch_embed_and_caption request with {len(request.images)} images. Example filenames: {[item.filename for item in request.images[:3]]}{'...' if len(request.images) > 3 else ''}")
+    _ensure_models_ready(embed, caption)
+
+    with _track_inflight():
+        encoded, failed_decodes = await asyncio.to_thread(_decode_base64, request.images)
+        filenames = {item.unique_id: item.filename for item in request.images}
+        order = [item.unique_id for item in request.images]
+        return await _dispatch_batch(encoded, filenames, failed_decodes, order, caption, async_job, embed, priority, tenant)
+
+
+@router.post("/batch_embed_and_caption_multipart", response_model=Union[BatchEmbedAndCaptionResponse, JobResponse])
+async def batch_embed_and_caption_multipart_endpoint(
+    files: List[UploadFile] = File(..., description="Encoded images (JPEG/PNG), one part per image"),
+    unique_ids: List[str] = Form(..., description="Unique id for each file part, in the same order"),
+    caption: bool = Query(True, description="Generate captions in addition to embeddings"),
+    async_job: bool = Query(False, description=ASYNC_JOB_DESCRIPTION),
+    embed: bool = Query(True, description=EMBED_DESCRIPTION),
+    priority: Priority = Query(batcher.BULK_LANE, description=PRIORITY_DESCRIPTION),
+    tenant: str = Query(batcher.DEFAULT_TENANT, description=TENANT_DESCRIPTION),
+):
+    """
+    Binary variant of ``/batch_embed_and_caption``.
+
+    Images travel as raw multipart file parts instead of base64 strings inside a
+    JSON body, which avoids the base64 inflation and the JSON parse of the whole
+    batch. The response is identical to the JSON endpoint.
+    """
+    if len(files) != len(unique_ids):
+        raise HTTPException(status_code=422, detail=f"Got {len(files)} files but {len(unique_ids)} unique_ids")
+    logger.info(f"[ML Service] Received multipart batch with {len(files)} images. Example filenames: {[f.filename for f in files[:3]]}{'...' if len(files) > 3 else ''}")
+    _ensure_models_ready(embed, caption)
+
+    filenames: Dict[str, str] = {}
+    with _track_inflight():
+        encoded: List[Tuple[str, str, bytes]] = []
+        for uid, upload in zip(unique_ids, files):
+            filenames[uid] = upload.filename or ""
+            encoded.append((uid, filenames[uid], await upload.read()))
+
+        return await _dispatch_batch(encoded, filenames, {}, list(unique_ids), caption, async_job, embed, priority, tenant)
 
 
 @router.get("/status/{job_id}", response_model=JobStatusResponse)
-async def get_job_status(job_id: str):
-    status = await scheduler.get_job_status(job_id)
+async def get_job_status(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=60, description="Long-poll: hold the request up to this many seconds for new results or completion"),
+    since: int = Query(0, ge=0, description="Only return per-item results after this cursor"),
+):
+    if wait > 0:
+        status = await scheduler.wait_for_job_update(job_id, since=since, timeout=wait)
+    else:
+        status = await scheduler.get_job_status(job_id)
     if not status:
         raise HTTPException(status_code=404, detail="Job not found")
-    if status.get("status") in {"completed", "failed"}:
-        result = status.get("result")
-        error = status.get("error")
-        result_model = None
-        if result:
-            result_model = BatchEmbedAndCaptionResponse(**result)
-        return JobStatusResponse(job_id=job_id, status=status["status"], result=result_model, error=error)
-    return JobStatusResponse(job_id=job_id, status=status["status"])
+    return _job_status_response(job_id, status, since)
+
+
+@router.get("/status/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    since: int = Query(0, ge=0, description="Skip per-item results before this cursor"),
+):
+    """
+    Server-Sent Events stream for a job. Emits a ``results`` event carrying the
+    per-item results as each sub-batch finishes and a final ``done`` event with
+    the job status, so clients never wait on a poll interval.
+    """
+    if not await scheduler.get_job_status(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        cursor = since
+        while True:
+            status = await scheduler.wait_for_job_update(job_id, since=cursor, timeout=15)
+            if status is None:
+                return
+            update = _job_status_response(job_id, status, cursor)
+            if update.results:
+                yield f"event: results\ndata: {json.dumps([r.model_dump() for r in update.results])}\n\n"
+                cursor = update.cursor
+            if status["status"] in scheduler.FINAL_STATUSES:
+                yield f"event: done\ndata: {json.dumps({'job_id': job_id, 'status': status['status'], 'error': status.get('error'), 'cursor': cursor})}\n\n"
+                return
+            if not update.results:
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.post("/cancel/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job. Results published before cancellation stay readable."""
+    status = await scheduler.cancel_job(job_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobResponse(job_id=job_id, status=status["status"])
 
 
 @router.get("/capabilities", response_model=CapabilitiesResponse)
@@ -150,18 +501,35 @@ async def get_capabilities():
         blip_model_loaded=blip_service.get_blip_model_status(),
         device_type=str(clip_service.DEVICE),
         cuda_available=torch.cuda.is_available(),
+        clip_input_size=clip_service.get_clip_input_size(),
+        blip_input_size=blip_service.get_blip_input_size(),
+        max_queue_depth=MAX_QUEUE_DEPTH * max(1, len(replicas.pool)),
+        queue_depth=_inflight_batches,
+        batchers=batcher.all_metrics(),
+        inference_backend={"clip": clip_service.get_clip_backend(), "blip": blip_service.get_blip_backend()},
+        batch_profiles={
+            "clip": clip_service.CLIP_BATCH_PROFILE.as_dict() if clip_service.CLIP_BATCH_PROFILE else None,
+            "blip": blip_service.BLIP_BATCH_PROFILE.as_dict() if blip_service.BLIP_BATCH_PROFILE else None,
+        },
+        text_cache=text_embedding_cache.metrics(),
+        replicas=replicas.pool.metrics(),
+        scheduler=scheduler.metrics(),
     )
 
 @router.post("/warmup")
 async def warmup_models():
     """Load both CLIP and BLIP models into memory."""
+    # The VRAM probes run forward passes, so they go on the bulk inference thread
+    bulk = batcher.get_executor(batcher.BULK_LANE)
+    loop = asyncio.get_running_loop()
     async with clip_service.gpu_lock:
         await clip_service.load_clip_model()
-        clip_service.recalculate_safe_batch_size()
+        await loop.run_in_executor(bulk, clip_service.recalculate_safe_batch_size)
     
     async with clip_service.gpu_lock:
         await blip_service.load_blip_model()
-        blip_service.recalculate_safe_batch_size()
+        await loop.run_in_executor(bulk, blip_service.recalculate_safe_batch_size)
+    replicas.pool.measure_memory()
         
     return {"message": "Models warmed up and ready."}
 
@@ -181,10 +549,37 @@ async def embed_text_endpoint(request: TextEmbedRequest):
     if not clip_service.get_clip_model_status():
         raise HTTPException(status_code=503, detail="CLIP model is not available.")
     try:
-        features = clip_service.encode_text_batch([request.text])
-        embedding = features[0].detach().cpu().numpy().tolist()
-        embedding_shape = list(features[0].shape)
-        return TextEmbedResponse(embedding=embedding, embedding_shape=embedding_shape)
+        embedding = (await _embed_texts([request.text]))[0]
+        return TextEmbedResponse(
+            embedding=embedding,
+            embedding_shape=[len(embedding)],
+            model_name=clip_service.CLIP_MODEL_NAME_CONFIG,
+        )
     except Exception as e:
         logger.error(f"Failed to embed text: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Failed to embed text: {e}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to embed text: {e}")
+
+
+@router.post("/embed_text_batch", response_model=TextEmbedBatchResponse)
+async def embed_text_batch_endpoint(
+    request: TextEmbedBatchRequest,
+    cache: bool = Query(True, description="Store the results in the query embedding cache. Pass false for one-off texts (e.g. document chunks) so they do not evict popular queries."),
+    priority: Priority = Query(batcher.INTERACTIVE_LANE, description=PRIORITY_DESCRIPTION),
+):
+    """Embed a list of texts with CLIP; results are in request order."""
+    if not request.texts:
+        raise HTTPException(status_code=422, detail="'texts' must contain at least one text.")
+    if len(request.texts) > TEXT_BATCH_MAX:
+        raise HTTPException(status_code=422, detail=f"At most {TEXT_BATCH_MAX} texts per request.")
+    if not clip_service.get_clip_model_status():
+        raise HTTPException(status_code=503, detail="CLIP model is not available.")
+    try:
+        embeddings = await _embed_texts(request.texts, cache=cache, priority=priority)
+        return TextEmbedBatchResponse(
+            embeddings=embeddings,
+            embedding_shape=[len(embeddings), len(embeddings[0])],
+            model_name=clip_service.CLIP_MODEL_NAME_CONFIG,
+        )
+    except Exception as e:
+        logger.error(f"Failed to embed {len(request.texts)} texts: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to embed texts: {e}")
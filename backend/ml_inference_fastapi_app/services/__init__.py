@@ -1,4 +1,4 @@
 """
 services package for ML Inference Service
 """
-from .redis_scheduler import * 
\ No newline at end of file
+from .scheduler import * 
@@ -0,0 +1,217 @@
+"""
+Batch-size calibration for the CLIP and BLIP services.
+
+Instead of extrapolating from one dummy tensor, each model is benchmarked on
+synthetic PIL images through its real preprocessing and inference path at
+batch sizes 1, 2, 4, ... until the device runs out of memory, a batch exceeds
+the latency budget, or throughput stops improving (the knee). The batch size
+with the best throughput is used as the model's safe batch size, and the
+profile (including the whole curve and, on CUDA, the peak memory of each
+batch size) is persisted to ``ML_AUTOTUNE_CACHE`` keyed by model, device and
+backend, so restarts reuse it without probing. The per-item memory feeds the
+batchers' memory admission (see ``replicas``).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+AUTOTUNE_CACHE = Path(os.environ.get("ML_AUTOTUNE_CACHE", ".batch_autotune.json"))
+# Re-run the probe even if a persisted profile exists
+AUTOTUNE_REFRESH = os.environ.get("ML_AUTOTUNE_REFRESH", "false").lower() in ("1", "true", "yes")
+# Largest batch size probed on CUDA and on CPU
+AUTOTUNE_MAX_BATCH = int(os.environ.get("ML_AUTOTUNE_MAX_BATCH", "512"))
+CPU_MAX_BATCH = int(os.environ.get("ML_CPU_MAX_BATCH", "64"))
+# A batch slower than this ends the probe (interactive requests share the queue)
+AUTOTUNE_MAX_LATENCY_MS = float(os.environ.get("ML_AUTOTUNE_MAX_LATENCY_MS", "4000"))
+# Doubling the batch must improve throughput by at least this fraction to continue
+AUTOTUNE_MIN_GAIN = float(os.environ.get("ML_AUTOTUNE_MIN_GAIN", "0.05"))
+AUTOTUNE_REPEATS = int(os.environ.get("ML_AUTOTUNE_REPEATS", "2"))
+
+# Synthetic images are larger than the model input so the processor's resize/crop is exercised
+SYNTHETIC_IMAGE_SIZE = (640, 480)
+
+_cache_lock = threading.Lock()
+
+
+@dataclass
+class BatchProfile:
+    model: str
+    device: str
+    backend: str
+    batch_size: int = 1
+    # [{"batch_size", "latency_ms", "items_per_sec"(, "peak_mem_mb")}] for every size that ran
+    curve: List[Dict[str, float]] = field(default_factory=list)
+    # Device memory one item of a batch of ``batch_size`` needs (CUDA only; 0 = not measured)
+    bytes_per_item: int = 0
+    stop_reason: str = ""
+    tuned_at: float = 0.0
+    from_cache: bool = False
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def device_label(device: torch.device) -> str:
+    """Identifies the hardware a profile was measured on."""
+    if device.type == "cuda":
+        try:
+            return f"cuda:{torch.cuda.get_device_name(device)}"
+        except Exception:
+            return str(device)
+    return f"cpu:{os.cpu_count()}"
+
+
+def _cache_key(model: str, device: str, backend: str) -> str:
+    return f"{model}|{device}|{backend}|torch-{torch.__version__}"
+
+
+def _load_cache(path: Path) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable batch autotune cache {path}: {e}")
+        return {}
+
+
+def _save_profile(path: Path, key: str, profile: BatchProfile) -> None:
+    with _cache_lock:
+        data = _load_cache(path)
+        data[key] = {k: v for k, v in profile.as_dict().items() if k != "from_cache"}
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, indent=2)
+        os.replace(tmp_path, path)
+
+
+def synthetic_images(count: int, size=SYNTHETIC_IMAGE_SIZE, seed: int = 0) -> List[Image.Image]:
+    """Random-noise RGB images at a typical photo size (distinct per index)."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    return [Image.fromarray(np.roll(base, i, axis=1)) for i in range(count)]
+
+
+def _is_oom(error: BaseException) -> bool:
+    return isinstance(error, (RuntimeError, MemoryError)) and (
+        isinstance(error, MemoryError) or "out of memory" in str(error).lower()
+    )
+
+
+def _time_batch(run_batch: Callable[[List[Any]], Any], images: List[Any], device: torch.device) -> float:
+    """Median latency in seconds of ``run_batch`` over ``AUTOTUNE_REPEATS`` runs (after one warm-up)."""
+    run_batch(images)
+    timings = []
+    for _ in range(max(1, AUTOTUNE_REPEATS)):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        run_batch(images)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def probe(
+    run_batch: Callable[[List[Any]], Any],
+    device: torch.device,
+    max_batch: Optional[int] = None,
+    make_images: Optional[Callable[[int], List[Any]]] = None,
+) -> BatchProfile:
+    """Benchmark ``run_batch`` at power-of-two batch sizes and return the throughput curve and optimum."""
+    make_images = make_images or synthetic_images
+    if max_batch is None:
+        max_batch = AUTOTUNE_MAX_BATCH if device.type == "cuda" else CPU_MAX_BATCH
+    max_batch = max(1, max_batch)
+    profile = BatchProfile(model="", device=device_label(device), backend="")
+    best_throughput = 0.0
+    stop_reason = "max_batch"
+    batch_size = 1
+    while batch_size <= max_batch:
+        if device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(device)
+            baseline = torch.cuda.memory_allocated(device)
+        try:
+            latency = _time_batch(run_batch, make_images(batch_size), device)
+        except Exception as e:
+            if not _is_oom(e):
+                raise
+            stop_reason = "oom"
+            if device.type == "cuda":
+                torch.cuda.empty_cache()
+            break
+        throughput = batch_size / latency if latency > 0 else float("inf")
+        point = {
+            "batch_size": batch_size,
+            "latency_ms": round(latency * 1000, 2),
+            "items_per_sec": round(throughput, 2),
+        }
+        if device.type == "cuda":
+            point["peak_mem_mb"] = round((torch.cuda.max_memory_allocated(device) - baseline) / 2**20, 2)
+        profile.curve.append(point)
+        logger.info(f"[Autotune] batch={batch_size} latency={latency * 1000:.1f}ms throughput={throughput:.1f}/s")
+
+        gain = (throughput - best_throughput) / best_throughput if best_throughput else float("inf")
+        if throughput > best_throughput:
+            best_throughput = throughput
+            profile.batch_size = batch_size
+        if latency * 1000 > AUTOTUNE_MAX_LATENCY_MS:
+            stop_reason = "latency"
+            break
+        if gain < AUTOTUNE_MIN_GAIN:
+            stop_reason = "knee"
+            break
+        batch_size *= 2
+
+    # The size right below an OOM has no headroom for fragmentation or the other model
+    if stop_reason == "oom" and profile.batch_size > 1 and profile.batch_size == batch_size // 2:
+        profile.batch_size //= 2
+    for point in profile.curve:
+        if point["batch_size"] == profile.batch_size and "peak_mem_mb" in point:
+            profile.bytes_per_item = int(point["peak_mem_mb"] * 2**20 / profile.batch_size)
+    profile.stop_reason = stop_reason
+    profile.tuned_at = time.time()
+    return profile
+
+
+def tune(
+    model: str,
+    backend: str,
+    run_batch: Callable[[List[Any]], Any],
+    device: torch.device,
+    max_batch: Optional[int] = None,
+    cache_path: Path = AUTOTUNE_CACHE,
+    refresh: bool = AUTOTUNE_REFRESH,
+) -> BatchProfile:
+    """Return the persisted profile for this model/device/backend, probing (and persisting) it if missing."""
+    device_name = device_label(device)
+    key = _cache_key(model, device_name, backend)
+    if not refresh:
+        cached = _load_cache(cache_path).get(key)
+        if cached:
+            profile = BatchProfile(**{**cached, "from_cache": True})
+            logger.info(f"[Autotune] Using persisted batch size {profile.batch_size} for {model} on {device_name} ({backend})")
+            return profile
+
+    logger.info(f"[Autotune] Probing batch sizes for {model} on {device_name} ({backend})")
+    profile = probe(run_batch, device, max_batch=max_batch)
+    profile.model, profile.backend = model, backend
+    logger.info(f"[Autotune] {model}: batch size {profile.batch_size} (stopped on {profile.stop_reason})")
+    try:
+        _save_profile(cache_path, key, profile)
+    except OSError as e:
+        logger.warning(f"Could not persist batch autotune profile to {cache_path}: {e}")
+    return profile
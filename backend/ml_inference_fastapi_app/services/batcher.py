@@ -0,0 +1,407 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, List, NamedTuple, Optional, Sequence, Union
+
+if TYPE_CHECKING:
+    from .replicas import Replica, ReplicaPool
+
+logger = logging.getLogger(__name__)
+
+# How long the first request in a batch may wait for others to join it
+DEFAULT_MAX_WAIT_MS = float(os.environ.get("ML_BATCH_MAX_WAIT_MS", "10"))
+# Items a batcher queue holds before submitters are made to wait (backpressure)
+MAX_QUEUED_ITEMS = int(os.environ.get("ML_INFERENCE_QUEUE_SIZE", "1024"))
+# How often a batch held back by memory admission checks again
+ADMISSION_RETRY_S = 0.05
+
+# Model calls run on dedicated threads, never on the event loop. Each lane is a
+# single thread so batches of one lane run in order; the "interactive" lane
+# (search text) is separate so it never queues behind a long captioning batch.
+INTERACTIVE_LANE = "interactive"
+BULK_LANE = "bulk"
+_executors: Dict[str, ThreadPoolExecutor] = {}
+
+# Request priorities, highest first; they share the lane names
+PRIORITIES = (INTERACTIVE_LANE, BULK_LANE)
+# Fair-share key of requests that do not name one
+DEFAULT_TENANT = "default"
+
+# Every batcher created in this process, by name (for metrics and shutdown)
+_batchers: Dict[str, "MicroBatcher"] = {}
+
+BatchFn = Callable[[List[Any]], Sequence[Any]]
+
+
+class _Entry(NamedTuple):
+    item: Any
+    future: asyncio.Future
+    queued: float
+    priority: str
+    tenant: str
+
+
+class FairQueue:
+    """
+    Batcher queue ordered by priority and shared fairly between tenants.
+
+    Interactive items are always taken before bulk ones; within a priority,
+    tenants (e.g. ingest jobs) are served round-robin one item at a time, so a
+    job with thousands of queued images cannot starve a smaller one. Items whose
+    caller has gone away (cancelled future) are dropped when reached. ``put``
+    waits while ``maxsize`` items are queued, like ``asyncio.Queue``.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        self.maxsize = maxsize
+        self._levels: Dict[str, "OrderedDict[str, Deque[_Entry]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._size = 0
+        self._getters: Deque[asyncio.Future] = deque()
+        self._putters: Deque[asyncio.Future] = deque()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self._size
+
+    def tenants(self) -> Dict[str, int]:
+        """Queued items per tenant."""
+        counts: Dict[str, int] = {}
+        for level in self._levels.values():
+            for tenant, entries in level.items():
+                counts[tenant] = counts.get(tenant, 0) + len(entries)
+        return counts
+
+    @staticmethod
+    def _wakeup_next(waiters: Deque[asyncio.Future]) -> None:
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def _wait(self, waiters: Deque[asyncio.Future]) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        try:
+            await waiter
+        except BaseException:
+            waiter.cancel()
+            with contextlib.suppress(ValueError):
+                waiters.remove(waiter)
+            # Pass on a wakeup this waiter received but can no longer use
+            if waiter.done() and not waiter.cancelled():
+                self._wakeup_next(waiters)
+            raise
+
+    def _append(self, entry: _Entry, front: bool = False) -> None:
+        level = self._levels[entry.priority]
+        entries = level.setdefault(entry.tenant, deque())
+        if front:
+            entries.appendleft(entry)
+            level.move_to_end(entry.tenant, last=False)
+        else:
+            entries.append(entry)
+        self._size += 1
+
+    async def put(self, entry: _Entry) -> None:
+        while self.full():
+            await self._wait(self._putters)
+        self._append(entry)
+        self._wakeup_next(self._getters)
+
+    def put_front(self, entries: Sequence[_Entry]) -> None:
+        """Return entries taken by ``get`` to the head of the queue, in order (ignores ``maxsize``)."""
+        for entry in reversed(entries):
+            self._append(entry, front=True)
+        if entries:
+            self._wakeup_next(self._getters)
+
+    def get_nowait(self) -> _Entry:
+        for level in self._levels.values():
+            while level:
+                tenant, entries = next(iter(level.items()))
+                entry = entries.popleft()
+                if entries:
+                    level.move_to_end(tenant)
+                else:
+                    del level[tenant]
+                self._size -= 1
+                self._wakeup_next(self._putters)
+                if not entry.future.done():
+                    return entry
+        raise asyncio.QueueEmpty
+
+    async def get(self) -> _Entry:
+        while True:
+            try:
+                return self.get_nowait()
+            except asyncio.QueueEmpty:
+                await self._wait(self._getters)
+
+
+def get_executor(lane: str) -> ThreadPoolExecutor:
+    executor = _executors.get(lane)
+    if executor is None:
+        executor = _executors[lane] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"inference-{lane}")
+    return executor
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item requests for one model operation into
+    device batches.
+
+    Callers ``await submit(item)`` (or ``submit_many``); a worker task takes the
+    next queued item (see ``FairQueue`` for priority and per-tenant fairness),
+    waits up to ``max_wait_ms`` for more to arrive, and runs
+    ``fn`` once on at most ``max_batch_size()`` items on the inference thread of
+    its ``lane``. ``fn`` must return one result per input, in order. Requests
+    from different endpoints and jobs share the same queue, so a search query
+    and an ingest batch can ride in the same forward pass.
+
+    With a replica ``pool``, ``fn(items, replica)`` runs on the replica's
+    inference thread for the lane instead. The batcher keeps at most one batch
+    in flight per replica and sends each batch to the least-loaded free replica,
+    so with one replica it behaves exactly like the single-device case.
+    ``bytes_per_item`` is the estimated device memory one item needs: a batch
+    only starts on a replica whose memory budget can hold it, and is trimmed
+    (the rest goes back to the head of the queue) or held until memory frees up.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: BatchFn,
+        max_batch_size: Union[int, Callable[[], int]],
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+        lane: str = BULK_LANE,
+        max_queued: int = MAX_QUEUED_ITEMS,
+        pool: Optional["ReplicaPool"] = None,
+        bytes_per_item: Union[int, Callable[[], int]] = 0,
+    ):
+        self.name = name
+        self.lane = lane
+        self.pool = pool
+        self._bytes_per_item = bytes_per_item
+        self.max_queued = max_queued
+        self._fn = fn
+        self._max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[FairQueue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # --- Metrics ---
+        self.batches = 0
+        self.items = 0
+        self._fill_sum = 0.0
+        self._wait_sum = 0.0
+        self.last_batch_size = 0
+        self.admission_waits = 0
+        self.trimmed_batches = 0
+        _batchers[name] = self
+
+    @property
+    def max_batch_size(self) -> int:
+        size = self._max_batch_size() if callable(self._max_batch_size) else self._max_batch_size
+        return max(1, int(size))
+
+    @property
+    def bytes_per_item(self) -> int:
+        size = self._bytes_per_item() if callable(self._bytes_per_item) else self._bytes_per_item
+        return max(0, int(size))
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_worker(self) -> FairQueue:
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            # (Re)bind to the running loop, e.g. after a restart or under a test client
+            self._loop = loop
+            self._queue = FairQueue(maxsize=self.max_queued)
+            self._worker = loop.create_task(self._run(self._queue))
+        return self._queue
+
+    async def submit(self, item: Any, priority: str = BULK_LANE, tenant: str = DEFAULT_TENANT) -> Any:
+        """Queue one item and wait for its result."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}")
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put(_Entry(item, future, time.perf_counter(), priority, tenant))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # The queue drops the item when it reaches it; a running batch just discards the result
+            future.cancel()
+            raise
+
+    async def submit_many(self, items: Sequence[Any], priority: str = BULK_LANE, tenant: str = DEFAULT_TENANT) -> List[Any]:
+        """Queue several items at once; they may be split across or merged into batches."""
+        return list(await asyncio.gather(*(self.submit(item, priority, tenant) for item in items)))
+
+    async def _collect(self, queue: FairQueue) -> List[_Entry]:
+        batch = [await queue.get()]
+        limit = self.max_batch_size
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < limit:
+            try:
+                batch.append(queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _next_batch(self, queue: FairQueue) -> List[_Entry]:
+        batch = await self._collect(queue)
+        # Callers that went away (cancelled, timed out) do not need a slot
+        return [entry for entry in batch if not entry.future.done()]
+
+    async def _execute(self, batch: List[_Entry], executor: ThreadPoolExecutor, fn: BatchFn) -> None:
+        """Run ``fn`` on ``executor`` and resolve the batch's futures with its results."""
+        started = time.perf_counter()
+        self._record(len(batch), sum(started - entry.queued for entry in batch))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(executor, fn, [entry.item for entry in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name} returned {len(results)} results for {len(batch)} inputs")
+        except asyncio.CancelledError:
+            for entry in batch:
+                if not entry.future.done():
+                    entry.future.set_exception(RuntimeError(f"{self.name} batcher stopped"))
+            raise
+        except Exception as e:
+            logger.error(f"[Batcher {self.name}] Batch of {len(batch)} failed: {e}", exc_info=True)
+            for entry in batch:
+                if not entry.future.done():
+                    entry.future.set_exception(e)
+            return
+        for entry, result in zip(batch, results):
+            if not entry.future.done():
+                entry.future.set_result(result)
+
+    async def _execute_on(self, replica: "Replica", batch: List[_Entry], reserved: int) -> None:
+        started = replica.begin(len(batch), reserved)
+        try:
+            await self._execute(batch, replica.executor(self.lane), lambda items: self._fn(items, replica))
+        finally:
+            replica.end(len(batch), started, reserved)
+
+    async def _run(self, queue: FairQueue) -> None:
+        if self.pool is not None:
+            return await self._run_pooled(queue)
+        while True:
+            batch = await self._next_batch(queue)
+            if batch:
+                await self._execute(batch, get_executor(self.lane), self._fn)
+
+    async def _run_pooled(self, queue: FairQueue) -> None:
+        # replica index -> the batch task this batcher has running there
+        running: Dict[int, asyncio.Task] = {}
+        batch: List[_Entry] = []
+        try:
+            while True:
+                for index, task in list(running.items()):
+                    if task.done():
+                        del running[index]
+                if len(running) >= len(self.pool.replicas):
+                    # Every replica is busy with one of our batches; the queue fills the next one meanwhile
+                    await asyncio.wait(running.values(), return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                batch = [entry for entry in batch if not entry.future.done()] or await self._next_batch(queue)
+                if not batch:
+                    continue
+                free = [r for r in self.pool.replicas if r.index not in running]
+                bytes_per_item = self.bytes_per_item
+                admitted = self.pool.admit(free, len(batch), bytes_per_item)
+                if admitted is None:
+                    # No replica has memory for even one item: wait for a batch (ours or another model's) to finish
+                    self.admission_waits += 1
+                    if running:
+                        await asyncio.wait(running.values(), timeout=ADMISSION_RETRY_S, return_when=asyncio.FIRST_COMPLETED)
+                    else:
+                        await asyncio.sleep(ADMISSION_RETRY_S)
+                    continue
+                replica, count = admitted
+                if count < len(batch):
+                    self.trimmed_batches += 1
+                    queue.put_front(batch[count:])
+                running[replica.index] = asyncio.create_task(
+                    self._execute_on(replica, batch[:count], count * bytes_per_item)
+                )
+                batch = []
+        except asyncio.CancelledError:
+            for task in running.values():
+                task.cancel()
+            for entry in batch:
+                if not entry.future.done():
+                    entry.future.set_exception(RuntimeError(f"{self.name} batcher stopped"))
+            raise
+
+    def _record(self, size: int, waited: float) -> None:
+        self.batches += 1
+        self.items += size
+        self.last_batch_size = size
+        self._fill_sum += size / self.max_batch_size
+        self._wait_sum += waited
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "lane": self.lane,
+            "queue_depth": self.queue_depth,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "batches": self.batches,
+            "items": self.items,
+            "last_batch_size": self.last_batch_size,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "mean_batch_fill": round(self._fill_sum / self.batches, 3) if self.batches else 0.0,
+            "mean_wait_ms": round(self._wait_sum / self.items * 1000, 2) if self.items else 0.0,
+            "queued_by_tenant": self._queue.tenants() if self._queue is not None else {},
+            "bytes_per_item": self.bytes_per_item,
+            "admission_waits": self.admission_waits,
+            "trimmed_batches": self.trimmed_batches,
+        }
+
+    async def stop(self) -> None:
+        """Cancel the worker and fail anything still queued."""
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._worker
+            self._worker = None
+        while self._queue is not None and not self._queue.empty():
+            try:
+                entry = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            entry.future.set_exception(RuntimeError(f"{self.name} batcher stopped"))
+
+
+def all_metrics() -> Dict[str, Dict[str, Any]]:
+    return {name: batcher.metrics() for name, batcher in _batchers.items()}
+
+
+async def stop_all() -> None:
+    for batcher in _batchers.values():
+        await batcher.stop()
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
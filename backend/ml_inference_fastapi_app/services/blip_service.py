@@ -1,13 +1,15 @@
 import asyncio
+import copy
 import logging
 import os
-from typing import Tuple, Any
+from typing import Tuple, Any, Optional
 
 import torch
 from transformers import AutoProcessor, BlipForConditionalGeneration
 
 # Import the shared GPU lock to ensure exclusive access
 from .clip_service import gpu_lock, DEVICE
+from . import autotune, onnx_backend, replicas
 
 logger = logging.getLogger(__name__)
 
@@ -15,40 +17,67 @@ logger = logging.getLogger(__name__)
 BLIP_MODEL: Any = None
 BLIP_PROCESSOR: Any = None
 SAFE_BLIP_BATCH_SIZE = 1  # Default, will be probed
+BLIP_BATCH_PROFILE: Optional[autotune.BatchProfile] = None  # Throughput curve behind SAFE_BLIP_BATCH_SIZE
+# Memory one image is assumed to need when calibration did not measure it (CPU, ONNX, older profiles)
+BLIP_ITEM_MEMORY_MB = float(os.environ.get("ML_BLIP_ITEM_MEMORY_MB", "64"))
+DEFAULT_BLIP_INPUT_SIZE = 384  # BLIP base input resolution, used until the processor is loaded
 BLIP_MODEL_NAME_CONFIG = os.environ.get("BLIP_MODEL", "Salesforce/blip-image-captioning-base")
 
 # --- Model Loading and Management ---
 
+def _place(model: Any, device: torch.device) -> Any:
+    """Prepares a torch model for ``device``: FP16 and torch.compile on CUDA."""
+    if device.type == 'cuda':
+        # Move model to GPU with FP16 for memory efficiency
+        model.to(torch.float16)
+
+        # Apply torch.compile for performance (PyTorch 2.0+)
+        try:
+            model = torch.compile(model, mode="reduce-overhead")
+            logger.info("✅ Applied torch.compile optimization to BLIP model")
+        except Exception as e:
+            logger.warning("torch.compile for BLIP failed, continuing without it: %s", e)
+    return model.to(device)
+
 async def load_blip_model() -> Tuple[Any, Any]:
-    """Loads the BLIP model and processor into memory."""
+    """Loads the BLIP model and processor onto every replica."""
     global BLIP_MODEL, BLIP_PROCESSOR
     if BLIP_MODEL is not None:
         return BLIP_MODEL, BLIP_PROCESSOR
 
-    logger.info(f"Loading BLIP model: {BLIP_MODEL_NAME_CONFIG} on device: {DEVICE}")
+    logger.info(f"Loading BLIP model: {BLIP_MODEL_NAME_CONFIG} on replicas: {[r.name for r in replicas.pool.replicas]}")
     try:
         blip_processor = AutoProcessor.from_pretrained(BLIP_MODEL_NAME_CONFIG)
         blip_model = BlipForConditionalGeneration.from_pretrained(BLIP_MODEL_NAME_CONFIG)
 
-        if DEVICE.type == 'cuda':
-            # Move model to GPU with FP16 for memory efficiency
-            blip_model.to(torch.float16)
-            
-            # Apply torch.compile for performance (PyTorch 2.0+)
-            try:
-                blip_model = torch.compile(blip_model, mode="reduce-overhead")
-                logger.info("✅ Applied torch.compile optimization to BLIP model")
-            except Exception as e:
-                logger.warning("torch.compile for BLIP failed, continuing without it: %s", e)
-
-        blip_model = blip_model.to(DEVICE)
-        blip_model.eval()
-        BLIP_MODEL = blip_model
-        BLIP_PROCESSOR = blip_processor
+        models = {}
+        for replica in replicas.pool.replicas:
+            if onnx_backend.use_onnx(replica.device):
+                # Export/quantize runs once per model and is cached on disk; keep the loop free meanwhile
+                try:
+                    models[replica.index] = await asyncio.to_thread(
+                        onnx_backend.load_blip, blip_model, BLIP_MODEL_NAME_CONFIG,
+                        threads=replica.threads or onnx_backend.ONNX_THREADS,
+                    )
+                    logger.info(f"✅ Serving BLIP through ONNX Runtime ({onnx_backend.backend_name(models[replica.index])}) on {replica.name}")
+                except Exception as e:
+                    logger.warning("ONNX backend for BLIP failed, continuing with torch: %s", e)
+
+        # Torch replicas on the same device share weights; copy before anything is cast or moved
+        devices = list(dict.fromkeys(r.device for r in replicas.pool.replicas if r.index not in models))
+        weights = {device: blip_model if i == 0 else copy.deepcopy(blip_model) for i, device in enumerate(devices)}
+        placed = {device: _place(weights[device], device).eval() for device in devices}
+        for replica in replicas.pool.replicas:
+            model = models[replica.index] if replica.index in models else placed[replica.device]
+            # Fast tokenizers must not be shared between threads
+            replica.models["blip"] = (model, blip_processor if replica.index == 0 else copy.deepcopy(blip_processor))
+
+        BLIP_MODEL, BLIP_PROCESSOR = replicas.pool.primary.models["blip"]
         logger.info("BLIP model loaded successfully.")
-        return blip_model, blip_processor
+        return BLIP_MODEL, BLIP_PROCESSOR
     except Exception as e:
         logger.error(f"Failed to load BLIP model: {e}", exc_info=True)
+        replicas.pool.drop_model("blip")
         BLIP_MODEL = "failed"
         return None, None
 
@@ -56,7 +85,35 @@ def get_blip_model_status() -> bool:
     """Returns True if the BLIP model is loaded, False otherwise."""
     return BLIP_MODEL is not None and BLIP_MODEL != "failed"
 
-def generate_captions(images: list[Any], text: str = None, do_rescale: bool = True) -> list[str]:
+def get_blip_backend() -> str:
+    """Returns the inference backend serving BLIP ("torch", "onnx-int8", ...)."""
+    return onnx_backend.backend_name(BLIP_MODEL)
+
+def get_blip_input_size() -> int:
+    """Returns the square input resolution the BLIP image processor feeds the model."""
+    image_processor = getattr(BLIP_PROCESSOR, "image_processor", None)
+    size = getattr(image_processor, "size", None) or {}
+    try:
+        return int(size.get("height") or size.get("shortest_edge") or DEFAULT_BLIP_INPUT_SIZE)
+    except (AttributeError, TypeError, ValueError):
+        return DEFAULT_BLIP_INPUT_SIZE
+
+def _replica_model(replica: Optional[replicas.Replica]) -> Tuple[Any, Any, torch.device]:
+    """(model, processor, device) of ``replica``, or of the primary replica when None."""
+    if replica is not None and "blip" in replica.models:
+        model, processor = replica.models["blip"]
+        return model, processor, replica.device
+    return BLIP_MODEL, BLIP_PROCESSOR, DEVICE
+
+def _generate(images: list[Any], text: str = None, do_rescale: bool = True, replica: Optional[replicas.Replica] = None) -> list[str]:
+    """One generate call over ``images``, without OOM splitting (used by the batch-size probe)."""
+    model, processor, device = _replica_model(replica)
+    inputs = processor(images=images, text=text, return_tensors="pt", do_rescale=do_rescale).to(device)
+    with torch.no_grad():
+        outputs = model.generate(**inputs)
+    return [processor.decode(out, skip_special_tokens=True) for out in outputs]
+
+def generate_captions(images: list[Any], text: str = None, do_rescale: bool = True, replica: Optional[replicas.Replica] = None) -> list[str]:
     """Generates captions for a batch of pre-processed images.
     If an OOM error occurs, splits the batch and retries recursively.
     """
@@ -64,11 +121,7 @@ def generate_captions(images: list[Any], text: str = None, do_rescale: bool = Tr
         raise RuntimeError("BLIP model is not available.")
 
     try:
-        inputs = BLIP_PROCESSOR(images=images, text=text, return_tensors="pt", do_rescale=do_rescale).to(DEVICE)
-        with torch.no_grad():
-            outputs = BLIP_MODEL.generate(**inputs)
-        captions = [BLIP_PROCESSOR.decode(out, skip_special_tokens=True) for out in outputs]
-        return captions
+        return _generate(images, text=text, do_rescale=do_rescale, replica=replica)
     except RuntimeError as e:
         # WARNING: This function previously caused CUDA OOM errors when batch size was too large.
         # If you see 'CUDA out of memory', this block will split the batch and retry.
@@ -79,54 +132,39 @@ def generate_captions(images: list[Any], text: str = None, do_rescale: bool = Tr
                 logger.error(f"[BLIP] OOM on single image. Cannot split further.")
                 raise
             mid = len(images) // 2
-            left = generate_captions(images[:mid], text=text, do_rescale=do_rescale)
-            right = generate_captions(images[mid:], text=text, do_rescale=do_rescale)
+            left = generate_captions(images[:mid], text=text, do_rescale=do_rescale, replica=replica)
+            right = generate_captions(images[mid:], text=text, do_rescale=do_rescale, replica=replica)
             return left + right
         else:
             raise
 
-# --- Performance & Memory Probing ---
+# --- Batch-size Calibration ---
 
-def _probe_model_memory(run_one_image_fn) -> int:
-    """Helper to probe GPU memory for a single inference call."""
-    if DEVICE.type != "cuda":
-        return 1
+def recalculate_safe_batch_size():
+    """Calibrates the BLIP batch size on the primary replica (or reuses the persisted profile)."""
+    global SAFE_BLIP_BATCH_SIZE, BLIP_BATCH_PROFILE
+    if not get_blip_model_status():
+        SAFE_BLIP_BATCH_SIZE = 1
+        BLIP_BATCH_PROFILE = None
+        return
 
-    # Clear cache and reset peak memory statistics
-    torch.cuda.empty_cache()
-    torch.cuda.reset_peak_memory_stats(DEVICE)
-    # Record baseline memory usage
-    baseline = torch.cuda.memory_allocated(DEVICE)
     try:
-        run_one_image_fn()
+        BLIP_BATCH_PROFILE = autotune.tune(BLIP_MODEL_NAME_CONFIG, get_blip_backend(), _generate, DEVICE)
+        SAFE_BLIP_BATCH_SIZE = max(1, BLIP_BATCH_PROFILE.batch_size)
     except Exception as e:
-        logger.error(f"Probing function failed: {e}", exc_info=True)
-        torch.cuda.empty_cache()
-        return 1
-    # Get peak memory usage during inference
-    peak = torch.cuda.max_memory_allocated(DEVICE)
-    torch.cuda.empty_cache()
-    # Calculate memory used by one inference
-    mem_used = peak - baseline
-    return mem_used if mem_used > 0 else 1
-
-def recalculate_safe_batch_size():
-    """Calculates and sets the safe batch size for the BLIP model."""
-    global SAFE_BLIP_BATCH_SIZE
-    if not get_blip_model_status() or DEVICE.type != "cuda":
+        logger.error(f"BLIP batch-size calibration failed: {e}", exc_info=True)
+        if DEVICE.type == "cuda":
+            torch.cuda.empty_cache()
         SAFE_BLIP_BATCH_SIZE = 1
-        return
+        BLIP_BATCH_PROFILE = None
+    logger.info(f"Recalculated SAFE_BLIP_BATCH_SIZE: {SAFE_BLIP_BATCH_SIZE}")
 
-    def _one_blip_real():
-        dummy_image = torch.zeros((3, 224, 224))
-        generate_captions([dummy_image], do_rescale=False)
 
-    free_mem, _ = torch.cuda.mem_get_info(DEVICE)
-    mem_per_item = _probe_model_memory(_one_blip_real)
-    
-    safe_size = int((free_mem * 0.8) / mem_per_item)
-    SAFE_BLIP_BATCH_SIZE = max(1, safe_size)
-    logger.info(f"Recalculated SAFE_BLIP_BATCH_SIZE: {SAFE_BLIP_BATCH_SIZE}")
+def item_memory_bytes() -> int:
+    """Estimated memory per image of a BLIP batch, for the batchers' memory admission."""
+    if BLIP_BATCH_PROFILE is not None and BLIP_BATCH_PROFILE.bytes_per_item:
+        return BLIP_BATCH_PROFILE.bytes_per_item
+    return int(BLIP_ITEM_MEMORY_MB * 2**20)
 
 
 async def cooldown_blip_model():
@@ -134,6 +172,7 @@ async def cooldown_blip_model():
     global BLIP_MODEL, BLIP_PROCESSOR
     if BLIP_MODEL is not None and BLIP_MODEL != "failed":
         logger.info("Unloading BLIP model from memory.")
+        replicas.pool.drop_model("blip")
         del BLIP_MODEL
         del BLIP_PROCESSOR
         BLIP_MODEL = None
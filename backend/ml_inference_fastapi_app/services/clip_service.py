@@ -1,57 +1,90 @@
 import asyncio
+import copy
 import logging
 import os
-from typing import Tuple, Any
+from typing import Tuple, Any, Optional
 
 import torch
 from transformers import AutoProcessor, AutoModel
 
+from . import autotune, onnx_backend, replicas
+
 logger = logging.getLogger(__name__)
 
 # --- Globals for CLIP Service ---
 CLIP_MODEL: Any = None
 CLIP_PROCESSOR: Any = None
 SAFE_CLIP_BATCH_SIZE = 1  # Default, will be probed
+CLIP_BATCH_PROFILE: Optional[autotune.BatchProfile] = None  # Throughput curve behind SAFE_CLIP_BATCH_SIZE
+# Memory one image is assumed to need when calibration did not measure it (CPU, ONNX, older profiles)
+CLIP_ITEM_MEMORY_MB = float(os.environ.get("ML_CLIP_ITEM_MEMORY_MB", "16"))
+DEFAULT_CLIP_INPUT_SIZE = 224  # ViT-B/32 input resolution, used until the processor is loaded
 CLIP_MODEL_NAME_CONFIG = os.environ.get("CLIP_MODEL", "openai/clip-vit-base-patch32")
 DEVICE_PREFERENCE = os.environ.get("DEVICE", "cuda" if torch.cuda.is_available() else "cpu")
 DEVICE = torch.device(DEVICE_PREFERENCE)
+# Replicas serving CLIP and BLIP (ML_DEVICES, ML_CPU_REPLICAS); DEVICE is the primary one's
+replicas.pool.configure(replicas.replica_devices(DEVICE))
+DEVICE = replicas.pool.primary.device
 
 # GPU lock for exclusive access
 gpu_lock = asyncio.Lock()
 
 # --- Model Loading and Management ---
 
+def _place(model: Any, device: torch.device) -> Any:
+    """Prepares a torch model for ``device``: FP16 and torch.compile on CUDA."""
+    if device.type == 'cuda':
+        # FP16 for memory efficiency
+        model.to(torch.float16)
+
+        # Apply torch.compile for performance (PyTorch 2.0+)
+        try:
+            # mode="reduce-overhead" is great for inference
+            model = torch.compile(model, mode="reduce-overhead")
+            logger.info("✅ Applied torch.compile optimization to CLIP model")
+        except Exception as e:
+            logger.warning("torch.compile for CLIP failed, continuing without it: %s", e)
+    return model.to(device)
+
 async def load_clip_model() -> Tuple[Any, Any]:
-    """Loads the CLIP model and processor into memory."""
+    """Loads the CLIP model and processor onto every replica."""
     global CLIP_MODEL, CLIP_PROCESSOR
     if CLIP_MODEL is not None:
         return CLIP_MODEL, CLIP_PROCESSOR
 
-    logger.info(f"Loading CLIP model: {CLIP_MODEL_NAME_CONFIG} on device: {DEVICE}")
+    logger.info(f"Loading CLIP model: {CLIP_MODEL_NAME_CONFIG} on replicas: {[r.name for r in replicas.pool.replicas]}")
     try:
         processor = AutoProcessor.from_pretrained(CLIP_MODEL_NAME_CONFIG)
         clip_model = AutoModel.from_pretrained(CLIP_MODEL_NAME_CONFIG)
 
-        if DEVICE.type == 'cuda':
-            # FP16 for memory efficiency
-            clip_model.to(torch.float16)
-            
-            # Apply torch.compile for performance (PyTorch 2.0+)
-            try:
-                # mode="reduce-overhead" is great for inference
-                clip_model = torch.compile(clip_model, mode="reduce-overhead")
-                logger.info("✅ Applied torch.compile optimization to CLIP model")
-            except Exception as e:
-                logger.warning("torch.compile for CLIP failed, continuing without it: %s", e)
-
-        clip_model = clip_model.to(DEVICE)
-        clip_model.eval()
-        CLIP_MODEL = clip_model
-        CLIP_PROCESSOR = processor
+        models = {}
+        for replica in replicas.pool.replicas:
+            if onnx_backend.use_onnx(replica.device):
+                # Export/quantize runs once per model and is cached on disk; keep the loop free meanwhile
+                try:
+                    models[replica.index] = await asyncio.to_thread(
+                        onnx_backend.load_clip, clip_model, CLIP_MODEL_NAME_CONFIG,
+                        threads=replica.threads or onnx_backend.ONNX_THREADS,
+                    )
+                    logger.info(f"✅ Serving CLIP through ONNX Runtime ({onnx_backend.backend_name(models[replica.index])}) on {replica.name}")
+                except Exception as e:
+                    logger.warning("ONNX backend for CLIP failed, continuing with torch: %s", e)
+
+        # Torch replicas on the same device share weights; copy before anything is cast or moved
+        devices = list(dict.fromkeys(r.device for r in replicas.pool.replicas if r.index not in models))
+        weights = {device: clip_model if i == 0 else copy.deepcopy(clip_model) for i, device in enumerate(devices)}
+        placed = {device: _place(weights[device], device).eval() for device in devices}
+        for replica in replicas.pool.replicas:
+            model = models[replica.index] if replica.index in models else placed[replica.device]
+            # Fast tokenizers must not be shared between threads
+            replica.models["clip"] = (model, processor if replica.index == 0 else copy.deepcopy(processor))
+
+        CLIP_MODEL, CLIP_PROCESSOR = replicas.pool.primary.models["clip"]
         logger.info("CLIP model loaded successfully.")
-        return clip_model, processor
+        return CLIP_MODEL, CLIP_PROCESSOR
     except Exception as e:
         logger.error(f"Failed to load CLIP model: {e}", exc_info=True)
+        replicas.pool.drop_model("clip")
         CLIP_MODEL = "failed" # Mark as failed to prevent retries
         return None, None
 
@@ -59,17 +92,45 @@ def get_clip_model_status() -> bool:
     """Returns True if the CLIP model is loaded, False otherwise."""
     return CLIP_MODEL is not None and CLIP_MODEL != "failed"
 
-def encode_text_batch(texts: list[str]) -> torch.Tensor:
+def get_clip_backend() -> str:
+    """Returns the inference backend serving CLIP ("torch", "onnx-int8", ...)."""
+    return onnx_backend.backend_name(CLIP_MODEL)
+
+def get_clip_input_size() -> int:
+    """Returns the square input resolution the CLIP image processor feeds the model."""
+    image_processor = getattr(CLIP_PROCESSOR, "image_processor", None)
+    size = getattr(image_processor, "crop_size", None) or getattr(image_processor, "size", None) or {}
+    try:
+        return int(size.get("height") or size.get("shortest_edge") or DEFAULT_CLIP_INPUT_SIZE)
+    except (AttributeError, TypeError, ValueError):
+        return DEFAULT_CLIP_INPUT_SIZE
+
+def _replica_model(replica: Optional[replicas.Replica]) -> Tuple[Any, Any, torch.device]:
+    """(model, processor, device) of ``replica``, or of the primary replica when None."""
+    if replica is not None and "clip" in replica.models:
+        model, processor = replica.models["clip"]
+        return model, processor, replica.device
+    return CLIP_MODEL, CLIP_PROCESSOR, DEVICE
+
+def encode_text_batch(texts: list[str], replica: Optional[replicas.Replica] = None) -> torch.Tensor:
     """Encodes a batch of text queries using the loaded CLIP model."""
     if not get_clip_model_status():
         raise RuntimeError("CLIP model is not available.")
-        
-    inputs = CLIP_PROCESSOR(text=texts, return_tensors="pt", padding=True, truncation=True).to(DEVICE)
+
+    model, processor, device = _replica_model(replica)
+    inputs = processor(text=texts, return_tensors="pt", padding=True, truncation=True).to(device)
     with torch.no_grad():
-        text_features = CLIP_MODEL.get_text_features(**inputs)
+        text_features = model.get_text_features(**inputs)
     return text_features
 
-def encode_image_batch(images: list[Any]) -> torch.Tensor:
+def _encode_images(images: list[Any], replica: Optional[replicas.Replica] = None) -> torch.Tensor:
+    """One forward pass over ``images``, without OOM splitting (used by the batch-size probe)."""
+    model, processor, device = _replica_model(replica)
+    inputs = processor(images=images, return_tensors="pt").to(device)
+    with torch.no_grad():
+        return model.get_image_features(**inputs)
+
+def encode_image_batch(images: list[Any], replica: Optional[replicas.Replica] = None) -> torch.Tensor:
     """Encodes a batch of pre-processed images using the loaded CLIP model.
     If an OOM error occurs, splits the batch and retries recursively.
     """
@@ -77,10 +138,7 @@ def encode_image_batch(images: list[Any]) -> torch.Tensor:
         raise RuntimeError("CLIP model is not available.")
 
     try:
-        inputs = CLIP_PROCESSOR(images=images, return_tensors="pt").to(DEVICE)
-        with torch.no_grad():
-            image_features = CLIP_MODEL.get_image_features(**inputs)
-        return image_features
+        return _encode_images(images, replica)
     except RuntimeError as e:
         # WARNING: This function previously caused CUDA OOM errors when batch size was too large.
         # If you see 'CUDA out of memory', this block will split the batch and retry.
@@ -91,57 +149,40 @@ def encode_image_batch(images: list[Any]) -> torch.Tensor:
                 logger.error(f"[CLIP] OOM on single image. Cannot split further.")
                 raise
             mid = len(images) // 2
-            left = encode_image_batch(images[:mid])
-            right = encode_image_batch(images[mid:])
+            left = encode_image_batch(images[:mid], replica)
+            right = encode_image_batch(images[mid:], replica)
             # Concatenate results
             return torch.cat([left, right], dim=0)
         else:
             raise
 
-# --- Performance & Memory Probing ---
+# --- Batch-size Calibration ---
 
-def _probe_model_memory(run_one_image_fn) -> int:
-    """Helper to probe GPU memory for a single inference call."""
-    if DEVICE.type != "cuda":
-        return 1
+def recalculate_safe_batch_size():
+    """Calibrates the CLIP batch size on the primary replica (or reuses the persisted profile)."""
+    global SAFE_CLIP_BATCH_SIZE, CLIP_BATCH_PROFILE
+    if not get_clip_model_status():
+        SAFE_CLIP_BATCH_SIZE = 1
+        CLIP_BATCH_PROFILE = None
+        return
 
-    # Clear cache and reset peak memory statistics
-    torch.cuda.empty_cache()
-    torch.cuda.reset_peak_memory_stats(DEVICE)
-    # Record baseline memory usage
-    baseline = torch.cuda.memory_allocated(DEVICE)
     try:
-        run_one_image_fn()
+        CLIP_BATCH_PROFILE = autotune.tune(CLIP_MODEL_NAME_CONFIG, get_clip_backend(), _encode_images, DEVICE)
+        SAFE_CLIP_BATCH_SIZE = max(1, CLIP_BATCH_PROFILE.batch_size)
     except Exception as e:
-        logger.error(f"Probing function failed: {e}", exc_info=True)
-        torch.cuda.empty_cache()
-        return 1
-    # Get peak memory usage during inference
-    peak = torch.cuda.max_memory_allocated(DEVICE)
-    torch.cuda.empty_cache()
-    # Calculate memory used by one inference
-    mem_used = peak - baseline
-    return mem_used if mem_used > 0 else 1
-
-
-def recalculate_safe_batch_size():
-    """Calculates and sets the safe batch size for the CLIP model."""
-    global SAFE_CLIP_BATCH_SIZE
-    if not get_clip_model_status() or DEVICE.type != "cuda":
+        logger.error(f"CLIP batch-size calibration failed: {e}", exc_info=True)
+        if DEVICE.type == "cuda":
+            torch.cuda.empty_cache()
         SAFE_CLIP_BATCH_SIZE = 1
-        return
+        CLIP_BATCH_PROFILE = None
+    logger.info(f"Recalculated SAFE_CLIP_BATCH_SIZE: {SAFE_CLIP_BATCH_SIZE}")
 
-    def _one_clip_real():
-        dummy_image = torch.zeros((3, 224, 224), device=DEVICE)
-        encode_image_batch([dummy_image])
 
-    free_mem, _ = torch.cuda.mem_get_info(DEVICE)
-    mem_per_item = _probe_model_memory(_one_clip_real)
-    
-    # Calculate batch size with a 20% safety margin
-    safe_size = int((free_mem * 0.8) / mem_per_item)
-    SAFE_CLIP_BATCH_SIZE = max(1, safe_size)
-    logger.info(f"Recalculated SAFE_CLIP_BATCH_SIZE: {SAFE_CLIP_BATCH_SIZE}")
+def item_memory_bytes() -> int:
+    """Estimated memory per image of a CLIP batch, for the batchers' memory admission."""
+    if CLIP_BATCH_PROFILE is not None and CLIP_BATCH_PROFILE.bytes_per_item:
+        return CLIP_BATCH_PROFILE.bytes_per_item
+    return int(CLIP_ITEM_MEMORY_MB * 2**20)
 
 
 async def cooldown_clip_model():
@@ -149,6 +190,7 @@ async def cooldown_clip_model():
     global CLIP_MODEL, CLIP_PROCESSOR
     if CLIP_MODEL is not None and CLIP_MODEL != "failed":
         logger.info("Unloading CLIP model from memory.")
+        replicas.pool.drop_model("clip")
         del CLIP_MODEL
         del CLIP_PROCESSOR
         CLIP_MODEL = None
@@ -0,0 +1,319 @@
+"""
+ONNX Runtime inference backend for the CLIP and BLIP services.
+
+The PyTorch models are exported once per model name to ``ML_ONNX_CACHE_DIR``
+(CLIP vision and text towers, BLIP vision encoder and text decoder), optionally
+int8 dynamically quantized, and served through ONNX Runtime sessions. The
+wrappers expose the subset of the transformers API the services call
+(``get_image_features``, ``get_text_features``, ``generate``) and take and return
+torch tensors, so ``clip_service``/``blip_service`` use them in place of the
+eager model.
+
+Configuration:
+- ``ML_INFERENCE_BACKEND``: ``torch`` (default), ``onnx``, or ``auto`` (ONNX on CPU-only nodes when onnxruntime is installed)
+- ``ML_ONNX_QUANTIZE``: ``int8`` (default) or ``none``
+- ``ML_ONNX_PROVIDERS``: comma-separated execution providers, e.g. ``OpenVINOExecutionProvider,CPUExecutionProvider``
+- ``ML_ONNX_THREADS``: intra-op threads per session (0 lets ONNX Runtime decide)
+"""
+import hashlib
+import inspect
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_BACKEND = os.environ.get("ML_INFERENCE_BACKEND", "torch").lower()
+ONNX_QUANTIZE = os.environ.get("ML_ONNX_QUANTIZE", "int8").lower()
+ONNX_PROVIDERS = [p.strip() for p in os.environ.get("ML_ONNX_PROVIDERS", "CPUExecutionProvider").split(",") if p.strip()]
+ONNX_THREADS = int(os.environ.get("ML_ONNX_THREADS", "0"))
+ONNX_CACHE_DIR = Path(os.environ.get("ML_ONNX_CACHE_DIR", ".onnx_cache"))
+ONNX_OPSET = 17
+
+BACKENDS = {"torch", "onnx", "auto"}
+
+
+def onnxruntime_available() -> bool:
+    try:
+        import onnxruntime  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def use_onnx(device: torch.device) -> bool:
+    """Whether the services should serve models through ONNX Runtime on ``device``."""
+    if INFERENCE_BACKEND not in BACKENDS:
+        logger.warning(f"Unknown ML_INFERENCE_BACKEND '{INFERENCE_BACKEND}', using torch")
+        return False
+    if INFERENCE_BACKEND == "torch":
+        return False
+    if not onnxruntime_available():
+        if INFERENCE_BACKEND == "onnx":
+            logger.warning("ML_INFERENCE_BACKEND=onnx but onnxruntime is not installed, using torch")
+        return False
+    if INFERENCE_BACKEND == "auto":
+        return device.type == "cpu"
+    return True
+
+
+def is_onnx(model: Any) -> bool:
+    return isinstance(model, (OnnxClipModel, OnnxBlipModel))
+
+
+def backend_name(model: Any) -> str:
+    """Backend label for capability reporting."""
+    if is_onnx(model):
+        return f"onnx-{model.quantization}"
+    return "torch"
+
+
+# --- Export ---
+
+def _features(output: Any) -> torch.Tensor:
+    """Projected features from ``get_*_features``; newer transformers return a model output."""
+    if isinstance(output, torch.Tensor):
+        return output
+    return output.pooler_output
+
+
+class _ClipVision(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return _features(self.model.get_image_features(pixel_values=pixel_values))
+
+
+class _ClipText(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return _features(self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask))
+
+
+class _BlipVision(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.vision_model = model.vision_model
+
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values, return_dict=False)[0]
+
+
+class _BlipDecoderStep(torch.nn.Module):
+    """Next-token logits for the whole prefix (no KV cache; captions are ~20 tokens)."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.text_decoder = model.text_decoder
+
+    def forward(self, input_ids, attention_mask, encoder_hidden_states):
+        logits = self.text_decoder(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            encoder_hidden_states=encoder_hidden_states,
+            return_dict=False,
+        )[0]
+        return logits[:, -1, :]
+
+
+def _export(module: torch.nn.Module, args: tuple, path: Path, input_names: List[str], output_names: List[str], dynamic_axes: Dict[str, Dict[int, str]]) -> None:
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # The TorchScript exporter handles the transformers control flow without onnxscript
+        kwargs["dynamo"] = False
+    tmp_path = path.with_suffix(".tmp")
+    with torch.no_grad():
+        torch.onnx.export(
+            module.eval(),
+            args,
+            str(tmp_path),
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+            do_constant_folding=True,
+            **kwargs,
+        )
+    os.replace(tmp_path, path)
+
+
+def _quantize(path: Path, quantization: str) -> Path:
+    if quantization != "int8":
+        return path
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized = path.with_name(f"{path.stem}.int8.onnx")
+    if not quantized.exists():
+        logger.info(f"Quantizing {path.name} to int8 (dynamic)")
+        tmp_path = quantized.with_suffix(".tmp")
+        quantize_dynamic(str(path), str(tmp_path), weight_type=QuantType.QInt8)
+        os.replace(tmp_path, quantized)
+    return quantized
+
+
+def _model_dir(model_name: str, cache_dir: Path) -> Path:
+    slug = model_name.replace("/", "--")
+    digest = hashlib.sha1(f"{model_name}:{torch.__version__}:{ONNX_OPSET}".encode()).hexdigest()[:8]
+    path = cache_dir / f"{slug}-{digest}"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _session(path: Path, threads: int = ONNX_THREADS):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads > 0:
+        options.intra_op_num_threads = threads
+    available = set(ort.get_available_providers())
+    providers = [p for p in ONNX_PROVIDERS if p in available] or ["CPUExecutionProvider"]
+    return ort.InferenceSession(str(path), sess_options=options, providers=providers)
+
+
+def _numpy(tensor: Any, dtype) -> np.ndarray:
+    if isinstance(tensor, torch.Tensor):
+        tensor = tensor.detach().cpu().numpy()
+    return np.ascontiguousarray(tensor, dtype=dtype)
+
+
+# --- Runtime wrappers ---
+
+class OnnxClipModel:
+    """CLIP image and text towers served by ONNX Runtime."""
+
+    def __init__(self, vision_path: Path, text_path: Path, quantization: str, threads: int = ONNX_THREADS):
+        self.vision = _session(vision_path, threads)
+        self.text = _session(text_path, threads)
+        self.quantization = quantization
+
+    def get_image_features(self, pixel_values: Any, **_: Any) -> torch.Tensor:
+        features = self.vision.run(None, {"pixel_values": _numpy(pixel_values, np.float32)})[0]
+        return torch.from_numpy(features)
+
+    def get_text_features(self, input_ids: Any, attention_mask: Any = None, **_: Any) -> torch.Tensor:
+        input_ids = _numpy(input_ids, np.int64)
+        if attention_mask is None:
+            attention_mask = np.ones_like(input_ids)
+        features = self.text.run(None, {"input_ids": input_ids, "attention_mask": _numpy(attention_mask, np.int64)})[0]
+        return torch.from_numpy(features)
+
+    def eval(self):
+        return self
+
+
+class OnnxBlipModel:
+    """BLIP vision encoder and text decoder served by ONNX Runtime, with greedy decoding."""
+
+    def __init__(self, vision_path: Path, decoder_path: Path, quantization: str, bos_token_id: int, sep_token_id: int, pad_token_id: int, max_length: int, threads: int = ONNX_THREADS):
+        self.vision = _session(vision_path, threads)
+        self.decoder = _session(decoder_path, threads)
+        self.quantization = quantization
+        self.bos_token_id = bos_token_id
+        self.sep_token_id = sep_token_id
+        self.pad_token_id = pad_token_id
+        self.max_length = max_length
+
+    def generate(self, pixel_values: Any, input_ids: Any = None, attention_mask: Any = None, max_length: Optional[int] = None, **_: Any) -> torch.Tensor:
+        """Greedy caption generation matching ``BlipForConditionalGeneration.generate`` defaults."""
+        max_length = max_length or self.max_length
+        image_embeds = self.vision.run(None, {"pixel_values": _numpy(pixel_values, np.float32)})[0]
+        batch_size = image_embeds.shape[0]
+
+        # Same prompt handling as BLIP: BOS replaces [CLS] and the trailing [SEP] is dropped
+        if input_ids is None:
+            tokens = np.full((batch_size, 1), self.bos_token_id, dtype=np.int64)
+            mask = np.ones_like(tokens)
+        else:
+            tokens = _numpy(input_ids, np.int64)[:, :-1].copy()
+            tokens[:, 0] = self.bos_token_id
+            mask = _numpy(attention_mask, np.int64)[:, :-1] if attention_mask is not None else np.ones_like(tokens)
+
+        finished = np.zeros(batch_size, dtype=bool)
+        while tokens.shape[1] < max_length and not finished.all():
+            logits = self.decoder.run(None, {
+                "input_ids": tokens,
+                "attention_mask": mask,
+                "encoder_hidden_states": image_embeds,
+            })[0]
+            next_tokens = np.where(finished, self.pad_token_id, logits.argmax(axis=-1))
+            tokens = np.concatenate([tokens, next_tokens[:, None]], axis=1)
+            mask = np.concatenate([mask, np.ones((batch_size, 1), dtype=np.int64)], axis=1)
+            finished |= next_tokens == self.sep_token_id
+        return torch.from_numpy(tokens)
+
+    def eval(self):
+        return self
+
+
+def load_clip(model: Any, model_name: str, quantization: str = ONNX_QUANTIZE, cache_dir: Path = ONNX_CACHE_DIR, threads: int = ONNX_THREADS) -> OnnxClipModel:
+    """Export (once) and load the CLIP towers of ``model`` as ONNX Runtime sessions with ``threads`` intra-op threads."""
+    model_dir = _model_dir(model_name, cache_dir)
+    vision_path, text_path = model_dir / "clip_vision.onnx", model_dir / "clip_text.onnx"
+    model = model.float().eval()
+    if not vision_path.exists():
+        size = model.config.vision_config.image_size
+        logger.info(f"Exporting CLIP vision tower to {vision_path}")
+        _export(
+            _ClipVision(model), (torch.zeros(1, 3, size, size),), vision_path,
+            ["pixel_values"], ["image_embeds"], {"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+        )
+    if not text_path.exists():
+        logger.info(f"Exporting CLIP text tower to {text_path}")
+        ids = torch.ones(2, 7, dtype=torch.long)
+        _export(
+            _ClipText(model), (ids, torch.ones_like(ids)), text_path,
+            ["input_ids", "attention_mask"], ["text_embeds"],
+            {"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"}, "text_embeds": {0: "batch"}},
+        )
+    return OnnxClipModel(_quantize(vision_path, quantization), _quantize(text_path, quantization), quantization, threads=threads)
+
+
+def load_blip(model: Any, model_name: str, quantization: str = ONNX_QUANTIZE, cache_dir: Path = ONNX_CACHE_DIR, threads: int = ONNX_THREADS) -> OnnxBlipModel:
+    """Export (once) and load the BLIP vision encoder and text decoder as ONNX Runtime sessions with ``threads`` intra-op threads."""
+    model_dir = _model_dir(model_name, cache_dir)
+    vision_path, decoder_path = model_dir / "blip_vision.onnx", model_dir / "blip_decoder.onnx"
+    model = model.float().eval()
+    if not vision_path.exists():
+        size = model.config.vision_config.image_size
+        logger.info(f"Exporting BLIP vision encoder to {vision_path}")
+        _export(
+            _BlipVision(model), (torch.zeros(1, 3, size, size),), vision_path,
+            ["pixel_values"], ["image_embeds"], {"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+        )
+    if not decoder_path.exists():
+        logger.info(f"Exporting BLIP text decoder to {decoder_path}")
+        with torch.no_grad():
+            image_embeds = _BlipVision(model)(torch.zeros(2, 3, model.config.vision_config.image_size, model.config.vision_config.image_size))
+        ids = torch.full((2, 3), model.config.text_config.bos_token_id, dtype=torch.long)
+        _export(
+            _BlipDecoderStep(model), (ids, torch.ones_like(ids), image_embeds), decoder_path,
+            ["input_ids", "attention_mask", "encoder_hidden_states"], ["logits"],
+            {
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "encoder_hidden_states": {0: "batch", 1: "patches"},
+                "logits": {0: "batch"},
+            },
+        )
+    text_config = model.config.text_config
+    generation_config = getattr(model.text_decoder, "generation_config", None)
+    return OnnxBlipModel(
+        _quantize(vision_path, quantization),
+        _quantize(decoder_path, quantization),
+        quantization,
+        bos_token_id=text_config.bos_token_id,
+        sep_token_id=text_config.sep_token_id,
+        pad_token_id=text_config.pad_token_id,
+        max_length=getattr(generation_config, "max_length", None) or 20,
+        threads=threads,
+    )
@@ -0,0 +1,237 @@
+"""
+Model replicas: one ML service node serving from every device of a machine.
+
+By default there is a single replica on ``DEVICE``, which is the old
+single-device behaviour. ``ML_DEVICES`` lists the devices to serve from
+(``cuda:0,cuda:1``, or ``all`` for every visible GPU); ``ML_CPU_REPLICAS``
+turns a ``cpu`` entry into several CPU replicas, each running on its own
+threads with ``ML_CPU_THREADS_PER_REPLICA`` intra-op threads (default: cores
+divided by replicas). Every replica holds its own CLIP and BLIP (replicas on
+the same device share torch weights) and its own inference threads per lane;
+the micro-batchers send each batch to the least-loaded replica.
+
+Each replica also has a memory budget: on CUDA the memory left free once the
+models are loaded (minus ``ML_VRAM_RESERVE_MB``), on CPU ``ML_CPU_MEMORY_BUDGET_MB``
+(unlimited by default). Batches reserve their estimated memory before they
+start (``ReplicaPool.admit``), so CLIP and BLIP batches running side by side on
+one GPU cannot together exceed it.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Devices to load replicas on; empty means DEVICE only
+ML_DEVICES = os.environ.get("ML_DEVICES", "").strip()
+# Replicas per "cpu" entry of ML_DEVICES (or of DEVICE)
+ML_CPU_REPLICAS = int(os.environ.get("ML_CPU_REPLICAS", "1"))
+# Intra-op threads per CPU replica; 0 = cores / ML_CPU_REPLICAS (torch default for one replica)
+ML_CPU_THREADS_PER_REPLICA = int(os.environ.get("ML_CPU_THREADS_PER_REPLICA", "0"))
+# CUDA memory kept out of the batch budget (allocator fragmentation, other processes)
+ML_VRAM_RESERVE_MB = int(os.environ.get("ML_VRAM_RESERVE_MB", "512"))
+# Memory the batches of all CPU replicas may use together; 0 = unlimited
+ML_CPU_MEMORY_BUDGET_MB = int(os.environ.get("ML_CPU_MEMORY_BUDGET_MB", "0"))
+
+
+def replica_devices(
+    default: torch.device,
+    spec: str = ML_DEVICES,
+    cpu_replicas: int = ML_CPU_REPLICAS,
+    cpu_threads: int = ML_CPU_THREADS_PER_REPLICA,
+) -> List[Tuple[torch.device, int]]:
+    """``(device, intra-op threads)`` for every replica; threads is 0 where the device decides."""
+    if not spec:
+        devices = [default]
+    elif spec.lower() == "all":
+        count = torch.cuda.device_count() if torch.cuda.is_available() else 0
+        devices = [torch.device(f"cuda:{i}") for i in range(count)] or [torch.device("cpu")]
+    else:
+        devices = [torch.device(name.strip()) for name in spec.split(",") if name.strip()]
+
+    cpu_replicas = max(1, cpu_replicas)
+    result: List[Tuple[torch.device, int]] = []
+    for device in devices:
+        if device.type != "cpu":
+            result.append((device, 0))
+            continue
+        threads = cpu_threads or (max(1, (os.cpu_count() or 1) // cpu_replicas) if cpu_replicas > 1 else 0)
+        result.extend((device, threads) for _ in range(cpu_replicas))
+    return result
+
+
+class Replica:
+    """One device (or CPU thread group) with its loaded models and inference threads."""
+
+    def __init__(self, index: int, device: torch.device, threads: int = 0):
+        self.index = index
+        self.device = device
+        self.threads = threads
+        # "clip" / "blip" -> (model, processor), filled in by the model services
+        self.models: Dict[str, Tuple[Any, Any]] = {}
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        # --- Memory budget (bytes; capacity 0 = unlimited) ---
+        self.memory_capacity = 0
+        self.reserved_bytes = 0
+        # --- Load and metrics ---
+        self.inflight_items = 0
+        self.inflight_batches = 0
+        self.batches = 0
+        self.items = 0
+        self.busy_s = 0.0
+        self.last_dispatch = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"{self.device}#{self.index}"
+
+    def _pin_threads(self) -> None:
+        if self.threads:
+            torch.set_num_threads(self.threads)
+
+    def executor(self, lane: str) -> ThreadPoolExecutor:
+        """Single inference thread of this replica for ``lane`` (see ``batcher``)."""
+        executor = self._executors.get(lane)
+        if executor is None:
+            executor = self._executors[lane] = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix=f"inference-{lane}-r{self.index}",
+                initializer=self._pin_threads,
+            )
+        return executor
+
+    def fits(self, count: int, bytes_per_item: int) -> int:
+        """How many of ``count`` items fit into the unreserved memory."""
+        if not self.memory_capacity or bytes_per_item <= 0:
+            return count
+        return max(0, min(count, (self.memory_capacity - self.reserved_bytes) // bytes_per_item))
+
+    def begin(self, items: int, reserved: int = 0) -> float:
+        self.reserved_bytes += reserved
+        self.inflight_items += items
+        self.inflight_batches += 1
+        self.last_dispatch = time.monotonic()
+        return time.perf_counter()
+
+    def end(self, items: int, started: float, reserved: int = 0) -> None:
+        self.reserved_bytes -= reserved
+        self.inflight_items -= items
+        self.inflight_batches -= 1
+        self.batches += 1
+        self.items += items
+        self.busy_s += time.perf_counter() - started
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "device": str(self.device),
+            "threads": self.threads,
+            "models": sorted(self.models),
+            "inflight_items": self.inflight_items,
+            "inflight_batches": self.inflight_batches,
+            "batches": self.batches,
+            "items": self.items,
+            "busy_s": round(self.busy_s, 3),
+            "memory_capacity_mb": round(self.memory_capacity / 2**20, 1),
+            "reserved_mb": round(self.reserved_bytes / 2**20, 1),
+        }
+
+    def shutdown(self) -> None:
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors.clear()
+
+
+class ReplicaPool:
+    """The replicas of this process. The first one is the primary (DEVICE), used for calibration."""
+
+    def __init__(self):
+        self.replicas: List[Replica] = []
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    @property
+    def primary(self) -> Optional[Replica]:
+        return self.replicas[0] if self.replicas else None
+
+    def configure(self, devices: Sequence[Tuple[torch.device, int]]) -> None:
+        """(Re)create the replicas; models are loaded onto them by the model services."""
+        if not devices:
+            raise ValueError("At least one replica device is required")
+        self.shutdown()
+        self.replicas = [Replica(i, device, threads) for i, (device, threads) in enumerate(devices)]
+        if len(self.replicas) > 1:
+            logger.info(f"Serving from {len(self.replicas)} replicas: {[r.name for r in self.replicas]}")
+
+    def least_loaded(self, candidates: Optional[Sequence[Replica]] = None) -> Replica:
+        """Replica with the fewest items in flight; ties go to the one idle longest."""
+        return min(candidates or self.replicas, key=lambda r: (r.inflight_items, r.last_dispatch))
+
+    def admit(self, candidates: Sequence[Replica], count: int, bytes_per_item: int) -> Optional[Tuple[Replica, int]]:
+        """
+        Pick a replica for a batch of ``count`` items: ``(replica, items to run now)``.
+
+        Prefers the least-loaded candidate that fits the whole batch, else the
+        one fitting the most. ``None`` when no candidate has memory for a single
+        item while some batch is still running to free it; if nothing runs
+        anywhere, one item is admitted regardless so an underestimated budget
+        cannot stall the queue.
+        """
+        if not candidates:
+            return None
+        ordered = sorted(candidates, key=lambda r: (r.inflight_items, r.last_dispatch))
+        best, best_fit = ordered[0], 0
+        for replica in ordered:
+            fit = replica.fits(count, bytes_per_item)
+            if fit == count:
+                return replica, count
+            if fit > best_fit:
+                best, best_fit = replica, fit
+        if best_fit:
+            return best, best_fit
+        if any(r.inflight_batches for r in self.replicas):
+            return None
+        return best, 1
+
+    def measure_memory(self, vram_reserve_mb: int = ML_VRAM_RESERVE_MB, cpu_budget_mb: int = ML_CPU_MEMORY_BUDGET_MB) -> None:
+        """Set every replica's memory budget; call once the models are loaded."""
+        per_device: Dict[torch.device, List[Replica]] = {}
+        for replica in self.replicas:
+            per_device.setdefault(replica.device, []).append(replica)
+        for device, sharing in per_device.items():
+            if device.type == "cuda":
+                try:
+                    torch.cuda.empty_cache()
+                    free, _ = torch.cuda.mem_get_info(device)
+                except Exception as e:
+                    logger.warning(f"Could not read free memory of {device}, batches on it are not memory-limited: {e}")
+                    free = 0
+                capacity = max(1, free - vram_reserve_mb * 2**20) if free else 0
+            elif device.type == "cpu" and cpu_budget_mb > 0:
+                capacity = cpu_budget_mb * 2**20
+            else:
+                capacity = 0
+            # Replicas on one device share its memory
+            for replica in sharing:
+                replica.memory_capacity = capacity // len(sharing)
+            if capacity:
+                logger.info(f"Batch memory budget on {device}: {capacity / 2**20:.0f} MB across {len(sharing)} replica(s)")
+
+    def drop_model(self, key: str) -> None:
+        for replica in self.replicas:
+            replica.models.pop(key, None)
+
+    def metrics(self) -> List[Dict[str, Any]]:
+        return [replica.metrics() for replica in self.replicas]
+
+    def shutdown(self) -> None:
+        for replica in self.replicas:
+            replica.shutdown()
+
+
+pool = ReplicaPool()
@@ -1,67 +1,597 @@
+"""
+Job scheduler for asynchronous inference batches (``?async_job=true``).
+
+A job is a kind (registered with ``register_handler``) plus a payload of plain
+data (JSON types and bytes) - never a closure - so any node can store and run
+it. Jobs carry a priority (``interactive`` before ``bulk``) and a tenant (the
+ingest job that sent the batch); queued jobs start highest priority first and
+round-robin across tenants, so one large ingest cannot hold back another. At
+most ``ML_SCHEDULER_MAX_RUNNING_JOBS`` jobs run at once - their images then
+share the micro-batchers, which admit work by estimated memory per item - and
+at most ``ML_SCHEDULER_MAX_QUEUED_JOBS`` wait; beyond that ``enqueue_job``
+raises ``SchedulerFull``. Queued and running jobs can be cancelled.
+
+``ML_SCHEDULER_BACKEND=memory`` (default) keeps jobs in this process.
+``redis`` stores job specs, statuses and partial results in Redis as JSON, so
+queued jobs survive a restart (jobs this node was running are requeued when it
+starts again) and several nodes can serve one queue.
+"""
 import asyncio
-import uuid
-import logging
+import base64
 import contextlib
-from typing import Awaitable, Callable, Dict, Any, Optional
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
 
-from . import clip_service
+from .batcher import BULK_LANE, DEFAULT_TENANT, PRIORITIES
 
 logger = logging.getLogger(__name__)
 
-# Internal job structures
-_job_queue: asyncio.Queue[tuple[str, Callable[[], Awaitable[Any]]]] = asyncio.Queue()
-_job_results: Dict[str, Dict[str, Any]] = {}
-_job_events: Dict[str, asyncio.Event] = {}
-_scheduler_task: Optional[asyncio.Task] = None
+SCHEDULER_BACKEND = os.environ.get("ML_SCHEDULER_BACKEND", "memory").lower()
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# Jobs running at once; each keeps its images queued on the micro-batchers
+MAX_RUNNING_JOBS = int(os.environ.get("ML_SCHEDULER_MAX_RUNNING_JOBS", "4"))
+# Jobs waiting to start before new ones are rejected (HTTP 429)
+MAX_QUEUED_JOBS = int(os.environ.get("ML_SCHEDULER_MAX_QUEUED_JOBS", "256"))
+# How long finished jobs (status and results) are kept
+JOB_TTL_S = int(os.environ.get("ML_JOB_TTL_S", "3600"))
+# Identifies this node's running jobs in Redis, so a restart can requeue them
+NODE_ID = os.environ.get("ML_SCHEDULER_NODE_ID") or socket.gethostname()
+
+FINAL_STATUSES = {"completed", "failed", "cancelled"}
+
+
+class SchedulerFull(Exception):
+    """Raised by ``enqueue_job`` when ``MAX_QUEUED_JOBS`` jobs are already waiting."""
+
+
+@dataclass
+class JobSpec:
+    job_id: str
+    kind: str
+    # Plain data only (JSON types and bytes)
+    payload: Dict[str, Any]
+    priority: str = BULK_LANE
+    tenant: str = DEFAULT_TENANT
+
+
+JobHandler = Callable[[JobSpec], Awaitable[Any]]
+
+_handlers: Dict[str, JobHandler] = {}
+_current_job_id: ContextVar[Optional[str]] = ContextVar("current_job_id", default=None)
+
+
+def register_handler(kind: str, handler: JobHandler) -> None:
+    """Run jobs of ``kind`` with ``handler(spec)``; its return value becomes the job result."""
+    _handlers[kind] = handler
+
+
+async def _run_handler(spec: JobSpec) -> Any:
+    handler = _handlers.get(spec.kind)
+    if handler is None:
+        raise RuntimeError(f"No handler registered for job kind {spec.kind!r}")
+    token = _current_job_id.set(spec.job_id)
+    try:
+        return await handler(spec)
+    finally:
+        _current_job_id.reset(token)
+
+
+# --- In-process backend ---
+
+class _MemoryBackend:
+    def __init__(self):
+        # job_id -> {"status", "results", "priority", "tenant", ("result" | "error")}
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.specs: Dict[str, JobSpec] = {}
+        # priority -> tenant -> queued job ids; tenants are served round-robin
+        self.queues: Dict[str, "OrderedDict[str, Deque[str]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self.queued = 0
+        self.running: Dict[str, asyncio.Task] = {}
+        # Replaced on every status change or partial result so each waiter wakes once per update
+        self.updates: Dict[str, asyncio.Event] = {}
+        # job_id -> finish time, oldest first
+        self.finished: "OrderedDict[str, float]" = OrderedDict()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.workers: List[asyncio.Task] = []
+
+    def _notify(self, job_id: str) -> None:
+        event = self.updates.pop(job_id, None)
+        if event:
+            event.set()
+
+    def _set_status(self, job_id: str, **fields: Any) -> None:
+        job = self.jobs[job_id]
+        job.pop("result", None)
+        job.pop("error", None)
+        job.update(fields)
+        if job["status"] in FINAL_STATUSES:
+            self.specs.pop(job_id, None)
+            self.finished[job_id] = time.monotonic()
+        self._notify(job_id)
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - JOB_TTL_S
+        while self.finished:
+            job_id, finished_at = next(iter(self.finished.items()))
+            if finished_at > cutoff:
+                break
+            del self.finished[job_id]
+            self.jobs.pop(job_id, None)
+            self.updates.pop(job_id, None)
+
+    async def enqueue(self, spec: JobSpec) -> None:
+        self._prune()
+        if self.queued >= MAX_QUEUED_JOBS:
+            raise SchedulerFull(f"{self.queued} jobs already queued")
+        self.jobs[spec.job_id] = {"status": "queued", "results": [], "priority": spec.priority, "tenant": spec.tenant}
+        self.specs[spec.job_id] = spec
+        self.queues[spec.priority].setdefault(spec.tenant, deque()).append(spec.job_id)
+        self.queued += 1
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def _pop(self) -> Optional[JobSpec]:
+        for level in self.queues.values():
+            if level:
+                tenant, job_ids = next(iter(level.items()))
+                job_id = job_ids.popleft()
+                if job_ids:
+                    level.move_to_end(tenant)
+                else:
+                    del level[tenant]
+                self.queued -= 1
+                return self.specs[job_id]
+        return None
+
+    async def _run(self, spec: JobSpec) -> None:
+        job = self.jobs.get(spec.job_id)
+        # Cancelled between being popped and started
+        if job is None or job["status"] != "queued":
+            return
+        self._set_status(spec.job_id, status="running")
+        try:
+            result = await _run_handler(spec)
+        except asyncio.CancelledError:
+            self._set_status(spec.job_id, status="cancelled")
+        except Exception as e:
+            logger.error(f"Job {spec.job_id} failed: {e}", exc_info=True)
+            self._set_status(spec.job_id, status="failed", error=str(e))
+        else:
+            self._set_status(spec.job_id, status="completed", result=result)
+
+    async def _worker(self) -> None:
+        while True:
+            spec = self._pop()
+            if spec is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            # Its own task, so cancel_job can stop it without stopping the worker
+            task = asyncio.create_task(self._run(spec))
+            self.running[spec.job_id] = task
+            try:
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            finally:
+                self.running.pop(spec.job_id, None)
+
+    async def start(self) -> None:
+        if self.workers:
+            return
+        self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(max(1, MAX_RUNNING_JOBS))]
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        for worker in self.workers:
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await worker
+        self.workers = []
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        return {**job, "results": list(job["results"])} if job else None
+
+    async def add_partial_results(self, job_id: str, results: List[Dict[str, Any]]) -> None:
+        if job_id in self.jobs:
+            self.jobs[job_id]["results"].extend(results)
+            self._notify(job_id)
+
+    async def wait(self, job_id: str, since: int, timeout: float) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job["status"] not in FINAL_STATUSES and len(job["results"]) <= since:
+            event = self.updates.setdefault(job_id, asyncio.Event())
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(event.wait(), timeout)
+        return await self.status(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job["status"] == "queued":
+            spec = self.specs[job_id]
+            job_ids = self.queues[spec.priority].get(spec.tenant)
+            if job_ids is not None and job_id in job_ids:
+                job_ids.remove(job_id)
+                if not job_ids:
+                    del self.queues[spec.priority][spec.tenant]
+                self.queued -= 1
+            self._set_status(job_id, status="cancelled")
+        elif job_id in self.running:
+            task = self.running[job_id]
+            task.cancel()
+            # The job's status changes once the handler has unwound
+            await asyncio.wait([task])
+        return await self.status(job_id)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "queued": self.queued,
+            "running": len(self.running),
+            "queued_by_priority": {p: sum(len(ids) for ids in level.values()) for p, level in self.queues.items()},
+            "queued_tenants": sorted({t for level in self.queues.values() for t in level}),
+        }
+
+
+# --- Redis backend ---
+
+_JOB_KEY = "ml_jobs:job:{job_id}"  # status (JSON)
+_SPEC_KEY = "ml_jobs:spec:{job_id}"  # JobSpec (JSON)
+_PARTIAL_KEY = "ml_jobs:partial:{job_id}"  # per-item results published so far (JSON list items)
+_EVENTS_CHANNEL = "ml_jobs:events:{job_id}"  # status changes and new partial results
+_CANCEL_CHANNEL = "ml_jobs:cancel"  # job ids to cancel on whichever node runs them
+_QUEUE_PREFIX = "ml_jobs:queue:"  # + "{priority}:{tenant}" -> job ids
+_RING_PREFIX = "ml_jobs:tenants:"  # + "{priority}" -> tenants with queued jobs, in serving order
+_RING_SET_PREFIX = "ml_jobs:tenant_set:"  # + "{priority}" -> the same tenants, for membership tests
+_QUEUED_KEY = "ml_jobs:queued"  # number of queued jobs
+_WAKEUP_KEY = "ml_jobs:wakeup"  # doorbell list workers block on
+_RUNNING_KEY = "ml_jobs:running:{node}"  # job ids running on a node
+
+# KEYS: queued counter, queue list, ring list, ring set, wakeup list
+# ARGV: job id, tenant, max queued, push to front ("1") or back
+_ENQUEUE_SCRIPT = """
+if tonumber(ARGV[3]) > 0 and tonumber(redis.call('GET', KEYS[1]) or '0') >= tonumber(ARGV[3]) then
+  return 0
+end
+if ARGV[4] == '1' then
+  redis.call('LPUSH', KEYS[2], ARGV[1])
+else
+  redis.call('RPUSH', KEYS[2], ARGV[1])
+end
+if redis.call('SADD', KEYS[4], ARGV[2]) == 1 then
+  redis.call('RPUSH', KEYS[3], ARGV[2])
+end
+redis.call('INCR', KEYS[1])
+redis.call('RPUSH', KEYS[5], '1')
+redis.call('LTRIM', KEYS[5], 0, 1023)
+return 1
+"""
+
+# KEYS: queued counter, running hash; ARGV: queue prefix, ring prefix, ring set prefix, priorities...
+_POP_SCRIPT = """
+for i = 4, #ARGV do
+  local ring = ARGV[2] .. ARGV[i]
+  local ring_set = ARGV[3] .. ARGV[i]
+  while true do
+    local tenant = redis.call('LPOP', ring)
+    if not tenant then break end
+    local queue = ARGV[1] .. ARGV[i] .. ':' .. tenant
+    local job_id = redis.call('LPOP', queue)
+    if redis.call('LLEN', queue) > 0 then
+      redis.call('RPUSH', ring, tenant)
+    else
+      redis.call('SREM', ring_set, tenant)
+    end
+    if job_id then
+      redis.call('DECR', KEYS[1])
+      redis.call('HSET', KEYS[2], job_id, '1')
+      return job_id
+    end
+  end
+end
+return false
+"""
+
+# KEYS: queued counter, queue list, ring list, ring set; ARGV: job id, tenant
+_DEQUEUE_SCRIPT = """
+local removed = redis.call('LREM', KEYS[2], 0, ARGV[1])
+if removed == 0 then return 0 end
+redis.call('DECR', KEYS[1])
+if redis.call('LLEN', KEYS[2]) == 0 then
+  redis.call('LREM', KEYS[3], 0, ARGV[2])
+  redis.call('SREM', KEYS[4], ARGV[2])
+end
+return 1
+"""
+
+
+def _to_json(value: Any) -> str:
+    def default(obj: Any) -> Any:
+        if isinstance(obj, (bytes, bytearray)):
+            return {"__bytes__": base64.b64encode(obj).decode("ascii")}
+        raise TypeError(f"Job data must be plain data, got {type(obj).__name__}")
+    return json.dumps(value, default=default)
+
 
-async def _worker() -> None:
-    """Background task that processes jobs sequentially under the GPU lock."""
-    while True:
-        job_id, job_coro = await _job_queue.get()
+def _from_json(data: Any) -> Any:
+    def object_hook(obj: Dict[str, Any]) -> Any:
+        if len(obj) == 1 and "__bytes__" in obj:
+            return base64.b64decode(obj["__bytes__"])
+        return obj
+    return json.loads(data, object_hook=object_hook)
+
+
+class _RedisBackend:
+    def __init__(self, url: str = REDIS_URL, node_id: str = NODE_ID):
+        self.url = url
+        self.node_id = node_id
+        self.running_key = _RUNNING_KEY.format(node=node_id)
+        self.redis: Any = None
+        self.running: Dict[str, asyncio.Task] = {}
+        self.workers: List[asyncio.Task] = []
+
+    async def _client(self) -> Any:
+        if self.redis is None:
+            # Only needed in this mode
+            import aioredis
+            self.redis = await aioredis.from_url(self.url, decode_responses=True)
+        return self.redis
+
+    def _queue_keys(self, spec: JobSpec) -> List[str]:
+        return [
+            _QUEUED_KEY,
+            f"{_QUEUE_PREFIX}{spec.priority}:{spec.tenant}",
+            f"{_RING_PREFIX}{spec.priority}",
+            f"{_RING_SET_PREFIX}{spec.priority}",
+        ]
+
+    async def _push(self, spec: JobSpec, front: bool = False) -> bool:
+        redis = await self._client()
+        keys = self._queue_keys(spec) + [_WAKEUP_KEY]
+        limit = 0 if front else MAX_QUEUED_JOBS
+        return bool(await redis.eval(_ENQUEUE_SCRIPT, len(keys), *keys, spec.job_id, spec.tenant, limit, "1" if front else "0"))
+
+    async def _set_status(self, job_id: str, status: Dict[str, Any]) -> None:
+        redis = await self._client()
+        pipe = redis.pipeline()
+        pipe.set(_JOB_KEY.format(job_id=job_id), _to_json(status))
+        if status["status"] in FINAL_STATUSES:
+            for key in (_JOB_KEY, _SPEC_KEY, _PARTIAL_KEY):
+                pipe.expire(key.format(job_id=job_id), JOB_TTL_S)
+        pipe.publish(_EVENTS_CHANNEL.format(job_id=job_id), status["status"])
+        await pipe.execute()
+
+    async def _get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        redis = await self._client()
+        data = await redis.get(_JOB_KEY.format(job_id=job_id))
+        return _from_json(data) if data is not None else None
+
+    async def _get_spec(self, job_id: str) -> Optional[JobSpec]:
+        redis = await self._client()
+        data = await redis.get(_SPEC_KEY.format(job_id=job_id))
+        return JobSpec(**_from_json(data)) if data is not None else None
+
+    async def enqueue(self, spec: JobSpec) -> None:
+        redis = await self._client()
+        await redis.set(_SPEC_KEY.format(job_id=spec.job_id), _to_json(asdict(spec)))
+        await redis.set(_JOB_KEY.format(job_id=spec.job_id), _to_json({"status": "queued", "priority": spec.priority, "tenant": spec.tenant}))
+        if not await self._push(spec):
+            await redis.delete(_SPEC_KEY.format(job_id=spec.job_id), _JOB_KEY.format(job_id=spec.job_id))
+            raise SchedulerFull(f"{MAX_QUEUED_JOBS} jobs already queued")
+
+    async def _pop(self) -> Optional[str]:
+        redis = await self._client()
+        prefixes = [_QUEUE_PREFIX, _RING_PREFIX, _RING_SET_PREFIX]
+        return await redis.eval(_POP_SCRIPT, 2, _QUEUED_KEY, self.running_key, *prefixes, *PRIORITIES)
+
+    async def _run(self, job_id: str) -> None:
+        redis = await self._client()
         try:
-            _job_results[job_id] = {"status": "running"}
-            async with clip_service.gpu_lock:
-                result = await job_coro()
-            _job_results[job_id] = {"status": "completed", "result": result}
-        except Exception as e:  # pragma: no cover - defensive
-            logger.error(f"Job {job_id} failed: {e}", exc_info=True)
-            _job_results[job_id] = {"status": "failed", "error": str(e)}
+            spec = await self._get_spec(job_id)
+            status = await self._get_status(job_id)
+            if spec is None or status is None or status["status"] != "queued":
+                return
+            await self._set_status(job_id, {**status, "status": "running", "node": self.node_id})
+            try:
+                result = await _run_handler(spec)
+            except asyncio.CancelledError:
+                await self._set_status(job_id, {**status, "status": "cancelled"})
+                return
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+                await self._set_status(job_id, {**status, "status": "failed", "error": str(e)})
+                return
+            await self._set_status(job_id, {**status, "status": "completed", "result": result})
         finally:
-            event = _job_events.pop(job_id, None)
-            if event:
-                event.set()
-            _job_queue.task_done()
+            await redis.hdel(self.running_key, job_id)
 
-async def start_scheduler() -> None:
-    """Start the background scheduler worker."""
-    global _scheduler_task
-    if _scheduler_task is None or _scheduler_task.done():
-        _scheduler_task = asyncio.create_task(_worker())
+    async def _worker(self) -> None:
+        redis = await self._client()
+        while True:
+            try:
+                job_id = await self._pop()
+                if job_id is None:
+                    await redis.blpop(_WAKEUP_KEY, timeout=5)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job scheduler could not reach Redis: {e}")
+                await asyncio.sleep(1)
+                continue
+            task = asyncio.create_task(self._run(job_id))
+            self.running[job_id] = task
+            try:
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            finally:
+                self.running.pop(job_id, None)
 
-async def stop_scheduler() -> None:
-    """Stop the scheduler worker."""
-    if _scheduler_task:
-        _scheduler_task.cancel()
-        with contextlib.suppress(Exception):
-            await _scheduler_task
-
-def get_job_status(job_id: str) -> Optional[Dict[str, Any]]:
-    """Return the current status for a job."""
-    return _job_results.get(job_id)
-
-def enqueue_job(coro_func: Callable[[], Awaitable[Any]]) -> str:
-    """Enqueue a coroutine for execution and return its job id."""
+    async def _listen_for_cancels(self) -> None:
+        redis = await self._client()
+        pubsub = redis.pubsub()
+        await pubsub.subscribe(_CANCEL_CHANNEL)
+        try:
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=5)
+                if message is not None and message["data"] in self.running:
+                    self.running[message["data"]].cancel()
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.close()
+
+    async def _recover(self) -> None:
+        """Requeue jobs this node was running when it stopped; their partial results are discarded."""
+        redis = await self._client()
+        for job_id in await redis.hkeys(self.running_key):
+            spec = await self._get_spec(job_id)
+            status = await self._get_status(job_id)
+            if spec is not None and status is not None and status["status"] not in FINAL_STATUSES:
+                await redis.delete(_PARTIAL_KEY.format(job_id=job_id))
+                await self._set_status(job_id, {"status": "queued", "priority": spec.priority, "tenant": spec.tenant})
+                await self._push(spec, front=True)
+                logger.info(f"Requeued job {job_id} interrupted on node {self.node_id}")
+            await redis.hdel(self.running_key, job_id)
+
+    async def start(self) -> None:
+        if self.workers:
+            return
+        await self._recover()
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(max(1, MAX_RUNNING_JOBS))]
+        self.workers.append(asyncio.create_task(self._listen_for_cancels()))
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        for worker in self.workers:
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await worker
+        self.workers = []
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        status = await self._get_status(job_id)
+        if status is None:
+            return None
+        redis = await self._client()
+        partial = await redis.lrange(_PARTIAL_KEY.format(job_id=job_id), 0, -1)
+        return {**status, "results": [_from_json(r) for r in partial]}
+
+    async def add_partial_results(self, job_id: str, results: List[Dict[str, Any]]) -> None:
+        redis = await self._client()
+        await redis.rpush(_PARTIAL_KEY.format(job_id=job_id), *[_to_json(r) for r in results])
+        await redis.publish(_EVENTS_CHANNEL.format(job_id=job_id), "results")
+
+    async def wait(self, job_id: str, since: int, timeout: float) -> Optional[Dict[str, Any]]:
+        # Subscribe before reading the status so no update can slip in between
+        redis = await self._client()
+        pubsub = redis.pubsub()
+        await pubsub.subscribe(_EVENTS_CHANNEL.format(job_id=job_id))
+        try:
+            status = await self.status(job_id)
+            if status is None or status["status"] in FINAL_STATUSES or len(status["results"]) > since:
+                return status
+            deadline = asyncio.get_running_loop().time() + timeout
+            while (remaining := deadline - asyncio.get_running_loop().time()) > 0:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if message is not None:
+                    break
+            return await self.status(job_id)
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.close()
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        status = await self._get_status(job_id)
+        if status is None:
+            return None
+        redis = await self._client()
+        if status["status"] == "queued":
+            spec = await self._get_spec(job_id)
+            keys = self._queue_keys(spec)
+            if await redis.eval(_DEQUEUE_SCRIPT, len(keys), *keys, job_id, spec.tenant):
+                await self._set_status(job_id, {**status, "status": "cancelled"})
+            else:
+                # Taken by a worker in the meantime
+                await redis.publish(_CANCEL_CHANNEL, job_id)
+        elif status["status"] == "running":
+            # The node running it marks it cancelled once the handler has unwound
+            await redis.publish(_CANCEL_CHANNEL, job_id)
+        return await self.status(job_id)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"backend": "redis", "node": self.node_id, "running": len(self.running)}
+
+
+_backend: Any = _RedisBackend() if SCHEDULER_BACKEND == "redis" else _MemoryBackend()
+
+
+# --- Public API ---
+
+async def enqueue_job(kind: str, payload: Dict[str, Any], priority: str = BULK_LANE, tenant: str = DEFAULT_TENANT) -> str:
+    """Queue a job and return its id; raises ``SchedulerFull`` when the queue is at capacity."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority {priority!r}")
     job_id = str(uuid.uuid4())
-    _job_results[job_id] = {"status": "queued"}
-    _job_events[job_id] = asyncio.Event()
-    _job_queue.put_nowait((job_id, coro_func))
+    await _backend.enqueue(JobSpec(job_id, kind, payload, priority, tenant or DEFAULT_TENANT))
     return job_id
 
-async def get_job_result(job_id: str) -> Optional[Dict[str, Any]]:
-    """Return job result if completed or failed."""
-    if job_id in _job_results and _job_results[job_id]["status"] in {"completed", "failed"}:
-        return _job_results[job_id]
-    event = _job_events.get(job_id)
-    if event:
-        await event.wait()
-    return _job_results.get(job_id)
+
+async def get_job_status(job_id: str) -> Optional[Dict[str, Any]]:
+    """Status of a job, with the per-item results published so far under ``results``."""
+    return await _backend.status(job_id)
+
+
+async def add_partial_results(results: List[Dict[str, Any]]) -> None:
+    """Publish per-item results from inside a running job as soon as a sub-batch finishes."""
+    job_id = _current_job_id.get()
+    if job_id is None or not results:
+        return
+    await _backend.add_partial_results(job_id, results)
+
+
+async def wait_for_job_update(job_id: str, since: int = 0, timeout: float = 30.0) -> Optional[Dict[str, Any]]:
+    """
+    Return the job status once it has more than ``since`` partial results or has
+    finished, or after ``timeout`` seconds, whichever comes first.
+    """
+    return await _backend.wait(job_id, since, timeout)
+
+
+async def cancel_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Cancel a queued or running job; returns its status (``None`` for unknown jobs)."""
+    return await _backend.cancel(job_id)
+
+
+def metrics() -> Dict[str, Any]:
+    return _backend.metrics()
+
+
+async def start_scheduler() -> None:
+    """Start the job workers (and, with Redis, requeue jobs interrupted on this node)."""
+    await _backend.start()
+
+
+async def stop_scheduler() -> None:
+    """Stop the job workers; running jobs are cancelled."""
+    await _backend.stop()
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+# Provide dummy modules if heavy deps missing
+for mod_name in ('torch',):
+    if mod_name not in sys.modules:
+        try:
+            __import__(mod_name)
+        except ImportError:
+            sys.modules[mod_name] = MagicMock()
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+from backend.ml_inference_fastapi_app.services import autotune
+
+CPU = SimpleNamespace(type="cpu")
+
+
+def _fake_model(latency_for, oom_from=None):
+    """A run_batch whose latency depends only on the batch size."""
+    sizes = []
+
+    def run_batch(images):
+        sizes.append(len(images))
+        if oom_from is not None and len(images) >= oom_from:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        time.sleep(latency_for(len(images)))
+        return images
+
+    return run_batch, sizes
+
+
+def test_probe_stops_at_throughput_knee():
+    # Fixed overhead up to 4 images, then linear: throughput plateaus after 4
+    run_batch, sizes = _fake_model(lambda n: 0.02 if n <= 4 else 0.008 * n)
+    profile = autotune.probe(run_batch, CPU, max_batch=64, make_images=lambda n: [0] * n)
+
+    assert profile.batch_size == 4
+    assert profile.stop_reason == "knee"
+    assert [point["batch_size"] for point in profile.curve] == [1, 2, 4, 8]
+    assert max(sizes) == 8
+
+
+def test_probe_backs_off_below_oom():
+    run_batch, _ = _fake_model(lambda n: 0.005, oom_from=8)
+    profile = autotune.probe(run_batch, CPU, max_batch=64, make_images=lambda n: [0] * n)
+
+    assert profile.stop_reason == "oom"
+    assert [point["batch_size"] for point in profile.curve] == [1, 2, 4]
+    assert profile.batch_size == 2
+
+
+def test_tuned_profile_is_persisted_and_reused(tmp_path, monkeypatch):
+    cache_path = tmp_path / "autotune.json"
+    monkeypatch.setattr(autotune, "synthetic_images", lambda n: [0] * n)
+    run_batch, sizes = _fake_model(lambda n: 0.002)
+
+    first = autotune.tune("clip-test", "torch", run_batch, CPU, max_batch=4, cache_path=cache_path)
+    assert first.batch_size == 4 and first.stop_reason == "max_batch" and not first.from_cache
+    assert cache_path.exists()
+
+    calls = len(sizes)
+    second = autotune.tune("clip-test", "torch", run_batch, CPU, max_batch=4, cache_path=cache_path)
+    assert len(sizes) == calls  # restart path: no probing
+    assert second.from_cache
+    assert second.batch_size == 4
+    assert second.curve == first.curve
+
+    # A different backend on the same device is calibrated separately
+    autotune.tune("clip-test", "onnx-int8", run_batch, CPU, max_batch=2, cache_path=cache_path)
+    assert len(sizes) > calls
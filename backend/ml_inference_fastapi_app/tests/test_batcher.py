@@ -0,0 +1,124 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+from backend.ml_inference_fastapi_app.services.batcher import BULK_LANE, INTERACTIVE_LANE, FairQueue, MicroBatcher, _Entry
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_concurrent_requests_are_fused():
+    """Requests arriving within the wait window share one batch, capped at the max size."""
+    calls = []
+
+    def fn(items):
+        calls.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher("test_fused", fn, max_batch_size=4, max_wait_ms=50)
+    results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+    await batcher.stop()
+
+    assert results == [i * 10 for i in range(6)]
+    assert [len(c) for c in calls] == [4, 2]
+    metrics = batcher.metrics()
+    assert metrics["batches"] == 2
+    assert metrics["items"] == 6
+    assert metrics["mean_batch_fill"] == pytest.approx((4 / 4 + 2 / 4) / 2, abs=1e-3)
+    assert metrics["queue_depth"] == 0
+
+
+async def test_lone_request_dispatched_after_max_wait():
+    batcher = MicroBatcher("test_lone", lambda items: [len(items)] * len(items), max_batch_size=lambda: 32, max_wait_ms=20)
+    result = await asyncio.wait_for(batcher.submit("query"), timeout=1)
+    await batcher.stop()
+
+    assert result == 1
+    assert batcher.metrics()["last_batch_size"] == 1
+
+
+async def test_batch_failure_is_raised_to_every_caller():
+    def fn(items):
+        raise RuntimeError("device lost")
+
+    batcher = MicroBatcher("test_failure", fn, max_batch_size=8, max_wait_ms=20)
+    results = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+    await batcher.stop()
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+    # The worker keeps serving after a failed batch
+    ok = MicroBatcher("test_failure_recovers", lambda items: items, max_batch_size=8, max_wait_ms=5)
+    assert await ok.submit_many([1, 2, 3]) == [1, 2, 3]
+    await ok.stop()
+
+
+async def test_model_calls_do_not_block_the_event_loop():
+    """A slow batch runs on its lane's thread; the loop and the interactive lane stay responsive."""
+    def slow(items):
+        time.sleep(0.3)
+        return items
+
+    bulk = MicroBatcher("test_slow_bulk", slow, max_batch_size=8, max_wait_ms=1, lane=BULK_LANE)
+    interactive = MicroBatcher("test_fast_text", lambda items: items, max_batch_size=8, max_wait_ms=1, lane=INTERACTIVE_LANE)
+
+    slow_call = asyncio.ensure_future(bulk.submit("image"))
+    await asyncio.sleep(0.05)  # Let the slow batch start
+
+    started = time.perf_counter()
+    assert await interactive.submit("query") == "query"
+    assert time.perf_counter() - started < 0.2
+    assert not slow_call.done()
+
+    assert await slow_call == "image"
+    await bulk.stop()
+    await interactive.stop()
+
+
+async def test_fair_queue_orders_by_priority_then_tenant():
+    """Interactive items go first; bulk tenants take turns; abandoned items are skipped."""
+    loop = asyncio.get_running_loop()
+    queue = FairQueue()
+
+    def entry(item, priority=BULK_LANE, tenant="a"):
+        return _Entry(item, loop.create_future(), time.perf_counter(), priority, tenant)
+
+    for i in range(3):
+        await queue.put(entry(f"a{i}"))
+    await queue.put(entry("b0", tenant="b"))
+    gone = entry("b-gone", tenant="b")
+    gone.future.cancel()
+    await queue.put(gone)
+    await queue.put(entry("q", INTERACTIVE_LANE))
+
+    first, second = queue.get_nowait(), queue.get_nowait()
+    queue.put_front([second])
+    order = [first.item] + [queue.get_nowait().item for _ in range(4)]
+
+    assert order == ["q", "a0", "b0", "a1", "a2"]
+    assert queue.empty()
+
+
+async def test_interactive_requests_overtake_queued_bulk_work():
+    batches = []
+
+    def fn(items):
+        batches.append(list(items))
+        time.sleep(0.03)
+        return items
+
+    batcher = MicroBatcher("test_priority", fn, max_batch_size=2, max_wait_ms=1)
+    bulk = asyncio.ensure_future(batcher.submit_many(list(range(6)), BULK_LANE, "ingest"))
+    await asyncio.sleep(0.01)
+    assert await batcher.submit("query", INTERACTIVE_LANE) == "query"
+    await bulk
+    await batcher.stop()
+
+    assert batches[0] == [0, 1]
+    assert "query" in batches[1]
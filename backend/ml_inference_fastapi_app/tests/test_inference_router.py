@@ -5,6 +5,7 @@ import base64
 import io
 from PIL import Image
 import time
+import numpy as np
 import sys
 import os
 
@@ -33,18 +34,8 @@ def mock_models():
         mock_clip.get_clip_model_status.return_value = True
         mock_blip.get_blip_model_status.return_value = True
 
-        class DummyTensor:
-            def __init__(self, data):
-                self._data = data
-
-            def tolist(self):
-                return self._data
-
-            @property
-            def shape(self):
-                return (1, len(self._data[0]))
-
-        mock_clip.encode_image_batch.return_value = DummyTensor([[0.1, 0.2, 0.3]])
+        # The CLIP service returns a NumPy array of embeddings
+        mock_clip.encode_image_batch.return_value = np.array([[0.1, 0.2, 0.3]])
         mock_blip.generate_captions.return_value = ["a test caption"]
 
         yield mock_clip, mock_blip
@@ -69,36 +60,16 @@ def test_batch_embed_and_caption_success(client, mock_models):
     }
 
     # --- Act ---
-    job_result = {
-        "status": "completed",
-        "result": {
-            "results": [{
-                "unique_id": "123",
-                "filename": "test.png",
-                "embedding": [0.1, 0.2, 0.3],
-                "embedding_shape": [1, 3],
-                "caption": "a test caption",
-                "error": None,
-                "model_name_clip": "clip",
-                "model_name_blip": "blip",
-                "device_used": "cpu"
-            }]
-        }
-    }
-    with patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.enqueue_job', return_value='job1'), \
-         patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.get_job_status', return_value=job_result):
-        response = client.post("/api/v1/batch_embed_and_caption", json=payload)
-        assert response.status_code == 200
-        job_id = response.json()["job_id"]
-        status_resp = client.get(f"/api/v1/status/{job_id}")
-        assert status_resp.status_code == 200
-        result = status_resp.json()["result"]["results"][0]
+    response = client.post("/api/v1/batch_embed_and_caption", json=payload)
+
+    # --- Assert ---
+    assert response.status_code == 200
+    result = response.json()["results"][0]
 
     assert result['unique_id'] == "123"
     assert result['error'] is None
     assert result['caption'] == "a test caption"
-    assert result['embedding'] is not None
-
+    assert result['embedding'] == [0.1, 0.2, 0.3]
 
 
 def test_batch_embed_and_caption_decode_failure(client, mock_models):
@@ -113,34 +84,202 @@ def test_batch_embed_and_caption_decode_failure(client, mock_models):
     }
 
     # --- Act ---
-    job_result = {
-        "status": "completed",
-        "result": {
-            "results": [{
-                "unique_id": "456",
-                "filename": "broken.png",
-                "embedding": None,
-                "embedding_shape": None,
-                "caption": None,
-                "error": "Failed to decode image",
-                "model_name_clip": "clip",
-                "model_name_blip": "blip",
-                "device_used": "cpu"
-            }]
-        }
-    }
-    with patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.enqueue_job', return_value='job2'), \
-         patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.get_job_status', return_value=job_result):
-        response = client.post("/api/v1/batch_embed_and_caption", json=payload)
-        assert response.status_code == 200
-        job_id = response.json()["job_id"]
-        status_resp = client.get(f"/api/v1/status/{job_id}")
-        assert status_resp.status_code == 200
-        result = status_resp.json()["result"]["results"][0]
+    response = client.post("/api/v1/batch_embed_and_caption", json=payload)
+
+    # --- Assert ---
+    assert response.status_code == 200
+    result = response.json()["results"][0]
 
     assert result['unique_id'] == "456"
     assert result['error'] is not None
     assert "Failed to decode image" in result['error']
     assert result['embedding'] is None
     assert result['caption'] is None
+    mock_models[0].encode_image_batch.assert_not_called()
+
+
+def test_batch_embed_and_caption_multipart(client, mock_models):
+    """
+    Tests the binary multipart batch endpoint returns results in part order.
+    """
+    # --- Setup ---
+    img = Image.new('RGB', (10, 10), color='red')
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG")
+    files = [("files", ("test.jpg", buffer.getvalue(), "image/jpeg"))]
+    mock_clip, _ = mock_models
+    mock_clip.encode_image_batch.return_value = np.array([[0.1, 0.2, 0.3]])
+
+    # --- Act ---
+    response = client.post(
+        "/api/v1/batch_embed_and_caption_multipart",
+        data={"unique_ids": ["789"]},
+        files=files,
+    )
+
+    # --- Assert ---
+    assert response.status_code == 200
+    result = response.json()["results"][0]
+    assert result['unique_id'] == "789"
+    assert result['filename'] == "test.jpg"
+    assert result['caption'] == "a test caption"
+    assert result['embedding'] == [0.1, 0.2, 0.3]
+
+
+def test_batch_caption_only_skips_clip(client, mock_models):
+    """
+    Tests that embed=false runs only the captioning stage.
+    """
+    img = Image.new('RGB', (10, 10), color='red')
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG")
+    mock_clip, mock_blip = mock_models
+
+    response = client.post(
+        "/api/v1/batch_embed_and_caption_multipart?embed=false",
+        data={"unique_ids": ["c1"]},
+        files=[("files", ("c1.jpg", buffer.getvalue(), "image/jpeg"))],
+    )
+
+    assert response.status_code == 200
+    result = response.json()["results"][0]
+    assert result['caption'] == "a test caption"
+    assert result['embedding'] is None
+    mock_clip.encode_image_batch.assert_not_called()
+    mock_blip.generate_captions.assert_called_once()
+
+
+def test_batch_embed_and_caption_multipart_id_mismatch(client, mock_models):
+    """
+    Tests that the number of unique_ids must match the number of file parts.
+    """
+    response = client.post(
+        "/api/v1/batch_embed_and_caption_multipart",
+        data={"unique_ids": ["1", "2"]},
+        files=[("files", ("a.jpg", b"x", "image/jpeg"))],
+    )
+    assert response.status_code == 422
+
+
+def _result_item(uid):
+    return {
+        "unique_id": uid,
+        "filename": f"{uid}.png",
+        "embedding": [0.1, 0.2, 0.3],
+        "embedding_shape": [3],
+        "caption": "a test caption",
+        "error": None,
+        "model_name_clip": "clip",
+        "model_name_blip": "blip",
+        "device_used": "cpu"
+    }
+
+
+def test_batch_embed_and_caption_async_job(client, mock_models):
+    """
+    Tests that async_job=true queues the batch and returns a job id.
+    """
+    payload = {
+        "images": [
+            {"unique_id": "123", "image_base64": create_test_image_base64(), "filename": "test.png"}
+        ]
+    }
+    with patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.enqueue_job', return_value='job3') as mock_enqueue:
+        response = client.post("/api/v1/batch_embed_and_caption?async_job=true&tenant=ingest-1", json=payload)
+
+    assert response.status_code == 200
+    assert response.json() == {"job_id": "job3", "status": "queued"}
+    mock_enqueue.assert_called_once()
+    # The job is plain data (encoded image bytes), not a closure
+    kind, job_payload = mock_enqueue.call_args.args
+    assert kind == "embed_and_caption"
+    assert job_payload["images"] == [["123", "test.png", base64.b64decode(payload["images"][0]["image_base64"])]]
+    assert mock_enqueue.call_args.kwargs == {"priority": "bulk", "tenant": "ingest-1"}
+
+
+def test_full_job_queue_returns_429(client, mock_models):
+    from backend.ml_inference_fastapi_app.services import scheduler
+    payload = {"images": [{"unique_id": "1", "image_base64": create_test_image_base64(), "filename": "a.png"}]}
+    with patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.enqueue_job', side_effect=scheduler.SchedulerFull("256 jobs already queued")):
+        response = client.post("/api/v1/batch_embed_and_caption?async_job=true", json=payload)
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
+
+
+def test_cancel_job(client):
+    with patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.cancel_job', return_value={"status": "cancelled", "results": []}) as mock_cancel:
+        response = client.post("/api/v1/cancel/job6")
+
+    assert response.status_code == 200
+    assert response.json() == {"job_id": "job6", "status": "cancelled"}
+    mock_cancel.assert_awaited_once_with("job6")
+
+    with patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.cancel_job', return_value=None):
+        assert client.post("/api/v1/cancel/missing").status_code == 404
+
+
+def test_job_status_long_poll_returns_new_results(client):
+    """
+    Tests that ?wait= long-polls through the scheduler and only returns results after ``since``.
+    """
+    status = {"status": "running", "results": [_result_item("a"), _result_item("b")]}
+    with patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.wait_for_job_update', return_value=status) as mock_wait:
+        response = client.get("/api/v1/status/job4?wait=5&since=1")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "running"
+    assert [r["unique_id"] for r in body["results"]] == ["b"]
+    assert body["cursor"] == 2
+    mock_wait.assert_awaited_once_with("job4", since=1, timeout=5)
+
+
+def test_job_events_stream(client):
+    """
+    Tests that the SSE stream emits results as they are published and a final done event.
+    """
+    updates = [
+        {"status": "running", "results": [_result_item("a")]},
+        {"status": "completed", "results": [_result_item("a"), _result_item("b")]},
+    ]
+    with patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.get_job_status', return_value={"status": "running"}), \
+         patch('backend.ml_inference_fastapi_app.routers.inference.scheduler.wait_for_job_update', side_effect=updates):
+        response = client.get("/api/v1/status/job5/events")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block for block in response.text.split("\n\n") if block.strip()]
+    assert events[0].startswith("event: results") and '"unique_id": "a"' in events[0]
+    assert events[1].startswith("event: results") and '"unique_id": "b"' in events[1]
+    assert events[2].startswith("event: done") and '"status": "completed"' in events[2]
+
+
+def test_embed_text_batch_dedupes_and_caches(client, mock_models):
+    """
+    Tests that /embed_text_batch embeds each distinct normalized text once and
+    that /embed_text answers repeated queries from the cache.
+    """
+    from backend.ml_inference_fastapi_app.routers import inference
+    inference.text_embedding_cache.clear()
+    mock_clip, _ = mock_models
+    mock_clip.CLIP_MODEL_NAME_CONFIG = "clip-test"
+    mock_clip.encode_text_batch.side_effect = lambda texts, replica=None: [[float(len(t)), 1.0] for t in texts]
+
+    response = client.post("/api/v1/embed_text_batch", json={"texts": ["A Dog", "a  dog", "cat"]})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["embeddings"] == [[5.0, 1.0], [5.0, 1.0], [3.0, 1.0]]
+    assert body["embedding_shape"] == [3, 2]
+    assert body["model_name"] == "clip-test"
+    embedded = [t for call in mock_clip.encode_text_batch.call_args_list for t in call.args[0]]
+    assert sorted(embedded) == ["A Dog", "cat"]
+
+    mock_clip.encode_text_batch.reset_mock()
+    response = client.post("/api/v1/embed_text", json={"text": " a dog "})
+    assert response.status_code == 200
+    assert response.json()["embedding"] == [5.0, 1.0]
+    mock_clip.encode_text_batch.assert_not_called()
 
+    assert client.post("/api/v1/embed_text_batch", json={"texts": []}).status_code == 422
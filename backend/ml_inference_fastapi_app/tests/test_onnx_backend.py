@@ -0,0 +1,95 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+if not all(isinstance(getattr(mod, "__version__", None), str) for mod in (torch, transformers)):
+    pytest.skip("torch/transformers are stubbed in this session", allow_module_level=True)
+
+from backend.ml_inference_fastapi_app.services import onnx_backend
+
+# Small random-weight models: the parity check is about the export, not the checkpoint
+CLIP_CONFIG = dict(
+    text_config=dict(vocab_size=99, hidden_size=32, intermediate_size=37, num_hidden_layers=2, num_attention_heads=4, max_position_embeddings=32),
+    vision_config=dict(image_size=32, patch_size=8, hidden_size=32, intermediate_size=37, num_hidden_layers=2, num_attention_heads=4),
+    projection_dim=16,
+)
+BLIP_CONFIG = dict(
+    text_config=dict(vocab_size=99, hidden_size=32, intermediate_size=37, num_hidden_layers=2, num_attention_heads=4, max_position_embeddings=64,
+                     bos_token_id=97, sep_token_id=98, pad_token_id=0),
+    vision_config=dict(image_size=32, patch_size=8, hidden_size=32, intermediate_size=37, num_hidden_layers=2, num_attention_heads=4),
+)
+
+
+def _cosine(a, b):
+    a, b = np.asarray(a), np.asarray(b)
+    return (a * b).sum(-1) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1))
+
+
+def _features(output):
+    return output if isinstance(output, torch.Tensor) else output.pooler_output
+
+
+@pytest.fixture(scope="module")
+def clip_model():
+    torch.manual_seed(0)
+    return transformers.CLIPModel(transformers.CLIPConfig(**CLIP_CONFIG)).eval()
+
+
+@pytest.fixture(scope="module")
+def blip_model():
+    torch.manual_seed(0)
+    return transformers.BlipForConditionalGeneration(transformers.BlipConfig(**BLIP_CONFIG)).eval()
+
+
+@pytest.mark.parametrize("quantization, min_cosine", [("none", 0.9999), ("int8", 0.98)])
+def test_clip_onnx_matches_torch(clip_model, tmp_path, quantization, min_cosine):
+    onnx_clip = onnx_backend.load_clip(clip_model, "test/clip", quantization=quantization, cache_dir=tmp_path)
+
+    pixel_values = torch.randn(3, 3, 32, 32)
+    input_ids = torch.tensor([[1, 5, 9, 2, 0], [1, 7, 2, 0, 0]])
+    attention_mask = (input_ids != 0).long()
+    with torch.no_grad():
+        ref_image = _features(clip_model.get_image_features(pixel_values=pixel_values))
+        ref_text = _features(clip_model.get_text_features(input_ids=input_ids, attention_mask=attention_mask))
+
+    image = onnx_clip.get_image_features(pixel_values=pixel_values)
+    text = onnx_clip.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+    assert image.shape == ref_image.shape and text.shape == ref_text.shape
+    assert _cosine(image, ref_image).min() >= min_cosine
+    assert _cosine(text, ref_text).min() >= min_cosine
+    assert onnx_backend.backend_name(onnx_clip) == f"onnx-{quantization}"
+
+
+def test_blip_onnx_greedy_captions_match_torch(blip_model, tmp_path):
+    onnx_blip = onnx_backend.load_blip(blip_model, "test/blip", quantization="none", cache_dir=tmp_path)
+
+    pixel_values = torch.randn(2, 3, 32, 32)
+    with torch.no_grad():
+        reference = blip_model.generate(pixel_values=pixel_values, max_length=12)
+    tokens = onnx_blip.generate(pixel_values=pixel_values, max_length=12)
+
+    # torch pads finished rows the same way, so the token matrices are identical
+    assert tokens.tolist() == reference.tolist()
+
+
+def test_blip_int8_encoder_stays_close(blip_model, tmp_path):
+    onnx_blip = onnx_backend.load_blip(blip_model, "test/blip", quantization="int8", cache_dir=tmp_path)
+
+    pixel_values = torch.randn(2, 3, 32, 32)
+    with torch.no_grad():
+        reference = blip_model.vision_model(pixel_values=pixel_values)[0]
+    image_embeds = onnx_blip.vision.run(None, {"pixel_values": pixel_values.numpy()})[0]
+
+    assert _cosine(image_embeds, reference.numpy()).min() >= 0.98
+    tokens = onnx_blip.generate(pixel_values=pixel_values, max_length=12)
+    assert tokens.shape[0] == 2 and tokens.shape[1] <= 12
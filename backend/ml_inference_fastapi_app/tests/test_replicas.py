@@ -0,0 +1,179 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+torch = pytest.importorskip("torch")
+if not isinstance(getattr(torch, "__version__", None), str):
+    pytest.skip("torch is stubbed in this session", allow_module_level=True)
+
+from backend.ml_inference_fastapi_app.services import replicas
+from backend.ml_inference_fastapi_app.services.batcher import MicroBatcher
+
+
+def _cpu_pool(count: int, threads: int = 1) -> replicas.ReplicaPool:
+    pool = replicas.ReplicaPool()
+    pool.configure(replicas.replica_devices(torch.device("cpu"), spec="cpu", cpu_replicas=count, cpu_threads=threads))
+    return pool
+
+
+def test_replica_devices_from_spec(monkeypatch):
+    monkeypatch.setattr(replicas.os, "cpu_count", lambda: 8)
+    cpu = torch.device("cpu")
+
+    assert replicas.replica_devices(cpu, spec="") == [(cpu, 0)]
+    assert replicas.replica_devices(cpu, spec="cpu", cpu_replicas=4) == [(cpu, 2)] * 4
+    assert replicas.replica_devices(cpu, spec="cpu", cpu_replicas=2, cpu_threads=3) == [(cpu, 3)] * 2
+    assert replicas.replica_devices(cpu, spec="cuda:0,cuda:1") == [(torch.device("cuda:0"), 0), (torch.device("cuda:1"), 0)]
+    if not torch.cuda.is_available():
+        assert replicas.replica_devices(cpu, spec="all") == [(cpu, 0)]
+
+
+def test_least_loaded_replica_is_chosen():
+    pool = _cpu_pool(3)
+    busy, idle_recently, idle_longest = pool.replicas
+    busy.begin(16)
+    idle_recently.last_dispatch = time.monotonic()
+
+    assert pool.least_loaded() is idle_longest
+    assert pool.least_loaded([busy, idle_recently]) is idle_recently
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_batches_run_concurrently_on_cpu_replicas():
+    pool = _cpu_pool(3)
+    weight = torch.randn(8, 4)
+    seen = {}
+
+    def fn(items, replica):
+        seen.setdefault(replica.index, set()).add(threading.current_thread().name)
+        time.sleep(0.05)
+        return list(torch.stack(items) @ weight)
+
+    batcher = MicroBatcher("test_replicas", fn, max_batch_size=2, max_wait_ms=1, pool=pool)
+    inputs = [torch.randn(8) for _ in range(6)]
+    started = time.perf_counter()
+    results = await batcher.submit_many(inputs)
+    elapsed = time.perf_counter() - started
+    await batcher.stop()
+    pool.shutdown()
+
+    for x, result in zip(inputs, results):
+        assert torch.allclose(result, x @ weight)
+    # Three batches of two on three replicas: one round instead of three
+    assert sorted(seen) == [0, 1, 2]
+    assert elapsed < 0.12
+    assert all(len(threads) == 1 for threads in seen.values())
+    assert [m["items"] for m in pool.metrics()] == [2, 2, 2]
+    assert all(m["inflight_items"] == 0 for m in pool.metrics())
+
+
+@pytest.mark.asyncio
+async def test_single_replica_keeps_one_batch_in_flight():
+    """With one replica the next batch accumulates while the current one runs."""
+    pool = _cpu_pool(1)
+    sizes = []
+
+    def fn(items, replica):
+        sizes.append(len(items))
+        time.sleep(0.05)
+        return items
+
+    batcher = MicroBatcher("test_single_replica", fn, max_batch_size=16, max_wait_ms=1, pool=pool)
+    first = asyncio.ensure_future(batcher.submit(0))
+    await asyncio.sleep(0.01)
+    rest = await batcher.submit_many(list(range(1, 6)))
+    await first
+    await batcher.stop()
+    pool.shutdown()
+
+    assert rest == [1, 2, 3, 4, 5]
+    assert sizes == [1, 5]
+
+
+def test_clip_is_loaded_on_every_cpu_replica(monkeypatch):
+    transformers = pytest.importorskip("transformers")
+    if not isinstance(getattr(transformers, "__version__", None), str):
+        pytest.skip("transformers is stubbed in this session")
+    from backend.ml_inference_fastapi_app.services import clip_service, onnx_backend
+
+    config = transformers.CLIPConfig(
+        text_config=dict(vocab_size=99, hidden_size=32, intermediate_size=37, num_hidden_layers=2, num_attention_heads=4, max_position_embeddings=32),
+        vision_config=dict(image_size=32, patch_size=8, hidden_size=32, intermediate_size=37, num_hidden_layers=2, num_attention_heads=4),
+        projection_dim=16,
+    )
+
+    class Processor:
+        def __call__(self, images=None, return_tensors="pt", **_):
+            return transformers.BatchFeature({"pixel_values": torch.stack(images)})
+
+    pool = _cpu_pool(2)
+    monkeypatch.setattr(replicas, "pool", pool)
+    monkeypatch.setattr(clip_service, "CLIP_MODEL", None)
+    monkeypatch.setattr(clip_service, "CLIP_PROCESSOR", None)
+    monkeypatch.setattr(clip_service.AutoModel, "from_pretrained", lambda name: transformers.CLIPModel(config))
+    monkeypatch.setattr(clip_service.AutoProcessor, "from_pretrained", lambda name: Processor())
+    monkeypatch.setattr(onnx_backend, "use_onnx", lambda device: False)
+
+    asyncio.run(clip_service.load_clip_model())
+    first, second = pool.replicas
+    assert first.models["clip"][0] is second.models["clip"][0]  # same device: shared weights
+    assert first.models["clip"][1] is not second.models["clip"][1]  # own processor per thread
+
+    images = [torch.randn(3, 32, 32) for _ in range(2)]
+    on_first = clip_service.encode_image_batch(images, first)
+    on_second = clip_service.encode_image_batch(images, second)
+    on_first = on_first if isinstance(on_first, torch.Tensor) else on_first.pooler_output
+    on_second = on_second if isinstance(on_second, torch.Tensor) else on_second.pooler_output
+    assert torch.allclose(on_first, on_second)
+    pool.shutdown()
+
+
+def test_admission_fits_batches_into_memory_budget():
+    pool = _cpu_pool(2)
+    small, large = pool.replicas
+    small.memory_capacity, large.memory_capacity = 2 * 2**20, 8 * 2**20
+
+    assert pool.admit(pool.replicas, 4, 2**20) == (large, 4)
+    large.begin(6, 6 * 2**20)
+    assert pool.admit(pool.replicas, 4, 2**20) == (small, 2)
+    small.begin(2, 2 * 2**20)
+    assert pool.admit(pool.replicas, 4, 2**20) == (large, 2)
+    large.begin(2, 2 * 2**20)
+    # Full everywhere: wait for a running batch to release memory
+    assert pool.admit(pool.replicas, 4, 2**20) is None
+    pool.shutdown()
+
+    idle = _cpu_pool(1)
+    idle.primary.memory_capacity = 2**20
+    # Nothing running anywhere: one oversized item still goes through
+    assert idle.admit(idle.replicas, 4, 4 * 2**20) == (idle.primary, 1)
+    idle.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_batches_are_trimmed_to_the_memory_budget():
+    pool = _cpu_pool(1)
+    pool.primary.memory_capacity = 3 * 2**20
+    sizes = []
+
+    def fn(items, replica):
+        sizes.append(len(items))
+        assert replica.reserved_bytes <= replica.memory_capacity
+        return items
+
+    batcher = MicroBatcher("test_admission", fn, max_batch_size=8, max_wait_ms=5, pool=pool, bytes_per_item=2**20)
+    assert await batcher.submit_many(list(range(8))) == list(range(8))
+    await batcher.stop()
+    pool.shutdown()
+
+    assert sizes == [3, 3, 2]
+    assert batcher.metrics()["trimmed_batches"] == 2
+    assert pool.primary.reserved_bytes == 0
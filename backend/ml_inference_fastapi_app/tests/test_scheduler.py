@@ -0,0 +1,103 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+from backend.ml_inference_fastapi_app.services import scheduler
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def memory_scheduler(monkeypatch):
+    """A fresh in-process scheduler running one job at a time."""
+    monkeypatch.setattr(scheduler, "_backend", scheduler._MemoryBackend())
+    monkeypatch.setattr(scheduler, "MAX_RUNNING_JOBS", 1)
+    return scheduler
+
+
+async def test_jobs_start_by_priority_then_tenant_round_robin(memory_scheduler):
+    started = []
+
+    async def record(job):
+        started.append(job.payload["name"])
+        return {"name": job.payload["name"]}
+
+    memory_scheduler.register_handler("test_record", record)
+    for name in ("a1", "a2", "a3"):
+        await memory_scheduler.enqueue_job("test_record", {"name": name}, tenant="ingest-a")
+    await memory_scheduler.enqueue_job("test_record", {"name": "b1"}, tenant="ingest-b")
+    last = await memory_scheduler.enqueue_job("test_record", {"name": "search"}, priority="interactive")
+
+    await memory_scheduler.start_scheduler()
+    status = await memory_scheduler.wait_for_job_update(last, timeout=1)
+    while len(started) < 5:
+        await asyncio.sleep(0.01)
+    await memory_scheduler.stop_scheduler()
+
+    assert status["status"] == "completed" and status["result"] == {"name": "search"}
+    assert started == ["search", "a1", "b1", "a2", "a3"]
+
+
+async def test_queued_and_running_jobs_can_be_cancelled(memory_scheduler):
+    running = asyncio.Event()
+
+    async def slow(job):
+        await memory_scheduler.add_partial_results([{"unique_id": "first"}])
+        running.set()
+        await asyncio.sleep(60)
+
+    memory_scheduler.register_handler("test_slow", slow)
+    await memory_scheduler.start_scheduler()
+    first = await memory_scheduler.enqueue_job("test_slow", {})
+    second = await memory_scheduler.enqueue_job("test_slow", {})
+    await asyncio.wait_for(running.wait(), timeout=1)
+
+    queued = await memory_scheduler.cancel_job(second)
+    cancelled = await memory_scheduler.cancel_job(first)
+    await memory_scheduler.stop_scheduler()
+
+    assert queued["status"] == "cancelled"
+    assert cancelled["status"] == "cancelled"
+    assert cancelled["results"] == [{"unique_id": "first"}]
+    assert memory_scheduler.metrics()["queued"] == 0
+    assert await memory_scheduler.cancel_job("unknown") is None
+
+
+async def test_job_cancelled_after_being_popped_does_not_run(memory_scheduler):
+    ran = []
+
+    async def record(job):
+        ran.append(job.job_id)
+
+    memory_scheduler.register_handler("test_record", record)
+    job_id = await memory_scheduler.enqueue_job("test_record", {})
+    backend = memory_scheduler._backend
+    spec = backend._pop()
+
+    cancelled = await memory_scheduler.cancel_job(job_id)
+    await backend._run(spec)
+
+    assert cancelled["status"] == "cancelled"
+    assert ran == []
+    assert (await memory_scheduler.get_job_status(job_id))["status"] == "cancelled"
+
+
+async def test_full_queue_rejects_new_jobs(memory_scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_QUEUED_JOBS", 1)
+    await memory_scheduler.enqueue_job("test_record", {})
+
+    with pytest.raises(scheduler.SchedulerFull):
+        await memory_scheduler.enqueue_job("test_record", {})
+
+
+async def test_job_data_round_trips_through_json():
+    payload = {"images": [["id", "a.jpg", b"\xff\xd8 jpeg"]], "caption": True}
+
+    assert scheduler._from_json(scheduler._to_json(payload)) == payload
+    with pytest.raises(TypeError):
+        scheduler._to_json({"handler": test_job_data_round_trips_through_json})
@@ -0,0 +1,51 @@
+import os
+import sys
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+
+from backend.ml_inference_fastapi_app.services import text_cache
+from backend.ml_inference_fastapi_app.services.text_cache import TextEmbeddingCache
+
+
+def test_lookup_uses_normalized_text_and_model_name():
+    cache = TextEmbeddingCache(max_size=8, ttl_s=60)
+    cache.put("clip-a", "  Red   Car ", [1.0])
+
+    assert cache.get("clip-a", "red car") == [1.0]
+    assert cache.get("clip-b", "red car") is None
+    assert cache.metrics()["hits"] == 1 and cache.metrics()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TextEmbeddingCache(max_size=2, ttl_s=60)
+    cache.put("m", "a", [1.0])
+    cache.put("m", "b", [2.0])
+    cache.get("m", "a")  # "b" is now the least recently used
+    cache.put("m", "c", [3.0])
+
+    assert cache.get("m", "b") is None
+    assert cache.get("m", "a") == [1.0]
+    assert cache.get("m", "c") == [3.0]
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(text_cache.time, "monotonic", lambda: now[0])
+    cache = TextEmbeddingCache(max_size=8, ttl_s=10)
+    cache.put("m", "query", [1.0])
+
+    now[0] += 5
+    assert cache.get("m", "query") == [1.0]
+    now[0] += 6
+    assert cache.get("m", "query") is None
+    assert cache.metrics()["size"] == 0
+
+
+def test_from_env_reads_settings_under_the_given_prefix(monkeypatch):
+    monkeypatch.setenv("X_TEXT_CACHE_SIZE", "3")
+    monkeypatch.delenv("X_TEXT_CACHE_TTL_S", raising=False)
+    cache = TextEmbeddingCache.from_env("X_TEXT_CACHE", max_size=10, ttl_s=42)
+
+    assert cache.max_size == 3
+    assert cache.ttl_s == 42.0
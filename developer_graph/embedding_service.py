@@ -166,8 +166,11 @@ class EmbeddingService:
         try:
             # Try ML service first
             if self.ml_service_url:
+                # Chunk texts are one-off background work: keep them out of the ML
+                # service's query cache and behind interactive searches
                 response = requests.post(
-                    f"{self.ml_service_url}/embed_text",
+                    f"{self.ml_service_url}/api/v1/embed_text_batch",
+                    params={"cache": "false", "priority": "bulk"},
                     json={"texts": texts},
                     timeout=30
                 )
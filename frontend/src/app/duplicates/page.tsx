@@ -33,10 +33,13 @@ import { useStore } from "@/store/useStore";
 import {
   startFindSimilar,
   getFindSimilarReport,
+  cancelFindSimilar,
   archiveSelection,
   FindSimilarTask,
 } from "@/lib/api";
 
+const API_URL = process.env.NEXT_PUBLIC_API_URL || "";
+
 export default function DuplicatesPage() {
   const { collection } = useStore();
   const [taskId, setTaskId] = useState<string | null>(null);
@@ -51,6 +54,11 @@ export default function DuplicatesPage() {
     },
   });
 
+  const cancelMutation = useMutation({
+    mutationFn: () => cancelFindSimilar(taskId as string),
+    onSuccess: () => setTaskId(null),
+  });
+
   const { data: report, isLoading } = useQuery<FindSimilarTask | null>({
     queryKey: ["dup-report", taskId],
     queryFn: () =>
@@ -102,7 +110,20 @@ export default function DuplicatesPage() {
           {report && (
             <Box w="full">
               <Text mb={2}>Status: {report.status}</Text>
-              <Text mb={4}>Progress: {report.progress.toFixed(2)}%</Text>
+              <HStack mb={4}>
+                <Text>
+                  Progress: {report.progress.toFixed(2)}% ({report.phase})
+                </Text>
+                {report.status === "running" && (
+                  <Button
+                    size="sm"
+                    onClick={() => cancelMutation.mutate()}
+                    isLoading={cancelMutation.isLoading}
+                  >
+                    Cancel
+                  </Button>
+                )}
+              </HStack>
               {report.status === "completed" && (
                 <VStack align="start" spacing={4}>
                   <Text fontWeight="bold">{report.results.length} near-duplicate groups found.</Text>
@@ -115,7 +136,7 @@ export default function DuplicatesPage() {
                               <VStack>
                                 <Box position="relative">
                                   <Image
-                                    src={`data:image/jpeg;base64,${p.payload.thumbnail_base64}`}
+                                    src={`${API_URL}/api/v1/images/${p.id}/thumbnail`}
                                     alt={p.payload.filename}
                                     boxSize="150px"
                                     objectFit="cover"
@@ -13,6 +13,8 @@ import {
 } from '@chakra-ui/react';
 import { UMAPPoint } from '../types/latent-space';
 
+const API_URL = process.env.NEXT_PUBLIC_API_URL || '';
+
 interface ThumbnailOverlayProps {
   point: UMAPPoint | null;
   mousePosition: { x: number; y: number } | null;
@@ -61,9 +63,13 @@ export function ThumbnailOverlay({
         cursor={onImageClick ? 'pointer' : 'default'}
       >
         <VStack spacing={2} align="stretch">
-          {point.thumbnail_base64 && (
+          {(point.thumbnail_url || point.thumbnail_base64) && (
             <Image
-              src={`data:image/jpeg;base64,${point.thumbnail_base64}`}
+              src={
+                point.thumbnail_base64
+                  ? `data:image/jpeg;base64,${point.thumbnail_base64}`
+                  : `${API_URL}${point.thumbnail_url}`
+              }
               alt={point.filename || 'Image'}
               maxH="150px"
               objectFit="contain"
@@ -4,7 +4,9 @@ export interface UMAPPoint {
   y: number;
   cluster_id?: number | null;
   is_outlier?: boolean;
-  thumbnail_base64?: string;
+  file_hash?: string;
+  thumbnail_url?: string;
+  thumbnail_base64?: string; // Only for points not yet migrated to the thumbnail store
   filename?: string;
   caption?: string;
 }
@@ -31,6 +31,8 @@ import { useQuery, useMutation } from '@tanstack/react-query';
 import { getIngestStatus, archiveExact, archiveAllDuplicates } from '@/lib/api';
 import { Header } from '@/components/Header';
 
+const API_URL = process.env.NEXT_PUBLIC_API_URL || '';
+
 export default function JobLogsPage() {
   const { jobId } = useParams<{ jobId: string }>();
   const [selected, setSelected] = useState<Set<string>>(new Set());
@@ -211,9 +213,9 @@ export default function JobLogsPage() {
                             </VStack>
                             <VStack align="start">
                               <Text fontWeight="bold">Original</Text>
-                              {dup.existing_payload?.thumbnail_base64 ? (
+                              {dup.existing_id ? (
                                 <Image
-                                  src={`data:image/jpeg;base64,${dup.existing_payload.thumbnail_base64}`}
+                                  src={`${API_URL}/api/v1/images/${dup.existing_id}/thumbnail`}
                                   alt="Original image thumbnail"
                                   boxSize="100px"
                                   objectFit="cover"
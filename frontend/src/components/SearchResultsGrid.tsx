@@ -64,7 +64,7 @@ export function SearchResultsGrid({ results, isLoading, onImageClick }: SearchRe
             role="group"
           >
             <NextImage
-              src={`/api/v1/images/${result.id}/thumbnail`}
+              src={result.thumbnail_url ?? `/api/v1/images/${result.id}/thumbnail`}
               alt={result.payload.filename}
               width={300}
               height={300}
@@ -15,6 +15,7 @@ export interface SearchResult {
   id: string;
   payload: SearchResultPayload;
   score: number;
+  thumbnail_url?: string;
 }
 
 interface SearchResponse {
@@ -108,6 +108,7 @@ export async function archiveExact(filePaths: string[]) {
 export interface FindSimilarTask {
   task_id: string;
   status: string;
+  phase: string;
   progress: number;
   total_points: number;
   processed_points: number;
@@ -130,6 +131,11 @@ export async function getFindSimilarReport(taskId: string) {
   return data as FindSimilarTask;
 }
 
+export async function cancelFindSimilar(taskId: string) {
+  const { data } = await api.post(`/api/v1/duplicates/cancel/${taskId}`);
+  return data as FindSimilarTask;
+}
+
 export async function archiveSelection(pointIds: string[]) {
   const { data } = await api.post('/api/v1/curation/archive-selection', {
     point_ids: pointIds,
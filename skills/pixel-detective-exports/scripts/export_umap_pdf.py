@@ -41,6 +41,22 @@ def fetch_projection(api_base: str, sample_size: int, full: bool) -> Dict[str, A
     return request_json("GET", f"{api_base}/umap/projection", params=params)
 
 
+def fetch_thumbnails(api_base: str, points: List[Dict[str, Any]], size: int = 256, chunk: int = 500) -> None:
+    """Inline thumbnails from the thumbnail store into ``points`` (``thumbnail_base64``) for the offline report."""
+    hashes = [p["file_hash"] for p in points if p.get("file_hash") and not p.get("thumbnail_base64")]
+    found: Dict[str, str] = {}
+    for start in range(0, len(hashes), chunk):
+        data = request_json(
+            "POST",
+            f"{api_base}/api/v1/thumbnails/batch",
+            json={"hashes": hashes[start:start + chunk], "size": size},
+        )
+        found.update(data.get("thumbnails") or {})
+    for point in points:
+        if point.get("file_hash") in found:
+            point["thumbnail_base64"] = found[point["file_hash"]]
+
+
 def build_cluster_payload(
     algorithm: str,
     data: List[List[float]],
@@ -344,6 +360,7 @@ def main() -> int:
         points = projection.get("points") or []
         if not points:
             continue
+        fetch_thumbnails(api_base, points)
 
         cluster_info = cluster_points(
             gpu_base,
@@ -0,0 +1,12 @@
+import os
+import shutil
+import tempfile
+
+# The pipeline opens its diskcache when it is imported; point it outside the
+# working tree before any test module imports it
+_cache_dir = tempfile.mkdtemp(prefix="ingest_cache_")
+os.environ.setdefault("INGEST_CACHE_DIR", _cache_dir)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_cache_dir, ignore_errors=True)
@@ -0,0 +1,95 @@
+import asyncio
+import base64
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi import BackgroundTasks
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app.pipeline import caption_backfill
+from backend.ingestion_orchestration_fastapi_app.pipeline.cpu_processor import cache
+from backend.ingestion_orchestration_fastapi_app.pipeline.manager import JobStatus, active_jobs
+
+pytestmark = pytest.mark.asyncio
+
+THUMB = base64.b64encode(b"thumbnail-jpeg").decode("utf-8")
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Clear diskcache before each test."""
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def _point(i: int, thumbnail: bool = True):
+    payload = {"filename": f"img_{i}.jpg", "file_hash": f"hash_{i}"}
+    if thumbnail:
+        payload["thumbnail_base64"] = THUMB
+    return SimpleNamespace(id=f"point_{i}", payload=payload)
+
+
+async def test_backfill_captions_uncaptioned_points():
+    qdrant_client = MagicMock()
+    qdrant_client.count.return_value = SimpleNamespace(count=5)
+    qdrant_client.scroll.side_effect = [
+        ([_point(0), _point(1)], "next"),
+        ([_point(2), _point(3), _point(4, thumbnail=False)], None),
+    ]
+    cache.set("photos:hash_1", {"id": "point_1", "vector": [0.1], "payload": {"caption": None}})
+    sent = []
+
+    async def fake_send(batch_items, caption=True, client=None, on_results=None, embed=True, tenant=None):
+        assert caption and not embed
+        assert all(item["image_bytes"] == b"thumbnail-jpeg" for item in batch_items)
+        sent.append([item["file_hash"] for item in batch_items])
+        return [{"unique_id": item["file_hash"], "caption": f"a photo {item['file_hash']}"} for item in batch_items]
+
+    with patch.object(caption_backfill, "CAPTION_BACKFILL_BATCH_SIZE", 3), \
+         patch.object(caption_backfill.gpu_worker, "send_batch_to_ml_service", side_effect=fake_send):
+        background = BackgroundTasks()
+        job_id = await caption_backfill.start_caption_backfill("photos", background, qdrant_client)
+        await asyncio.wait_for(background(), timeout=5)
+
+    ctx = active_jobs.pop(job_id)
+    assert ctx.status == JobStatus.COMPLETED
+    assert sent == [["point_0", "point_1"], ["point_2", "point_3"]]
+    assert qdrant_client.scroll.call_args_list[0].kwargs["limit"] == 3
+    assert qdrant_client.scroll.call_args_list[1].kwargs["offset"] == "next"
+    assert ctx.total_files == 5
+    assert ctx.processed_files == 4
+    assert ctx.failed_files == 1  # point_4 has nothing to caption from
+    assert ctx.progress == pytest.approx(80.0)
+    written = {
+        op.set_payload.points[0]: op.set_payload.payload["caption"]
+        for call in qdrant_client.batch_update_points.call_args_list
+        for op in call.kwargs["update_operations"]
+    }
+    assert written == {f"point_{i}": f"a photo point_{i}" for i in range(4)}
+    assert cache.get("photos:hash_1")["payload"]["caption"] == "a photo point_1"
+
+
+async def test_backfill_rejects_unknown_source():
+    with pytest.raises(ValueError):
+        await caption_backfill.start_caption_backfill("photos", BackgroundTasks(), MagicMock(), source="raw")
+
+
+async def test_caption_item_reads_the_thumbnail_store(tmp_path, monkeypatch):
+    from PIL import Image
+    from backend.ingestion_orchestration_fastapi_app import thumbnail_store
+
+    monkeypatch.setattr(thumbnail_store, "THUMBNAIL_STORE_DIR", str(tmp_path))
+    file_hash = "cd34" * 16
+    thumbnail_store.store_image(file_hash, Image.new("RGB", (800, 600), "green"), str(tmp_path))
+    point = SimpleNamespace(id="point_0", payload={"filename": "a.jpg", "file_hash": file_hash, "thumbnail_base64": THUMB})
+
+    item = caption_backfill._caption_item(point, "thumbnail")
+
+    assert item["image_bytes"] == thumbnail_store.path_for(file_hash, thumbnail_store.THUMBNAIL_SIZES[-1], str(tmp_path)).read_bytes()
+    assert item["cache_key_hash"] == file_hash
@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import io
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+from PIL import Image
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app.pipeline import caption_worker
+from backend.ingestion_orchestration_fastapi_app.pipeline.cpu_processor import cache
+from backend.ingestion_orchestration_fastapi_app.pipeline.ledger import JobLedger
+from backend.ingestion_orchestration_fastapi_app.pipeline.manager import JobContext
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Clear diskcache before each test."""
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def _caption_item(tmp_path, i: int) -> dict:
+    """A queued reference, as handed over by the embedding stage, to a source file on disk."""
+    path = tmp_path / f"img_{i}.jpg"
+    Image.new("RGB", (64, 48), color=(10 * i, 200, 30)).save(path, format="JPEG")
+    return {
+        "point_id": f"point_{i}",
+        "file_hash": hashlib.sha256(path.read_bytes()).hexdigest(),
+        "filename": path.name,
+        "file_path": str(path),
+        "collection_name": "test_collection",
+    }
+
+
+async def test_captions_written_after_points_are_acknowledged(tmp_path):
+    ctx = JobContext(job_id="caption_job", blip_batch_size=2, deferred_captions=True, ml_transport="multipart", model_input_size=24)
+    ctx.add_log = MagicMock()
+    ctx.caption_queue = asyncio.Queue()
+    ctx.ledger = JobLedger.create("caption_job", "test_collection", ledger_dir=str(tmp_path))
+    items = [_caption_item(tmp_path, i) for i in range(4)]
+    for i, item in enumerate(items):
+        ctx.ledger.record_embedded(f"point_{i}", f"test_collection:{item['file_hash']}")
+        cache.set(f"test_collection:{item['file_hash']}", {"id": f"point_{i}", "vector": [0.1], "payload": {"caption": None}})
+        await ctx.caption_queue.put(item)
+    await ctx.caption_queue.put(None)
+    # A source file removed after it was embedded is skipped, not sent to BLIP
+    os.remove(items[3]["file_path"])
+    ctx.ledger.record_acked(["point_3"])
+
+    qdrant_client = MagicMock()
+    requests = []
+
+    async def fake_send(batch_items, caption=True, client=None, on_results=None, embed=True, tenant=None):
+        requests.append((len(batch_items), caption, embed))
+        # BLIP gets the source decoded again at the model input size, not a thumbnail
+        for item in batch_items:
+            with Image.open(io.BytesIO(item["image_bytes"])) as image:
+                assert image.format == "JPEG" and min(image.size) == 24
+        # Points are acknowledged by the DB stage while BLIP is running
+        ctx.ledger.record_acked(item["point_id"] for item in batch_items)
+        return [{"unique_id": item["file_hash"], "caption": f"caption {item['file_hash']}"} for item in batch_items]
+
+    with patch.object(caption_worker.gpu_worker, "send_batch_to_ml_service", side_effect=fake_send):
+        await asyncio.wait_for(caption_worker.process_captions(ctx, "test_collection", qdrant_client), timeout=5)
+    await asyncio.wait_for(ctx.caption_queue.join(), timeout=1)
+    ctx.ledger.close()
+
+    assert requests == [(2, True, False), (1, True, False)]
+    assert qdrant_client.batch_update_points.call_count == 2
+    operations = [
+        op for call in qdrant_client.batch_update_points.call_args_list for op in call.kwargs["update_operations"]
+    ]
+    assert {op.set_payload.points[0]: op.set_payload.payload["caption"] for op in operations} == {
+        f"point_{i}": f"caption {items[i]['file_hash']}" for i in range(3)
+    }
+    assert cache.get(f"test_collection:{items[1]['file_hash']}")["payload"]["caption"] == f"caption {items[1]['file_hash']}"
+    assert ctx.stage("caption").items == 3
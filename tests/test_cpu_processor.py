@@ -1,7 +1,9 @@
 import asyncio
+import contextlib
 import unittest
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import diskcache
 import pytest
 from PIL import Image
 import os
@@ -10,7 +12,11 @@ import sys
 # Add project root to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from backend.ingestion_orchestration_fastapi_app.pipeline.cpu_processor import process_files, cache
+from backend.ingestion_orchestration_fastapi_app import thumbnail_store
+from backend.ingestion_orchestration_fastapi_app.pipeline import cpu_processor
+from backend.ingestion_orchestration_fastapi_app.pipeline.cpu_processor import process_files
+from backend.ingestion_orchestration_fastapi_app.pipeline.decode_pool import create_decode_pool
+from backend.ingestion_orchestration_fastapi_app.pipeline.image_record import ImageRecord
 from backend.ingestion_orchestration_fastapi_app.pipeline.manager import JobContext
 
 # Pytest mark for async tests
@@ -23,21 +29,33 @@ def mock_job_context():
     ctx.raw_queue = AsyncMock(spec=asyncio.Queue)
     ctx.ml_queue = AsyncMock(spec=asyncio.Queue)
     ctx.db_queue = AsyncMock(spec=asyncio.Queue)
+    ctx.add_log = MagicMock()
     return ctx
 
 @pytest.fixture(autouse=True)
-def clear_cache():
-    """Clear diskcache before each test."""
-    cache.clear()
+def cache(tmp_path, monkeypatch):
+    """Point the stage and its decode workers at a per-test diskcache."""
+    test_cache = diskcache.Cache(str(tmp_path / "cache"))
+    monkeypatch.setattr(cpu_processor, "CACHE_DIR", test_cache.directory)
+    monkeypatch.setattr(cpu_processor, "cache", test_cache)
+    yield test_cache
+    test_cache.close()
 
-async def test_cpu_worker_cache_miss_success(mock_job_context):
+@pytest.fixture(autouse=True)
+def thumbnail_dir(tmp_path, monkeypatch):
+    """Write thumbnails to a per-test store."""
+    store_dir = str(tmp_path / "thumbnails")
+    monkeypatch.setattr(thumbnail_store, "THUMBNAIL_STORE_DIR", store_dir)
+    return store_dir
+
+async def test_cpu_worker_cache_miss_success(mock_job_context, thumbnail_dir):
     """
     Tests the successful processing of a new image (cache miss).
     """
     # --- Setup ---
     ctx = mock_job_context
     test_file_path = "/tmp/test.dng"
-    test_file_hash = "fake_hash_123"
+    test_file_hash = "ab12" * 16
     collection_name = "test_collection"
 
     # Mock the file path queue
@@ -53,19 +71,26 @@ async def test_cpu_worker_cache_miss_success(mock_job_context):
     # Mock utilities
     mock_pil_image = Image.new('RGB', (10, 10), color = 'red')
 
+    mock_record = ImageRecord(
+        file_path=test_file_path,
+        file_hash=test_file_hash,
+        image=mock_pil_image,
+        metadata={"filename": "test.dng"},
+    )
+
     # Patch the functions that are called
-    with patch('backend.ingestion_orchestration_fastapi_app.pipeline.utils.compute_sha256', return_value=test_file_hash) as mock_hash, \
-         patch('backend.ingestion_orchestration_fastapi_app.pipeline.image_processing.decode_and_prep_image', return_value=(mock_pil_image, None)) as mock_decode, \
-         patch('backend.ingestion_orchestration_fastapi_app.pipeline.utils.extract_image_metadata', return_value={"filename": "test.dng"}) as mock_metadata:
+    with patch('backend.ingestion_orchestration_fastapi_app.pipeline.image_record.open_file_buffer', return_value=contextlib.nullcontext(b"raw-bytes")) as mock_open, \
+         patch('backend.ingestion_orchestration_fastapi_app.pipeline.image_record.hash_buffer', return_value=test_file_hash) as mock_hash, \
+         patch('backend.ingestion_orchestration_fastapi_app.pipeline.image_record.decode_buffer', return_value=(mock_record, None)) as mock_decode:
         
         # --- Act ---
         await process_files(ctx, collection_name)
 
         # --- Assert ---
-        # Ensure external functions were called
-        mock_hash.assert_called_once_with(test_file_path)
-        mock_decode.assert_called_once_with(test_file_path)
-        mock_metadata.assert_called_once_with(test_file_path)
+        # The file is read once and that buffer feeds hashing and decoding
+        mock_open.assert_called_once_with(test_file_path)
+        mock_hash.assert_called_once_with(b"raw-bytes")
+        mock_decode.assert_called_once_with(test_file_path, b"raw-bytes", test_file_hash, None)
 
         # Ensure the correct payload was put into the ml_queue
         ctx.ml_queue.put.assert_called_once()
@@ -76,6 +101,8 @@ async def test_cpu_worker_cache_miss_success(mock_job_context):
         assert call_args['filename'] == "test.dng"
         assert 'image_base64' in call_args
         assert call_args['collection_name'] == collection_name
+        assert 'thumbnail_base64' not in call_args
+        assert thumbnail_store.exists(test_file_hash, root=thumbnail_dir)
         
         # Ensure nothing was put in the db_queue
         ctx.db_queue.put.assert_not_called()
@@ -105,14 +132,15 @@ async def test_cpu_worker_decode_failure(mock_job_context):
     ctx.raw_queue.get.side_effect = get_side_effect
 
     # Mock utilities to simulate a decoding failure
-    with patch('backend.ingestion_orchestration_fastapi_app.pipeline.utils.compute_sha256', return_value=test_file_hash), \
-         patch('backend.ingestion_orchestration_fastapi_app.pipeline.image_processing.decode_and_prep_image', return_value=(None, error_message)) as mock_decode:
+    with patch('backend.ingestion_orchestration_fastapi_app.pipeline.image_record.open_file_buffer', return_value=contextlib.nullcontext(b"raw-bytes")), \
+         patch('backend.ingestion_orchestration_fastapi_app.pipeline.image_record.hash_buffer', return_value=test_file_hash), \
+         patch('backend.ingestion_orchestration_fastapi_app.pipeline.image_record.decode_buffer', return_value=(None, error_message)) as mock_decode:
         
         # --- Act ---
         await process_files(ctx, collection_name)
 
         # --- Assert ---
-        mock_decode.assert_called_once_with(test_file_path)
+        mock_decode.assert_called_once_with(test_file_path, b"raw-bytes", test_file_hash, None)
         
         # Ensure nothing was queued
         ctx.ml_queue.put.assert_not_called()
@@ -121,4 +149,73 @@ async def test_cpu_worker_decode_failure(mock_job_context):
         # Ensure failure is logged and counted
         assert ctx.failed_files == 1
         assert ctx.processed_files == 0
-        ctx.add_log.assert_called_with(f"Failed to decode {os.path.basename(test_file_path)}: {error_message}", level="error") 
\ No newline at end of file
+        ctx.add_log.assert_called_with(f"Failed to decode {os.path.basename(test_file_path)}: {error_message}", level="error")
+
+async def test_cpu_worker_process_pool(mock_job_context, tmp_path, thumbnail_dir):
+    """
+    Tests that a real image round-trips through the decode process pool and
+    that the decode stage throughput counter is updated.
+    """
+    # --- Setup ---
+    ctx = mock_job_context
+    image_path = tmp_path / "pool.jpg"
+    Image.new('RGB', (64, 48), color='blue').save(image_path, format='JPEG')
+
+    async def get_side_effect():
+        if not get_side_effect.called:
+            get_side_effect.called = True
+            return str(image_path)
+        raise asyncio.CancelledError
+    get_side_effect.called = False
+    ctx.raw_queue.get.side_effect = get_side_effect
+
+    ctx.decode_pool = create_decode_pool(1)
+    try:
+        # --- Act ---
+        await process_files(ctx, "test_collection")
+    finally:
+        ctx.decode_pool.shutdown(wait=True)
+
+    # --- Assert ---
+    ctx.ml_queue.put.assert_called_once()
+    call_args = ctx.ml_queue.put.call_args[0][0]
+    assert len(call_args['file_hash']) == 64
+    assert call_args['metadata']['width'] == 64
+    assert call_args['metadata']['height'] == 48
+    for size in thumbnail_store.THUMBNAIL_SIZES:
+        assert thumbnail_store.path_for(call_args['file_hash'], size, thumbnail_dir).is_file()
+
+    stats = ctx.stage("decode").as_dict()
+    assert stats["items"] == 1
+    assert stats["bytes"] == os.path.getsize(image_path)
+    assert ctx.processed_files == 1
+
+async def test_cpu_worker_cache_hit_uses_the_entry_read_by_the_worker(mock_job_context, cache):
+    """
+    A cache hit is served from the entry the decode worker read, so an eviction
+    before the parent process looks again does not fail the file.
+    """
+    # --- Setup ---
+    ctx = mock_job_context
+    test_file_hash = "cd34" * 16
+    cache.set(f"test_collection:{test_file_hash}", {"id": "p1", "vector": [0.1, 0.2], "payload": {"filename": "hit.jpg"}})
+
+    async def get_side_effect():
+        if not get_side_effect.called:
+            get_side_effect.called = True
+            return "/tmp/hit.jpg"
+        raise asyncio.CancelledError
+    get_side_effect.called = False
+    ctx.raw_queue.get.side_effect = get_side_effect
+
+    with patch('backend.ingestion_orchestration_fastapi_app.pipeline.image_record.open_file_buffer', return_value=contextlib.nullcontext(b"raw-bytes")), \
+         patch('backend.ingestion_orchestration_fastapi_app.pipeline.image_record.hash_buffer', return_value=test_file_hash), \
+         patch('backend.ingestion_orchestration_fastapi_app.pipeline.cpu_processor.cache', new=MagicMock(get=MagicMock(return_value=None))):
+        # --- Act ---
+        await process_files(ctx, "test_collection")
+
+    # --- Assert ---
+    point = ctx.db_queue.put.call_args[0][0]
+    assert point.id == "p1" and point.payload == {"filename": "hit.jpg"}
+    assert ctx.cached_files == 1
+    assert ctx.failed_files == 0
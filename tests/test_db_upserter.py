@@ -0,0 +1,247 @@
+import asyncio
+import json
+import os
+import sys
+import uuid
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import httpx
+import pytest
+from qdrant_client.http.exceptions import UnexpectedResponse
+from qdrant_client.http.models import PointStruct
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app.pipeline import db_upserter, ledger, scan_index, utils
+from backend.ingestion_orchestration_fastapi_app.pipeline.cpu_processor import cache
+from backend.ingestion_orchestration_fastapi_app.pipeline.manager import JobContext
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Clear diskcache before each test."""
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def _point(i: int) -> PointStruct:
+    return PointStruct(
+        id=f"00000000-0000-0000-0000-{i:012d}",
+        vector=[0.1] * 512,
+        payload={"filename": f"img_{i}.jpg", "caption": "x" * 2000, "tags": ["a", "b"], "width": 10},
+    )
+
+
+def test_estimate_point_bytes_bounds_json_size():
+    point = _point(1)
+    actual = len(json.dumps(point.dict()).encode("utf-8"))
+    estimate = db_upserter.estimate_point_bytes(point)
+    assert actual <= estimate <= actual * 2
+
+
+@pytest.mark.asyncio
+async def test_upsert_to_db_bulk_checks_existence_per_batch():
+    """With random IDs: one retrieve per batch, existing points skipped, every new point upserted."""
+    ctx = JobContext(job_id="test_job", qdrant_batch_size=2, deterministic_ids=False)
+    ctx.add_log = MagicMock()
+    ctx.db_queue = asyncio.Queue()
+    points = [_point(i) for i in range(5)]
+    for p in points:
+        await ctx.db_queue.put(p)
+    await ctx.db_queue.put(None)
+
+    client = MagicMock()
+    client.retrieve.side_effect = lambda collection_name, ids, **kwargs: [
+        SimpleNamespace(id=i) for i in ids if i == points[1].id
+    ]
+
+    await asyncio.wait_for(db_upserter.upsert_to_db(ctx, "test_collection", client), timeout=5)
+
+    assert client.retrieve.call_count == 3
+    assert all(len(call.kwargs["ids"]) <= 2 for call in client.retrieve.call_args_list)
+    upserted = [p.id for call in client.upsert.call_args_list for p in call.kwargs["points"]]
+    assert sorted(upserted) == sorted(p.id for p in points if p.id != points[1].id)
+    assert ctx.stage("db").items == 4
+    assert ctx.failed_files == 0
+
+
+@pytest.mark.asyncio
+async def test_upsert_to_db_isolates_failing_point():
+    """A batch Qdrant rejects is bisected so only the bad point is counted as failed."""
+    ctx = JobContext(job_id="test_job", qdrant_batch_size=4)
+    ctx.add_log = MagicMock()
+    ctx.db_queue = asyncio.Queue()
+    points = [_point(i) for i in range(4)]
+    for p in points:
+        await ctx.db_queue.put(p)
+    await ctx.db_queue.put(None)
+
+    def upsert(collection_name, points, wait):
+        if any(p.id == "00000000-0000-0000-0000-000000000002" for p in points):
+            raise UnexpectedResponse(400, "Bad Request", b'{"status": {"error": "bad vector"}}', httpx.Headers())
+
+    client = MagicMock()
+    client.retrieve.return_value = []
+    client.upsert.side_effect = upsert
+
+    await asyncio.wait_for(db_upserter.upsert_to_db(ctx, "test_collection", client), timeout=5)
+
+    assert ctx.failed_files == 1
+    assert ctx.stage("db").items == 3
+
+
+@pytest.mark.asyncio
+async def test_unavailable_qdrant_retries_the_whole_batch_without_bisecting():
+    ctx = JobContext(job_id="test_job", qdrant_batch_size=4)
+    ctx.add_log = MagicMock()
+    ctx.db_queue = asyncio.Queue()
+    for i in range(4):
+        await ctx.db_queue.put(_point(i))
+    await ctx.db_queue.put(None)
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    client = MagicMock()
+    client.retrieve.return_value = []
+    client.upsert.side_effect = httpx.ConnectError("connection refused")
+    with patch.object(db_upserter, "QDRANT_UPSERT_RETRIES", 2), patch.object(db_upserter, "QDRANT_UPSERT_BACKOFF", 1.0), \
+            patch.object(db_upserter.asyncio, "sleep", fake_sleep):
+        await asyncio.wait_for(db_upserter.upsert_to_db(ctx, "test_collection", client), timeout=5)
+
+    assert [len(call.kwargs["points"]) for call in client.upsert.call_args_list] == [4, 4, 4]
+    assert delays == [1.0, 2.0]
+    assert ctx.failed_files == 4
+
+
+def test_point_id_for_is_content_addressed():
+    first = utils.point_id_for("photos", "abc123")
+    assert first == utils.point_id_for("photos", "abc123")
+    assert first != utils.point_id_for("photos", "abc124")
+    assert first != utils.point_id_for("other", "abc123")
+    assert uuid.UUID(first).version == 5
+
+
+@pytest.mark.asyncio
+async def test_upsert_to_db_deterministic_ids_skip_existence_checks_and_sweep():
+    """Content-addressed IDs make upserts idempotent: no retrieve calls and no cache sweep."""
+    ctx = JobContext(job_id="test_job", qdrant_batch_size=2, deterministic_ids=True)
+    ctx.add_log = MagicMock()
+    ctx.db_queue = asyncio.Queue()
+    for i in range(3):
+        await ctx.db_queue.put(_point(i))
+    await ctx.db_queue.put(None)
+    # A cached record from an earlier run must not be swept back in
+    cache.set("test_collection:stale", {"id": _point(9).id, "vector": [0.1], "payload": {}})
+
+    client = MagicMock()
+    await asyncio.wait_for(db_upserter.upsert_to_db(ctx, "test_collection", client), timeout=5)
+
+    client.retrieve.assert_not_called()
+    upserted = [p.id for call in client.upsert.call_args_list for p in call.kwargs["points"]]
+    assert sorted(upserted) == sorted(_point(i).id for i in range(3))
+
+
+def test_job_ledger_tracks_unacknowledged_points(tmp_path):
+    job_ledger = ledger.JobLedger.create("job1", "photos", ledger_dir=str(tmp_path))
+    job_ledger.record_embedded("p1", "photos:h1")
+    job_ledger.record_embedded("p2", "photos:h2")
+    job_ledger.record_acked(["p1", "unknown"])
+
+    reloaded = ledger.JobLedger.load(job_ledger.path)
+    assert reloaded.collection_name == "photos"
+    assert reloaded.pending == {"p2": "photos:h2"}
+
+    # Kept on disk while points are pending, removed once everything is acknowledged
+    job_ledger.close()
+    assert os.path.exists(job_ledger.path)
+    reloaded.record_acked(["p2"])
+    reloaded.close()
+    assert not os.path.exists(job_ledger.path)
+
+
+@pytest.mark.asyncio
+async def test_upsert_to_db_replays_only_unacknowledged_ledger_entries(tmp_path):
+    """Points embedded in this job but never written are replayed from the ledger, nothing else."""
+    ctx = JobContext(job_id="test_job", qdrant_batch_size=4)
+    ctx.add_log = MagicMock()
+    ctx.db_queue = asyncio.Queue()
+    ctx.ledger = ledger.JobLedger.create("test_job", "test_collection", ledger_dir=str(tmp_path))
+
+    delivered, lost = _point(1), _point(2)
+    for p in (delivered, lost):
+        cache.set(f"test_collection:{p.id}", {"id": p.id, "vector": p.vector, "payload": p.payload})
+        ctx.ledger.record_embedded(p.id, f"test_collection:{p.id}")
+    # Unrelated cached record from another job must not be touched
+    cache.set("test_collection:other", {"id": _point(3).id, "vector": [0.1], "payload": {}})
+    await ctx.db_queue.put(delivered)
+    await ctx.db_queue.put(None)
+
+    client = MagicMock()
+    await asyncio.wait_for(db_upserter.upsert_to_db(ctx, "test_collection", client), timeout=5)
+
+    upserted = [p.id for call in client.upsert.call_args_list for p in call.kwargs["points"]]
+    assert sorted(upserted) == sorted([delivered.id, lost.id])
+    # Only upserts Qdrant has applied are recorded as acknowledged
+    assert all(call.kwargs["wait"] is True for call in client.upsert.call_args_list)
+    assert ctx.ledger.pending == {}
+
+
+@pytest.mark.asyncio
+async def test_scan_index_records_only_applied_upserts(tmp_path):
+    ctx = JobContext(job_id="test_job", qdrant_batch_size=4)
+    ctx.add_log = MagicMock()
+    ctx.db_queue = asyncio.Queue()
+    ctx.scan_index = scan_index.ScanIndex.open("test_collection", str(tmp_path))
+    p = PointStruct(id="p1", vector=[0.1], payload={"full_path": "/photos/a.jpg"})
+    ctx.file_signatures["/photos/a.jpg"] = (4, 1)
+    await ctx.db_queue.put(p)
+    await ctx.db_queue.put(None)
+
+    client = MagicMock()
+    await asyncio.wait_for(db_upserter.upsert_to_db(ctx, "test_collection", client), timeout=5)
+
+    assert client.upsert.call_args.kwargs["wait"] is True
+    assert ctx.scan_index.is_unchanged("/photos/a.jpg", (4, 1))
+    ctx.scan_index.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_upsert_stays_pending_in_the_ledger(tmp_path):
+    ctx = JobContext(job_id="test_job", qdrant_batch_size=4)
+    ctx.add_log = MagicMock()
+    ctx.db_queue = asyncio.Queue()
+    ctx.ledger = ledger.JobLedger.create("test_job", "test_collection", ledger_dir=str(tmp_path))
+    p = _point(1)
+    ctx.ledger.record_embedded(p.id, f"test_collection:{p.id}")
+    await ctx.db_queue.put(p)
+    await ctx.db_queue.put(None)
+
+    client = MagicMock()
+    client.upsert.side_effect = RuntimeError("apply failed")
+    with patch.object(db_upserter, "QDRANT_UPSERT_RETRIES", 0):
+        await asyncio.wait_for(db_upserter.upsert_to_db(ctx, "test_collection", client), timeout=5)
+
+    assert ctx.ledger.is_pending(p.id)
+    ctx.ledger.close()
+
+
+@pytest.mark.asyncio
+async def test_recover_ledgers_replays_interrupted_jobs(tmp_path):
+    job_ledger = ledger.JobLedger.create("crashed_job", "test_collection", ledger_dir=str(tmp_path))
+    p = _point(4)
+    cache.set("test_collection:h4", {"id": p.id, "vector": p.vector, "payload": p.payload})
+    job_ledger.record_embedded(p.id, "test_collection:h4")
+    job_ledger._file.close()  # Simulate the process dying without closing the ledger
+
+    client = MagicMock()
+    await db_upserter.recover_ledgers(client, ledger_dir=str(tmp_path))
+
+    client.upsert.assert_called_once()
+    assert client.upsert.call_args.kwargs["collection_name"] == "test_collection"
+    assert [pt.id for pt in client.upsert.call_args.kwargs["points"]] == [p.id]
+    assert not os.path.exists(job_ledger.path)
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+import httpx
+
+import pytest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app.pipeline import gpu_worker, utils
+from backend.ingestion_orchestration_fastapi_app.pipeline.cpu_processor import cache
+from backend.ingestion_orchestration_fastapi_app.pipeline.manager import JobContext
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Clear diskcache before each test."""
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def _ml_item(i: int) -> dict:
+    return {
+        "unique_id": f"id_{i}",
+        "file_hash": f"hash_{i}",
+        "filename": f"img_{i}.jpg",
+        "metadata": {"filename": f"img_{i}.jpg", "full_path": f"/photos/img_{i}.jpg"},
+        "collection_name": "test_collection",
+        "image_base64": "data",
+    }
+
+
+def test_negotiate_inflight_window():
+    assert gpu_worker.negotiate_inflight_window({}) == 2
+    assert gpu_worker.negotiate_inflight_window({"max_queue_depth": 3}) == 3
+    assert gpu_worker.negotiate_inflight_window({"max_queue_depth": 0}) == 2
+    assert gpu_worker.negotiate_inflight_window({"max_queue_depth": 1000}) == gpu_worker.ML_MAX_INFLIGHT_BATCHES
+
+
+@pytest.mark.asyncio
+async def test_process_ml_batches_keeps_window_in_flight():
+    """Batches overlap up to the negotiated window and every result reaches the DB queue."""
+    ctx = JobContext(job_id="test_job", ml_batch_size=2, cpu_worker_count=1, ml_inflight_batches=2)
+    ctx.add_log = MagicMock()
+    ctx.ml_queue = asyncio.Queue()
+    ctx.db_queue = asyncio.Queue()
+
+    active = 0
+    peak = 0
+    clients = set()
+
+    async def fake_send(batch_items, caption=True, client=None, on_results=None, tenant=None):
+        nonlocal active, peak
+        clients.add(id(client))
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.05)
+        active -= 1
+        return [{"unique_id": item["file_hash"], "embedding": [0.1, 0.2], "caption": "c"} for item in batch_items]
+
+    for i in range(6):
+        await ctx.ml_queue.put(_ml_item(i))
+    await ctx.ml_queue.put(None)
+
+    with patch.object(gpu_worker, "send_batch_to_ml_service", side_effect=fake_send):
+        await asyncio.wait_for(gpu_worker.process_ml_batches(ctx), timeout=5)
+
+    assert peak == 2
+    assert len(clients) == 1
+    # All items (and the sentinel) are marked done once results are handed off
+    await asyncio.wait_for(ctx.ml_queue.join(), timeout=1)
+
+    points = [ctx.db_queue.get_nowait() for _ in range(ctx.db_queue.qsize())]
+    assert points[-1] is None
+    assert sorted(p.payload["filename"] for p in points[:-1]) == [f"img_{i}.jpg" for i in range(6)]
+    # Point IDs are content-addressed by default
+    assert {p.id for p in points[:-1]} == {utils.point_id_for("test_collection", f"hash_{i}") for i in range(6)}
+    assert ctx.stage("ml").items == 6
+
+
+@pytest.mark.asyncio
+async def test_process_ml_batches_flushes_partial_batch_when_idle():
+    """A partial batch is sent after a short linger instead of waiting for the fill timeout."""
+    ctx = JobContext(job_id="test_job", ml_batch_size=64, cpu_worker_count=1, ml_inflight_batches=2)
+    ctx.add_log = MagicMock()
+    ctx.ml_queue = asyncio.Queue()
+    ctx.db_queue = asyncio.Queue()
+
+    sent = asyncio.Event()
+
+    async def fake_send(batch_items, caption=True, client=None, on_results=None, tenant=None):
+        sent.set()
+        return [{"unique_id": item["file_hash"], "embedding": [0.1], "caption": None} for item in batch_items]
+
+    await ctx.ml_queue.put(_ml_item(0))
+
+    with patch.object(gpu_worker, "send_batch_to_ml_service", side_effect=fake_send):
+        worker = asyncio.create_task(gpu_worker.process_ml_batches(ctx))
+        await asyncio.wait_for(sent.wait(), timeout=2)
+        await ctx.ml_queue.put(None)
+        await asyncio.wait_for(worker, timeout=2)
+
+    assert ctx.db_queue.qsize() == 2  # one point plus the sentinel
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@pytest.mark.asyncio
+async def test_send_batch_streams_job_results():
+    """Per-item results are handed over as each SSE event arrives, then returned in batch order."""
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            assert request.url.params["async_job"] == "true"
+            return httpx.Response(200, json={"job_id": "j1", "status": "queued"})
+        assert request.url.path == "/api/v1/status/j1/events"
+        body = (
+            _sse("results", [{"unique_id": "hash_1", "embedding": [0.1], "caption": "b"}])
+            + ": keep-alive\n\n"
+            + _sse("results", [{"unique_id": "hash_0", "embedding": [0.2], "caption": "a"}])
+            + _sse("done", {"job_id": "j1", "status": "completed", "error": None, "cursor": 2})
+        )
+        return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+    streamed = []
+
+    async def on_results(results):
+        streamed.append([r["unique_id"] for r in results])
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with patch.object(gpu_worker, "_job_mode_retry_at", 0.0):
+            results = await gpu_worker.send_batch_to_ml_service(
+                [_ml_item(0), _ml_item(1)], client=client, on_results=on_results
+            )
+
+    assert streamed == [["hash_1"], ["hash_0"]]
+    assert [r["unique_id"] for r in results] == ["hash_0", "hash_1"]
+
+
+@pytest.mark.asyncio
+async def test_send_batch_falls_back_to_long_poll():
+    """Without an event stream the worker long-polls the status endpoint with a cursor."""
+    polls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            return httpx.Response(200, json={"job_id": "j2", "status": "queued"})
+        if request.url.path.endswith("/events"):
+            return httpx.Response(404, json={"detail": "Not Found"})
+        polls.append(dict(request.url.params))
+        if len(polls) == 1:
+            return httpx.Response(200, json={
+                "job_id": "j2", "status": "running", "cursor": 1,
+                "results": [{"unique_id": "hash_0", "embedding": [0.1], "caption": "a"}],
+            })
+        return httpx.Response(200, json={
+            "job_id": "j2", "status": "completed", "cursor": 2,
+            "results": [{"unique_id": "hash_1", "embedding": [0.2], "caption": "b"}],
+        })
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with patch.object(gpu_worker, "_job_mode_retry_at", 0.0):
+            results = await gpu_worker.send_batch_to_ml_service([_ml_item(0), _ml_item(1)], client=client)
+
+    assert [p["since"] for p in polls] == ["0", "1"]
+    assert all(float(p["wait"]) > 0 for p in polls)
+    assert [r.get("error") for r in results] == [None, None]
+
+
+@pytest.mark.asyncio
+async def test_job_submit_failure_pauses_job_mode_for_a_cooldown():
+    """A 5xx on job submit sends batches inline for ML_JOB_MODE_COOLDOWN, then job mode is tried again."""
+    async_flags = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        async_job = request.url.params.get("async_job") == "true"
+        async_flags.append(async_job)
+        if async_job and len(async_flags) == 1:
+            return httpx.Response(503, json={"detail": "restarting"})
+        if async_job:
+            return httpx.Response(200, json={"job_id": "j4", "status": "queued"})
+        return httpx.Response(200, json={"results": [{"unique_id": "hash_0", "embedding": [0.1]}]})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with patch.object(gpu_worker, "_job_mode_retry_at", 0.0), patch.object(gpu_worker, "ML_JOB_MODE_COOLDOWN", 60.0):
+            await gpu_worker.send_batch_to_ml_service([_ml_item(0)], client=client)
+            await gpu_worker.send_batch_to_ml_service([_ml_item(0)], client=client)
+            assert async_flags == [True, False, False]
+
+            retry_at = gpu_worker._job_mode_retry_at
+            with patch.object(gpu_worker.time, "monotonic", return_value=retry_at):
+                assert gpu_worker._job_mode_enabled()
+
+
+@pytest.mark.asyncio
+async def test_full_job_queue_backs_off_before_going_inline():
+    """A 429 on job submit is retried after Retry-After (or a doubling backoff); inline is the last resort."""
+    async_flags = []
+    delays = []
+    full = {"count": 2}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        async_job = request.url.params.get("async_job") == "true"
+        async_flags.append(async_job)
+        if async_job and len(async_flags) <= full["count"]:
+            headers = {"Retry-After": "5"} if len(async_flags) == 1 else {}
+            return httpx.Response(429, json={"detail": "Job queue is full"}, headers=headers)
+        return httpx.Response(200, json={"results": [{"unique_id": "hash_0", "embedding": [0.1]}]})
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with patch.object(gpu_worker, "_job_mode_retry_at", 0.0), patch.object(gpu_worker, "ML_JOB_SUBMIT_RETRIES", 3), \
+                patch.object(gpu_worker, "ML_JOB_SUBMIT_BACKOFF", 1.0), patch.object(gpu_worker.asyncio, "sleep", fake_sleep):
+            results = await gpu_worker.send_batch_to_ml_service([_ml_item(0)], client=client)
+            assert async_flags == [True, True, True] and delays == [5.0, 2.0]
+            assert results[0]["embedding"] == [0.1]
+
+            async_flags.clear()
+            delays.clear()
+            full["count"] = 10
+            await gpu_worker.send_batch_to_ml_service([_ml_item(0)], client=client)
+            assert async_flags == [True, True, True, True, False] and delays == [5.0, 2.0, 4.0]
+            assert gpu_worker._job_mode_enabled()
+
+
+@pytest.mark.asyncio
+async def test_abandoned_wait_cancels_the_ml_job():
+    """Batches carry the ingest job as tenant; cancelling the wait cancels the ML job."""
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append((request.method, request.url.path, dict(request.url.params)))
+        if request.url.path.endswith("/batch_embed_and_caption"):
+            return httpx.Response(200, json={"job_id": "j3", "status": "queued"})
+        if request.url.path.endswith("/cancel/j3"):
+            return httpx.Response(200, json={"job_id": "j3", "status": "cancelled"})
+        await asyncio.sleep(60)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with patch.object(gpu_worker, "_job_mode_retry_at", 0.0):
+            task = asyncio.create_task(gpu_worker.send_batch_to_ml_service([_ml_item(0)], client=client, tenant="job-a"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    submit = requests[0][2]
+    assert submit["tenant"] == "job-a" and submit["priority"] == "bulk"
+    assert requests[-1][:2] == ("POST", "/api/v1/cancel/j3")
+
+
+@pytest.mark.asyncio
+async def test_deferred_captions_embed_only_and_queue_for_captioning():
+    """With deferred captions the ML stage asks for embeddings only and hands items to the caption stage."""
+    ctx = JobContext(job_id="test_job", ml_batch_size=2, cpu_worker_count=1, deferred_captions=True)
+    ctx.add_log = MagicMock()
+    ctx.ml_queue = asyncio.Queue()
+    ctx.db_queue = asyncio.Queue()
+    ctx.caption_queue = asyncio.Queue()
+    captions_requested = []
+
+    async def fake_send(batch_items, caption=True, client=None, on_results=None, tenant=None):
+        captions_requested.append(caption)
+        return [{"unique_id": item["file_hash"], "embedding": [0.1], "caption": None} for item in batch_items]
+
+    for i in range(2):
+        await ctx.ml_queue.put(_ml_item(i))
+    await ctx.ml_queue.put(None)
+
+    with patch.object(gpu_worker, "send_batch_to_ml_service", side_effect=fake_send):
+        await asyncio.wait_for(gpu_worker.process_ml_batches(ctx), timeout=5)
+
+    assert captions_requested == [False]
+    queued = [ctx.caption_queue.get_nowait() for _ in range(ctx.caption_queue.qsize())]
+    assert queued[-1] is None
+    assert [item["point_id"] for item in queued[:-1]] == [
+        utils.point_id_for("test_collection", f"hash_{i}") for i in range(2)
+    ]
+    # Only references are queued; the caption stage decodes the source file again
+    assert queued[0]["file_path"] == "/photos/img_0.jpg"
+    assert "image_base64" not in queued[0] and "metadata" not in queued[0]
+
+
+@pytest.mark.asyncio
+async def test_full_caption_queue_does_not_block_embedding():
+    """When BLIP falls behind, points are upserted anyway and counted as captions_skipped."""
+    ctx = JobContext(job_id="test_job", ml_batch_size=3, cpu_worker_count=1, deferred_captions=True)
+    ctx.add_log = MagicMock()
+    ctx.ml_queue = asyncio.Queue()
+    ctx.db_queue = asyncio.Queue()
+    ctx.caption_queue = asyncio.Queue(maxsize=1)
+
+    async def fake_send(batch_items, caption=True, client=None, on_results=None, tenant=None):
+        return [{"unique_id": item["file_hash"], "embedding": [0.1], "caption": None} for item in batch_items]
+
+    for i in range(3):
+        await ctx.ml_queue.put(_ml_item(i))
+    await ctx.ml_queue.put(None)
+
+    with patch.object(gpu_worker, "send_batch_to_ml_service", side_effect=fake_send):
+        # Nothing drains caption_queue here, so only the end-of-stream sentinel may wait on it
+        task = asyncio.create_task(gpu_worker.process_ml_batches(ctx))
+        while ctx.db_queue.qsize() < 3:
+            await asyncio.sleep(0.01)
+        ctx.caption_queue.get_nowait()
+        await asyncio.wait_for(task, timeout=5)
+
+    assert ctx.captions_skipped == 2
+    assert ctx.db_queue.qsize() == 3 + ctx.db_worker_count
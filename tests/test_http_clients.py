@@ -0,0 +1,108 @@
+import asyncio
+import os
+import sys
+
+import httpx
+
+import pytest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app import http_clients
+
+
+@pytest.fixture(autouse=True)
+def reset_registry():
+    http_clients._clients.clear()
+    http_clients._breakers.clear()
+    yield
+    http_clients._clients.clear()
+    http_clients._breakers.clear()
+
+
+def test_client_is_shared_per_origin_and_closed_on_shutdown():
+    async def run():
+        a = http_clients.get_client("http://ml:8001/api/v1/embed")
+        b = http_clients.get_client("http://ml:8001/api/v1/capabilities")
+        other = http_clients.get_client("http://qdrant:6333")
+        assert a is b and a is not other
+        await http_clients.aclose_all()
+        assert a.is_closed and other.is_closed
+        assert http_clients._clients == {}
+
+    asyncio.run(run())
+
+
+def test_circuit_opens_after_consecutive_failures_and_recovers():
+    calls = []
+    healthy = False
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        if not healthy:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, json={"ok": True})
+
+    async def run():
+        nonlocal healthy
+        breaker = http_clients.get_breaker("http://ml:8001")
+        breaker.failure_threshold = 3
+        client = http_clients.get_client("http://ml:8001", transport=httpx.MockTransport(handler))
+        for _ in range(3):
+            with pytest.raises(httpx.ConnectError):
+                await client.get("http://ml:8001/ping")
+        assert breaker.state == "open"
+
+        # While open, requests fail fast without reaching the upstream
+        with pytest.raises(http_clients.CircuitOpenError):
+            await client.get("http://ml:8001/ping")
+        assert len(calls) == 3
+
+        # After the reset timeout one trial request goes through and closes the circuit
+        breaker.opened_at -= breaker.reset_timeout
+        assert breaker.state == "half_open"
+        healthy = True
+        resp = await client.get("http://ml:8001/ping")
+        assert resp.status_code == 200
+        assert http_clients.upstream_states()["http://ml:8001"] == {"state": "closed", "consecutive_failures": 0}
+        await http_clients.aclose_all()
+
+    asyncio.run(run())
+
+
+def test_gateway_errors_count_as_failures_but_client_errors_do_not():
+    statuses = iter([502, 504, 404])
+
+    async def run():
+        breaker = http_clients.get_breaker("http://ml:8001")
+        client = http_clients.get_client(
+            "http://ml:8001", transport=httpx.MockTransport(lambda request: httpx.Response(next(statuses)))
+        )
+        await client.get("http://ml:8001/a")
+        await client.get("http://ml:8001/b")
+        assert breaker.failures == 2
+        await client.get("http://ml:8001/c")
+        assert breaker.failures == 0
+        await http_clients.aclose_all()
+
+    asyncio.run(run())
+
+
+def test_model_warmup_503s_do_not_open_the_circuit():
+    statuses = iter([503] * 6 + [200])
+
+    async def run():
+        breaker = http_clients.get_breaker("http://ml:8001")
+        breaker.failure_threshold = 3
+        client = http_clients.get_client(
+            "http://ml:8001",
+            transport=httpx.MockTransport(lambda request: httpx.Response(next(statuses), json={"detail": "Models are not ready"})),
+        )
+        for _ in range(6):
+            assert (await client.post("http://ml:8001/api/v1/warmup")).status_code == 503
+        assert breaker.state == "closed" and breaker.failures == 0
+        assert (await client.post("http://ml:8001/api/v1/batch_embed_and_caption")).status_code == 200
+        await http_clients.aclose_all()
+
+    asyncio.run(run())
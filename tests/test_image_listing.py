@@ -0,0 +1,163 @@
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from qdrant_client.http.models import PayloadSchemaType
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app import payload_indexes
+from backend.ingestion_orchestration_fastapi_app.dependencies import get_qdrant_client, get_active_collection
+from backend.ingestion_orchestration_fastapi_app.routers import images
+from backend.ingestion_orchestration_fastapi_app.utils import count_cache
+
+# Widths with ties, so ordered pages must resume inside a run of equal values
+WIDTHS = [30, 10, 20, 20, 20, 40, 10]
+
+
+class FakeQdrant:
+    """Scroll semantics the listing relies on: id-offset paging and order_by with start_from."""
+
+    def __init__(self):
+        self.points = [SimpleNamespace(id=f"p{i}", payload={"filename": f"{i}.jpg", "width": w}) for i, w in enumerate(WIDTHS)]
+        self.scrolls = []
+        self.count = MagicMock(return_value=SimpleNamespace(count=len(self.points)))
+        self.payload_schema = {}
+        self.create_payload_index = MagicMock(side_effect=lambda collection_name, field_name, field_schema, wait: self.payload_schema.__setitem__(field_name, SimpleNamespace(data_type=field_schema)))
+
+    def get_collection(self, collection_name):
+        return SimpleNamespace(payload_schema=self.payload_schema)
+
+    def scroll(self, collection_name, limit, with_payload, with_vectors, scroll_filter=None, offset=None, order_by=None):
+        self.scrolls.append({"limit": limit, "offset": offset, "order_by": order_by, "with_payload": with_payload})
+        excluded = set()
+        if scroll_filter is not None and scroll_filter.must_not:
+            excluded = {str(i) for cond in scroll_filter.must_not for i in getattr(cond, "has_id", [])}
+        points = [p for p in self.points if p.id not in excluded]
+        if order_by is None:
+            start = int(offset[1:]) if offset else 0
+            page = [p for p in points if int(p.id[1:]) >= start][:limit + 1]
+            next_offset = page[limit].id if len(page) > limit else None
+            return page[:limit], next_offset
+        reverse = order_by.direction == "desc"
+        points = sorted(points, key=lambda p: p.payload[order_by.key], reverse=reverse)
+        if order_by.start_from is not None:
+            points = [p for p in points if (p.payload[order_by.key] <= order_by.start_from if reverse else p.payload[order_by.key] >= order_by.start_from)]
+        return points[:limit], None
+
+
+@pytest.fixture(autouse=True)
+def reset_caches():
+    count_cache.image_counts.invalidate()
+    payload_indexes._ensured.clear()
+    yield
+    payload_indexes._ensured.clear()
+
+
+@pytest.fixture
+def qdrant():
+    return FakeQdrant()
+
+
+@pytest.fixture
+def client(qdrant):
+    app = FastAPI()
+    app.include_router(images.router)
+    app.dependency_overrides[get_qdrant_client] = lambda: qdrant
+    app.dependency_overrides[get_active_collection] = lambda: "photos"
+    return TestClient(app)
+
+
+def _walk(client, **params):
+    ids, cursor = [], None
+    while True:
+        body = client.get("/api/v1/images", params={**params, **({"cursor": cursor} if cursor else {})}).json()
+        ids.extend(r["id"] for r in body["results"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids, body
+
+
+def test_cursor_walks_unsorted_listing(client, qdrant):
+    ids, _ = _walk(client, per_page=3)
+
+    assert ids == [f"p{i}" for i in range(len(WIDTHS))]
+    # Pages resume from the previous next_page_offset instead of a numeric skip
+    assert [s["offset"] for s in qdrant.scrolls] == [None, "p3", "p6"]
+
+
+def test_cursor_walks_sorted_listing_across_ties(client, qdrant):
+    ids, body = _walk(client, per_page=2, sort_by="width", sort_order="asc", fields="filename")
+
+    widths = [qdrant.points[int(i[1:])].payload["width"] for i in ids]
+    assert sorted(ids) == sorted(p.id for p in qdrant.points)
+    assert widths == sorted(WIDTHS)
+    # The sort key is fetched for the cursor but only filename is returned
+    assert body["results"][0]["payload"] == {"filename": body["results"][0]["id"][1:] + ".jpg"}
+    qdrant.create_payload_index.assert_called_once_with(
+        collection_name="photos", field_name="width", field_schema=PayloadSchemaType.INTEGER, wait=True
+    )
+
+
+def test_cursor_walks_ties_spanning_several_pages(client, qdrant):
+    qdrant.points = [SimpleNamespace(id=f"p{i}", payload={"filename": f"{i}.jpg", "width": 20}) for i in range(6)]
+    ids, cursor = [], None
+    for _ in range(5):  # three pages and a margin; an unbounded walk would loop forever on a regression
+        body = client.get("/api/v1/images", params={"per_page": 2, "sort_by": "width", **({"cursor": cursor} if cursor else {})}).json()
+        ids.extend(r["id"] for r in body["results"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert cursor is None
+    assert sorted(ids) == [f"p{i}" for i in range(6)] and len(ids) == 6
+
+
+def test_page_numbers_skip_with_an_id_only_scroll(client, qdrant):
+    body = client.get("/api/v1/images", params={"per_page": 3, "page": 2}).json()
+
+    assert [r["id"] for r in body["results"]] == ["p3", "p4", "p5"]
+    assert qdrant.scrolls[0]["with_payload"] is False
+    assert client.get("/api/v1/images", params={"per_page": 3, "page": 5}).json()["results"] == []
+
+
+def test_cursor_is_bound_to_filters_and_sort(client):
+    cursor = client.get("/api/v1/images", params={"per_page": 2}).json()["next_cursor"]
+
+    assert client.get("/api/v1/images", params={"cursor": cursor, "sort_by": "width"}).status_code == 400
+    assert client.get("/api/v1/images", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_approximate_count_is_cached_until_the_collection_changes(client, qdrant):
+    assert client.get("/api/v1/images").json()["total"] == len(WIDTHS)
+    client.get("/api/v1/images")
+    assert qdrant.count.call_count == 1
+    assert qdrant.count.call_args.kwargs["exact"] is False
+
+    count_cache.image_counts.invalidate("photos")
+    client.get("/api/v1/images")
+    body = client.get("/api/v1/images", params={"exact_count": True}).json()
+    assert qdrant.count.call_count == 3
+    assert body["total_is_exact"] is True
+
+
+def test_count_computed_before_an_invalidation_is_not_cached():
+    cache = count_cache.CountCache()
+
+    def compute():
+        cache.invalidate("photos")  # an upsert lands while counting
+        return 5
+
+    assert cache.get_or_compute("photos", "", compute) == 5
+    assert cache.get("photos", "") is None
+
+
+def test_unsortable_fields_are_rejected(client, qdrant):
+    qdrant.points[0].payload["format"] = "JPEG"
+    assert client.get("/api/v1/images", params={"sort_by": "format"}).status_code == 400
+    qdrant.create_payload_index.assert_not_called()
@@ -0,0 +1,68 @@
+import io
+import os
+import sys
+
+from PIL import Image
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app.pipeline import image_record, utils
+
+XMP_PACKET = b"""<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description xmlns:dc="http://purl.org/dc/elements/1.1/">
+   <dc:subject><rdf:Bag><rdf:li>beach</rdf:li><rdf:li>sunset</rdf:li></rdf:Bag></dc:subject>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>"""
+
+
+def test_load_image_record_matches_path_based_helpers(tmp_path):
+    """The single-read record agrees with the per-path hash and metadata helpers."""
+    image_path = tmp_path / "sample.jpg"
+    Image.new('RGB', (40, 30), color='green').save(image_path, format='JPEG')
+
+    record, error = image_record.load_image_record(str(image_path))
+
+    assert error is None
+    assert record.file_hash == utils.compute_sha256(str(image_path))
+    assert record.image.size == (40, 30)
+    assert record.nbytes == os.path.getsize(image_path)
+
+    expected = utils.extract_image_metadata(str(image_path))
+    for key in ("filename", "full_path", "width", "height", "format", "mode", "tags"):
+        assert record.metadata[key] == expected[key]
+
+
+def test_decode_buffer_reads_embedded_xmp_keywords():
+    """XMP keywords are parsed from the same buffer used for decoding."""
+    buf = io.BytesIO()
+    Image.new('RGB', (8, 8), color='white').save(buf, format='PNG')
+    data = buf.getvalue() + XMP_PACKET
+
+    record, error = image_record.decode_buffer("tagged.png", data, "abc")
+
+    assert error is None
+    assert record.file_hash == "abc"
+    assert record.metadata["tags"] == ["beach", "sunset"]
+
+
+def test_decode_buffer_reports_corrupt_data():
+    record, error = image_record.decode_buffer("broken.jpg", b"not an image", "abc")
+
+    assert record is None
+    assert error.startswith("Failed to decode image")
+
+
+def test_decode_buffer_resizes_to_model_input_but_keeps_original_metadata():
+    """With a target size the model input shrinks while metadata keeps the source dimensions."""
+    buf = io.BytesIO()
+    Image.new('RGB', (1600, 1200), color='blue').save(buf, format='JPEG')
+
+    record, error = image_record.decode_buffer("large.jpg", buf.getvalue(), "abc", target_min_side=384)
+
+    assert error is None
+    assert min(record.image.size) == 384
+    assert record.image.size == (512, 384)
+    assert (record.metadata["width"], record.metadata["height"]) == (1600, 1200)
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+from qdrant_client.http.models import PointStruct
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app.pipeline import io_scanner, scan_index
+from backend.ingestion_orchestration_fastapi_app.pipeline.manager import JobContext
+
+pytestmark = pytest.mark.asyncio
+
+
+def _touch(path, data=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@pytest.fixture
+def image_tree(tmp_path):
+    _touch(tmp_path / "a.jpg", b"aaaa")
+    _touch(tmp_path / "notes.txt")
+    _touch(tmp_path / "trip" / "b.JPG", b"bb")
+    _touch(tmp_path / "trip" / "day2" / "c.dng", b"ccc")
+    _touch(tmp_path / "trip" / "day2" / "d.png")
+    _touch(tmp_path / "exports" / "e.jpg")
+    return tmp_path
+
+
+def _ctx(**kwargs) -> JobContext:
+    ctx = JobContext(job_id="scan_job", cpu_worker_count=2, **kwargs)
+    ctx.raw_queue = asyncio.Queue()
+    ctx.add_log = MagicMock()
+    return ctx
+
+
+def _drain(ctx: JobContext):
+    items = [ctx.raw_queue.get_nowait() for _ in range(ctx.raw_queue.qsize())]
+    paths = [p for p in items if p is not None]
+    return paths, items.count(None)
+
+
+async def test_scan_walks_subtrees_and_counts_bytes(image_tree):
+    ctx = _ctx()
+    await io_scanner.scan_directory(ctx, str(image_tree))
+
+    paths, sentinels = _drain(ctx)
+    assert sentinels == 2
+    assert sorted(os.path.relpath(p, image_tree) for p in paths) == sorted([
+        "a.jpg", os.path.join("trip", "b.JPG"), os.path.join("trip", "day2", "c.dng"),
+        os.path.join("trip", "day2", "d.png"), os.path.join("exports", "e.jpg"),
+    ])
+    assert all(os.path.isabs(p) for p in paths)
+    assert ctx.total_files == 5
+    assert ctx.total_bytes == 4 + 2 + 3 + 1 + 1
+    assert ctx.scan_complete
+
+
+async def test_scan_include_and_exclude_globs(image_tree):
+    ctx = _ctx(include_globs=["*.jpg", "*.dng"], exclude_globs=["exports"])
+    await io_scanner.scan_directory(ctx, str(image_tree))
+
+    paths, _ = _drain(ctx)
+    assert sorted(os.path.basename(p) for p in paths) == ["a.jpg", "c.dng"]
+
+    ctx = _ctx(exclude_globs=["trip/day2/*"])
+    await io_scanner.scan_directory(ctx, str(image_tree))
+    paths, _ = _drain(ctx)
+    assert sorted(os.path.basename(p) for p in paths) == ["a.jpg", "b.JPG", "e.jpg"]
+
+
+async def test_scan_skips_files_recorded_in_index(image_tree, tmp_path_factory):
+    index_dir = str(tmp_path_factory.mktemp("index"))
+    ctx = _ctx()
+    ctx.scan_index = scan_index.ScanIndex.open("photos", index_dir)
+    await io_scanner.scan_directory(ctx, str(image_tree))
+    paths, _ = _drain(ctx)
+    assert len(ctx.file_signatures) == 5
+
+    # Qdrant acknowledges every point except the one for a.jpg
+    points = [
+        PointStruct(id=i, vector=[0.0], payload={"full_path": p})
+        for i, p in enumerate(paths) if not p.endswith("a.jpg")
+    ]
+    scan_index.record_points(ctx, points)
+    ctx.scan_index.close()
+
+    # Modify one indexed file: size changes, so it is queued again
+    _touch(image_tree / "exports" / "e.jpg", b"changed")
+
+    ctx = _ctx()
+    ctx.scan_index = scan_index.ScanIndex.open("photos", index_dir)
+    await io_scanner.scan_directory(ctx, str(image_tree))
+    paths, _ = _drain(ctx)
+    ctx.scan_index.close()
+
+    assert sorted(os.path.basename(p) for p in paths) == ["a.jpg", "e.jpg"]
+    assert ctx.unchanged_files == 3
+    assert ctx.total_files == 2
+
+    scan_index.drop_index("photos", index_dir)
+    assert len(scan_index.ScanIndex.open("photos", index_dir)) == 0
+
+
+async def test_forgotten_paths_are_scanned_again(image_tree, tmp_path_factory):
+    index_dir = str(tmp_path_factory.mktemp("index"))
+    ctx = _ctx()
+    ctx.scan_index = scan_index.ScanIndex.open("photos", index_dir)
+    await io_scanner.scan_directory(ctx, str(image_tree))
+    paths, _ = _drain(ctx)
+    scan_index.record_points(ctx, [PointStruct(id=i, vector=[0.0], payload={"full_path": p}) for i, p in enumerate(paths)])
+    ctx.scan_index.close()
+
+    # Points archived in one collection, a file archived as a duplicate everywhere
+    a_jpg = next(p for p in paths if p.endswith("a.jpg"))
+    e_jpg = next(p for p in paths if p.endswith("e.jpg"))
+    scan_index.forget_paths([a_jpg], "photos", index_dir)
+    scan_index.forget_paths([e_jpg], index_dir=index_dir)
+
+    ctx = _ctx()
+    ctx.scan_index = scan_index.ScanIndex.open("photos", index_dir)
+    await io_scanner.scan_directory(ctx, str(image_tree))
+    paths, _ = _drain(ctx)
+    ctx.scan_index.close()
+
+    assert sorted(os.path.basename(p) for p in paths) == ["a.jpg", "e.jpg"]
+    assert ctx.unchanged_files == 3
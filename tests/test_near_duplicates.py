@@ -0,0 +1,151 @@
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app import near_duplicates
+from backend.ingestion_orchestration_fastapi_app.routers import duplicates
+
+
+def _vectors(seed=0, n=11, dim=16):
+    """Random unit vectors with near copies: {0, 5, 9} form a chain, {3, 7} a pair."""
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    vectors[5] = vectors[0] + 0.05 * rng.normal(size=dim)
+    vectors[9] = vectors[5] + 0.05 * rng.normal(size=dim)
+    vectors[7] = 2.0 * vectors[3]  # same direction, other norm
+    return vectors
+
+
+class FakeQdrant:
+    def __init__(self, vectors):
+        self.points = [SimpleNamespace(id=f"p{i}", vector=v.tolist()) for i, v in enumerate(vectors)]
+        self.scroll_calls = 0
+        self.retrieve = MagicMock(side_effect=lambda collection_name, ids, with_payload, with_vectors: [
+            SimpleNamespace(id=i, payload={"filename": f"{i}.jpg"}) for i in ids
+        ])
+
+    def count(self, collection_name, exact):
+        return SimpleNamespace(count=len(self.points))
+
+    def scroll(self, collection_name, limit, offset, with_payload, with_vectors):
+        self.scroll_calls += 1
+        start = offset or 0
+        end = start + limit
+        return self.points[start:end], (end if end < len(self.points) else None)
+
+
+def _as_sets(groups):
+    return sorted(sorted(point_id for point_id, _ in group) for group in groups)
+
+
+@pytest.mark.parametrize("block_size", [3, 4, 64])
+def test_tiled_top_k_matches_brute_force(block_size):
+    vectors = _vectors()
+    unit = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float16)
+    expected = unit.astype(np.float32) @ unit.astype(np.float32).T
+    np.fill_diagonal(expected, -np.inf)
+
+    scores, ids = near_duplicates.top_k_neighbours(unit, threshold=-1.0, k=3, block_size=block_size)
+
+    for row in range(len(unit)):
+        # Rows 3 and 7 tie exactly, so compare each neighbour's score rather than the id sets
+        np.testing.assert_allclose(expected[row, ids[row]], scores[row], rtol=1e-5)
+        assert row not in ids[row]
+    np.testing.assert_allclose(np.sort(scores, axis=1), np.sort(expected, axis=1)[:, -3:], rtol=1e-5)
+
+
+def test_groups_merge_chained_pairs(tmp_path):
+    qdrant = FakeQdrant(_vectors())
+    progress = []
+
+    groups = near_duplicates.find_duplicate_groups(
+        qdrant, "photos", threshold=0.95, k=2, batch_size=4, block_size=4, work_dir=str(tmp_path),
+        progress=lambda phase, done, total: progress.append((phase, done, total)),
+    )
+
+    assert _as_sets(groups) == [["p0", "p5", "p9"], ["p3", "p7"]]
+    pair = next(g for g in groups if g[0][0] == "p3")
+    assert pair[0] == ("p3", 1.0) and pair[1][1] == pytest.approx(1.0, abs=1e-2)
+    assert progress[0] == ("loading", 4, 11) and ("loading", 11, 11) in progress
+    assert progress[-1] == ("comparing", 6, 6)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cancellation_stops_and_removes_the_matrix(tmp_path):
+    qdrant = FakeQdrant(_vectors())
+    checks = []
+
+    def cancelled():
+        checks.append(1)
+        return len(checks) > 4
+
+    with pytest.raises(near_duplicates.Cancelled):
+        near_duplicates.find_duplicate_groups(
+            qdrant, "photos", threshold=0.95, k=2, batch_size=4, block_size=4, work_dir=str(tmp_path), cancelled=cancelled,
+        )
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_matrix_is_unmapped_before_its_file_is_removed(monkeypatch, tmp_path):
+    qdrant = FakeQdrant(_vectors())
+    checks = []
+    maps = []
+    memmap = np.memmap
+
+    def tracking_memmap(*args, **kwargs):
+        maps.append(memmap(*args, **kwargs))
+        return maps[-1]
+
+    def unlink(path):
+        # Windows refuses to remove a file that is still mapped
+        assert maps and all(m._mmap.closed for m in maps)
+        raise PermissionError(path)
+
+    monkeypatch.setattr(near_duplicates.np, "memmap", tracking_memmap)
+    monkeypatch.setattr(near_duplicates.os, "unlink", unlink)
+
+    # Cancelled while loading: the unlink failure is logged, not raised over it
+    with pytest.raises(near_duplicates.Cancelled):
+        near_duplicates.find_duplicate_groups(
+            qdrant, "photos", threshold=0.95, k=2, batch_size=4, work_dir=str(tmp_path),
+            cancelled=lambda: checks.append(1) or len(checks) > 2,
+        )
+    groups = near_duplicates.find_duplicate_groups(
+        qdrant, "photos", threshold=0.95, k=2, batch_size=4, block_size=4, work_dir=str(tmp_path),
+    )
+    assert _as_sets(groups) == [["p0", "p5", "p9"], ["p3", "p7"]]
+
+
+def test_task_reports_groups_with_payloads(monkeypatch, tmp_path):
+    monkeypatch.setattr(near_duplicates, "DUPLICATES_WORK_DIR", str(tmp_path))
+    qdrant = FakeQdrant(_vectors())
+    task = duplicates.FindSimilarTask(task_id="t1")
+    duplicates.tasks["t1"] = task
+
+    duplicates.find_similar_images_task("t1", qdrant, "photos", 0.95, 10)
+
+    assert task.status == "completed" and task.progress == 100.0
+    assert task.total_points == task.processed_points == 11
+    assert sorted(sorted(p["id"] for p in g["points"]) for g in task.results) == [["p0", "p5", "p9"], ["p3", "p7"]]
+    assert task.results[0]["points"][0]["payload"] == {"filename": f"{task.results[0]['points'][0]['id']}.jpg"}
+
+
+def test_task_can_be_cancelled(monkeypatch, tmp_path):
+    monkeypatch.setattr(near_duplicates, "DUPLICATES_WORK_DIR", str(tmp_path))
+    task = duplicates.FindSimilarTask(task_id="t2")
+    duplicates.tasks["t2"] = task
+    duplicates._cancel_events["t2"] = near_duplicates_event = duplicates.threading.Event()
+    near_duplicates_event.set()
+
+    duplicates.find_similar_images_task("t2", FakeQdrant(_vectors()), "photos", 0.95, 10)
+
+    assert task.status == "cancelled"
+    assert duplicates.collection_curation_status["photos"] == "cancelled"
+    assert "t2" not in duplicates._cancel_events
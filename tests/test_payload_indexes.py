@@ -0,0 +1,134 @@
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from qdrant_client.http.models import PayloadSchemaType
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app import payload_indexes
+from backend.ingestion_orchestration_fastapi_app.dependencies import get_qdrant_client
+from backend.ingestion_orchestration_fastapi_app.pipeline.utils import normalize_exif
+from backend.ingestion_orchestration_fastapi_app.routers import collections
+
+
+class FakeQdrant:
+    """Payload schema bookkeeping and the scroll/update calls of the payload backfill."""
+
+    def __init__(self, payload_schema=None, points=()):
+        self.payload_schema = {f: SimpleNamespace(data_type=s, points=0) for f, s in (payload_schema or {}).items()}
+        self.points = list(points)
+        self.create_payload_index = MagicMock(side_effect=self._create)
+        self.delete_payload_index = MagicMock(side_effect=lambda collection_name, field_name, wait: self.payload_schema.pop(field_name))
+        self.batch_update_points = MagicMock()
+
+    def _create(self, collection_name, field_name, field_schema, wait):
+        self.payload_schema[field_name] = SimpleNamespace(data_type=field_schema, points=0)
+
+    def get_collection(self, collection_name):
+        return SimpleNamespace(payload_schema=self.payload_schema)
+
+    def scroll(self, collection_name, limit, offset, with_payload, with_vectors):
+        start = offset or 0
+        page = self.points[start:start + limit]
+        return page, (start + limit if start + limit < len(self.points) else None)
+
+
+@pytest.fixture(autouse=True)
+def reset_ensured():
+    payload_indexes._ensured.clear()
+    yield
+    payload_indexes._ensured.clear()
+
+
+def test_normalize_exif_parses_stringified_values():
+    typed = normalize_exif({
+        "exif_Image_Make": "Canon",
+        "exif_EXIF_DateTimeOriginal": "2023:05:01 12:30:00",
+        "exif_EXIF_ISOSpeedRatings": "[100]",
+        "exif_EXIF_FNumber": "[14/5]",
+        "exif_EXIF_ExposureTime": "[1/250]",
+        "exif_EXIF_LensModel": "",
+    })
+    assert typed == {
+        "camera_make": "Canon",
+        "date_taken": "2023-05-01T12:30:00",
+        "iso": 100,
+        "f_number": 2.8,
+        "exposure_time": 0.004,
+    }
+    # Legacy ingest keys, and the all-zero date cameras write when the clock is unset
+    assert normalize_exif({"exif_Make": "NIKON ", "exif_DateTimeOriginal": "0000:00:00 00:00:00", "exif_FNumber": "28/10"}) == {
+        "camera_make": "NIKON",
+        "f_number": 2.8,
+    }
+
+
+def test_ensure_indexes_creates_only_missing_declared_indexes():
+    qdrant = FakeQdrant({"tags": PayloadSchemaType.KEYWORD, "width": PayloadSchemaType.KEYWORD})
+
+    created = payload_indexes.ensure_indexes(qdrant, "photos")
+
+    assert "tags" not in created and "width" not in created
+    assert set(created) == set(payload_indexes.INDEX_SCHEMAS) - {"tags", "width"}
+    assert qdrant.payload_schema["date_taken"].data_type == PayloadSchemaType.DATETIME
+    assert payload_indexes.ensure_indexes(qdrant, "photos") == []
+
+
+def test_inspect_reports_missing_mismatched_and_undeclared_indexes():
+    qdrant = FakeQdrant({"tags": PayloadSchemaType.KEYWORD, "width": PayloadSchemaType.KEYWORD, "format": PayloadSchemaType.KEYWORD})
+
+    report = {entry["field"]: entry for entry in payload_indexes.inspect_indexes(qdrant, "photos")}
+
+    assert report["tags"]["status"] == "ok"
+    assert report["width"]["status"] == "mismatch"
+    assert report["width"]["declared"] == "integer" and report["width"]["actual"] == "keyword"
+    assert report["date_taken"]["status"] == "missing"
+    assert report["format"]["status"] == "undeclared"
+
+
+def test_rebuild_replaces_mismatched_index():
+    qdrant = FakeQdrant({"width": PayloadSchemaType.KEYWORD})
+
+    assert payload_indexes.rebuild_indexes(qdrant, "photos", ["width", "height"]) == ["width", "height"]
+
+    qdrant.delete_payload_index.assert_called_once_with(collection_name="photos", field_name="width", wait=True)
+    assert qdrant.payload_schema["width"].data_type == PayloadSchemaType.INTEGER
+    assert payload_indexes._ensured["photos"] == {"width": PayloadSchemaType.INTEGER, "height": PayloadSchemaType.INTEGER}
+    with pytest.raises(ValueError):
+        payload_indexes.rebuild_indexes(qdrant, "photos", ["format"])
+
+
+def test_normalize_payloads_sets_only_changed_typed_fields():
+    points = [
+        SimpleNamespace(id="a", payload={"exif_Image_Make": "Canon", "exif_EXIF_ISOSpeedRatings": "[200]"}),
+        SimpleNamespace(id="b", payload={"exif_Image_Make": "Canon", "camera_make": "Canon"}),
+        SimpleNamespace(id="c", payload={}),
+    ]
+    qdrant = FakeQdrant(points=points)
+
+    assert payload_indexes.normalize_payloads(qdrant, "photos", batch_size=2) == 1
+
+    operations = qdrant.batch_update_points.call_args.kwargs["update_operations"]
+    assert [(op.set_payload.points, op.set_payload.payload) for op in operations] == [(["a"], {"camera_make": "Canon", "iso": 200})]
+
+
+def test_index_endpoints():
+    qdrant = FakeQdrant({"width": PayloadSchemaType.KEYWORD}, points=[SimpleNamespace(id="a", payload={"exif_Make": "Sony"})])
+    app = FastAPI()
+    app.include_router(collections.router)
+    app.dependency_overrides[get_qdrant_client] = lambda: qdrant
+    client = TestClient(app)
+
+    indexes = client.get("/api/v1/collections/photos/indexes").json()["indexes"]
+    assert next(i for i in indexes if i["field"] == "width")["status"] == "mismatch"
+
+    body = client.post("/api/v1/collections/photos/indexes/rebuild", json={"fields": ["width"], "normalize": True}).json()
+    assert body["rebuilt"] == ["width"] and body["normalize_scheduled"] is True
+    assert qdrant.batch_update_points.call_count == 1
+    assert client.post("/api/v1/collections/photos/indexes/rebuild", json={"fields": ["nope"]}).status_code == 400
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import os
+import sys
+from unittest.mock import patch
+
+import httpx
+
+import pytest
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app.routers import search
+
+
+@pytest.fixture(autouse=True)
+def clear_query_cache():
+    search.query_embedding_cache.clear()
+    search._query_model_name = None
+    yield
+    search.query_embedding_cache.clear()
+    search._query_model_name = None
+
+
+def _ml_service(model_name: str, requests: list):
+    def handler(request: httpx.Request) -> httpx.Response:
+        text = json.loads(request.content)["text"]
+        requests.append(text)
+        return httpx.Response(200, json={"embedding": [float(len(text))], "embedding_shape": [1], "model_name": model_name})
+
+    return lambda url: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_repeated_queries_are_served_from_cache():
+    requests = []
+    with patch.object(search.http_clients, "get_client", _ml_service("clip-a", requests)):
+        first = asyncio.run(search.embed_query_text("Sunset  over the sea"))
+        second = asyncio.run(search.embed_query_text("sunset over the sea "))
+
+    assert first == second == [20.0]
+    assert requests == ["Sunset  over the sea"]
+
+
+def test_model_change_invalidates_cached_queries():
+    requests = []
+    with patch.object(search.http_clients, "get_client", _ml_service("clip-a", requests)):
+        asyncio.run(search.embed_query_text("cat"))
+    with patch.object(search.http_clients, "get_client", _ml_service("clip-b", requests)):
+        # The first miss after the swap reveals the new model and drops clip-a vectors
+        asyncio.run(search.embed_query_text("dog"))
+        asyncio.run(search.embed_query_text("cat"))
+        asyncio.run(search.embed_query_text("cat"))
+
+    assert requests == ["cat", "dog", "cat"]
+    assert search._query_model_name == "clip-b"
+    assert search.query_embedding_cache.metrics()["size"] == 2
+
+
+def test_text_cache_copy_matches_the_ml_service_source():
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+    with open(os.path.join(root, 'ml_inference_fastapi_app', 'services', 'text_cache.py'), 'rb') as f:
+        source = f.read()
+    with open(os.path.join(root, 'ingestion_orchestration_fastapi_app', 'utils', 'text_cache.py'), 'rb') as f:
+        copy = f.read()
+
+    assert copy == source, "Copy services/text_cache.py from the ML service over utils/text_cache.py"
@@ -0,0 +1,104 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from qdrant_client import models
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app.dependencies import get_qdrant_client, get_active_collection
+from backend.ingestion_orchestration_fastapi_app.routers import images, search
+from backend.ingestion_orchestration_fastapi_app.utils.payload_fields import COMPACT_FIELDS, parse_fields
+
+HASH = "ab" * 32
+PAYLOAD = {"filename": "a.jpg", "caption": "a cat", "file_hash": HASH, "width": 10}
+
+
+def test_default_profile_is_compact():
+    projection = parse_fields(None)
+    assert projection.selector == COMPACT_FIELDS
+    assert projection.select(PAYLOAD) == PAYLOAD
+
+
+def test_full_profile_excludes_inline_thumbnails():
+    selector = parse_fields("full").selector
+    assert isinstance(selector, models.PayloadSelectorExclude)
+    assert selector.exclude == ["thumbnail_base64"]
+
+
+def test_include_list_fetches_file_hash_but_does_not_return_it():
+    projection = parse_fields("filename, caption")
+    assert projection.selector == ["filename", "caption", "file_hash"]
+    assert projection.select(PAYLOAD) == {"filename": "a.jpg", "caption": "a cat"}
+    assert parse_fields(["filename", "file_hash"]).selector == ["filename", "file_hash"]
+
+
+def test_exclude_list():
+    projection = parse_fields("-caption,-file_hash")
+    assert projection.selector.exclude == ["caption", "thumbnail_base64"]
+    assert projection.select(PAYLOAD) == {"filename": "a.jpg", "caption": "a cat", "width": 10}
+
+
+@pytest.mark.parametrize("fields", ["filename,-caption", "compact,filename", "-"])
+def test_malformed_fields_are_rejected(fields):
+    with pytest.raises(ValueError):
+        parse_fields(fields)
+
+
+@pytest.fixture
+def client():
+    qdrant = MagicMock()
+    qdrant.search.return_value = [SimpleNamespace(id="p1", score=0.9, payload=dict(PAYLOAD))]
+    qdrant.scroll.return_value = ([SimpleNamespace(id="p2", payload={"filename": "b.jpg"})], None)
+    qdrant.count.return_value = SimpleNamespace(count=1)
+    app = FastAPI()
+    app.include_router(search.router)
+    app.include_router(images.router)
+    app.dependency_overrides[get_qdrant_client] = lambda: qdrant
+    app.dependency_overrides[get_active_collection] = lambda: "photos"
+    return TestClient(app), qdrant
+
+
+def test_search_projects_payload_and_returns_served_thumbnail_url(client):
+    http, qdrant = client
+    with patch.object(search, "embed_query_text", return_value=[0.1]):
+        response = http.post("/api/v1/search", json={"query": "cat", "fields": "filename"})
+
+    assert qdrant.search.call_args.kwargs["with_payload"] == ["filename", "file_hash"]
+    assert response.json()["results"] == [{
+        "id": "p1",
+        "score": 0.9,
+        "payload": {"filename": "a.jpg"},
+        "filename": "a.jpg",
+        "thumbnail_url": f"/api/v1/thumbnails/{HASH}",
+    }]
+
+    with patch.object(search, "embed_query_text", return_value=[0.1]):
+        assert http.post("/api/v1/search", json={"query": "cat", "fields": "filename,-caption"}).status_code == 400
+
+
+def test_list_images_uses_compact_profile(client):
+    http, qdrant = client
+    body = http.get("/api/v1/images").json()
+
+    assert qdrant.scroll.call_args.kwargs["with_payload"] == COMPACT_FIELDS
+    # Without a content hash the id-based thumbnail URL is used
+    assert body["results"] == [{"id": "p2", "payload": {"filename": "b.jpg"}, "thumbnail_url": "/api/v1/images/p2/thumbnail"}]
+
+
+def test_date_range_filters_use_datetime_ranges(client):
+    filters = {"date_taken": {"gte": "2023-01-01", "lte": "2023-12-31"}, "width": {"gte": 100, "lte": 200}}
+    conditions = {c.key: c.range for c in search.build_qdrant_filter(filters).must}
+    assert isinstance(conditions["date_taken"], models.DatetimeRange)
+    assert type(conditions["width"]) is models.Range
+
+    http, qdrant = client
+    assert http.get("/api/v1/images", params={"filters": json.dumps(filters)}).status_code == 200
+    listed = {c.key: c.range for c in qdrant.scroll.call_args.kwargs["scroll_filter"].must}
+    assert isinstance(listed["date_taken"], models.DatetimeRange) and type(listed["width"]) is models.Range
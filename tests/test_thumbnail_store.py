@@ -0,0 +1,122 @@
+import base64
+import io
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+# Add project root to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.ingestion_orchestration_fastapi_app import thumbnail_store
+from backend.ingestion_orchestration_fastapi_app.dependencies import get_qdrant_client, get_active_collection
+from backend.ingestion_orchestration_fastapi_app.pipeline import cpu_processor
+from backend.ingestion_orchestration_fastapi_app.routers import thumbnails
+
+HASH = "ab" * 32
+
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnail_store, "THUMBNAIL_STORE_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def qdrant():
+    return MagicMock()
+
+
+@pytest.fixture
+def client(qdrant):
+    app = FastAPI()
+    app.include_router(thumbnails.router)
+    app.dependency_overrides[get_qdrant_client] = lambda: qdrant
+    app.dependency_overrides[get_active_collection] = lambda: "photos"
+    return TestClient(app)
+
+
+def _jpeg(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def test_store_writes_one_variant_per_size():
+    assert thumbnail_store.store_image(HASH, Image.new("RGB", (1000, 500), "red"))
+    assert not thumbnail_store.store_image(HASH, Image.new("RGB", (1000, 500), "red"))
+
+    for size in thumbnail_store.THUMBNAIL_SIZES:
+        variant, data = thumbnail_store.read(HASH, size)
+        with Image.open(io.BytesIO(data)) as image:
+            assert variant == size
+            assert image.size == (size, size // 2)
+
+
+def test_read_falls_back_to_other_variants(store_dir):
+    thumbnail_store.store_image(HASH, Image.new("RGB", (64, 64)), sizes=[128])
+
+    assert thumbnail_store.read(HASH, 512)[0] == 128
+    assert thumbnail_store.read("cd" * 32) is None
+    assert thumbnail_store.read("../../etc/passwd") is None
+    with pytest.raises(ValueError):
+        thumbnail_store.path_for("../x", 128)
+
+
+def test_get_thumbnail_is_immutable_and_revalidates(client):
+    thumbnail_store.store_image(HASH, Image.new("RGB", (800, 600)))
+
+    response = client.get(f"/api/v1/thumbnails/{HASH}", params={"size": 100})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["etag"] == f'"{HASH}-128"'
+    assert "immutable" in response.headers["cache-control"]
+
+    revalidated = client.get(f"/api/v1/thumbnails/{HASH}?size=100", headers={"If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+    assert client.get(f"/api/v1/thumbnails/{'cd' * 32}").status_code == 404
+    assert client.get("/api/v1/thumbnails/not-a-hash").status_code == 404
+
+
+def test_batch_returns_stored_thumbnails_and_missing_hashes(client, monkeypatch):
+    thumbnail_store.store_image(HASH, Image.new("RGB", (300, 300)))
+
+    response = client.post("/api/v1/thumbnails/batch", json={"hashes": [HASH, "cd" * 32], "size": 128})
+    body = response.json()
+    assert body["size"] == 128
+    assert base64.b64decode(body["thumbnails"][HASH]) == thumbnail_store.read(HASH, 128)[1]
+    assert body["missing"] == ["cd" * 32]
+
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_BATCH_MAX", 1)
+    assert client.post("/api/v1/thumbnails/batch", json={"hashes": [HASH, HASH]}).status_code == 400
+
+
+def test_migrate_moves_payload_thumbnails_into_the_store(client, qdrant):
+    legacy = base64.b64encode(_jpeg(200, 100)).decode("ascii")
+    qdrant.scroll.side_effect = [
+        ([SimpleNamespace(id="p1", payload={"file_hash": HASH, "thumbnail_base64": legacy})], "next"),
+        ([SimpleNamespace(id="p2", payload={"thumbnail_base64": legacy})], None),
+    ]
+
+    response = client.post("/api/v1/thumbnails/migrate")
+
+    assert response.json() == {"collection": "photos", "migrated": 1, "failed": 1}
+    qdrant.delete_payload.assert_called_once_with(collection_name="photos", keys=["thumbnail_base64"], points=["p1"])
+    assert qdrant.scroll.call_args_list[1].kwargs["offset"] == "next"
+    assert thumbnail_store.exists(HASH)
+
+
+def test_cached_payload_thumbnail_is_moved_to_the_store():
+    payload = {"filename": "a.jpg", "thumbnail_base64": base64.b64encode(_jpeg(64, 64)).decode("ascii")}
+
+    stripped = cpu_processor._without_legacy_thumbnail(HASH, payload)
+
+    assert stripped == {"filename": "a.jpg"}
+    assert thumbnail_store.exists(HASH)
@@ -21,7 +21,10 @@ logger = get_logger(__name__)
 ML_INFERENCE_URL = os.getenv("ML_INFERENCE_SERVICE_URL", "http://localhost:8001/api/v1")
 INGESTION_ORCHESTRATION_URL = os.getenv("INGESTION_ORCHESTRATION_SERVICE_URL", "http://localhost:8002/api/v1") # Assuming 8002 for ingestion
 
-# Cached HTTPX client
+# Not pooled on purpose: the backend services share clients through
+# backend/ingestion_orchestration_fastapi_app/http_clients.py, but this legacy
+# Streamlit layer runs each call in its own event loop, and a pooled client
+# would stay bound to the loop it was created in.
 def get_async_client():
     """
     Returns a new HTTPX AsyncClient to ensure fresh event loop context for each call.